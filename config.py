@@ -10,9 +10,19 @@ load_dotenv()
 DATA_FOLDER = "data"
 OUTPUT_FOLDER = "data/output_recordings"
 CUSTOMER_STATES_FOLDER = f"{DATA_FOLDER}/customer_states"
+# "json": one {id}_state.json per customer. "sqlite": indexed WAL database (migrate with: python -m utils.customer_store_sqlite migrate)
+CUSTOMER_STATE_BACKEND = os.getenv("CUSTOMER_STATE_BACKEND", "json").lower()
+CUSTOMER_STATE_DB_FILE = f"{DATA_FOLDER}/customer_states.sqlite3"
+CUSTOMER_STATE_CACHE_SIZE = int(os.getenv("CUSTOMER_STATE_CACHE_SIZE", "1024")) # Customers kept resident in the in-memory LRU cache
+CUSTOMER_HISTORY_WINDOW_MESSAGES = int(os.getenv("CUSTOMER_HISTORY_WINDOW_MESSAGES", "30")) # Live chat_history length; older messages are archived (0 = never)
+CUSTOMER_HISTORY_ARCHIVE_BATCH = int(os.getenv("CUSTOMER_HISTORY_ARCHIVE_BATCH", "10")) # Archive only once the window overflows by this many
+CUSTOMER_HISTORY_SUMMARY_MAX_CHARS = 1500
+CUSTOMER_HISTORY_ARCHIVE_FOLDER = f"{DATA_FOLDER}/customer_archives"
+CUSTOMER_HISTORY_ARCHIVE_PROMPT_MATCHES = 8 # Archived messages matching the admin's request added to the active-customer prompt (0 = off)
 TELEGRAM_VOICE_TEMP_FOLDER = f"{DATA_FOLDER}/telegram_voice_temp" # For incoming voice from admin
 TELEGRAM_TTS_TEMP_FOLDER = f"{DATA_FOLDER}/telegram_tts_temp" # For outgoing TTS to admin/customer
-CHAT_HISTORY_FILE = f"{DATA_FOLDER}/chat_history.json" # Admin's chat
+CHAT_HISTORY_FILE = f"{DATA_FOLDER}/chat_history.json" # Admin's chat (legacy JSON array, migrated into the journal once)
+CHAT_HISTORY_JOURNAL_FILE = f"{DATA_FOLDER}/chat_history.jsonl" # Admin's chat, append-only (utils/history_journal.py)
 USER_STATE_FILE = f"{DATA_FOLDER}/user_state.json"     # Admin's state
 ASSISTANT_STATE_FILE = f"{DATA_FOLDER}/assistant_state.json"
 WEB_UI_AUDIO_TEMP_FOLDER = f"{DATA_FOLDER}/webui_audio_temp" # For incoming web audio & conversions
@@ -41,6 +51,9 @@ OLLAMA_MODEL_NAME = "phi4"
 OLLAMA_REQUEST_TIMEOUT = 180
 OLLAMA_PING_TIMEOUT = 15
 OLLAMA_PING_PROMPT = "You are an AI assistant. Respond with a single word: 'ready'."
+# "patch": the LLM returns small patch ops per state (see utils/state_patch.py), far fewer generated tokens.
+# "full": the LLM returns whole updated state objects (previous protocol).
+LLM_STATE_UPDATE_MODE = os.getenv("LLM_STATE_UPDATE_MODE", "patch").lower()
 
 # --- Search Engine ---
 SEARCH_ENGINE_URL = "https://search.vovsn.com"
@@ -50,17 +63,49 @@ SEARCH_ENGINE_PING_TIMEOUT = 10
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
 TELEGRAM_ADMIN_USER_ID = os.getenv("TELEGRAM_ADMIN_USER_ID", "")
 TELEGRAM_POLLING_TIMEOUT = 20
+TELEGRAM_POLL_INTERVAL_SECONDS = float(os.getenv("TELEGRAM_POLL_INTERVAL_SECONDS", "1.0")) # Pause between getUpdates calls in polling mode
+# How updates arrive: "polling" (long polling) or "webhook" (utils/telegram_webhook.py serves TELEGRAM_WEBHOOK_PATH;
+# Telegram must reach TELEGRAM_WEBHOOK_URL over HTTPS, e.g. through a reverse proxy, or directly with TELEGRAM_WEBHOOK_USE_SSL)
+TELEGRAM_INGESTION_MODE = os.getenv("TELEGRAM_INGESTION_MODE", "polling").lower()
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL", "") # Public URL registered with setWebhook
+TELEGRAM_WEBHOOK_LISTEN = os.getenv("TELEGRAM_WEBHOOK_LISTEN", "0.0.0.0")
+TELEGRAM_WEBHOOK_PORT = int(os.getenv("TELEGRAM_WEBHOOK_PORT", "8443"))
+TELEGRAM_WEBHOOK_PATH = os.getenv("TELEGRAM_WEBHOOK_PATH", "/telegram/webhook")
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET", "") # Empty: a random secret is registered on every start
+TELEGRAM_WEBHOOK_USE_SSL = os.getenv("TELEGRAM_WEBHOOK_USE_SSL", "False").lower() == "true" # Serve HTTPS with SSL_CERT_FILE/SSL_KEY_FILE and upload the cert
+TELEGRAM_WEBHOOK_MAX_CONNECTIONS = int(os.getenv("TELEGRAM_WEBHOOK_MAX_CONNECTIONS", "40"))
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "") # Empty: api.telegram.org. http://127.0.0.1:8081/bot for utils/telegram_fake_api.py
 TELEGRAM_START_MESSAGE = "Hi there! I'm Iri-shka, your friendly AI assistant, connected via Telegram. How can I help you today?"
 START_BOT_ON_APP_START = True
 TELEGRAM_REPLY_WITH_TEXT = os.getenv("TELEGRAM_REPLY_WITH_TEXT", "True").lower() == "true"
 TELEGRAM_REPLY_WITH_VOICE = os.getenv("TELEGRAM_REPLY_WITH_VOICE", "True").lower() == "true"
+TELEGRAM_CONCURRENT_UPDATES = int(os.getenv("TELEGRAM_CONCURRENT_UPDATES", "32")) # Updates handled at once; per-customer order is kept by the state lock
+TELEGRAM_BLOCKING_WORKERS = int(os.getenv("TELEGRAM_BLOCKING_WORKERS", "4")) # Threads for state file I/O, ffmpeg and dashboards
+TELEGRAM_LOOP_LAG_THRESHOLD_MS = float(os.getenv("TELEGRAM_LOOP_LAG_THRESHOLD_MS", "100")) # Log anything holding the polling loop longer
+TELEGRAM_LOOP_MONITOR_INTERVAL_SECONDS = 0.25
+# Outbound messages (utils/telegram_outbox.py). Telegram allows about 1 msg/s per chat and 30 msg/s per bot.
+TELEGRAM_OUTBOX_CHAT_PER_SECOND = float(os.getenv("TELEGRAM_OUTBOX_CHAT_PER_SECOND", "1.0"))
+TELEGRAM_OUTBOX_CHAT_BURST = 3
+TELEGRAM_OUTBOX_GLOBAL_PER_SECOND = float(os.getenv("TELEGRAM_OUTBOX_GLOBAL_PER_SECOND", "25"))
+TELEGRAM_OUTBOX_GLOBAL_BURST = 5
+TELEGRAM_OUTBOX_MAX_RETRIES = 5
+TELEGRAM_OUTBOX_GLOBAL_FLOOD_CHATS = 2 # 429s from this many chats within 1s pause every chat (bot-wide limit)
 
 # Messages for Non-Admin (Customer) Interactions
 TELEGRAM_NON_ADMIN_GREETING = "Добрый день! Пожалуйста, назовите свое имя и опишите ваш вопрос или что бы вы хотели."
 TELEGRAM_NON_ADMIN_THANKS_AND_FORWARDED = "Спасибо! Ваше обращение принято и будет передано администратору. Мы свяжемся с вами при необходимости."
 TELEGRAM_NON_ADMIN_ALREADY_FORWARDED = "Ваше предыдущее обращение уже обрабатывается. Пожалуйста, ожидайте ответа от администратора."
 TELEGRAM_NON_ADMIN_PROCESSING_ERROR_TO_ADMIN_PREFIX = "Admin Alert: Failed to process LLM summary for customer "
-TELEGRAM_NON_ADMIN_MESSAGE_AGGREGATION_DELAY_SECONDS = 30
+TELEGRAM_NON_ADMIN_MESSAGE_AGGREGATION_DELAY_SECONDS = 30 # Flat window; also the adaptive policy's starting point for unknown cadence
+# Adaptive aggregation window (utils/customer_interaction_manager.py): learns each customer's gap between messages
+TELEGRAM_AGGREGATION_ADAPTIVE = os.getenv("TELEGRAM_AGGREGATION_ADAPTIVE", "True").lower() == "true"
+TELEGRAM_AGGREGATION_MIN_DELAY_SECONDS = 4
+TELEGRAM_AGGREGATION_MAX_DELAY_SECONDS = 60
+TELEGRAM_AGGREGATION_MAX_WINDOW_SECONDS = 150 # First message to dispatch, however long a burst goes on
+TELEGRAM_AGGREGATION_GAP_MULTIPLIER = 2.5 # Wait this many typical gaps after the last message
+TELEGRAM_AGGREGATION_EWMA_ALPHA = 0.3
+TELEGRAM_AGGREGATION_LONG_MESSAGE_CHARS = 200 # A message this long usually says everything at once
+TELEGRAM_AGGREGATION_MAX_TRACKED_CUSTOMERS = 10000 # Per-customer cadences kept (least recently active dropped first)
 
 TELEGRAM_RETURNING_CUSTOMER_GREETING_KNOWN_NAME = "Добрый день, {customer_name}! Рады снова видеть."
 TELEGRAM_RETURNING_CUSTOMER_GREETING_STILL_UNKNOWN_NAME = "Добрый день! Вы обращались к нам ранее. Если несложно, напомните, пожалуйста, ваше имя."
@@ -79,20 +124,81 @@ SAVE_RECORDINGS_TO_WAV = False
 
 # --- Whisper (For Admin Voice Input) ---
 WHISPER_MODEL_SIZE = "medium"
+# Inference mode: auto | fp32 | fp16 | bf16 (GPU autocast) | int8 (CPU dynamic quantization)
+WHISPER_INFERENCE_MODE = os.getenv("WHISPER_INFERENCE_MODE", "auto").lower()
+WHISPER_TORCH_COMPILE = os.getenv("WHISPER_TORCH_COMPILE", "False").lower() == "true"
+WHISPER_COMPILE_SUBMODULES = ["encoder", "decoder"]
 
 # --- Bark TTS (For Admin & Customer Voice Replies if enabled for customer later) ---
 BARK_MODEL_NAME = "suno/bark-small"
 BARK_VOICE_PRESET_RU = "v2/ru_speaker_6"
 BARK_VOICE_PRESET_EN = "v2/en_speaker_9"
-BARK_MAX_SENTENCES_PER_CHUNK = 2
+# TTS chunking (utils/text_segmentation.py): chunks are packed by estimated speech duration
+TTS_CHUNK_TARGET_SECONDS = 8.0
+TTS_CHUNK_MAX_SECONDS = 12.0 # Bark degrades past ~13s per call; longer sentences are split at clauses
+TTS_SEGMENT_CACHE_SIZE = 256 # Memoized segmentations of recently spoken texts
 BARK_SILENCE_DURATION_MS = 300
 BARK_DO_SAMPLE = True
 BARK_FINE_TEMPERATURE = 0.5
 BARK_COARSE_TEMPERATURE = 0.7
+# Inference mode: auto | fp32 | fp16 | bf16 (GPU autocast) | int8 (CPU dynamic quantization)
+BARK_INFERENCE_MODE = os.getenv("BARK_INFERENCE_MODE", "auto").lower()
+BARK_TORCH_COMPILE = os.getenv("BARK_TORCH_COMPILE", "False").lower() == "true"
+BARK_COMPILE_SUBMODULES = ["semantic", "coarse_acoustics", "fine_acoustics"]
+# Run one short synthesis/transcription right after load so the first real request isn't slow
+INFERENCE_WARMUP_ON_LOAD = os.getenv("INFERENCE_WARMUP_ON_LOAD", "True").lower() == "true"
+
+# --- Streaming Playback (utils/playback_engine.py) ---
+PLAYBACK_CROSSFADE_MS = 15 # Fade length at chunk boundaries
+PLAYBACK_RING_BUFFER_SECONDS = 30 # Preallocated PCM ring size (one ring, reused across utterances)
+PLAYBACK_BLOCKSIZE = 512 # Frames per OutputStream callback (~21ms at Bark's 24kHz; also the stop latency)
+
+# --- TTS Output Encoding (utils/opus_encoder.py) ---
+TTS_OPUS_SAMPLE_RATE = 16000 # Opus allows 8000/12000/16000/24000/48000
+TTS_OPUS_BITRATE = "24k" # ffmpeg -b:a; mapped to compression_level for libsndfile (soundfile >= 0.12)
+TTS_OPUS_ENCODE_TIMEOUT_SECONDS = 15
+# "ogg" serves Opus to the Web UI, "wav" falls back to PCM_16 for browsers without Ogg/Opus support
+WEB_UI_TTS_AUDIO_FORMAT = os.getenv("WEB_UI_TTS_AUDIO_FORMAT", "ogg").lower()
+
+# --- Artifact Reaper (utils/artifact_reaper.py) ---
+ARTIFACT_REAPER_ENABLED = os.getenv("ARTIFACT_REAPER_ENABLED", "True").lower() == "true"
+ARTIFACT_REAPER_INTERVAL_SECONDS = int(os.getenv("ARTIFACT_REAPER_INTERVAL_SECONDS", "300"))
+ARTIFACT_SERVE_GRACE_SECONDS = 600 # Files created/served more recently than this are never reaped
+ARTIFACT_REAPER_POLICIES = { # folder -> TTL and byte quota (None disables that limit)
+    WEB_UI_TTS_SERVE_FOLDER: {"ttl_seconds": 6 * 3600, "max_bytes": 200 * 1024**2},
+    WEB_UI_AUDIO_TEMP_FOLDER: {"ttl_seconds": 3600, "max_bytes": 100 * 1024**2},
+    TELEGRAM_VOICE_TEMP_FOLDER: {"ttl_seconds": 3600, "max_bytes": 100 * 1024**2},
+    TELEGRAM_TTS_TEMP_FOLDER: {"ttl_seconds": 3600, "max_bytes": 100 * 1024**2},
+    f"{DATA_FOLDER}/temp_dashboards": {"ttl_seconds": 24 * 3600, "max_bytes": 50 * 1024**2},
+}
 
 # --- Chat & State ---
 MAX_HISTORY_TURNS = 10
+CHAT_HISTORY_FSYNC_BATCH = 4 # fsync the chat journal after this many appends...
+CHAT_HISTORY_FSYNC_INTERVAL_SECONDS = 2.0 # ...or when this long has passed since the last fsync
+CHAT_HISTORY_COMPACTION_FACTOR = 5 # Compact the journal when it holds this many times MAX_HISTORY_TURNS lines
 TIMEZONE_OFFSET_HOURS = 3
+CALENDAR_DEFAULT_EVENT_DURATION_MINUTES = int(os.getenv("CALENDAR_DEFAULT_EVENT_DURATION_MINUTES", "60")) # Used for conflict detection when an event has no duration_minutes
+
+# --- State Persistence (write-behind) ---
+# Per document type durability. "sync": written before save returns. "write_behind": coalesced and written
+# debounce_ms after the last save, never later than max_delay_ms after the first unflushed one. A crash
+# (not a clean exit - on_app_exit flushes) can lose at most max_delay_ms of updates for that document type.
+STATE_WRITE_BEHIND_ENABLED = os.getenv("STATE_WRITE_BEHIND_ENABLED", "True").lower() == "true"
+STATE_WRITE_BEHIND_DEBOUNCE_MS = int(os.getenv("STATE_WRITE_BEHIND_DEBOUNCE_MS", "250"))
+STATE_WRITE_BEHIND_MAX_DELAY_MS = int(os.getenv("STATE_WRITE_BEHIND_MAX_DELAY_MS", "2000"))
+_STATE_PERSISTENCE_MODE = "write_behind" if STATE_WRITE_BEHIND_ENABLED else "sync"
+PERSISTENCE_POLICIES = {
+    "assistant_state": {"mode": _STATE_PERSISTENCE_MODE, "debounce_ms": STATE_WRITE_BEHIND_DEBOUNCE_MS, "max_delay_ms": STATE_WRITE_BEHIND_MAX_DELAY_MS},
+    "admin_user_state": {"mode": _STATE_PERSISTENCE_MODE, "debounce_ms": STATE_WRITE_BEHIND_DEBOUNCE_MS, "max_delay_ms": STATE_WRITE_BEHIND_MAX_DELAY_MS},
+    "customer_state": {"mode": _STATE_PERSISTENCE_MODE, "debounce_ms": STATE_WRITE_BEHIND_DEBOUNCE_MS, "max_delay_ms": STATE_WRITE_BEHIND_MAX_DELAY_MS},
+    "default": {"mode": "sync"},
+}
+# State files are written atomically (temp file + fsync + os.replace). The previous version is kept as
+# <file>.lastgood and is used to recover a file that fails to parse instead of resetting it to defaults.
+STATE_FSYNC_FILES = os.getenv("STATE_FSYNC_FILES", "True").lower() == "true"
+STATE_FSYNC_DIRECTORY = os.getenv("STATE_FSYNC_DIRECTORY", "False").lower() == "true" # Also persist the rename (POSIX)
+STATE_KEEP_LAST_GOOD = os.getenv("STATE_KEEP_LAST_GOOD", "True").lower() == "true"
 
 # --- GUI Themes & Font ---
 GUI_THEME_LIGHT = "light"
@@ -103,7 +209,19 @@ MAX_CHAT_FONT_SIZE = 18
 
 # --- Threading ---
 LLM_TASK_THREAD_POOL_SIZE = int(os.getenv("LLM_TASK_THREAD_POOL_SIZE", "3"))
-CUSTOMER_INTERACTION_CHECK_INTERVAL_SECONDS = 5
+ADMIN_DISPATCHER_WORKERS = int(os.getenv("ADMIN_DISPATCHER_WORKERS", "2")) # Admin queue handlers; one at a time per source
+# Admin turns (GUI, Telegram, Web UI) run through stt -> llm -> merge -> reply stages (utils/admin_interaction_processor.py)
+ADMIN_PIPELINE_QUEUE_SIZE = int(os.getenv("ADMIN_PIPELINE_QUEUE_SIZE", "4")) # Per stage; a full queue holds back the stage before it
+ADMIN_PIPELINE_STT_TIMEOUT_SECONDS = float(os.getenv("ADMIN_PIPELINE_STT_TIMEOUT_SECONDS", "120")) # 0 = no limit
+ADMIN_PIPELINE_LLM_TIMEOUT_SECONDS = float(os.getenv("ADMIN_PIPELINE_LLM_TIMEOUT_SECONDS", str(OLLAMA_REQUEST_TIMEOUT + 30)))
+ADMIN_PIPELINE_REPLY_TIMEOUT_SECONDS = float(os.getenv("ADMIN_PIPELINE_REPLY_TIMEOUT_SECONDS", "600")) # Telegram voice replies synthesize here
+CUSTOMER_INTERACTION_CHECK_INTERVAL_SECONDS = 5 # Periodic status checks only; customer aggregation timers are event-driven
+# Pending customer packages and admin queue items survive restarts (utils/work_queue.py)
+WORK_QUEUE_DB_FILE = f"{DATA_FOLDER}/work_queue.sqlite3"
+WORK_QUEUE_RECOVERY_CONCURRENCY = int(os.getenv("WORK_QUEUE_RECOVERY_CONCURRENCY", "2")) # Recovered customer packages in flight at once
+WORK_QUEUE_MAX_ATTEMPTS = 3 # Items interrupted this many times are dropped instead of replayed
+CUSTOMER_LLM_BATCH_SIZE = int(os.getenv("CUSTOMER_LLM_BATCH_SIZE", "1")) # >1: customers whose windows close together share one LLM call
+CUSTOMER_LLM_BATCH_COALESCE_SECONDS = 2.0 # Windows closing this soon after an expired one join its batch
 
 # --- Default State Blueprints ---
 DEFAULT_USER_STATE = {
@@ -126,6 +244,7 @@ DEFAULT_NON_ADMIN_USER_STATE = {
     "intent": "unknown",
     "chat_history": [],
     "calendar_events": [], # Customer-specific events
+    "history_summary": "", # Rolling summary of chat_history messages moved to the archive
     "conversation_stage": "new",
     "last_message_timestamp": "",
 }
@@ -156,7 +275,8 @@ LANGUAGE_INSTRUCTION_NON_RUSSIAN = "The user is not speaking Russian. Please res
 LANGUAGE_INSTRUCTION_RUSSIAN = "The user is speaking Russian. Please respond clearly and naturally in Russian."
 
 # For Admin interactions (GUI or direct Telegram with Admin)
-OLLAMA_PROMPT_TEMPLATE = """
+# The context part is shared; the response part differs between full-state and patch mode (LLM_STATE_UPDATE_MODE).
+_OLLAMA_ADMIN_PROMPT_CONTEXT = """
 You are Iri-shka, a helpful female AI partner. Your primary human partner, who you assist, is named {admin_name_value}.
 Your goal is to have a natural, helpful conversation and manage your state and {admin_name_value}'s notes and events.
 You may also be asked to manage information related to specific customers if their context is provided.
@@ -183,7 +303,9 @@ If Customer Context Active is True, the details of the customer in focus are:
 --- End Optional Customer Context ---
 
 {admin_name_value} just said (potentially via voice, text, or Telegram): "{last_transcribed_text}"
+"""
 
+OLLAMA_PROMPT_TEMPLATE = _OLLAMA_ADMIN_PROMPT_CONTEXT + """
 Based on all the above information, please provide ONLY a valid JSON response with the following structure.
 Do NOT include any text before or after the JSON object. Ensure the JSON is well-formed.
 
@@ -220,8 +342,48 @@ Instructions for your response and state updates:
 Ensure your entire output is ONLY the specified JSON object.
 """
 
+OLLAMA_PROMPT_TEMPLATE_PATCH = _OLLAMA_ADMIN_PROMPT_CONTEXT + """
+Based on all the above information, please provide ONLY a valid JSON response with the following structure.
+Do NOT include any text before or after the JSON object. Ensure the JSON is well-formed.
+Do NOT repeat the states. Describe ONLY what changes, as a list of patch operations per state (an empty list if nothing changes).
+
+{{
+  "answer_to_user": "Your natural language response to {admin_name_value} here.",
+  "user_state_patch": [ ... operations on {admin_name_value}'s state ... ],
+  "assistant_state_patch": [ ... operations on your own state ... ],
+  "active_customer_state_patch": [ ... operations on the Active Customer's state, or [] ... ]
+}}
+
+Patch operations ("path" names a field; use dots for nested fields, e.g. "internal_tasks.pending"):
+- {{"op": "append", "path": "<list field>", "value": <new item>}}
+- {{"op": "remove_value", "path": "<list field>", "value": <item, or an object with enough fields to identify it>}}
+- {{"op": "move_value", "from": "<list field>", "path": "<list field>", "value": <item>}}
+- {{"op": "replace", "path": "<field>", "value": <new value>}}
+
+Instructions for your response and state updates:
+1.  **Primary Goal:** Respond to {admin_name_value}'s query: "{last_transcribed_text}". Your response goes into "answer_to_user".
+2.  **{admin_name_value}'s State (`user_state_patch`):**
+    - Calendar: append to "calendar_events" objects with "description" (string), "date" (string "YYYY-MM-DD"), and "time" (string "HH:MM", optional).
+      Example: `{{"op": "append", "path": "calendar_events", "value": {{"description": "Meeting with team", "date": "2024-06-15", "time": "14:30"}}}}`.
+      To cancel an event: `{{"op": "remove_value", "path": "calendar_events", "value": {{"description": "Meeting with team", "date": "2024-06-15"}}}}`. Leave other events alone.
+    - Theme: `{{"op": "replace", "path": "gui_theme", "value": "{actual_dark_theme_value}"}}` (or "{actual_light_theme_value}").
+    - Chat text size: `{{"op": "replace", "path": "chat_font_size", "value": <integer between {min_font_size_value} and {max_font_size_value}>}}`.
+    - Birthdays: append to "birthdays" (e.g. `{{"name": "Alice", "date": "03-25"}}`). Current topic: replace "current_topic".
+    - REMEMBER: {admin_name_value} does NOT have a personal "todos" list. Tasks for you (Iri-shka) go into your `internal_tasks.pending`.
+3.  **Your State (`assistant_state_patch`):**
+    - If {admin_name_value} asks you to 'call me [New Name]' or states 'my name is [New Name]': `{{"op": "replace", "path": "admin_name", "value": "[New Name]"}}`. Otherwise do not touch `admin_name` (currently '{assistant_admin_name_current_value}').
+    - New task for you: `{{"op": "append", "path": "internal_tasks.pending", "value": "<task>"}}`.
+      Task completed in this interaction: `{{"op": "move_value", "from": "internal_tasks.pending", "path": "internal_tasks.completed", "value": "<exact task text>"}}`.
+4.  **Customer Context (`active_customer_state_patch`):** Only if `Customer Context Active` is True AND the request requires changing the Active Customer's state,
+    give operations on that customer's state (e.g. append to its "calendar_events", with "attendees": ["{admin_name_value}", "{active_customer_id}"]).
+    If the event also involves {admin_name_value}, ALSO append it to {admin_name_value}'s calendar in `user_state_patch`. Otherwise use [].
+5.  **Language:** Respond in the language indicated by `{language_instruction}` for `answer_to_user`.
+
+Ensure your entire output is ONLY the specified JSON object.
+"""
+
 # For Non-Admin (Customer) Interactions
-OLLAMA_CUSTOMER_PROMPT_TEMPLATE_V3 = """
+_OLLAMA_CUSTOMER_PROMPT_CONTEXT = """
 You are Iri-shka, a virtual assistant for a business. Your business partner, who manages this system, is named {admin_name_value}.
 Your role is to process interactions from potential customers contacting via a Telegram bot and summarize them for {admin_name_value}.
 The system has ALREADY SENT an initial acknowledgment message ("{actual_thanks_and_forwarded_message_value}") to this customer.
@@ -240,7 +402,9 @@ Your (Iri-shka's) current internal state (note its `internal_tasks` format: `{{"
 IMPORTANT LANGUAGE NOTE: {admin_name_value} prefers to receive summaries and notifications from you in Russian.
 Therefore, the 'message_for_admin' you generate MUST be in clear, natural Russian.
 The 'polite_followup_message_for_customer' should also be in Russian.
+"""
 
+OLLAMA_CUSTOMER_PROMPT_TEMPLATE_V3 = _OLLAMA_CUSTOMER_PROMPT_CONTEXT + """
 Your tasks:
 1.  Analyze the `customer_interaction_text_blob`. Identify the customer's name (if provided and not already in their state, or if they re-state it) and their primary intent/request.
 2.  Update the `customer_state` object (derived from `customer_state_string`).
@@ -270,4 +434,90 @@ Provide ONLY a valid JSON response with the following structure. Do NOT include
   "message_for_admin": "Your RUSSIAN summary for {admin_name_value} here (single sentence, use known name if available).",
   "polite_followup_message_for_customer": "Your RUSSIAN polite follow-up message to the customer, or 'NO_CUSTOMER_FOLLOWUP_NEEDED'."
 }}
-"""
\ No newline at end of file
+"""
+OLLAMA_CUSTOMER_PROMPT_TEMPLATE_PATCH = _OLLAMA_CUSTOMER_PROMPT_CONTEXT + """
+Your tasks:
+1.  Analyze the `customer_interaction_text_blob`. Identify the customer's name (if provided and not already in their state, or if they re-state it) and their primary intent/request.
+2.  Describe the changes to the customer's state as `customer_state_patch` (a list of operations; do NOT repeat the state):
+    - Name, if identifiable and currently "unknown" or different: `{{"op": "replace", "path": "name", "value": "<name>"}}`.
+    - Intent: `{{"op": "replace", "path": "intent", "value": "<concise description of their request>"}}`.
+    - If the customer requests an appointment or mentions a specific date/time for something actionable with the business (e.g., a meeting, a call), append an event:
+      `{{"op": "append", "path": "calendar_events", "value": {{"description": "Запись на консультацию", "date": "2024-07-10", "time": "15:00", "attendees": ["{admin_name_value}", "{customer_user_id}"]}}}}`.
+      "date" is "YYYY-MM-DD", "time" is "HH:MM" and optional. Do not invent events; only add if a clear request with date/time is present.
+    - ALWAYS include `{{"op": "replace", "path": "conversation_stage", "value": "llm_followup_sent"}}`.
+    - Never change `chat_history`; the system keeps it up to date.
+3.  Generate a `message_for_admin`. **This message MUST be in Russian.** It should be a concise, single sentence summarizing the key information for {admin_name_value}.
+    - Include the customer's identified name (e.g., "Клиент Иван..." or "Новый клиент..."). If their name was already known (not "unknown"), use "Клиент {{Имя}}" rather than "Новый клиент {{Имя}}". REMEMBER: {{Имя}} here is for the LLM to fill, not a Python format variable.
+    - State their primary intent. Briefly mention any new calendar event you added, if any.
+4.  Generate `polite_followup_message_for_customer`. **This message MUST be in Russian.** It should be brief and friendly.
+    - Example: "Спасибо, {{Имя Клиента}}! Мы получили ваш запрос по поводу {{Намерение Клиента}} и скоро с вами свяжемся."
+    - If no specific follow-up beyond the initial system acknowledgment is necessary or adds value, output the exact string "NO_CUSTOMER_FOLLOWUP_NEEDED" for this field.
+5.  Describe the changes to your own state as `assistant_state_patch`. Append a concise task:
+    `{{"op": "append", "path": "internal_tasks.pending", "value": "Сообщить {admin_name_value} о контакте от {customer_user_id} ([{{Identified Customer Name}}]) по поводу [{{Identified Intent Summary}}]"}}`.
+
+Patch operations: "append" / "remove_value" (on list fields), "replace" (on any field); "path" uses dots for nested fields.
+
+Provide ONLY a valid JSON response with the following structure. Do NOT include any text before or after the JSON object. Ensure the JSON is well-formed.
+
+{{
+  "customer_state_patch": [ ... operations, including the conversation_stage replace ... ],
+  "assistant_state_patch": [ ... operations ... ],
+  "message_for_admin": "Your RUSSIAN summary for {admin_name_value} here (single sentence, use known name if available).",
+  "polite_followup_message_for_customer": "Your RUSSIAN polite follow-up message to the customer, or 'NO_CUSTOMER_FOLLOWUP_NEEDED'."
+}}
+"""
+
+# Batched customer processing (CUSTOMER_LLM_BATCH_SIZE > 1): several customers' packages in one LLM call.
+# Results always use patch operations, so several customers' changes to the assistant state can be applied in turn.
+OLLAMA_CUSTOMER_BATCH_PROMPT_TEMPLATE = """
+You are Iri-shka, a virtual assistant for a business. Your business partner, who manages this system, is named {admin_name_value}.
+Your role is to process interactions from potential customers contacting via a Telegram bot and summarize them for {admin_name_value}.
+The system has ALREADY SENT an initial acknowledgment message ("{actual_thanks_and_forwarded_message_value}") to each customer below.
+Below are {customer_count} INDEPENDENT customer interactions. Process each one on its own; never mix information between customers.
+
+Your (Iri-shka's) current internal state (note its `internal_tasks` format: `{{"pending": [...], "completed": [...]}}`):
+{assistant_state_string}
+
+IMPORTANT LANGUAGE NOTE: {admin_name_value} prefers to receive summaries and notifications from you in Russian.
+Therefore, every 'message_for_admin' you generate MUST be in clear, natural Russian.
+Every 'polite_followup_message_for_customer' should also be in Russian.
+
+{customer_sections}
+
+For EACH customer above:
+1.  Analyze their interaction. Identify the customer's name (if provided and not already in their state, or if they re-state it) and their primary intent/request.
+2.  Describe the changes to that customer's state as `customer_state_patch` (a list of operations; do NOT repeat the state):
+    - Name, if identifiable and currently "unknown" or different: `{{"op": "replace", "path": "name", "value": "<name>"}}`.
+    - Intent: `{{"op": "replace", "path": "intent", "value": "<concise description of their request>"}}`.
+    - If the customer requests an appointment with a specific date/time, append an event:
+      `{{"op": "append", "path": "calendar_events", "value": {{"description": "Запись на консультацию", "date": "2024-07-10", "time": "15:00", "attendees": ["{admin_name_value}", "<customer_user_id>"]}}}}`.
+      "date" is "YYYY-MM-DD", "time" is "HH:MM" and optional. Do not invent events.
+    - ALWAYS include `{{"op": "replace", "path": "conversation_stage", "value": "llm_followup_sent"}}`.
+    - Never change `chat_history`; the system keeps it up to date.
+3.  `message_for_admin`: one concise RUSSIAN sentence for {admin_name_value} with the customer's name ("Клиент Иван..." if the name was already known, "Новый клиент..." otherwise), their intent, and any calendar event you added.
+4.  `polite_followup_message_for_customer`: a brief, friendly RUSSIAN follow-up, or the exact string "NO_CUSTOMER_FOLLOWUP_NEEDED".
+5.  `assistant_state_patch`: append one concise task for that customer:
+    `{{"op": "append", "path": "internal_tasks.pending", "value": "Сообщить {admin_name_value} о контакте от <customer_user_id> ([<Customer Name>]) по поводу [<Intent Summary>]"}}`.
+
+Patch operations: "append" / "remove_value" (on list fields), "replace" (on any field); "path" uses dots for nested fields.
+
+Provide ONLY a valid JSON response with the following structure, with exactly one entry per customer. Do NOT include any text before or after the JSON object.
+
+{{
+  "results": [
+    {{
+      "customer_user_id": "<the customer's Telegram User ID, exactly as given above>",
+      "customer_state_patch": [ ... operations, including the conversation_stage replace ... ],
+      "assistant_state_patch": [ ... operations ... ],
+      "message_for_admin": "RUSSIAN summary for {admin_name_value}.",
+      "polite_followup_message_for_customer": "RUSSIAN follow-up, or 'NO_CUSTOMER_FOLLOWUP_NEEDED'."
+    }}
+  ]
+}}
+"""
+OLLAMA_CUSTOMER_BATCH_SECTION_TEMPLATE = """=== Customer {index} of {customer_count}: Telegram User ID {customer_user_id} ===
+Current state:
+{customer_state_string}
+Interaction:
+{customer_interaction_text_blob}
+"""
@@ -8,6 +8,7 @@ import threading
 
 # Assuming logger.py is in project root
 from logger import get_logger
+from utils.calendar_index import CalendarIndex, ADMIN_OWNER
 logger = get_logger("Iri-shka_App.GUIManager")
 
 
@@ -69,6 +70,7 @@ class GUIManager:
         self.calendar_widget = None
         self.calendar_events_display = None
         self.all_calendar_events_data = []
+        self.calendar_index = CalendarIndex() # Admin calendar; parsed once per change, queried per selected day
         self.selected_calendar_date = date.today()
 
         self.act_status_frame = None; self.act_status_text_label = None
@@ -327,11 +329,7 @@ class GUIManager:
 
     def _mark_dates_with_events_on_calendar(self, all_events):
         if not TKCALENDAR_AVAILABLE or not self.calendar_widget: return
-        self.calendar_widget.calevent_remove('all'); event_dates = set()
-        for item in all_events:
-            if isinstance(item, dict) and "date" in item:
-                try: event_dates.add(datetime.strptime(item["date"], "%Y-%m-%d").date())
-                except ValueError: logger.warning(f"Invalid date in event for calendar mark: {item}")
+        self.calendar_widget.calevent_remove('all'); event_dates = self.calendar_index.dates_with_events()
         mark_bg = self.get_current_theme_colors().get("calendar_event_mark_bg", "yellow")
         for dt in event_dates:
             try: self.calendar_widget.calevent_create(dt, text='', tags=['has_event'])
@@ -344,23 +342,11 @@ class GUIManager:
         self.calendar_events_display.config(state=tk.NORMAL); self.calendar_events_display.delete(1.0, tk.END)
         if not self.all_calendar_events_data: self.calendar_events_display.insert(tk.END, "No calendar events.")
         else:
-            events_today = []
-            for ev in self.all_calendar_events_data:
-                if isinstance(ev, dict) and "date" in ev:
-                    try:
-                        if datetime.strptime(ev["date"], "%Y-%m-%d").date() == self.selected_calendar_date: events_today.append(ev)
-                    except ValueError: logger.warning(f"Invalid date string '{ev['date']}' in event when filtering for display.")
+            events_today = self.calendar_index.events_on(self.selected_calendar_date) # Already in time order
             logger.debug(f"Events for selected day ({self.selected_calendar_date}): {events_today}")
             if not events_today: self.calendar_events_display.insert(tk.END, f"No events for {self.selected_calendar_date.strftime('%Y-%m-%d')}.")
             else:
-                def get_event_time_for_day_sort(event_dict):
-                    time_str = event_dict.get("time")
-                    if time_str:
-                        try: return datetime.strptime(time_str, "%H:%M").time()
-                        except ValueError: logger.warning(f"Invalid time string '{time_str}' for event '{event_dict.get('description', 'N/A')}' on {self.selected_calendar_date}, sorting as if no time."); return datetime.max.time()
-                    return datetime.max.time()
-                sorted_day_events = sorted(events_today, key=get_event_time_for_day_sort)
-                for ev in sorted_day_events: desc = ev.get('description', ev.get('name', 'Event')); time_prefix = f"{ev.get('time')}: " if ev.get('time') else ""; self.calendar_events_display.insert(tk.END, f"{time_prefix}{desc}\n")
+                for ev in events_today: time_prefix = f"{ev.raw.get('time')}: " if ev.raw.get('time') else ""; self.calendar_events_display.insert(tk.END, f"{time_prefix}{ev.description}\n")
         self.calendar_events_display.config(state=tk.DISABLED); self.calendar_events_display.see(tk.END)
 
     def _configure_tags_for_chat_display(self):
@@ -629,19 +615,10 @@ class GUIManager:
 
     def update_calendar_events_list(self, all_events_data):
         logger.debug(f"GUIManager.update_calendar_events_list called with: {all_events_data}")
-        if not isinstance(all_events_data, list): logger.warning(f"GUIManager.update_calendar_events_list received non-list data: {type(all_events_data)}"); self.all_calendar_events_data = []
+        if not isinstance(all_events_data, list): logger.warning(f"GUIManager.update_calendar_events_list received non-list data: {type(all_events_data)}"); self.all_calendar_events_data = []; self.calendar_index.drop_owner(ADMIN_OWNER)
         else:
-            def sort_key_calendar_event(event_dict):
-                date_val_str = event_dict.get("date", "1900-01-01"); event_date_obj = date.min
-                if isinstance(date_val_str, str):
-                    try: event_date_obj = datetime.strptime(date_val_str, "%Y-%m-%d").date()
-                    except ValueError: logger.warning(f"Invalid date string '{date_val_str}' in calendar event, using min date for sort.")
-                time_val_str = event_dict.get("time"); event_time_obj = datetime.min.time()
-                if isinstance(time_val_str, str) and time_val_str:
-                    try: event_time_obj = datetime.strptime(time_val_str, "%H:%M").time()
-                    except ValueError: logger.warning(f"Invalid time string '{time_val_str}' in calendar event, using min time for sort.")
-                return (event_date_obj, event_time_obj)
-            self.all_calendar_events_data = sorted([e for e in all_events_data if isinstance(e, dict) and "date" in e], key=sort_key_calendar_event)
+            self.calendar_index.sync_owner(ADMIN_OWNER, all_events_data) # Only changed events are re-parsed
+            self.all_calendar_events_data = [ev.raw for ev in self.calendar_index.events_for_owner(ADMIN_OWNER)]
             logger.debug(f"GUIManager.all_calendar_events_data after sorting: {self.all_calendar_events_data}")
         if TKCALENDAR_AVAILABLE and self.calendar_widget: self._mark_dates_with_events_on_calendar(self.all_calendar_events_data)
         self._update_filtered_event_display()
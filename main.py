@@ -1,6 +1,7 @@
-import tkinter as tk
 import threading
 import sys
+HEADLESS = "--headless" in sys.argv[1:] # No Tk/GUI: services run on threads, status goes to the log
+if not HEADLESS: import tkinter as tk
 import gc
 import os
 import logging
@@ -30,7 +31,7 @@ project_root_dir = os.path.dirname(os.path.abspath(__file__))
 
 try:
     import config
-    from utils import file_utils, state_manager, audio_processor, gpu_monitor
+    from utils import file_utils, state_manager, audio_processor, gpu_monitor, artifact_reaper
     from utils.telegram_handler import TelegramBotHandler, PYDUB_AVAILABLE as TELEGRAM_PYDUB_AVAILABLE
     from utils.customer_interaction_manager import CustomerInteractionManager
 
@@ -39,16 +40,22 @@ try:
     from utils.admin_interaction_processor import (
         process_gui_recorded_audio,
         process_admin_telegram_text_message as process_admin_tg_text_util,
-        process_admin_telegram_voice_message as process_admin_tg_voice_util
+        process_admin_telegram_voice_message as process_admin_tg_voice_util,
+        shutdown_admin_pipeline
     )
     from utils.customer_llm_processor import handle_customer_interaction_package as handle_customer_pkg_util
+    from utils.customer_llm_processor import handle_customer_interaction_batch as handle_customer_batch_util
     from utils.initialization_manager import load_all_models_and_services as load_services_util
     from utils.dashboard_utils import get_dashboard_data_for_telegram as get_dashboard_data_util
 
-    from utils import whisper_handler, tts_manager, ollama_handler
+    from utils import whisper_handler, tts_manager, ollama_handler, opus_encoder
+    from utils.versioned_state import get_app_state
+    from utils.admin_dispatcher import AdminMessageDispatcher, marshal_gui_callbacks
+    from utils.work_queue import DurableWorkStore, DurableAdminQueue, KIND_CUSTOMER, plan_recovery, fast_forward
     from utils import telegram_messaging_utils as telegram_messaging_utils_module
+    from utils.headless_runtime import HeadlessRuntime, LogOnlyGUICallbacks
 
-    from gui_manager import GUIManager
+    if not HEADLESS: from gui_manager import GUIManager # Pulls in tkinter, tkcalendar, pystray and Pillow
     from webui.web_app import flask_app as actual_flask_app, WEB_UI_ENABLED_FLAG as web_app_internal_enabled_flag_ref
     logger.info("Core modules imported successfully.")
 except ImportError as e_import:
@@ -66,10 +73,10 @@ if config.TELEGRAM_REPLY_WITH_VOICE and TELEGRAM_PYDUB_AVAILABLE:
         initialize_telegram_audio_dependencies(PydubAudioSegment_main, PydubExceptions_main)
         logger.info("Pydub imported in main.py and passed to messaging utils.")
     except ImportError:
-        logger.warning("Failed to import Pydub in main.py; TTS OGG conversion for Telegram will be disabled.")
+        logger.warning("Failed to import Pydub in main.py (TTS replies are encoded by utils.opus_encoder and are unaffected).")
         initialize_telegram_audio_dependencies(None, None)
 else:
-    logger.info("Pydub not available or Admin/Customer voice replies disabled, TTS OGG conversion for Telegram disabled.")
+    logger.info("Pydub not available or Admin/Customer voice replies disabled; Pydub reference not passed to messaging utils.")
     initialize_telegram_audio_dependencies(None, None)
 
 _whisper_module_for_load_audio = None
@@ -81,19 +88,22 @@ if whisper_handler.WHISPER_CAPABLE:
     except ImportError:
         logger.warning("Failed to import OpenAI whisper module in main.py; Admin Telegram voice WAV loading might fail.")
 
-gui: GUIManager = None 
-app_tk_instance: tk.Tk = None 
+gui: "GUIManager" = None 
+app_tk_instance: "tk.Tk" = None 
+headless_runtime: HeadlessRuntime = None
+headless_gui_callbacks: LogOnlyGUICallbacks = None
 _active_gpu_monitor: gpu_monitor.GPUMonitor = None 
+_active_artifact_reaper: artifact_reaper.ArtifactReaper = None
 telegram_bot_handler_instance: TelegramBotHandler = None 
 customer_interaction_manager_instance: CustomerInteractionManager = None 
-admin_llm_message_queue = queue.Queue()
+admin_llm_message_queue = queue.Queue() # Replaced by a DurableAdminQueue at startup
+admin_dispatcher: AdminMessageDispatcher = None
+admin_worker_gui_callbacks: dict = {} # gui_callbacks posted to the Tk thread, for the admin dispatcher's workers
+work_store: DurableWorkStore = None
+_work_recovery_plan: dict = None # Overdue work, replayed once Ollama is ready
 llm_task_executor: ThreadPoolExecutor = None 
 flask_thread_instance: threading.Thread = None 
 
-chat_history: list = []
-user_state: dict = {}
-assistant_state: dict = {}
-global_states_lock = threading.Lock()
 ollama_ready: bool = False
 current_gui_theme: str = config.GUI_THEME_LIGHT
 current_chat_font_size_applied: int = config.DEFAULT_CHAT_FONT_SIZE
@@ -176,19 +186,20 @@ def check_webui_health():
 
 
 def set_ollama_ready_main(is_ready: bool):
-    global ollama_ready
+    global ollama_ready, _work_recovery_plan
     ollama_ready = is_ready
+    if is_ready and _work_recovery_plan is not None:
+        plan, _work_recovery_plan = _work_recovery_plan, None
+        fast_forward(plan["overdue"], plan["admin"], _dispatch_expired_customer, admin_llm_message_queue)
 
 def on_gui_recording_finished(recorded_sample_rate):
-    global chat_history, user_state, assistant_state, global_states_lock, ollama_ready
+    global ollama_ready
     global telegram_bot_handler_instance, audio_processor, whisper_handler, tts_manager
     global ollama_handler, state_manager, file_utils, telegram_messaging_utils_module
 
     try:
         process_gui_recorded_audio(
-            recorded_sample_rate=recorded_sample_rate,
-            chat_history_ref=chat_history, user_state_ref=user_state, assistant_state_ref=assistant_state,
-            global_states_lock_ref=global_states_lock, gui_callbacks=gui_callbacks,
+            recorded_sample_rate=recorded_sample_rate, gui_callbacks=gui_callbacks,
             telegram_bot_handler_instance_ref=telegram_bot_handler_instance,
             ollama_ready_flag=ollama_ready, audio_processor_module_ref=audio_processor,
             whisper_handler_module_ref=whisper_handler, tts_manager_module_ref=tts_manager,
@@ -216,125 +227,6 @@ def on_gui_recording_finished(recorded_sample_rate):
             gui_callbacks['speak_button_update'](speak_btn_ready, "Speak" if speak_btn_ready else "HEAR NRDY")
 
 
-def handle_web_admin_interaction_result(bridge_result_data: dict):
-    global chat_history, user_state, assistant_state, global_states_lock, current_gui_theme, current_chat_font_size_applied
-    logger.info(f"MAIN: Processing WebAppBridge result. Transcription: '{bridge_result_data.get('user_transcription', '')[:50]}...'")
-
-    user_state_snapshot: dict
-    assistant_state_snapshot: dict
-    with global_states_lock:
-        user_state_snapshot = user_state.copy()
-        assistant_state_snapshot = assistant_state.copy()
-
-    if bridge_result_data.get("error_message"):
-        logger.error(f"MAIN: WebAppBridge reported error: {bridge_result_data['error_message']}")
-        if gui_callbacks and callable(gui_callbacks.get('add_assistant_message_to_display')):
-            gui_callbacks['add_assistant_message_to_display'](
-                f"[Web UI Error: {bridge_result_data['error_message']}]", is_error=True, source="web_admin_error"
-            )
-
-    llm_provided_user_state_changes = bridge_result_data.get("updated_user_state")
-    if llm_provided_user_state_changes and isinstance(llm_provided_user_state_changes, dict):
-        llm_theme_suggestion = llm_provided_user_state_changes.get("gui_theme", current_gui_theme)
-        applied_theme_value = current_gui_theme
-        if llm_theme_suggestion != current_gui_theme and llm_theme_suggestion in [config.GUI_THEME_LIGHT, config.GUI_THEME_DARK]:
-            if gui and callable(gui_callbacks.get('apply_application_theme')):
-                gui_callbacks['apply_application_theme'](llm_theme_suggestion)
-                current_gui_theme = llm_theme_suggestion
-                applied_theme_value = llm_theme_suggestion
-        llm_provided_user_state_changes["gui_theme"] = applied_theme_value
-
-        llm_font_size_str_suggestion = llm_provided_user_state_changes.get("chat_font_size", str(current_chat_font_size_applied))
-        try: llm_font_size_as_int = int(llm_font_size_str_suggestion)
-        except: llm_font_size_as_int = current_chat_font_size_applied
-        clamped_font_size_suggestion = max(config.MIN_CHAT_FONT_SIZE, min(llm_font_size_as_int, config.MAX_CHAT_FONT_SIZE))
-        applied_font_size_value = current_chat_font_size_applied
-        if clamped_font_size_suggestion != current_chat_font_size_applied:
-            if gui and callable(gui_callbacks.get('apply_chat_font_size')):
-                gui_callbacks['apply_chat_font_size'](clamped_font_size_suggestion)
-                current_chat_font_size_applied = clamped_font_size_suggestion
-            applied_font_size_value = clamped_font_size_suggestion
-        llm_provided_user_state_changes["chat_font_size"] = applied_font_size_value
-
-        # Ensure 'todos' from admin is not processed
-        if "todos" in llm_provided_user_state_changes:
-            del llm_provided_user_state_changes["todos"]
-            logger.warning("MAIN: WebAppBridge tried to update 'todos' for admin state via LLM. This key is ignored.")
-
-
-        with global_states_lock:
-            merged_user_state = user_state_snapshot.copy()
-            merged_user_state.update(llm_provided_user_state_changes)
-            user_state.clear(); user_state.update(merged_user_state)
-    else:
-        logger.warning("MAIN: WebAppBridge did not return a dictionary for updated_user_state. User state not modified by LLM this turn.")
-
-    llm_provided_assistant_state_changes = bridge_result_data.get("updated_assistant_state")
-    if llm_provided_assistant_state_changes and isinstance(llm_provided_assistant_state_changes, dict):
-        with global_states_lock:
-            merged_assistant_state = assistant_state_snapshot.copy()
-            if "internal_tasks" in llm_provided_assistant_state_changes and isinstance(llm_provided_assistant_state_changes["internal_tasks"], dict):
-                llm_tasks_dict = llm_provided_assistant_state_changes["internal_tasks"]
-                if "internal_tasks" not in merged_assistant_state or not isinstance(merged_assistant_state.get("internal_tasks"), dict):
-                    merged_assistant_state["internal_tasks"] = {"pending": [], "completed": []} # Initialize with new structure
-                
-                for task_type in ["pending", "completed"]: # Only process these two
-                    if task_type not in merged_assistant_state["internal_tasks"] or not isinstance(merged_assistant_state["internal_tasks"].get(task_type), list):
-                        merged_assistant_state["internal_tasks"][task_type] = [] # Ensure list exists
-                    
-                    new_tasks_from_llm = llm_tasks_dict.get(task_type, [])
-                    if not isinstance(new_tasks_from_llm, list): 
-                        new_tasks_from_llm = [str(new_tasks_from_llm)] if new_tasks_from_llm else []
-                    
-                    existing_tasks_in_merged = merged_assistant_state["internal_tasks"][task_type]
-                    merged_assistant_state["internal_tasks"][task_type] = list(dict.fromkeys(
-                        [str(t) for t in existing_tasks_in_merged] + [str(t) for t in new_tasks_from_llm]
-                    ))
-                if "in_process" in llm_tasks_dict:
-                     logger.warning("MAIN: WebAppBridge provided 'in_process' tasks for assistant. This key is now ignored.")
-
-            for key, val_llm in llm_provided_assistant_state_changes.items():
-                if key != "internal_tasks":
-                    merged_assistant_state[key] = val_llm
-            assistant_state.clear(); assistant_state.update(merged_assistant_state)
-    else:
-        logger.warning("MAIN: WebAppBridge did not return a dictionary for updated_assistant_state. Assistant state not modified by LLM this turn.")
-
-    updated_customer_state_from_bridge = bridge_result_data.get("updated_active_customer_state")
-    if updated_customer_state_from_bridge and isinstance(updated_customer_state_from_bridge, dict):
-        cust_id_in_state = updated_customer_state_from_bridge.get("user_id")
-        if cust_id_in_state:
-            if state_manager.save_customer_state(cust_id_in_state, updated_customer_state_from_bridge, gui_callbacks):
-                logger.info(f"MAIN: Updated state for context customer {cust_id_in_state} via web interaction.")
-        else: logger.warning("MAIN: Web bridge returned customer state without user_id.")
-
-    new_chat_turn_from_bridge = bridge_result_data.get("new_chat_turn")
-    if new_chat_turn_from_bridge and isinstance(new_chat_turn_from_bridge, dict):
-        with global_states_lock:
-            new_chat_turn_from_bridge["timestamp"] = state_manager.get_current_timestamp_iso()
-            chat_history.append(new_chat_turn_from_bridge)
-
-    with global_states_lock:
-        updated_ch = state_manager.save_states(chat_history, user_state, assistant_state, gui_callbacks)
-        if len(chat_history) != len(updated_ch): chat_history[:] = updated_ch
-
-    if gui and gui_callbacks:
-        with global_states_lock:
-            if callable(gui_callbacks.get('update_chat_display_from_list')): gui_callbacks['update_chat_display_from_list'](chat_history)
-            # Removed admin todo list update from GUI
-            if callable(gui_callbacks.get('update_calendar_events_list')): gui_callbacks['update_calendar_events_list'](user_state.get("calendar_events", []))
-            
-            asst_tasks_web = assistant_state.get("internal_tasks", {});
-            if not isinstance(asst_tasks_web, dict): asst_tasks_web = {"pending": [], "completed": []}
-            
-            if callable(gui_callbacks.get('update_kanban_pending')): 
-                gui_callbacks['update_kanban_pending'](asst_tasks_web.get("pending", []))
-            # Removed update_kanban_in_process
-            if callable(gui_callbacks.get('update_kanban_completed')): 
-                gui_callbacks['update_kanban_completed'](asst_tasks_web.get("completed", []))
-    logger.info(f"MAIN: WebAppBridge result processing finished.")
-
-
 def start_gui_recording():
     global gui_callbacks, audio_processor, whisper_handler, tts_manager
     logger.debug("start_gui_recording called.")
@@ -393,16 +285,32 @@ def _stop_telegram_bot_action():
 
 def on_app_exit():
     global gui, app_tk_instance, _active_gpu_monitor, telegram_bot_handler_instance, llm_task_executor, flask_thread_instance
+    global _active_artifact_reaper
     logger.info("Application closing sequence initiated...")
 
+    if admin_dispatcher:
+        logger.info(f"Stopping admin queue dispatcher: {admin_dispatcher.get_metrics()}")
+        admin_dispatcher.stop()
+    shutdown_admin_pipeline() # Cancels queued admin turns; their durable queue items are replayed on the next start
+    if customer_interaction_manager_instance:
+        logger.info(f"Stopping customer aggregation timers: {customer_interaction_manager_instance.get_metrics()}")
+        customer_interaction_manager_instance.stop()
     if llm_task_executor:
         logger.info("Shutting down LLM task thread pool..."); llm_task_executor.shutdown(wait=False, cancel_futures=True)
         llm_task_executor = None; logger.info("LLM task thread pool shutdown initiated.")
     if telegram_bot_handler_instance: logger.info("Shutting down Telegram bot..."); telegram_bot_handler_instance.full_shutdown()
     if _active_gpu_monitor: logger.info("Shutting down GPU monitor..."); _active_gpu_monitor.stop()
+    if _active_artifact_reaper: logger.info("Stopping artifact reaper..."); _active_artifact_reaper.stop(); _active_artifact_reaper = None
     logger.info("Shutting down audio resources..."); audio_processor.shutdown_audio_resources()
     if tts_manager.TTS_CAPABLE: logger.info("Shutting down TTS module..."); tts_manager.full_shutdown_tts_module()
     if whisper_handler.WHISPER_CAPABLE: logger.info("Cleaning up Whisper model..."); whisper_handler.full_shutdown_whisper_module()
+    opus_encoder.shutdown_encoder()
+    logger.info("Flushing pending state writes..."); state_manager.shutdown_state_persistence()
+    logger.info(f"Customer state cache: {state_manager.get_customer_cache_metrics()}")
+    logger.info(f"LLM eval metrics ({config.LLM_STATE_UPDATE_MODE} state updates): {ollama_handler.get_llm_eval_metrics()}")
+    state_manager.close_customer_state_store()
+    if work_store: logger.info(f"Unfinished work kept for the next start: {work_store.counts()}"); work_store.close()
+    state_manager.close_chat_history_journal()
 
     logger.info("Flask thread is daemonized, will exit with main app.")
 
@@ -417,30 +325,62 @@ def on_app_exit():
     logger.info("Application exit sequence fully complete."); logging.shutdown()
 
 
-def _periodic_status_and_task_checker():
-    global customer_interaction_manager_instance, llm_task_executor, app_tk_instance, gui_callbacks
+def _dispatch_expired_customer(customer_id: int):
+    """on_expired callback of CustomerInteractionManager; runs on its timer thread as soon as a window closes."""
+    if not customer_id: return None
+    if not llm_task_executor or llm_task_executor._shutdown:
+        logger.warning(f"MAIN: LLM executor unavailable; customer {customer_id} not dispatched.")
+        return None
+    logger.info(f"MAIN: Submitting customer {customer_id} for LLM processing.")
+    if work_store: work_store.mark_running(KIND_CUSTOMER, customer_id)
+    future = llm_task_executor.submit(
+        handle_customer_pkg_util,
+        customer_user_id=customer_id, gui_callbacks=gui_callbacks, telegram_bot_handler_instance_ref=telegram_bot_handler_instance,
+        state_manager_module_ref=state_manager, ollama_handler_module_ref=ollama_handler,
+        tts_manager_module_ref=tts_manager,
+        telegram_messaging_utils_module_ref=telegram_messaging_utils_module
+    )
+    if work_store: # Cancelled at shutdown: keep the row so the package is replayed on the next start
+        future.add_done_callback(lambda f: f.cancelled() or work_store.complete(KIND_CUSTOMER, customer_id, only_if_running=True))
+    return future
+
+
+def _dispatch_expired_customer_batch(customer_ids: list):
+    """on_expired_batch callback (CUSTOMER_LLM_BATCH_SIZE > 1): one LLM call for customers whose windows closed together."""
+    customer_ids = [cid for cid in customer_ids if cid]
+    if len(customer_ids) <= 1:
+        for customer_id in customer_ids: _dispatch_expired_customer(customer_id)
+        return
+    if not llm_task_executor or llm_task_executor._shutdown:
+        logger.warning(f"MAIN: LLM executor unavailable; customers {customer_ids} not dispatched.")
+        return
+    logger.info(f"MAIN: Submitting customers {customer_ids} for batched LLM processing.")
+    if work_store:
+        for customer_id in customer_ids: work_store.mark_running(KIND_CUSTOMER, customer_id)
+    future = llm_task_executor.submit(
+        handle_customer_batch_util,
+        customer_user_ids=customer_ids, gui_callbacks=gui_callbacks, telegram_bot_handler_instance_ref=telegram_bot_handler_instance,
+        state_manager_module_ref=state_manager, ollama_handler_module_ref=ollama_handler,
+        tts_manager_module_ref=tts_manager,
+        telegram_messaging_utils_module_ref=telegram_messaging_utils_module
+    )
+    if work_store:
+        def _complete_batch(f):
+            if f.cancelled(): return
+            for customer_id in customer_ids: work_store.complete(KIND_CUSTOMER, customer_id, only_if_running=True)
+        future.add_done_callback(_complete_batch)
+
 
+def _report_webui_status():
     if config.ENABLE_WEB_UI and gui_callbacks and callable(gui_callbacks.get('webui_status_update')):
         webui_text, webui_type = check_webui_health() 
         gui_callbacks['webui_status_update'](webui_text, webui_type)
 
-    if customer_interaction_manager_instance and llm_task_executor and not llm_task_executor._shutdown:
-        try:
-            expired_customer_ids = customer_interaction_manager_instance.check_and_get_expired_interactions()
-            for customer_id in expired_customer_ids:
-                if customer_id:
-                    logger.info(f"MAIN_PERIODIC_CHECKER: Submitting customer {customer_id} for LLM processing.")
-                    llm_task_executor.submit(
-                        handle_customer_pkg_util,
-                        customer_user_id=customer_id, chat_history_ref=chat_history, user_state_ref=user_state,
-                        assistant_state_ref=assistant_state, global_states_lock_ref=global_states_lock,
-                        gui_callbacks=gui_callbacks, telegram_bot_handler_instance_ref=telegram_bot_handler_instance,
-                        state_manager_module_ref=state_manager, ollama_handler_module_ref=ollama_handler,
-                        tts_manager_module_ref=tts_manager,
-                        telegram_messaging_utils_module_ref=telegram_messaging_utils_module
-                    )
-        except Exception as e:
-            logger.error(f"Error in customer interaction check part of periodic checker: {e}", exc_info=True)
+
+def _periodic_status_and_task_checker():
+    global app_tk_instance, gui_callbacks
+
+    _report_webui_status()
 
     if app_tk_instance and hasattr(app_tk_instance, 'winfo_exists') and app_tk_instance.winfo_exists():
         app_tk_instance.after(config.CUSTOMER_INTERACTION_CHECK_INTERVAL_SECONDS * 1000, _periodic_status_and_task_checker)
@@ -448,40 +388,23 @@ def _periodic_status_and_task_checker():
         logger.info("_periodic_status_and_task_checker: Tk instance not available. Stopping periodic check.")
 
 
-def _process_queued_admin_llm_messages():
-    global admin_llm_message_queue
-    try:
-        while not admin_llm_message_queue.empty():
-            item = admin_llm_message_queue.get_nowait()
-            if not isinstance(item, tuple) or len(item)!=3: logger.error(f"Invalid Admin LLM queue item: {item}"); continue
-            msg_type, user_id, data = item
-            if msg_type == "telegram_text_admin":
-                process_admin_tg_text_util(
-                    user_id=user_id, text_message=data, chat_history_ref=chat_history, user_state_ref=user_state,
-                    assistant_state_ref=assistant_state, global_states_lock_ref=global_states_lock,
-                    gui_callbacks=gui_callbacks, telegram_bot_handler_instance_ref=telegram_bot_handler_instance,
-                    ollama_ready_flag=ollama_ready, ollama_handler_module_ref=ollama_handler,
-                    state_manager_module_ref=state_manager, tts_manager_module_ref=tts_manager,
-                    telegram_messaging_utils_module_ref=telegram_messaging_utils_module
-                )
-            elif msg_type == "telegram_voice_admin_wav":
-                process_admin_tg_voice_util(
-                    user_id=user_id, wav_filepath=data, chat_history_ref=chat_history, user_state_ref=user_state,
-                    assistant_state_ref=assistant_state, global_states_lock_ref=global_states_lock,
-                    gui_callbacks=gui_callbacks, telegram_bot_handler_instance_ref=telegram_bot_handler_instance,
-                    ollama_ready_flag=ollama_ready, whisper_handler_module_ref=whisper_handler,
-                    _whisper_module_for_load_audio_ref=_whisper_module_for_load_audio,
-                    ollama_handler_module_ref=ollama_handler, state_manager_module_ref=state_manager,
-                    tts_manager_module_ref=tts_manager,
-                    telegram_messaging_utils_module_ref=telegram_messaging_utils_module
-                )
-            else: logger.warning(f"Unknown Admin LLM message type: {msg_type}")
-            admin_llm_message_queue.task_done()
-    except queue.Empty: pass
-    except Exception as e: logger.error(f"Error processing Admin LLM queue: {e}", exc_info=True)
-    if app_tk_instance and hasattr(app_tk_instance, 'winfo_exists') and app_tk_instance.winfo_exists():
-        app_tk_instance.after(300, _process_queued_admin_llm_messages)
-    else: logger.info("_process_queued_admin_llm_messages: Tk instance not available. Stopping queue check.")
+def _handle_admin_tg_text(user_id, text_message):
+    return process_admin_tg_text_util(
+        user_id=user_id, text_message=text_message, gui_callbacks=admin_worker_gui_callbacks, telegram_bot_handler_instance_ref=telegram_bot_handler_instance,
+        ollama_ready_flag=ollama_ready, ollama_handler_module_ref=ollama_handler,
+        state_manager_module_ref=state_manager, tts_manager_module_ref=tts_manager,
+        telegram_messaging_utils_module_ref=telegram_messaging_utils_module
+    )
+
+def _handle_admin_tg_voice(user_id, wav_filepath):
+    return process_admin_tg_voice_util(
+        user_id=user_id, wav_filepath=wav_filepath, gui_callbacks=admin_worker_gui_callbacks, telegram_bot_handler_instance_ref=telegram_bot_handler_instance,
+        ollama_ready_flag=ollama_ready, whisper_handler_module_ref=whisper_handler,
+        _whisper_module_for_load_audio_ref=_whisper_module_for_load_audio,
+        ollama_handler_module_ref=ollama_handler, state_manager_module_ref=state_manager,
+        tts_manager_module_ref=tts_manager,
+        telegram_messaging_utils_module_ref=telegram_messaging_utils_module
+    )
 
 
 if __name__ == "__main__":
@@ -509,98 +432,126 @@ if __name__ == "__main__":
     logger.info("Loading initial states (admin & assistant)...")
     try:
         loaded_ch, loaded_us, loaded_as = state_manager.load_initial_states(gui_callbacks=None)
-        with global_states_lock:
-            chat_history = loaded_ch; user_state = loaded_us; assistant_state = loaded_as
     except Exception as e_state_load:
         logger.critical(f"CRITICAL ERROR loading initial states: {e_state_load}", exc_info=True); sys.exit(1)
-
-    with global_states_lock:
-        initial_theme_from_state = user_state.get("gui_theme", config.DEFAULT_USER_STATE["gui_theme"])
-        current_gui_theme = initial_theme_from_state if initial_theme_from_state in [config.GUI_THEME_LIGHT, config.GUI_THEME_DARK] else config.GUI_THEME_LIGHT
-        user_state["gui_theme"] = current_gui_theme
-        initial_font_size_state = user_state.get("chat_font_size", config.DEFAULT_USER_STATE["chat_font_size"])
-        try: initial_font_size_state = int(initial_font_size_state)
-        except (ValueError, TypeError): initial_font_size_state = config.DEFAULT_CHAT_FONT_SIZE
-        current_chat_font_size_applied = max(config.MIN_CHAT_FONT_SIZE, min(initial_font_size_state, config.MAX_CHAT_FONT_SIZE))
-        user_state["chat_font_size"] = current_chat_font_size_applied
-        # Ensure admin's 'todos' is not loaded if it somehow existed in the file
-        if "todos" in user_state:
-            del user_state["todos"]
-            logger.info("Removed 'todos' key from loaded admin user_state as it's no longer used.")
+    try: state_manager.rebuild_calendar_index() # Customer calendars, for cross-calendar conflict detection
+    except Exception as e_cal_index: logger.error(f"Could not build the calendar index: {e_cal_index}", exc_info=True)
+
+    initial_theme_from_state = loaded_us.get("gui_theme", config.DEFAULT_USER_STATE["gui_theme"])
+    current_gui_theme = initial_theme_from_state if initial_theme_from_state in [config.GUI_THEME_LIGHT, config.GUI_THEME_DARK] else config.GUI_THEME_LIGHT
+    loaded_us["gui_theme"] = current_gui_theme
+    initial_font_size_state = loaded_us.get("chat_font_size", config.DEFAULT_USER_STATE["chat_font_size"])
+    try: initial_font_size_state = int(initial_font_size_state)
+    except (ValueError, TypeError): initial_font_size_state = config.DEFAULT_CHAT_FONT_SIZE
+    current_chat_font_size_applied = max(config.MIN_CHAT_FONT_SIZE, min(initial_font_size_state, config.MAX_CHAT_FONT_SIZE))
+    loaded_us["chat_font_size"] = current_chat_font_size_applied
+    # Ensure admin's 'todos' is not loaded if it somehow existed in the file
+    if "todos" in loaded_us:
+        del loaded_us["todos"]
+        logger.info("Removed 'todos' key from loaded admin user_state as it's no longer used.")
+    # Version 1: from here on the published snapshot is the admin/app state; writers go through get_app_state().update()
+    get_app_state().publish(loaded_ch, loaded_us, loaded_as)
 
 
     logger.info("Initializing ThreadPoolExecutor for LLM tasks...")
     llm_task_executor = ThreadPoolExecutor(max_workers=config.LLM_TASK_THREAD_POOL_SIZE, thread_name_prefix="LLMTaskThread")
+    logger.info("Opening durable work queue...")
+    work_store = DurableWorkStore()
+    admin_llm_message_queue = DurableAdminQueue(work_store)
     logger.info("Initializing CustomerInteractionManager...")
-    customer_interaction_manager_instance = CustomerInteractionManager()
-
-    logger.info("Attempting to initialize Tkinter root & GUIManager...")
-    try: app_tk_instance = tk.Tk()
-    except Exception as e_tk_root:
-        logger.critical(f"CRITICAL Tkinter root init: {e_tk_root}", exc_info=True); sys.exit(1)
-
-    action_callbacks_for_gui = {
-        'start_gui_recording': start_gui_recording,           
-        'stop_gui_recording_and_process': stop_gui_recording_and_process, 
-        'on_exit': on_app_exit,
-        'unload_bark_model': _unload_bark_model_action, 'reload_bark_model': _reload_bark_model_action,
-        'unload_whisper_model': _unload_whisper_model_action, 'reload_whisper_model': _reload_whisper_model_action,
-        'start_telegram_bot': _start_telegram_bot_action, 'stop_telegram_bot': _stop_telegram_bot_action,
-        'enable_webui': _enable_webui_action, 'disable_webui': _disable_webui_action,
-    }
+    customer_interaction_manager_instance = CustomerInteractionManager(
+        on_expired=_dispatch_expired_customer, store=work_store,
+        on_expired_batch=_dispatch_expired_customer_batch if config.CUSTOMER_LLM_BATCH_SIZE > 1 else None,
+        batch_size=config.CUSTOMER_LLM_BATCH_SIZE, coalesce_seconds=config.CUSTOMER_LLM_BATCH_COALESCE_SECONDS)
     try:
-        gui = GUIManager(app_tk_instance, action_callbacks_for_gui,
-                         initial_theme=current_gui_theme,
-                         initial_font_size=current_chat_font_size_applied)
-    except Exception as e_gui:
-        logger.critical(f"CRITICAL GUIManager init: {e_gui}", exc_info=True)
-        if app_tk_instance :
-            try: app_tk_instance.destroy()
-            except: pass
-        sys.exit(1)
-
-    if gui:
-        callback_mapping = {
-            'status_update': 'update_status_label', 'speak_button_update': 'update_speak_button',
-            'act_status_update': 'update_act_status', 'inet_status_update': 'update_inet_status',
-            'webui_status_update': 'update_webui_status', 'tele_status_update': 'update_tele_status',
-            'memory_status_update': 'update_memory_status', 'hearing_status_update': 'update_hearing_status',
-            'voice_status_update': 'update_voice_status', 'mind_status_update': 'update_mind_status',
-            'vis_status_update': 'update_vis_status', 'art_status_update': 'update_art_status',
-            'messagebox_error': 'show_error_messagebox', 'messagebox_info': 'show_info_messagebox',
-            'messagebox_warn': 'show_warning_messagebox',
-            'add_user_message_to_display': 'add_user_message_to_display',
-            'add_assistant_message_to_display': 'add_assistant_message_to_display',
-            'gpu_status_update_display': 'update_gpu_status_display',
-            # 'update_todo_list': 'update_todo_list', # Removed
-            'update_calendar_events_list': 'update_calendar_events_list',
-            'apply_application_theme': 'apply_theme', 'apply_chat_font_size': 'apply_chat_font_size',
-            'update_chat_display_from_list': 'update_chat_display_from_list',
-            'update_kanban_pending': 'update_kanban_pending',
-            # 'update_kanban_in_process': 'update_kanban_in_process', # Removed
-            'update_kanban_completed': 'update_kanban_completed'
+        stuck_customer_ids = [cid for stage in ("aggregating_messages", "acknowledged_pending_llm")
+                              for cid in state_manager.find_customer_ids_by_stage(stage)]
+        _work_recovery_plan = plan_recovery(work_store, stuck_customer_ids)
+        customer_interaction_manager_instance.restore_timers(_work_recovery_plan["timers"])
+    except Exception as e_recovery: logger.error(f"Could not plan work recovery: {e_recovery}", exc_info=True)
+    customer_interaction_manager_instance.start()
+
+    if HEADLESS:
+        logger.info("Headless mode: no Tk root or GUIManager; GUI status updates go to the log.")
+        headless_runtime = HeadlessRuntime()
+        headless_gui_callbacks = LogOnlyGUICallbacks()
+        gui_callbacks.update(headless_gui_callbacks.as_dict())
+    else:
+        logger.info("Attempting to initialize Tkinter root & GUIManager...")
+        try: app_tk_instance = tk.Tk()
+        except Exception as e_tk_root:
+            logger.critical(f"CRITICAL Tkinter root init: {e_tk_root}", exc_info=True); sys.exit(1)
+
+        action_callbacks_for_gui = {
+            'start_gui_recording': start_gui_recording,           
+            'stop_gui_recording_and_process': stop_gui_recording_and_process, 
+            'on_exit': on_app_exit,
+            'unload_bark_model': _unload_bark_model_action, 'reload_bark_model': _reload_bark_model_action,
+            'unload_whisper_model': _unload_whisper_model_action, 'reload_whisper_model': _reload_whisper_model_action,
+            'start_telegram_bot': _start_telegram_bot_action, 'stop_telegram_bot': _stop_telegram_bot_action,
+            'enable_webui': _enable_webui_action, 'disable_webui': _disable_webui_action,
         }
-        for cb_key, method_name in callback_mapping.items():
-            if hasattr(gui, method_name) and callable(getattr(gui, method_name)):
-                gui_callbacks[cb_key] = getattr(gui, method_name)
-        gui_callbacks['on_recording_finished'] = on_gui_recording_finished 
-    else: logger.error("GUI object is None, callbacks cannot be populated.")
+        try:
+            gui = GUIManager(app_tk_instance, action_callbacks_for_gui,
+                             initial_theme=current_gui_theme,
+                             initial_font_size=current_chat_font_size_applied)
+        except Exception as e_gui:
+            logger.critical(f"CRITICAL GUIManager init: {e_gui}", exc_info=True)
+            if app_tk_instance :
+                try: app_tk_instance.destroy()
+                except: pass
+            sys.exit(1)
+
+        if gui:
+            callback_mapping = {
+                'status_update': 'update_status_label', 'speak_button_update': 'update_speak_button',
+                'act_status_update': 'update_act_status', 'inet_status_update': 'update_inet_status',
+                'webui_status_update': 'update_webui_status', 'tele_status_update': 'update_tele_status',
+                'memory_status_update': 'update_memory_status', 'hearing_status_update': 'update_hearing_status',
+                'voice_status_update': 'update_voice_status', 'mind_status_update': 'update_mind_status',
+                'vis_status_update': 'update_vis_status', 'art_status_update': 'update_art_status',
+                'messagebox_error': 'show_error_messagebox', 'messagebox_info': 'show_info_messagebox',
+                'messagebox_warn': 'show_warning_messagebox',
+                'add_user_message_to_display': 'add_user_message_to_display',
+                'add_assistant_message_to_display': 'add_assistant_message_to_display',
+                'gpu_status_update_display': 'update_gpu_status_display',
+                # 'update_todo_list': 'update_todo_list', # Removed
+                'update_calendar_events_list': 'update_calendar_events_list',
+                'apply_application_theme': 'apply_theme', 'apply_chat_font_size': 'apply_chat_font_size',
+                'update_chat_display_from_list': 'update_chat_display_from_list',
+                'update_kanban_pending': 'update_kanban_pending',
+                # 'update_kanban_in_process': 'update_kanban_in_process', # Removed
+                'update_kanban_completed': 'update_kanban_completed'
+            }
+            for cb_key, method_name in callback_mapping.items():
+                if hasattr(gui, method_name) and callable(getattr(gui, method_name)):
+                    gui_callbacks[cb_key] = getattr(gui, method_name)
+            gui_callbacks['on_recording_finished'] = on_gui_recording_finished 
+        else: logger.error("GUI object is None, callbacks cannot be populated.")
+
+    logger.info("Starting admin queue dispatcher...")
+    admin_worker_gui_callbacks = gui_callbacks if HEADLESS else marshal_gui_callbacks(gui_callbacks, lambda fn: app_tk_instance.after(0, fn))
+    admin_dispatcher = AdminMessageDispatcher(admin_llm_message_queue, {
+        "telegram_text_admin": _handle_admin_tg_text,
+        "telegram_voice_admin_wav": _handle_admin_tg_voice,
+    })
+    admin_dispatcher.start()
 
     logger.info("Populating GUI with initial state data...")
     if gui and gui_callbacks:
-        with global_states_lock:
-            if callable(gui_callbacks.get('update_chat_display_from_list')): gui_callbacks['update_chat_display_from_list'](chat_history)
-            # if callable(gui_callbacks.get('update_todo_list')): gui_callbacks['update_todo_list'](user_state.get("todos", [])) # Removed
-            if callable(gui_callbacks.get('update_calendar_events_list')): gui_callbacks['update_calendar_events_list'](user_state.get("calendar_events", []))
-            
-            initial_asst_tasks = assistant_state.get("internal_tasks", {});
-            if not isinstance(initial_asst_tasks, dict): initial_asst_tasks = {"pending": [], "completed": []}
-            
-            if callable(gui_callbacks.get('update_kanban_pending')): 
-                gui_callbacks['update_kanban_pending'](initial_asst_tasks.get("pending", []))
-            # if callable(gui_callbacks.get('update_kanban_in_process')): gui_callbacks['update_kanban_in_process'](initial_asst_tasks.get("in_process", [])) # Removed
-            if callable(gui_callbacks.get('update_kanban_completed')): 
-                gui_callbacks['update_kanban_completed'](initial_asst_tasks.get("completed", []))
+        initial_snapshot = get_app_state().current() # GUI is fed from the immutable snapshot; no lock held
+        if callable(gui_callbacks.get('update_chat_display_from_list')): gui_callbacks['update_chat_display_from_list'](initial_snapshot.chat_history)
+        # if callable(gui_callbacks.get('update_todo_list')): gui_callbacks['update_todo_list'](user_state.get("todos", [])) # Removed
+        if callable(gui_callbacks.get('update_calendar_events_list')): gui_callbacks['update_calendar_events_list'](initial_snapshot.user_state.get("calendar_events", []))
+        
+        initial_asst_tasks = initial_snapshot.assistant_state.get("internal_tasks", {});
+        if not isinstance(initial_asst_tasks, dict): initial_asst_tasks = {"pending": [], "completed": []}
+        
+        if callable(gui_callbacks.get('update_kanban_pending')): 
+            gui_callbacks['update_kanban_pending'](initial_asst_tasks.get("pending", []))
+        # if callable(gui_callbacks.get('update_kanban_in_process')): gui_callbacks['update_kanban_in_process'](initial_asst_tasks.get("in_process", [])) # Removed
+        if callable(gui_callbacks.get('update_kanban_completed')): 
+            gui_callbacks['update_kanban_completed'](initial_asst_tasks.get("completed", []))
 
     logger.info("Initializing Telegram Bot Handler...")
     if config.TELEGRAM_BOT_TOKEN and config.TELEGRAM_ADMIN_USER_ID:
@@ -613,9 +564,7 @@ if __name__ == "__main__":
                 fn_get_dashboard_data=lambda: get_dashboard_data_util(
                     gui_ref=gui, telegram_bot_handler_instance_ref=telegram_bot_handler_instance,
                     ollama_ready_flag=ollama_ready, whisper_handler_module_ref=whisper_handler,
-                    tts_manager_module_ref=tts_manager, user_state_ref=user_state,
-                    assistant_state_ref=assistant_state, chat_history_ref=chat_history,
-                    global_states_lock_ref=global_states_lock
+                    tts_manager_module_ref=tts_manager
                 )
             )
             if config.START_BOT_ON_APP_START and telegram_bot_handler_instance:
@@ -638,20 +587,18 @@ if __name__ == "__main__":
     web_bridge_instance = None
     if config.ENABLE_WEB_UI:
         web_logger.info("Web UI is ENABLED. Initializing bridge and Flask thread...")
+        def _main_app_status_text():
+            if headless_gui_callbacks: return (headless_gui_callbacks.last('status_update') or ("N/A",))[0]
+            return gui.app_status_label.cget("text") if gui and hasattr(gui, 'app_status_label') and gui.app_status_label and gui.app_status_label.winfo_exists() else "N/A"
         web_bridge_instance = WebAppBridge(
             main_app_ollama_ready_flag_getter=lambda: ollama_ready,
-            main_app_status_label_getter_fn=lambda: gui.app_status_label.cget("text") if gui and hasattr(gui, 'app_status_label') and gui.app_status_label and gui.app_status_label.winfo_exists() else "N/A", 
+            main_app_status_label_getter_fn=_main_app_status_text, 
             whisper_handler_module=whisper_handler, ollama_handler_module=ollama_handler,
             tts_manager_module=tts_manager, _whisper_module_for_load_audio_ref=_whisper_module_for_load_audio,
             state_manager_module_ref=state_manager, gui_callbacks_ref=gui_callbacks,
             fn_check_webui_health_main=check_webui_health
         )
         actual_flask_app.main_app_components['bridge'] = web_bridge_instance
-        actual_flask_app.main_app_components['main_interaction_handler'] = handle_web_admin_interaction_result
-        actual_flask_app.main_app_components['chat_history_ref'] = chat_history
-        actual_flask_app.main_app_components['user_state_ref'] = user_state
-        actual_flask_app.main_app_components['assistant_state_ref'] = assistant_state
-        actual_flask_app.main_app_components['global_lock_ref'] = global_states_lock
         web_app_internal_enabled_flag_ref.set_enabled_status(_web_ui_user_toggle_enabled)
 
         if web_bridge_instance and telegram_bot_handler_instance:
@@ -706,31 +653,43 @@ if __name__ == "__main__":
     elif gui_callbacks and callable(gui_callbacks.get('gpu_status_update_display')):
         gui_callbacks['gpu_status_update_display']("N/A", "N/A", "na_nvml")
 
+    if config.ARTIFACT_REAPER_ENABLED:
+        _active_artifact_reaper = artifact_reaper.ArtifactReaper()
+        _active_artifact_reaper.start()
+
     logger.info("Starting model and services loader thread...")
     loader_thread = threading.Thread(
         target=load_services_util,
-        args=(gui_callbacks, assistant_state, chat_history, telegram_bot_handler_instance,
-              set_ollama_ready_main, whisper_handler, tts_manager, ollama_handler, state_manager,
-              global_states_lock),
+        args=(gui_callbacks, telegram_bot_handler_instance,
+              set_ollama_ready_main, whisper_handler, tts_manager, ollama_handler, state_manager),
         daemon=True, name="ServicesLoaderThread"
     )
     loader_thread.start()
 
-    if app_tk_instance and hasattr(app_tk_instance, 'winfo_exists') and app_tk_instance.winfo_exists():
-        app_tk_instance.after(300, _process_queued_admin_llm_messages)
-        app_tk_instance.after(1000, _periodic_status_and_task_checker) 
-    else: logger.error("Tkinter instance not available for scheduling periodic tasks.")
+    if HEADLESS:
+        headless_runtime.every(config.CUSTOMER_INTERACTION_CHECK_INTERVAL_SECONDS, _report_webui_status, "WebUIHealth", initial_delay=1.0)
+        headless_runtime.install_signal_handlers()
+        try: headless_runtime.run_until_stopped()
+        except KeyboardInterrupt: logger.info("KeyboardInterrupt detected. Initiating shutdown.")
+        except Exception as e_headless: logger.critical(f"Unexpected critical error in headless runtime: {e_headless}", exc_info=True)
+        finally:
+            logger.info("Headless runtime stopped. Ensuring graceful shutdown via on_app_exit().")
+            on_app_exit()
+    else:
+        if app_tk_instance and hasattr(app_tk_instance, 'winfo_exists') and app_tk_instance.winfo_exists():
+            app_tk_instance.after(1000, _periodic_status_and_task_checker) 
+        else: logger.error("Tkinter instance not available for scheduling periodic tasks.")
 
-    logger.info("Starting Tkinter mainloop...")
-    try:
-        if app_tk_instance: app_tk_instance.mainloop()
-        else: logger.critical("Cannot start mainloop: app_tk_instance is None."); on_app_exit(); sys.exit(1)
-    except KeyboardInterrupt: logger.info("KeyboardInterrupt detected by mainloop. Initiating shutdown.")
-    except tk.TclError as e_tcl:
-        if "application has been destroyed" in str(e_tcl).lower(): logger.info("Tkinter mainloop TclError: Application already destroyed.")
-        else: logger.error(f"Unhandled TclError in mainloop: {e_tcl}. Initiating shutdown.", exc_info=True)
-    except Exception as e_mainloop: logger.critical(f"Unexpected critical error in Tkinter mainloop: {e_mainloop}", exc_info=True)
-    finally:
-        logger.info("Mainloop exited. Ensuring graceful shutdown via on_app_exit().")
-        on_app_exit()
+        logger.info("Starting Tkinter mainloop...")
+        try:
+            if app_tk_instance: app_tk_instance.mainloop()
+            else: logger.critical("Cannot start mainloop: app_tk_instance is None."); on_app_exit(); sys.exit(1)
+        except KeyboardInterrupt: logger.info("KeyboardInterrupt detected by mainloop. Initiating shutdown.")
+        except tk.TclError as e_tcl:
+            if "application has been destroyed" in str(e_tcl).lower(): logger.info("Tkinter mainloop TclError: Application already destroyed.")
+            else: logger.error(f"Unhandled TclError in mainloop: {e_tcl}. Initiating shutdown.", exc_info=True)
+        except Exception as e_mainloop: logger.critical(f"Unexpected critical error in Tkinter mainloop: {e_mainloop}", exc_info=True)
+        finally:
+            logger.info("Mainloop exited. Ensuring graceful shutdown via on_app_exit().")
+            on_app_exit()
     logger.info("Application main thread has finished.")
\ No newline at end of file
@@ -42,8 +42,8 @@ async def execute(params: dict, app_context: dict, logger) -> dict:
     try:
         logger.info(f"Attempting to send Telegram message to user ID {recipient_user_id}: '{message_content[:50]}...'")
         
-        # Since this execute function is async, we can directly await
-        await telegram_handler.send_text_message_to_user(recipient_user_id, message_content)
+        # Goes through the bot's outbox (rate limits, retries); wrap_future lets this coroutine await it from any loop
+        await asyncio.wrap_future(telegram_handler.queue_text_message(recipient_user_id, message_content))
         
         success_message = f"Telegram message successfully queued for sending to user ID {recipient_user_id}."
         logger.info(success_message)
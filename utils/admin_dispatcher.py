@@ -0,0 +1,130 @@
+# utils/admin_dispatcher.py
+"""
+Dispatcher for the admin LLM queue (Telegram text/voice from the admin).
+
+One thread blocks on queue.get() and hands each item to a worker pool. Items from the same source
+(the Telegram user id) run one at a time and in arrival order; different sources run in parallel.
+Because the handlers never run on the Tk thread, a long LLM call cannot freeze the GUI or hold up
+the items queued behind it from other sources. marshal_gui_callbacks() wraps the GUI callbacks so
+that only the widget updates themselves are posted back to Tk.
+
+Metrics: per message type, the queue wait (put -> handler start) and the handler duration (until the
+returned future resolves, for handlers that submit to the admin pipeline).
+"""
+import collections
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from logger import get_logger
+from .interaction_pipeline import DurationStat
+
+logger = get_logger("Iri-shka_App.utils.AdminDispatcher")
+
+
+def marshal_gui_callbacks(gui_callbacks: dict, schedule) -> dict:
+    """
+    A copy of gui_callbacks whose functions run via schedule(fn), e.g. lambda fn: tk_root.after(0, fn).
+    Return values are dropped; GUI callbacks are fire-and-forget.
+    """
+    if not gui_callbacks or schedule is None: return gui_callbacks
+
+    def wrap(fn):
+        def _posted(*args, **kwargs):
+            try: schedule(lambda: fn(*args, **kwargs))
+            except Exception as e_sched: logger.debug(f"GUI update dropped ({e_sched}).") # Tk already gone
+        return _posted
+    return {key: wrap(fn) if callable(fn) else fn for key, fn in gui_callbacks.items()}
+
+
+class AdminMessageDispatcher:
+    def __init__(self, message_queue: queue.Queue, handlers: dict, max_workers: int = None):
+        """handlers: {msg_type: fn(user_id, data)}. Queue items are (msg_type, user_id, data) tuples."""
+        self._queue = message_queue
+        self._handlers = handlers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers or config.ADMIN_DISPATCHER_WORKERS, thread_name_prefix="AdminLLMWorker")
+        self._lock = threading.Lock()
+        self._pending_by_source = {} # source -> deque of (key, item, waited); present while that source has work queued or running
+        self._stop_requested = threading.Event()
+        self._thread = None
+        self._queue_wait = collections.defaultdict(DurationStat)
+        self._handler_duration = collections.defaultdict(DurationStat)
+        self._failures = 0
+
+    def start(self):
+        if self._thread and self._thread.is_alive(): return
+        self._stop_requested.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="AdminQueueDispatcher")
+        self._thread.start()
+        logger.info("Admin queue dispatcher started.")
+
+    def stop(self, timeout: float = 2.0):
+        """Stops taking items. Items not yet handled stay in the durable store (if any) for the next start."""
+        self._stop_requested.set()
+        if self._thread: self._thread.join(timeout=timeout)
+        self._thread = None
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self):
+        while not self._stop_requested.is_set():
+            try: item = self._queue.get(timeout=1.0) # Blocks; the timeout only bounds how long stop() waits
+            except queue.Empty: continue
+            key, waited = self._queue.last_get_info() if hasattr(self._queue, "last_get_info") else (None, None)
+            if not isinstance(item, tuple) or len(item) != 3:
+                logger.error(f"Invalid Admin LLM queue item: {item}")
+                if hasattr(self._queue, "ack"): self._queue.ack(key)
+                self._queue.task_done(); continue
+            source = item[1]
+            with self._lock:
+                backlog = self._pending_by_source.get(source)
+                start_chain = backlog is None
+                if start_chain: backlog = self._pending_by_source[source] = collections.deque()
+                backlog.append((key, item, waited))
+            if start_chain: self._pool.submit(self._drain_source, source)
+
+    def _drain_source(self, source):
+        """Runs the source's items one after another until its backlog is empty."""
+        while not self._stop_requested.is_set():
+            with self._lock:
+                backlog = self._pending_by_source[source]
+                if not backlog:
+                    del self._pending_by_source[source]; return
+                key, item, waited = backlog.popleft()
+            self._handle(key, item, waited)
+        with self._lock: self._pending_by_source.pop(source, None)
+
+    def _handle(self, key, item, waited):
+        """
+        A handler may return a Future (e.g. a job on the admin pipeline). The item is then acked when the
+        future resolves, and the source's next item is handed over right away; the pipeline keeps the order.
+        """
+        msg_type, user_id, data = item
+        handler = self._handlers.get(msg_type)
+        t0 = time.monotonic()
+        try:
+            result = handler(user_id, data) if handler else None
+            if not handler: logger.warning(f"Unknown Admin LLM message type: {msg_type}")
+        except Exception as e_handler:
+            logger.error(f"Admin LLM handler for '{msg_type}' failed: {e_handler}", exc_info=True)
+            self._finish(key, msg_type, waited, t0, ok=False); return
+        if hasattr(result, "add_done_callback"):
+            result.add_done_callback(lambda f: self._finish(key, msg_type, waited, t0, ok=not f.cancelled() and f.exception() is None))
+        else: self._finish(key, msg_type, waited, t0, ok=True)
+
+    def _finish(self, key, msg_type, waited, t0, ok: bool):
+        duration = time.monotonic() - t0
+        if ok and hasattr(self._queue, "ack"): self._queue.ack(key)
+        with self._lock:
+            if not ok: self._failures += 1 # Left in the durable store; replayed on the next start
+            if waited is not None: self._queue_wait[msg_type].add(waited)
+            self._handler_duration[msg_type].add(duration)
+        self._queue.task_done()
+        logger.info(f"Admin LLM item '{msg_type}' {'handled' if ok else 'FAILED'} in {duration:.2f}s (queued {waited or 0.0:.2f}s).")
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            return {"queue_wait": {t: s.as_dict() for t, s in self._queue_wait.items()},
+                    "handler_duration": {t: s.as_dict() for t, s in self._handler_duration.items()},
+                    "sources_busy": len(self._pending_by_source), "queued": self._queue.qsize(), "failures": self._failures}
@@ -1,17 +1,37 @@
 # utils/admin_interaction_processor.py
-import json
+"""
+Admin interactions (GUI voice, Telegram text/voice, Web UI voice) run through one stage pipeline:
+
+    stt -> llm -> merge (state merge + persist + GUI refresh) -> reply (local TTS / Telegram / Web TTS file)
+
+Each stage has its own worker thread and bounded queue (utils/interaction_pipeline.py), so the STT of
+the next message overlaps the LLM call of the current one. The llm stage waits until the previous turn
+has been merged, so every prompt sees the turn before it. The front-ends below (process_gui_recorded_audio,
+process_admin_telegram_*, and WebAppBridge.process_admin_web_audio) only build the job context and submit it;
+the per-source differences live in the stages, keyed by ctx["source"].
+"""
 import re
-import asyncio
 import os
+import uuid
 import datetime
 import threading # For type hint
-import gc # For process_gui_recorded_audio (optional)
+import gc # For the STT stage (frees audio arrays early)
 
 import config
 from logger import get_logger
+from .versioned_state import get_app_state, thaw
+from . import json_codec
+from . import state_patch
+from . import file_utils
+from . import opus_encoder
+from .customer_history_archive import archive_matches_for_request
+from .artifact_reaper import mark_artifact_in_use, resolve_artifact_path
+from .interaction_pipeline import InteractionPipeline, Stage, StageTimeoutError
 
 logger = get_logger("Iri-shka_App.utils.AdminInteractionProcessor")
 
+TELEGRAM_SOURCES = ("telegram_admin", "telegram_voice_admin")
+
 def _parse_ollama_error_to_short_code(error_message_from_handler):
     if not error_message_from_handler: return "NRDY", "error"
     lower_msg = error_message_from_handler.lower()
@@ -26,302 +46,455 @@ def _parse_ollama_error_to_short_code(error_message_from_handler):
     if "model not found" in lower_msg or "pull model" in lower_msg : return "NOMDL", "error"
     return "NRDY", "error"
 
-def handle_admin_llm_interaction(
-    input_text: str, source: str, detected_language_code,
-    chat_history_ref: list, user_state_ref: dict, assistant_state_ref: dict,
-    global_states_lock_ref: threading.Lock, gui_callbacks: dict,
-    telegram_bot_handler_instance_ref, ollama_handler_module_ref,
-    state_manager_module_ref, tts_manager_module_ref,
-    telegram_messaging_utils_module_ref, ollama_ready_flag: bool
-    ):
-    function_signature_for_log = f"handle_admin_llm_interaction(source={source}, input='{input_text[:30]}...')"
-    logger.info(f"ADMIN_LLM_FLOW ({source}): {function_signature_for_log} - Starting.")
-
-    if source == "gui" and gui_callbacks and callable(gui_callbacks.get('act_status_update')):
-        gui_callbacks['act_status_update']("ACT: BUSY", "busy")
-
-    assistant_response_text_llm = "Error: LLM processing did not complete."
-    selected_bark_voice_preset = config.BARK_VOICE_PRESET_EN
-    ollama_error_occurred = False 
-    ollama_error_message_str = "" 
-    current_lang_code_for_state = "en"
-
-    try:
-        user_state_snapshot_for_prompt: dict
-        assistant_state_snapshot_for_prompt: dict
-        chat_history_snapshot_for_prompt: list
-        with global_states_lock_ref:
-            user_state_snapshot_for_prompt = user_state_ref.copy()
-            assistant_state_snapshot_for_prompt = assistant_state_ref.copy()
-            chat_history_snapshot_for_prompt = chat_history_ref[:]
-
-            current_lang_code_for_state = detected_language_code if detected_language_code in ["ru", "en"] \
-                else assistant_state_snapshot_for_prompt.get("last_used_language", "en")
-            
-            language_instruction_for_llm = config.LANGUAGE_INSTRUCTION_RUSSIAN if current_lang_code_for_state == "ru" \
-                                           else config.LANGUAGE_INSTRUCTION_NON_RUSSIAN
-            if current_lang_code_for_state == "ru":
-                selected_bark_voice_preset = config.BARK_VOICE_PRESET_RU
-
-        if source == "gui" and gui_callbacks and callable(gui_callbacks.get('add_user_message_to_display')):
-            gui_callbacks['add_user_message_to_display'](input_text, source=source)
-
-        if gui_callbacks and callable(gui_callbacks.get('status_update')):
-            gui_callbacks['status_update'](f"Thinking (Admin {source})...")
-        if gui_callbacks and callable(gui_callbacks.get('mind_status_update')):
-            gui_callbacks['mind_status_update']("MIND: THK", "thinking")
-
-        target_customer_id_for_prompt = None
-        customer_state_for_prompt_str = "{}"
-        is_customer_context_active_for_prompt = False
-        history_to_scan = chat_history_snapshot_for_prompt[-(config.MAX_HISTORY_TURNS // 2 or 1):]
-        for turn in reversed(history_to_scan):
-            assistant_message_hist = turn.get("assistant", "")
-            turn_source_hist = turn.get("source", "")
-            if turn_source_hist == "customer_summary_internal":
-                match_summary = re.search(r"\[Сводка по клиенту (\d+)\]", assistant_message_hist)
-                if match_summary:
-                    try: target_customer_id_for_prompt = int(match_summary.group(1)); break
-                    except ValueError: pass
-        
-        if target_customer_id_for_prompt:
-            try:
-                loaded_customer_state = state_manager_module_ref.load_or_initialize_customer_state(
-                    target_customer_id_for_prompt, gui_callbacks)
-                if loaded_customer_state and loaded_customer_state.get("user_id") == target_customer_id_for_prompt:
-                    customer_state_for_prompt_str = json.dumps(loaded_customer_state, indent=2, ensure_ascii=False)
-                    is_customer_context_active_for_prompt = True
-                else: target_customer_id_for_prompt = None
-            except Exception as e_load_ctx_cust: logger.error(f"ADMIN_LLM_FLOW ({source}): Exc loading customer state {target_customer_id_for_prompt}: {e_load_ctx_cust}", exc_info=True); target_customer_id_for_prompt = None
-
-        assistant_state_for_this_prompt_input = assistant_state_snapshot_for_prompt.copy()
-        assistant_state_for_this_prompt_input["last_used_language"] = current_lang_code_for_state
-        admin_current_name = assistant_state_for_this_prompt_input.get("admin_name", "Partner")
-
-        format_kwargs_for_ollama = {
-            "admin_name_value": admin_current_name, "assistant_admin_name_current_value": admin_current_name,
-            "is_customer_context_active": is_customer_context_active_for_prompt,
-            "active_customer_id": str(target_customer_id_for_prompt) if target_customer_id_for_prompt else "N/A",
-            "active_customer_state_string": customer_state_for_prompt_str
-        }
-        expected_keys_for_response = ["answer_to_user", "updated_user_state", "updated_assistant_state", "updated_active_customer_state"]
-
-        ollama_data, ollama_error_message_str = ollama_handler_module_ref.call_ollama_for_chat_response(
-            prompt_template_to_use=config.OLLAMA_PROMPT_TEMPLATE, transcribed_text=input_text,
-            current_chat_history=chat_history_snapshot_for_prompt, current_user_state=user_state_snapshot_for_prompt,
-            current_assistant_state=assistant_state_for_this_prompt_input, language_instruction=language_instruction_for_llm,
-            format_kwargs=format_kwargs_for_ollama, expected_keys_override=expected_keys_for_response,
-            gui_callbacks=gui_callbacks
-        )
-
-        current_turn_for_history = {"user": input_text, "source": source}
-        if detected_language_code: current_turn_for_history[f"detected_language_code_for_{source}_display"] = detected_language_code
-        
-        with global_states_lock_ref:
-            if ollama_error_message_str: 
-                ollama_error_occurred = True
-                assistant_response_text_llm = "An internal error occurred (admin)."
-                if current_lang_code_for_state == "ru": assistant_response_text_llm = "Произошла внутренняя ошибка (админ)."
-                current_turn_for_history["assistant"] = f"[LLM Error ({source}): {assistant_response_text_llm}]"
-                if gui_callbacks and callable(gui_callbacks.get('add_assistant_message_to_display')):
-                    gui_callbacks['add_assistant_message_to_display'](assistant_response_text_llm, is_error=True, source=f"{source}_error")
-            else: 
-                assistant_response_text_llm = ollama_data.get("answer_to_user", "Error: No LLM answer.")
-                
-                llm_provided_user_state_changes = ollama_data.get("updated_user_state", {})
-                if isinstance(llm_provided_user_state_changes, dict):
-                    current_gui_theme_from_live_state = user_state_ref.get("gui_theme", config.DEFAULT_USER_STATE["gui_theme"])
-                    llm_theme_suggestion = llm_provided_user_state_changes.get("gui_theme", current_gui_theme_from_live_state)
-                    applied_theme_value = current_gui_theme_from_live_state
-                    if llm_theme_suggestion != current_gui_theme_from_live_state and llm_theme_suggestion in [config.GUI_THEME_LIGHT, config.GUI_THEME_DARK]:
-                        if gui_callbacks and callable(gui_callbacks.get('apply_application_theme')):
-                            gui_callbacks['apply_application_theme'](llm_theme_suggestion)
-                            applied_theme_value = llm_theme_suggestion
-                    llm_provided_user_state_changes["gui_theme"] = applied_theme_value
-
-                    current_font_size_from_live_state = user_state_ref.get("chat_font_size", config.DEFAULT_USER_STATE["chat_font_size"])
-                    llm_font_size_str_suggestion = llm_provided_user_state_changes.get("chat_font_size", str(current_font_size_from_live_state))
-                    try: llm_font_size_as_int = int(llm_font_size_str_suggestion)
-                    except: llm_font_size_as_int = current_font_size_from_live_state
-                    clamped_font_size_suggestion = max(config.MIN_CHAT_FONT_SIZE, min(llm_font_size_as_int, config.MAX_CHAT_FONT_SIZE))
-                    applied_font_size_value = current_font_size_from_live_state
-                    if clamped_font_size_suggestion != current_font_size_from_live_state:
-                        if gui_callbacks and callable(gui_callbacks.get('apply_chat_font_size')):
-                            gui_callbacks['apply_chat_font_size'](clamped_font_size_suggestion)
-                        applied_font_size_value = clamped_font_size_suggestion
-                    llm_provided_user_state_changes["chat_font_size"] = applied_font_size_value
-                    
-                    # Ensure 'todos' is not part of the update from LLM for admin state
-                    if "todos" in llm_provided_user_state_changes:
-                        del llm_provided_user_state_changes["todos"]
-                        logger.warning(f"ADMIN_LLM_FLOW ({source}): LLM tried to update 'todos' for admin state. This key is ignored.")
-
-                    merged_user_state = user_state_snapshot_for_prompt.copy()
-                    merged_user_state.update(llm_provided_user_state_changes)
-                    user_state_ref.clear(); user_state_ref.update(merged_user_state)
-                else:
-                    logger.warning(f"ADMIN_LLM_FLOW ({source}): updated_user_state from LLM was not a dict. User state not modified by LLM this turn.")
-
-                llm_provided_assistant_state_changes = ollama_data.get("updated_assistant_state", {})
-                if isinstance(llm_provided_assistant_state_changes, dict):
-                    merged_assistant_state = assistant_state_snapshot_for_prompt.copy()
-                    
-                    # Handle internal_tasks: pending and completed only
-                    if "internal_tasks" in llm_provided_assistant_state_changes and isinstance(llm_provided_assistant_state_changes["internal_tasks"], dict):
-                        llm_tasks_dict = llm_provided_assistant_state_changes["internal_tasks"]
-                        
-                        if "internal_tasks" not in merged_assistant_state or not isinstance(merged_assistant_state.get("internal_tasks"), dict):
-                            merged_assistant_state["internal_tasks"] = {"pending": [], "completed": []}
-                        
-                        for task_type in ["pending", "completed"]: # Only process these two
-                            if task_type not in merged_assistant_state["internal_tasks"] or not isinstance(merged_assistant_state["internal_tasks"].get(task_type), list):
-                                merged_assistant_state["internal_tasks"][task_type] = []
-                            
-                            new_tasks_from_llm = llm_tasks_dict.get(task_type, [])
-                            if not isinstance(new_tasks_from_llm, list): 
-                                new_tasks_from_llm = [str(new_tasks_from_llm)] if new_tasks_from_llm else []
-                            
-                            existing_tasks_in_merged = merged_assistant_state["internal_tasks"][task_type]
-                            merged_assistant_state["internal_tasks"][task_type] = list(dict.fromkeys(
-                                [str(t) for t in existing_tasks_in_merged] + [str(t) for t in new_tasks_from_llm]
-                            ))
-                        if "in_process" in llm_tasks_dict:
-                             logger.warning(f"ADMIN_LLM_FLOW ({source}): LLM provided 'in_process' tasks. This key is now ignored for assistant state. Tasks: {llm_tasks_dict['in_process']}")
-                    
-                    # Update other assistant state keys
-                    for key, val_llm in llm_provided_assistant_state_changes.items():
-                        if key != "internal_tasks": 
-                            merged_assistant_state[key] = val_llm
-                            
-                    merged_assistant_state["last_used_language"] = current_lang_code_for_state
-                    assistant_state_ref.clear(); assistant_state_ref.update(merged_assistant_state)
-                else:
-                     logger.warning(f"ADMIN_LLM_FLOW ({source}): updated_assistant_state from LLM was not a dict. Assistant state not modified by LLM this turn.")
-
-                if gui_callbacks:
-                    # Removed update_todo_list for admin
-                    if callable(gui_callbacks.get('update_calendar_events_list')): 
-                        gui_callbacks['update_calendar_events_list'](user_state_ref.get("calendar_events", []))
-                    
-                    asst_tasks = assistant_state_ref.get("internal_tasks", {});
-                    if not isinstance(asst_tasks, dict): asst_tasks = {"pending": [], "completed": []}
-                    
-                    if callable(gui_callbacks.get('update_kanban_pending')): 
-                        gui_callbacks['update_kanban_pending'](asst_tasks.get("pending", []))
-                    # Removed update_kanban_in_process
-                    if callable(gui_callbacks.get('update_kanban_completed')): 
-                        gui_callbacks['update_kanban_completed'](asst_tasks.get("completed", []))
-
-                updated_customer_state_from_llm = ollama_data.get("updated_active_customer_state")
-                if updated_customer_state_from_llm and isinstance(updated_customer_state_from_llm, dict) and target_customer_id_for_prompt:
-                    if updated_customer_state_from_llm.get("user_id") == target_customer_id_for_prompt:
-                        if state_manager_module_ref.save_customer_state(target_customer_id_for_prompt, updated_customer_state_from_llm, gui_callbacks): 
-                            logger.info(f"ADMIN_LLM_FLOW ({source}): Updated state for context customer {target_customer_id_for_prompt}.")
-                
-                current_turn_for_history["assistant"] = assistant_response_text_llm
-                if gui_callbacks and callable(gui_callbacks.get('add_assistant_message_to_display')):
-                     gui_callbacks['add_assistant_message_to_display'](assistant_response_text_llm, is_error=False, source=source)
-
-            current_turn_for_history["timestamp"] = state_manager_module_ref.get_current_timestamp_iso()
-            chat_history_ref.append(current_turn_for_history)
-            updated_chat_history = state_manager_module_ref.save_states(
-                chat_history_ref, user_state_ref, assistant_state_ref, gui_callbacks)
-            if len(chat_history_ref) != len(updated_chat_history): 
-                chat_history_ref[:] = updated_chat_history
-            if gui_callbacks and callable(gui_callbacks.get('memory_status_update')): gui_callbacks['memory_status_update']("MEM: SAVED", "saved")
-
-        if source == "gui" and tts_manager_module_ref.is_tts_ready() and not ollama_error_occurred:
-            def _deferred_gui_display():
-                 if gui_callbacks and callable(gui_callbacks.get('status_update')):
-                    gui_callbacks['status_update'](f"Speaking (Admin): {assistant_response_text_llm[:40]}...")
-            current_persona_name_tts = "Iri-shka"
-            with global_states_lock_ref: current_persona_name_tts = assistant_state_ref.get("persona_name", "Iri-shka")
-            tts_manager_module_ref.start_speaking_response(
-                assistant_response_text_llm, current_persona_name_tts, selected_bark_voice_preset, gui_callbacks,
-                on_actual_playback_start_gui_callback=_deferred_gui_display)
-
-        elif (source == "telegram_admin" or source == "telegram_voice_admin") and \
-             telegram_bot_handler_instance_ref and not ollama_error_occurred:
-            try:
-                admin_id_int = int(config.TELEGRAM_ADMIN_USER_ID)
-                if config.TELEGRAM_REPLY_WITH_TEXT:
-                    asyncio.run_coroutine_threadsafe(telegram_bot_handler_instance_ref.send_text_message_to_user(admin_id_int, assistant_response_text_llm), telegram_bot_handler_instance_ref.async_loop).result(timeout=15)
-                if config.TELEGRAM_REPLY_WITH_VOICE:
-                    telegram_messaging_utils_module_ref.send_voice_reply_to_telegram_user(
-                        admin_id_int, assistant_response_text_llm, selected_bark_voice_preset,
-                        telegram_bot_handler_instance_ref, tts_manager_module_ref
-                    )
-            except Exception as e_tg_send_admin: logger.error(f"ADMIN_LLM_FLOW: Error sending reply to admin TG ({source}): {e_tg_send_admin}", exc_info=True)
-        elif ollama_error_occurred and telegram_bot_handler_instance_ref and telegram_bot_handler_instance_ref.async_loop:
-            try:
-                admin_id_int = int(config.TELEGRAM_ADMIN_USER_ID)
-                err_text_for_tg = "LLM processing failed."
-                if current_lang_code_for_state == "ru": err_text_for_tg = "Ошибка обработки LLM."
-                asyncio.run_coroutine_threadsafe( telegram_bot_handler_instance_ref.send_text_message_to_user(admin_id_int, err_text_for_tg), telegram_bot_handler_instance_ref.async_loop).result(timeout=10)
-            except Exception as e_tg_err_send: logger.error(f"Failed to send LLM error to admin TG: {e_tg_err_send}")
-
-        if gui_callbacks:
-            if callable(gui_callbacks.get('mind_status_update')):
-                if ollama_error_occurred:
-                    short_code, status_type = _parse_ollama_error_to_short_code(ollama_error_message_str)
-                    gui_callbacks['mind_status_update'](f"MIND: {short_code.upper()}", status_type)
-                elif ollama_ready_flag: 
-                    gui_callbacks['mind_status_update']("MIND: RDY", "ready")
-                else: 
-                    gui_callbacks['mind_status_update']("MIND: NRDY", "error")
-
-            if callable(gui_callbacks.get('status_update')):
-                will_gui_tts_update_status = False
-                if source == "gui" and tts_manager_module_ref.is_tts_ready() and not ollama_error_occurred:
-                    will_gui_tts_update_status = True 
-
-                if not will_gui_tts_update_status:
-                    final_app_status_text = "Error processing." 
-                    if not ollama_error_occurred and ollama_ready_flag:
-                        current_admin_name_for_status = "Partner"
-                        current_persona_name_for_status = "Iri-shka"
-                        with global_states_lock_ref: 
-                            current_admin_name_for_status = assistant_state_ref.get("admin_name", "Partner")
-                            current_persona_name_for_status = assistant_state_ref.get("persona_name", "Iri-shka")
-                        
-                        if assistant_response_text_llm and not assistant_response_text_llm.startswith("Error:"):
-                            response_snippet = assistant_response_text_llm[:60]
-                            if len(assistant_response_text_llm) > 60: response_snippet += "..."
-                            final_app_status_text = f"{current_persona_name_for_status} to {current_admin_name_for_status}: {response_snippet}"
-                        elif assistant_response_text_llm:
-                             final_app_status_text = f"{current_persona_name_for_status} says: {assistant_response_text_llm[:60]}..."
-                        else: 
-                             final_app_status_text = "Ready."
-                    
-                    elif ollama_error_occurred: 
-                        short_code, _ = _parse_ollama_error_to_short_code(ollama_error_message_str)
-                        final_app_status_text = f"LLM Error: {short_code.upper()}"
-                    
-                    elif not ollama_ready_flag: 
-                        final_app_status_text = "LLM Not Ready." 
-                    
-                    gui_callbacks['status_update'](final_app_status_text)
-    finally:
-        if source == "gui" and gui_callbacks and callable(gui_callbacks.get('act_status_update')):
-            gui_callbacks['act_status_update']("ACT: IDLE", "idle")
-        logger.info(f"ADMIN_LLM_FLOW ({source}): {function_signature_for_log} - Processing finished.")
-
-
+def _gui(ctx: dict, callback_key: str, *args, **kwargs):
+    gui_callbacks = ctx.get("gui_callbacks")
+    if gui_callbacks and callable(gui_callbacks.get(callback_key)): gui_callbacks[callback_key](*args, **kwargs)
+
+def _mind_idle(ctx: dict):
+    _gui(ctx, 'mind_status_update', "MIND: RDY" if ctx.get("ollama_ready_flag") else "MIND: NRDY",
+         "ready" if ctx.get("ollama_ready_flag") else "error")
+
+def _web_error(ctx: dict, message: str):
+    web_result = ctx.get("web_result")
+    if web_result is not None: web_result["error_message"] = ((web_result["error_message"] or "") + " " + message).strip()
+
+def _send_telegram_text(ctx: dict, user_id, text: str):
+    """Queues the text on the bot's outbox; the stage does not wait for the network."""
+    tg_handler = ctx.get("telegram_bot_handler_instance_ref")
+    if not (tg_handler and tg_handler.async_loop): return
+    future = tg_handler.queue_text_message(user_id, text)
+    future.add_done_callback(lambda f: f.exception() and logger.error(f"ADMIN_PIPELINE: Telegram text to {user_id} not delivered: {f.exception()}"))
+
+
+# --- Stage: speech to text ---
+def _stage_transcribe(job):
+    c = job.ctx
+    source = c["source"]
+    if c.get("input_text"): return # Typed input (Telegram text)
+    whisper_ref = c["whisper_handler_module_ref"]
+    load_audio_ref = c.get("_whisper_module_for_load_audio_ref")
+    needs_load_audio = c.get("audio_np") is None
+
+    if not (whisper_ref.WHISPER_CAPABLE and whisper_ref.is_whisper_ready() and (load_audio_ref or not needs_load_audio)):
+        logger.error(f"ADMIN_PIPELINE ({source}): Whisper not ready or load_audio missing; input dropped.")
+        if source == "gui": _gui(c, 'status_update', "Hearing NRDY.")
+        elif source == "telegram_voice_admin": _send_telegram_text(c, c["user_id"], "Error: Voice processing module (Whisper) is not ready.")
+        elif source == "web_admin": _web_error(c, "Whisper (STT) service not ready.")
+        _mind_idle(c); job.finish(); return
+
+    audio_numpy = c.pop("audio_np", None)
+    if audio_numpy is None:
+        if source == "telegram_voice_admin": _gui(c, 'status_update', "Loading Admin voice (TG)...")
+        audio_numpy = load_audio_ref.load_audio(c["wav_filepath"])
+    if source == "gui": _gui(c, 'status_update', "Transcribing (GUI)...")
+    elif source == "telegram_voice_admin": _gui(c, 'status_update', "Transcribing Admin voice (TG)...")
+    trans_text, trans_err, detected_lang = whisper_ref.transcribe_audio(
+        audio_np_array=audio_numpy, language=None, task="transcribe",
+        gui_callbacks=c.get("gui_callbacks") if source != "web_admin" else None)
+    del audio_numpy; audio_numpy = None; gc.collect()
+    job.raise_if_cancelled()
+
+    web_result = c.get("web_result")
+    if not trans_err and trans_text:
+        logger.info(f"ADMIN_PIPELINE ({source}): Transcribed '{trans_text[:70]}...' (lang: {detected_lang})")
+        c["input_text"], c["detected_language_code"] = trans_text, detected_lang
+        if web_result is not None: web_result["user_transcription"] = trans_text
+        if source in ("telegram_voice_admin", "web_admin"): _gui(c, 'add_user_message_to_display', trans_text, source=source)
+        return
+
+    lang_for_err = get_app_state().current().assistant_state.get("last_used_language", "en")
+    if not trans_text and not trans_err:
+        logger.info(f"ADMIN_PIPELINE ({source}): No speech detected.")
+        if source == "gui":
+            err_msg_stt_gui = "I didn't catch that..." if lang_for_err == "en" else "Я не расслышала..."
+            _gui(c, 'add_user_message_to_display', "[Silent/Unclear Audio]", source="gui")
+            _gui(c, 'add_assistant_message_to_display', err_msg_stt_gui, is_error=False, source="gui")
+            _gui(c, 'status_update', err_msg_stt_gui)
+            tts_ref = c["tts_manager_module_ref"]
+            if tts_ref.is_tts_ready():
+                err_preset_gui = config.BARK_VOICE_PRESET_EN if lang_for_err == "en" else config.BARK_VOICE_PRESET_RU
+                current_persona_name_gui = get_app_state().current().assistant_state.get("persona_name", "Iri-shka")
+                tts_ref.start_speaking_response(err_msg_stt_gui, current_persona_name_gui, err_preset_gui, c.get("gui_callbacks"))
+        elif source == "telegram_voice_admin":
+            _gui(c, 'add_user_message_to_display', "[Silent/Unclear Audio from Admin TG]", source=source)
+            _gui(c, 'status_update', "Admin TG: No speech detected.")
+            _send_telegram_text(c, c["user_id"], "I didn't hear anything in your voice message.")
+        elif web_result is not None: web_result["user_transcription"] = "" # Tells the page nothing was heard
+    else:
+        logger.warning(f"ADMIN_PIPELINE ({source}): Transcription failed: {trans_err}")
+        if source == "gui":
+            err_msg_stt_gui = "Sorry, I had trouble understanding that." if lang_for_err == "en" else "Извините, не удалось разобрать речь."
+            _gui(c, 'add_user_message_to_display', "[Transcription Error]", source="gui")
+            _gui(c, 'add_assistant_message_to_display', err_msg_stt_gui, is_error=True, source="gui")
+            _gui(c, 'status_update', f"Transcription Error: {trans_err or 'Unknown'}")
+        elif source == "telegram_voice_admin":
+            _gui(c, 'add_user_message_to_display', f"[Transcription Error from Admin TG: {trans_err}]", source=source)
+            _gui(c, 'status_update', f"Admin TG Voice Error: {trans_err or 'Recognition error.'}")
+            _send_telegram_text(c, c["user_id"], f"Couldn't transcribe voice: {trans_err or 'Recognition error.'}")
+        else: _web_error(c, f"Admin Web Transcription error: {trans_err}")
+    if source != "web_admin": _mind_idle(c)
+    job.finish()
+
+
+# --- Stage: LLM call ---
+def _stage_llm(job):
+    c = job.ctx
+    source, input_text = c["source"], c["input_text"]
+    if c.get("require_llm_ready") and not c.get("ollama_ready_flag"):
+        _web_error(c, "Ollama (LLM) service not ready for admin web input.")
+        job.finish(); return
+    gui_callbacks = c.get("gui_callbacks")
+    state_manager_module_ref = c["state_manager_module_ref"]
+
+    # Lock-free read of the latest published version; thawed copies are private to this turn
+    state_snapshot = get_app_state().current()
+    user_state_snapshot_for_prompt = thaw(state_snapshot.user_state)
+    assistant_state_snapshot_for_prompt = thaw(state_snapshot.assistant_state)
+    chat_history_snapshot_for_prompt = state_snapshot.chat_history[:]
+
+    detected_language_code = c.get("detected_language_code")
+    current_lang_code_for_state = detected_language_code if detected_language_code in ["ru", "en"] \
+        else assistant_state_snapshot_for_prompt.get("last_used_language", "en")
+    language_instruction_for_llm = config.LANGUAGE_INSTRUCTION_RUSSIAN if current_lang_code_for_state == "ru" \
+                                   else config.LANGUAGE_INSTRUCTION_NON_RUSSIAN
+    c["lang_code"] = current_lang_code_for_state
+    c["bark_voice_preset"] = config.BARK_VOICE_PRESET_RU if current_lang_code_for_state == "ru" else config.BARK_VOICE_PRESET_EN
+
+    if source == "gui": _gui(c, 'add_user_message_to_display', input_text, source=source)
+    _gui(c, 'status_update', f"Thinking (Admin {source})...")
+    _gui(c, 'mind_status_update', "MIND: THK", "thinking")
+
+    target_customer_id_for_prompt = None
+    loaded_customer_state = None
+    customer_state_for_prompt_str = "{}"
+    is_customer_context_active_for_prompt = False
+    history_to_scan = chat_history_snapshot_for_prompt[-(config.MAX_HISTORY_TURNS // 2 or 1):]
+    for turn in reversed(history_to_scan):
+        assistant_message_hist = turn.get("assistant", "")
+        turn_source_hist = turn.get("source", "")
+        if turn_source_hist == "customer_summary_internal":
+            match_summary = re.search(r"\[Сводка по клиенту (\d+)\]", assistant_message_hist)
+            if match_summary:
+                try: target_customer_id_for_prompt = int(match_summary.group(1)); break
+                except ValueError: pass
+
+    if target_customer_id_for_prompt:
+        try:
+            loaded_customer_state = state_manager_module_ref.load_or_initialize_customer_state(
+                target_customer_id_for_prompt, gui_callbacks)
+            if loaded_customer_state and loaded_customer_state.get("user_id") == target_customer_id_for_prompt:
+                prompt_customer_state = loaded_customer_state
+                archive_matches = archive_matches_for_request(target_customer_id_for_prompt, input_text)
+                if archive_matches: # Older turns live only in the archive; surface the ones this request is about
+                    prompt_customer_state = {**loaded_customer_state, "archived_messages_matching_request": archive_matches}
+                customer_state_for_prompt_str = json_codec.dumps(prompt_customer_state, indent=2)
+                is_customer_context_active_for_prompt = True
+            else: target_customer_id_for_prompt = None; loaded_customer_state = None
+        except Exception as e_load_ctx_cust: logger.error(f"ADMIN_PIPELINE ({source}): Exc loading customer state {target_customer_id_for_prompt}: {e_load_ctx_cust}", exc_info=True); target_customer_id_for_prompt = None
+
+    assistant_state_for_this_prompt_input = assistant_state_snapshot_for_prompt.copy()
+    assistant_state_for_this_prompt_input["last_used_language"] = current_lang_code_for_state
+    admin_current_name = assistant_state_for_this_prompt_input.get("admin_name", "Partner")
+
+    format_kwargs_for_ollama = {
+        "admin_name_value": admin_current_name, "assistant_admin_name_current_value": admin_current_name,
+        "is_customer_context_active": is_customer_context_active_for_prompt,
+        "active_customer_id": str(target_customer_id_for_prompt) if target_customer_id_for_prompt else "N/A",
+        "active_customer_state_string": customer_state_for_prompt_str
+    }
+    ollama_data, ollama_error_message_str = c["ollama_handler_module_ref"].call_ollama_for_chat_response(
+        prompt_template_to_use=state_patch.admin_prompt_template(), transcribed_text=input_text,
+        current_chat_history=chat_history_snapshot_for_prompt, current_user_state=user_state_snapshot_for_prompt,
+        current_assistant_state=assistant_state_for_this_prompt_input, language_instruction=language_instruction_for_llm,
+        format_kwargs=format_kwargs_for_ollama, expected_keys_override=state_patch.admin_response_keys(),
+        gui_callbacks=gui_callbacks, stats_label=f"admin/{config.LLM_STATE_UPDATE_MODE}"
+    )
+    c.update(ollama_data=ollama_data, ollama_error_message_str=ollama_error_message_str or "",
+             target_customer_id=target_customer_id_for_prompt, loaded_customer_state=loaded_customer_state)
+
+
+# --- Stage: state merge + persist ---
+def _stage_merge(job):
+    c = job.ctx
+    source, input_text = c["source"], c["input_text"]
+    gui_callbacks = c.get("gui_callbacks")
+    state_manager_module_ref = c["state_manager_module_ref"]
+    ollama_data, current_lang_code_for_state = c["ollama_data"], c["lang_code"]
+    loaded_customer_state, target_customer_id_for_prompt = c["loaded_customer_state"], c["target_customer_id"]
+    web_result = c.get("web_result")
+
+    current_turn_for_history = {"user": input_text, "source": source}
+    detected_language_code = c.get("detected_language_code")
+    if detected_language_code:
+        display_source = "web" if source == "web_admin" else source
+        current_turn_for_history[f"detected_language_code_for_{display_source}_display"] = detected_language_code
+
+    if c["ollama_error_message_str"]: _web_error(c, f"LLM error: {c['ollama_error_message_str']}")
+    current_turn_for_history["timestamp"] = state_manager_module_ref.get_current_timestamp_iso()
+    outcome = {} # Filled by _next_version; it may run more than once, so it only records, never calls out
+
+    def _next_version(snapshot):
+        # Builds the next state version from `snapshot` (not from the llm-stage snapshot), so writes by customer
+        # threads during the LLM call are kept. Unchanged subtrees are shared with the previous version.
+        deferred_gui_calls = [] # (callback, args, kwargs), run after the swap
+        def _defer_gui(callback_key, *cb_args, **cb_kwargs):
+            if gui_callbacks and callable(gui_callbacks.get(callback_key)):
+                deferred_gui_calls.append((gui_callbacks[callback_key], cb_args, cb_kwargs))
+        outcome.update(deferred_gui_calls=deferred_gui_calls, refresh_task_and_calendar_views=False, apply_customer_update=False)
+        turn = dict(current_turn_for_history)
+        parts = {}
+        if c["ollama_error_message_str"]:
+            c["ollama_error_occurred"] = True
+            assistant_response_text_llm = "An internal error occurred (admin)."
+            if current_lang_code_for_state == "ru": assistant_response_text_llm = "Произошла внутренняя ошибка (админ)."
+            turn["assistant"] = f"[LLM Error ({source}): {assistant_response_text_llm}]"
+            _defer_gui('add_assistant_message_to_display', assistant_response_text_llm, is_error=True, source=f"{source}_error")
+        else:
+            c["ollama_error_occurred"] = False
+            assistant_response_text_llm = ollama_data.get("answer_to_user", "Error: No LLM answer.")
+
+            # Patch ops or a full document, validated against the schema (utils/state_patch.py)
+            llm_provided_user_state_changes = state_patch.resolve_state_update(
+                snapshot.user_state, ollama_data, "admin_user_state", "updated_user_state", "user_state_patch",
+                context=f"ADMIN_PIPELINE ({source}) user state")
+            if llm_provided_user_state_changes is not None:
+                current_gui_theme_from_live_state = snapshot.user_state.get("gui_theme", config.DEFAULT_USER_STATE["gui_theme"])
+                llm_theme_suggestion = llm_provided_user_state_changes.get("gui_theme", current_gui_theme_from_live_state)
+                applied_theme_value = current_gui_theme_from_live_state
+                if llm_theme_suggestion != current_gui_theme_from_live_state and llm_theme_suggestion in [config.GUI_THEME_LIGHT, config.GUI_THEME_DARK]:
+                    if gui_callbacks and callable(gui_callbacks.get('apply_application_theme')):
+                        _defer_gui('apply_application_theme', llm_theme_suggestion)
+                        applied_theme_value = llm_theme_suggestion
+                llm_provided_user_state_changes["gui_theme"] = applied_theme_value
+
+                current_font_size_from_live_state = snapshot.user_state.get("chat_font_size", config.DEFAULT_USER_STATE["chat_font_size"])
+                llm_font_size_str_suggestion = llm_provided_user_state_changes.get("chat_font_size", str(current_font_size_from_live_state))
+                try: llm_font_size_as_int = int(llm_font_size_str_suggestion)
+                except: llm_font_size_as_int = current_font_size_from_live_state
+                clamped_font_size_suggestion = max(config.MIN_CHAT_FONT_SIZE, min(llm_font_size_as_int, config.MAX_CHAT_FONT_SIZE))
+                applied_font_size_value = current_font_size_from_live_state
+                if clamped_font_size_suggestion != current_font_size_from_live_state:
+                    _defer_gui('apply_chat_font_size', clamped_font_size_suggestion)
+                    applied_font_size_value = clamped_font_size_suggestion
+                llm_provided_user_state_changes["chat_font_size"] = applied_font_size_value
+
+                parts["user_state"] = llm_provided_user_state_changes
+            else:
+                logger.info(f"ADMIN_PIPELINE ({source}): No user state changes from LLM this turn.")
+
+            merged_assistant_state = state_patch.resolve_state_update(
+                snapshot.assistant_state, ollama_data, "assistant_state", "updated_assistant_state", "assistant_state_patch",
+                context=f"ADMIN_PIPELINE ({source}) assistant state")
+            parts["assistant_state"] = {**(merged_assistant_state if merged_assistant_state is not None else snapshot.assistant_state),
+                                        "last_used_language": current_lang_code_for_state}
+
+            outcome["refresh_task_and_calendar_views"] = True # Done from the published snapshot
+            outcome["apply_customer_update"] = loaded_customer_state is not None and bool(target_customer_id_for_prompt)
+
+            turn["assistant"] = assistant_response_text_llm
+            _defer_gui('add_assistant_message_to_display', assistant_response_text_llm, is_error=False, source=source)
+
+        parts["chat_history"] = (snapshot.chat_history + [turn])[-config.MAX_HISTORY_TURNS:]
+        outcome["response_text"] = assistant_response_text_llm
+        return parts
+
+    published_snapshot = get_app_state().update(_next_version)
+    state_manager_module_ref.save_app_state(gui_callbacks) # After the swap, outside any state lock
+    assistant_response_text_llm = outcome["response_text"]
+    c["response_text"] = assistant_response_text_llm
+    if web_result is not None: web_result["llm_text_response"] = assistant_response_text_llm
+
+    # GUI callbacks and the customer save run after the new version is published
+    for gui_fn, gui_args, gui_kwargs in outcome["deferred_gui_calls"]: gui_fn(*gui_args, **gui_kwargs)
+    _gui(c, 'memory_status_update', "MEM: SAVED", "saved")
+    if outcome["refresh_task_and_calendar_views"] and gui_callbacks:
+        _gui(c, 'update_calendar_events_list', published_snapshot.user_state.get("calendar_events", []))
+        asst_tasks = published_snapshot.assistant_state.get("internal_tasks", {});
+        if not isinstance(asst_tasks, dict): asst_tasks = {"pending": [], "completed": []}
+        _gui(c, 'update_kanban_pending', asst_tasks.get("pending", []))
+        _gui(c, 'update_kanban_completed', asst_tasks.get("completed", []))
+
+    if outcome["apply_customer_update"]:
+        def _apply_llm_customer_update(current_state: dict):
+            # Re-read under the customer lock: the customer may have written since _stage_llm loaded their state
+            updated_state = state_patch.resolve_state_update(
+                current_state, ollama_data, "customer_state", "updated_active_customer_state", "active_customer_state_patch",
+                context=f"ADMIN_PIPELINE ({source}) customer {target_customer_id_for_prompt} state")
+            if not isinstance(updated_state, dict) or updated_state.get("user_id") != target_customer_id_for_prompt: return None
+            return updated_state
+        if state_manager_module_ref.update_customer_state(target_customer_id_for_prompt, _apply_llm_customer_update,
+                                                          read_state=loaded_customer_state, gui_callbacks=gui_callbacks):
+            logger.info(f"ADMIN_PIPELINE ({source}): Updated state for context customer {target_customer_id_for_prompt}.")
+
+
+# --- Stage: reply (local TTS, Telegram, or a TTS file for the Web UI) ---
+def _write_web_tts_file(c: dict):
+    """Synthesizes the answer and stores it in WEB_UI_TTS_SERVE_FOLDER; sets web_result['tts_audio_filename']."""
+    web_result, tts_ref = c["web_result"], c["tts_manager_module_ref"]
+    if not tts_ref.is_tts_ready():
+        logger.warning("ADMIN_PIPELINE (web_admin): TTS service not ready. Returning text only."); return
+    bark_engine_for_web_admin = tts_ref.get_bark_model_instance()
+    if not bark_engine_for_web_admin:
+        logger.error("ADMIN_PIPELINE (web_admin): Failed to get Bark TTS engine instance."); return
+    audio_array, samplerate = bark_engine_for_web_admin.synthesize_speech_to_array(
+        c["response_text"], generation_params={"voice_preset": c["bark_voice_preset"]})
+    if audio_array is None or samplerate is None or audio_array.size == 0:
+        logger.error("ADMIN_PIPELINE (web_admin): TTS synthesis returned no audio data or samplerate.")
+        _web_error(c, "TTS synthesis failed to produce audio."); return
+    serve_folder = resolve_artifact_path(config.WEB_UI_TTS_SERVE_FOLDER) # The folder /play_audio serves, whatever the cwd
+    if not file_utils.ensure_folder(serve_folder, gui_callbacks=None):
+        logger.critical(f"ADMIN_PIPELINE (web_admin): Could not create/access TTS serve folder: {serve_folder}")
+        _web_error(c, "Server error: Cannot save TTS audio (folder issue)."); return
+
+    # Encode in memory, then write the (compressed) result once so /play_audio can serve it
+    if config.WEB_UI_TTS_AUDIO_FORMAT == "ogg" and opus_encoder.is_opus_encoding_available():
+        tts_filename = f"web_admin_tts_{uuid.uuid4().hex}.ogg"
+        encoded_audio = opus_encoder.encode_pcm_to_ogg_opus(audio_array, samplerate)
+    else:
+        tts_filename = f"web_admin_tts_{uuid.uuid4().hex}.wav"
+        encoded_audio = opus_encoder.encode_pcm_to_wav(audio_array, samplerate)
+    tts_filepath = os.path.join(serve_folder, tts_filename)
+    with open(tts_filepath, 'wb') as f_tts: f_tts.write(encoded_audio)
+    mark_artifact_in_use(tts_filepath)
+    web_result["tts_audio_filename"] = tts_filename
+    logger.info(f"ADMIN_PIPELINE (web_admin): Synthesized TTS and saved to {tts_filepath} ({len(encoded_audio)} bytes)")
+
+def _stage_reply(job):
+    c = job.ctx
+    source, gui_callbacks = c["source"], c.get("gui_callbacks")
+    tts_manager_module_ref, tg_handler = c["tts_manager_module_ref"], c.get("telegram_bot_handler_instance_ref")
+    assistant_response_text_llm, ollama_error_occurred = c["response_text"], c["ollama_error_occurred"]
+    selected_bark_voice_preset, ollama_ready_flag = c["bark_voice_preset"], c.get("ollama_ready_flag")
+    gui_tts_will_update_status = source == "gui" and tts_manager_module_ref.is_tts_ready() and not ollama_error_occurred
+
+    if source == "web_admin":
+        if not ollama_error_occurred:
+            try: _write_web_tts_file(c)
+            except Exception as e_tts:
+                logger.error(f"ADMIN_PIPELINE (web_admin): TTS synthesis/saving failed: {e_tts}", exc_info=True)
+                _web_error(c, f"TTS synthesis/saving failed: {e_tts}")
+    elif gui_tts_will_update_status:
+        def _deferred_gui_display(playback_start_ts=None):
+            if playback_start_ts: logger.debug(f"ADMIN_PIPELINE ({source}): TTS audible at {playback_start_ts:.3f}.")
+            _gui(c, 'status_update', f"Speaking (Admin): {assistant_response_text_llm[:40]}...")
+        current_persona_name_tts = get_app_state().current().assistant_state.get("persona_name", "Iri-shka")
+        tts_manager_module_ref.start_speaking_response(
+            assistant_response_text_llm, current_persona_name_tts, selected_bark_voice_preset, gui_callbacks,
+            on_actual_playback_start_gui_callback=_deferred_gui_display)
+    elif source in TELEGRAM_SOURCES and tg_handler and not ollama_error_occurred:
+        try:
+            admin_id_int = int(config.TELEGRAM_ADMIN_USER_ID)
+            if config.TELEGRAM_REPLY_WITH_TEXT: _send_telegram_text(c, admin_id_int, assistant_response_text_llm)
+            if config.TELEGRAM_REPLY_WITH_VOICE:
+                c["telegram_messaging_utils_module_ref"].send_voice_reply_to_telegram_user(
+                    admin_id_int, assistant_response_text_llm, selected_bark_voice_preset, tg_handler, tts_manager_module_ref)
+        except Exception as e_tg_send_admin: logger.error(f"ADMIN_PIPELINE: Error sending reply to admin TG ({source}): {e_tg_send_admin}", exc_info=True)
+    elif ollama_error_occurred and tg_handler and tg_handler.async_loop:
+        try:
+            err_text_for_tg = "Ошибка обработки LLM." if c["lang_code"] == "ru" else "LLM processing failed."
+            _send_telegram_text(c, int(config.TELEGRAM_ADMIN_USER_ID), err_text_for_tg)
+        except Exception as e_tg_err_send: logger.error(f"Failed to send LLM error to admin TG: {e_tg_err_send}")
+
+    if not gui_callbacks: return
+    if ollama_error_occurred:
+        short_code, status_type = _parse_ollama_error_to_short_code(c["ollama_error_message_str"])
+        _gui(c, 'mind_status_update', f"MIND: {short_code.upper()}", status_type)
+    else: _mind_idle(c)
+
+    if not gui_tts_will_update_status:
+        final_app_status_text = "Error processing."
+        if not ollama_error_occurred and ollama_ready_flag:
+            latest_assistant_state = get_app_state().current().assistant_state
+            current_admin_name_for_status = latest_assistant_state.get("admin_name", "Partner")
+            current_persona_name_for_status = latest_assistant_state.get("persona_name", "Iri-shka")
+            if assistant_response_text_llm and not assistant_response_text_llm.startswith("Error:"):
+                response_snippet = assistant_response_text_llm[:60]
+                if len(assistant_response_text_llm) > 60: response_snippet += "..."
+                final_app_status_text = f"{current_persona_name_for_status} to {current_admin_name_for_status}: {response_snippet}"
+            elif assistant_response_text_llm:
+                final_app_status_text = f"{current_persona_name_for_status} says: {assistant_response_text_llm[:60]}..."
+            else:
+                final_app_status_text = "Ready."
+        elif ollama_error_occurred:
+            short_code, _ = _parse_ollama_error_to_short_code(c["ollama_error_message_str"])
+            final_app_status_text = f"LLM Error: {short_code.upper()}"
+        elif not ollama_ready_flag:
+            final_app_status_text = "LLM Not Ready."
+        _gui(c, 'status_update', final_app_status_text)
+
+
+def _on_admin_job_finished(job):
+    """Runs once per job whatever happened: failure reporting, GUI idle state, temp file cleanup."""
+    c, future = job.ctx, job.future
+    source = c["source"]
+    failure = "cancelled" if future.cancelled() else future.exception()
+    if failure is not None:
+        timed_out = isinstance(failure, StageTimeoutError)
+        logger.error(f"ADMIN_PIPELINE ({source}): Job {job.seq} ended in stage '{job.stage}': {failure}")
+        _gui(c, 'status_update', f"Error processing admin {source} input" + (" (timeout)." if timed_out else "."))
+        if timed_out and job.stage == "llm": _gui(c, 'mind_status_update', "MIND: TMO", "timeout")
+        else: _mind_idle(c)
+        if source == "telegram_voice_admin":
+            try: _send_telegram_text(c, c["user_id"], "An error occurred while processing your voice message.")
+            except Exception as e_tg_err: logger.error(f"Failed to send pipeline error to admin TG: {e_tg_err}")
+        elif source == "web_admin": _web_error(c, f"Admin web interaction failed in '{job.stage}': {failure}")
+    if source == "gui": _gui(c, 'act_status_update', "ACT: IDLE", "idle")
+    wav_filepath = c.get("wav_filepath")
+    if c.get("delete_wav_after") and wav_filepath and os.path.exists(wav_filepath):
+        try: os.remove(wav_filepath)
+        except Exception as e_rem: logger.warning(f"Could not remove temp admin WAV {wav_filepath}: {e_rem}")
+    durations = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in job.stage_durations.items())
+    logger.info(f"ADMIN_PIPELINE ({source}): Job {job.seq} finished ({durations}).")
+
+
+_admin_pipeline: InteractionPipeline = None
+_admin_pipeline_lock = threading.Lock()
+
+def get_admin_pipeline() -> InteractionPipeline:
+    global _admin_pipeline
+    with _admin_pipeline_lock:
+        if _admin_pipeline is None:
+            queue_size = config.ADMIN_PIPELINE_QUEUE_SIZE
+            _admin_pipeline = InteractionPipeline("AdminPipeline", [
+                Stage("stt", _stage_transcribe, timeout=config.ADMIN_PIPELINE_STT_TIMEOUT_SECONDS, queue_size=queue_size),
+                Stage("llm", _stage_llm, timeout=config.ADMIN_PIPELINE_LLM_TIMEOUT_SECONDS, queue_size=queue_size, after_prior="merge"),
+                Stage("merge", _stage_merge, queue_size=queue_size),
+                Stage("reply", _stage_reply, timeout=config.ADMIN_PIPELINE_REPLY_TIMEOUT_SECONDS, queue_size=queue_size),
+            ], on_finished=_on_admin_job_finished)
+            _admin_pipeline.start()
+        return _admin_pipeline
+
+def shutdown_admin_pipeline():
+    global _admin_pipeline
+    with _admin_pipeline_lock:
+        pipeline, _admin_pipeline = _admin_pipeline, None
+    if pipeline:
+        logger.info(f"Admin pipeline metrics: {pipeline.get_metrics()}")
+        pipeline.stop()
+
+def submit_admin_interaction(ctx: dict):
+    """Queues one admin turn; returns its PipelineJob (job.future resolves with ctx when the reply is done)."""
+    logger.info(f"ADMIN_PIPELINE ({ctx['source']}): Submitting " +
+                (f"text '{ctx['input_text'][:30]}...'" if ctx.get("input_text") else "audio"))
+    return get_admin_pipeline().submit(ctx)
+
+
+# --- Front-end adapters ---
 def process_gui_recorded_audio(
-    recorded_sample_rate: int, chat_history_ref: list, user_state_ref: dict, assistant_state_ref: dict,
-    global_states_lock_ref: threading.Lock, gui_callbacks: dict, telegram_bot_handler_instance_ref, ollama_ready_flag: bool,
+    recorded_sample_rate: int, gui_callbacks: dict, telegram_bot_handler_instance_ref, ollama_ready_flag: bool,
     audio_processor_module_ref, whisper_handler_module_ref, tts_manager_module_ref,
     ollama_handler_module_ref, state_manager_module_ref, file_utils_module_ref,
     telegram_messaging_utils_module_ref
     ):
+    """Converts the recorded frames here (they live in audio_processor) and submits the rest; returns the job's future or None."""
     logger.info(f"Processing recorded audio (Admin GUI). Sample rate: {recorded_sample_rate} Hz.")
-    llm_called = False
     if gui_callbacks and callable(gui_callbacks.get('act_status_update')):
         gui_callbacks['act_status_update']("ACT: BUSY", "busy")
+    submitted = False
     try:
         audio_float32, audio_frames_for_save = audio_processor_module_ref.convert_frames_to_numpy(
             recorded_sample_rate, gui_callbacks)
-        if audio_float32 is None: return
+        if audio_float32 is None: return None
 
         if config.SAVE_RECORDINGS_TO_WAV and audio_frames_for_save:
             file_utils_module_ref.ensure_folder(config.OUTPUT_FOLDER, gui_callbacks)
@@ -330,159 +503,54 @@ def process_gui_recorded_audio(
                 os.path.join(config.OUTPUT_FOLDER, filename), audio_frames_for_save, recorded_sample_rate, gui_callbacks)
         del audio_frames_for_save; audio_frames_for_save=None; gc.collect()
 
-
-        if not (whisper_handler_module_ref.WHISPER_CAPABLE and whisper_handler_module_ref.is_whisper_ready()):
-            if gui_callbacks and callable(gui_callbacks.get('status_update')): gui_callbacks['status_update']("Hearing NRDY.")
-            if gui_callbacks and callable(gui_callbacks.get('mind_status_update')):
-                 current_mind_status_text = "MIND: RDY" if ollama_ready_flag else "MIND: NRDY"
-                 current_mind_status_type = "ready" if ollama_ready_flag else "error"
-                 gui_callbacks['mind_status_update'](current_mind_status_text, current_mind_status_type)
-            return
-
-        if gui_callbacks and callable(gui_callbacks.get('status_update')): gui_callbacks['status_update']("Transcribing (GUI)...")
-        transcribed_text, trans_err, detected_lang = whisper_handler_module_ref.transcribe_audio(
-            audio_np_array=audio_float32, language=None, task="transcribe", gui_callbacks=gui_callbacks)
-        del audio_float32; audio_float32=None; gc.collect()
-        
-        if not trans_err and transcribed_text:
-            llm_called = True
-            handle_admin_llm_interaction(
-                input_text=transcribed_text, source="gui", detected_language_code=detected_lang,
-                chat_history_ref=chat_history_ref, user_state_ref=user_state_ref, assistant_state_ref=assistant_state_ref,
-                global_states_lock_ref=global_states_lock_ref, gui_callbacks=gui_callbacks,
-                telegram_bot_handler_instance_ref=telegram_bot_handler_instance_ref,
-                ollama_handler_module_ref=ollama_handler_module_ref, state_manager_module_ref=state_manager_module_ref,
-                tts_manager_module_ref=tts_manager_module_ref,
-                telegram_messaging_utils_module_ref=telegram_messaging_utils_module_ref,
-                ollama_ready_flag=ollama_ready_flag 
-            )
-        elif not transcribed_text and not trans_err: 
-            lang_for_err_gui = "en"
-            with global_states_lock_ref: lang_for_err_gui = assistant_state_ref.get("last_used_language", "en") 
-            err_msg_stt_gui = "I didn't catch that..." if lang_for_err_gui == "en" else "Я не расслышала..."
-            if gui_callbacks and callable(gui_callbacks.get('add_user_message_to_display')): gui_callbacks['add_user_message_to_display']("[Silent/Unclear Audio]", source="gui")
-            if gui_callbacks and callable(gui_callbacks.get('add_assistant_message_to_display')): gui_callbacks['add_assistant_message_to_display'](err_msg_stt_gui, is_error=False, source="gui") 
-            if gui_callbacks and callable(gui_callbacks.get('status_update')): gui_callbacks['status_update'](err_msg_stt_gui)
-            if gui_callbacks and callable(gui_callbacks.get('mind_status_update')):
-                 current_mind_status_text = "MIND: RDY" if ollama_ready_flag else "MIND: NRDY"
-                 current_mind_status_type = "ready" if ollama_ready_flag else "error"
-                 gui_callbacks['mind_status_update'](current_mind_status_text, current_mind_status_type)
-            if tts_manager_module_ref.is_tts_ready():
-                err_preset_gui = config.BARK_VOICE_PRESET_EN if lang_for_err_gui == "en" else config.BARK_VOICE_PRESET_RU
-                current_persona_name_gui = "Iri-shka"; 
-                with global_states_lock_ref: current_persona_name_gui = assistant_state_ref.get("persona_name", "Iri-shka") 
-                tts_manager_module_ref.start_speaking_response(err_msg_stt_gui, current_persona_name_gui, err_preset_gui, gui_callbacks)
-        else: 
-             lang_for_err_gui = "en"
-             with global_states_lock_ref: lang_for_err_gui = assistant_state_ref.get("last_used_language", "en")
-             err_msg_stt_gui = "Sorry, I had trouble understanding that." if lang_for_err_gui == "en" else "Извините, не удалось разобрать речь."
-             if gui_callbacks and callable(gui_callbacks.get('add_user_message_to_display')): gui_callbacks['add_user_message_to_display']("[Transcription Error]", source="gui")
-             if gui_callbacks and callable(gui_callbacks.get('add_assistant_message_to_display')): gui_callbacks['add_assistant_message_to_display'](err_msg_stt_gui, is_error=True, source="gui")
-             if gui_callbacks and callable(gui_callbacks.get('status_update')): gui_callbacks['status_update'](f"Transcription Error: {trans_err or 'Unknown'}")
-             if gui_callbacks and callable(gui_callbacks.get('mind_status_update')):
-                 current_mind_status_text = "MIND: RDY" if ollama_ready_flag else "MIND: NRDY"
-                 current_mind_status_type = "ready" if ollama_ready_flag else "error"
-                 gui_callbacks['mind_status_update'](current_mind_status_text, current_mind_status_type)
-
+        job = submit_admin_interaction({
+            "source": "gui", "audio_np": audio_float32,
+            "gui_callbacks": gui_callbacks,
+            "telegram_bot_handler_instance_ref": telegram_bot_handler_instance_ref, "ollama_ready_flag": ollama_ready_flag,
+            "whisper_handler_module_ref": whisper_handler_module_ref, "tts_manager_module_ref": tts_manager_module_ref,
+            "ollama_handler_module_ref": ollama_handler_module_ref, "state_manager_module_ref": state_manager_module_ref,
+            "telegram_messaging_utils_module_ref": telegram_messaging_utils_module_ref,
+        })
+        submitted = True
+        return job.future
     finally:
-        if not llm_called: 
-            if gui_callbacks and callable(gui_callbacks.get('act_status_update')):
-                gui_callbacks['act_status_update']("ACT: IDLE", "idle")
+        if not submitted and gui_callbacks and callable(gui_callbacks.get('act_status_update')):
+            gui_callbacks['act_status_update']("ACT: IDLE", "idle") # Otherwise reset when the job finishes
 
 
 def process_admin_telegram_text_message(
-    user_id, text_message, chat_history_ref: list, user_state_ref: dict, assistant_state_ref: dict,
-    global_states_lock_ref: threading.Lock, gui_callbacks: dict, telegram_bot_handler_instance_ref, ollama_ready_flag: bool,
+    user_id, text_message, gui_callbacks: dict, telegram_bot_handler_instance_ref, ollama_ready_flag: bool,
     ollama_handler_module_ref, state_manager_module_ref, tts_manager_module_ref,
     telegram_messaging_utils_module_ref
     ):
+    """Returns the job's future; the admin dispatcher acks the queue item when it resolves."""
     logger.info(f"Processing Admin Telegram text from {user_id}: '{text_message[:70]}...'")
     if gui_callbacks and callable(gui_callbacks.get('add_user_message_to_display')):
         gui_callbacks['add_user_message_to_display'](text_message, source="telegram_admin")
 
-    handle_admin_llm_interaction(
-        input_text=text_message, source="telegram_admin", detected_language_code=None,
-        chat_history_ref=chat_history_ref, user_state_ref=user_state_ref, assistant_state_ref=assistant_state_ref,
-        global_states_lock_ref=global_states_lock_ref, gui_callbacks=gui_callbacks,
-        telegram_bot_handler_instance_ref=telegram_bot_handler_instance_ref,
-        ollama_handler_module_ref=ollama_handler_module_ref, state_manager_module_ref=state_manager_module_ref,
-        tts_manager_module_ref=tts_manager_module_ref,
-        telegram_messaging_utils_module_ref=telegram_messaging_utils_module_ref,
-        ollama_ready_flag=ollama_ready_flag
-    )
+    return submit_admin_interaction({
+        "source": "telegram_admin", "user_id": user_id, "input_text": text_message,
+        "gui_callbacks": gui_callbacks,
+        "telegram_bot_handler_instance_ref": telegram_bot_handler_instance_ref, "ollama_ready_flag": ollama_ready_flag,
+        "tts_manager_module_ref": tts_manager_module_ref, "ollama_handler_module_ref": ollama_handler_module_ref,
+        "state_manager_module_ref": state_manager_module_ref,
+        "telegram_messaging_utils_module_ref": telegram_messaging_utils_module_ref,
+    }).future
 
 def process_admin_telegram_voice_message(
-    user_id, wav_filepath, chat_history_ref: list, user_state_ref: dict, assistant_state_ref: dict,
-    global_states_lock_ref: threading.Lock, gui_callbacks: dict, telegram_bot_handler_instance_ref, ollama_ready_flag: bool,
+    user_id, wav_filepath, gui_callbacks: dict, telegram_bot_handler_instance_ref, ollama_ready_flag: bool,
     whisper_handler_module_ref, _whisper_module_for_load_audio_ref,
     ollama_handler_module_ref, state_manager_module_ref, tts_manager_module_ref,
     telegram_messaging_utils_module_ref
     ):
+    """Returns the job's future; the WAV is deleted when the job finishes."""
     logger.info(f"Processing Admin Telegram voice from {user_id}, WAV: {wav_filepath}")
-    try:
-        if not (whisper_handler_module_ref.WHISPER_CAPABLE and whisper_handler_module_ref.is_whisper_ready() and _whisper_module_for_load_audio_ref):
-            logger.error("Cannot process admin voice: Whisper not ready or load_audio missing.")
-            if telegram_bot_handler_instance_ref and telegram_bot_handler_instance_ref.async_loop:
-                 asyncio.run_coroutine_threadsafe(telegram_bot_handler_instance_ref.send_text_message_to_user(user_id, "Error: Voice processing module (Whisper) is not ready."), telegram_bot_handler_instance_ref.async_loop)
-            if gui_callbacks and callable(gui_callbacks.get('mind_status_update')):
-                 current_mind_status_text = "MIND: RDY" if ollama_ready_flag else "MIND: NRDY"
-                 current_mind_status_type = "ready" if ollama_ready_flag else "error"
-                 gui_callbacks['mind_status_update'](current_mind_status_text, current_mind_status_type)
-            return
-
-        if gui_callbacks and callable(gui_callbacks.get('status_update')): gui_callbacks['status_update']("Loading Admin voice (TG)...")
-        audio_numpy = _whisper_module_for_load_audio_ref.load_audio(wav_filepath)
-        if gui_callbacks and callable(gui_callbacks.get('status_update')): gui_callbacks['status_update']("Transcribing Admin voice (TG)...")
-        
-        trans_text, trans_err, detected_lang = whisper_handler_module_ref.transcribe_audio(
-            audio_np_array=audio_numpy, language=None, task="transcribe", gui_callbacks=gui_callbacks)
-        del audio_numpy; audio_numpy=None; gc.collect()
-        
-        if not trans_err and trans_text:
-            if gui_callbacks and callable(gui_callbacks.get('add_user_message_to_display')):
-                gui_callbacks['add_user_message_to_display'](trans_text, source="telegram_voice_admin")
-            handle_admin_llm_interaction(
-                input_text=trans_text, source="telegram_voice_admin", detected_language_code=detected_lang,
-                chat_history_ref=chat_history_ref, user_state_ref=user_state_ref, assistant_state_ref=assistant_state_ref,
-                global_states_lock_ref=global_states_lock_ref, gui_callbacks=gui_callbacks,
-                telegram_bot_handler_instance_ref=telegram_bot_handler_instance_ref,
-                ollama_handler_module_ref=ollama_handler_module_ref, state_manager_module_ref=state_manager_module_ref,
-                tts_manager_module_ref=tts_manager_module_ref,
-                telegram_messaging_utils_module_ref=telegram_messaging_utils_module_ref,
-                ollama_ready_flag=ollama_ready_flag
-            )
-        elif not trans_text and not trans_err: 
-             logger.info(f"Admin TG Voice: No speech detected in {wav_filepath}")
-             if gui_callbacks and callable(gui_callbacks.get('add_user_message_to_display')):
-                gui_callbacks['add_user_message_to_display']("[Silent/Unclear Audio from Admin TG]", source="telegram_voice_admin")
-             if gui_callbacks and callable(gui_callbacks.get('status_update')): gui_callbacks['status_update']("Admin TG: No speech detected.")
-             if gui_callbacks and callable(gui_callbacks.get('mind_status_update')):
-                 current_mind_status_text = "MIND: RDY" if ollama_ready_flag else "MIND: NRDY"
-                 current_mind_status_type = "ready" if ollama_ready_flag else "error"
-                 gui_callbacks['mind_status_update'](current_mind_status_text, current_mind_status_type)
-             if telegram_bot_handler_instance_ref and telegram_bot_handler_instance_ref.async_loop:
-                asyncio.run_coroutine_threadsafe(telegram_bot_handler_instance_ref.send_text_message_to_user(user_id, "I didn't hear anything in your voice message."), telegram_bot_handler_instance_ref.async_loop)
-        else: 
-            logger.warning(f"Admin TG Voice Transcription failed: {trans_err}")
-            if gui_callbacks and callable(gui_callbacks.get('add_user_message_to_display')):
-                gui_callbacks['add_user_message_to_display'](f"[Transcription Error from Admin TG: {trans_err}]", source="telegram_voice_admin")
-            if gui_callbacks and callable(gui_callbacks.get('status_update')): gui_callbacks['status_update'](f"Admin TG Voice Error: {trans_err or 'Recognition error.'}")
-            if gui_callbacks and callable(gui_callbacks.get('mind_status_update')):
-                 current_mind_status_text = "MIND: RDY" if ollama_ready_flag else "MIND: NRDY"
-                 current_mind_status_type = "ready" if ollama_ready_flag else "error"
-                 gui_callbacks['mind_status_update'](current_mind_status_text, current_mind_status_type)
-            if telegram_bot_handler_instance_ref and telegram_bot_handler_instance_ref.async_loop:
-                asyncio.run_coroutine_threadsafe(telegram_bot_handler_instance_ref.send_text_message_to_user(user_id, f"Couldn't transcribe voice: {trans_err or 'Recognition error.'}"), telegram_bot_handler_instance_ref.async_loop)
-    except Exception as e:
-        logger.error(f"Error processing admin voice WAV {wav_filepath}: {e}", exc_info=True)
-        if gui_callbacks and callable(gui_callbacks.get('status_update')): gui_callbacks['status_update']("Error processing admin voice.")
-        if gui_callbacks and callable(gui_callbacks.get('mind_status_update')):
-             current_mind_status_text = "MIND: RDY" if ollama_ready_flag else "MIND: NRDY" 
-             current_mind_status_type = "ready" if ollama_ready_flag else "error"
-             gui_callbacks['mind_status_update'](current_mind_status_text, current_mind_status_type)
-        if telegram_bot_handler_instance_ref and telegram_bot_handler_instance_ref.async_loop:
-             asyncio.run_coroutine_threadsafe(telegram_bot_handler_instance_ref.send_text_message_to_user(user_id, "An error occurred while processing your voice message."), telegram_bot_handler_instance_ref.async_loop)
-    finally:
-        if os.path.exists(wav_filepath):
-            try: os.remove(wav_filepath)
-            except Exception as e_rem: logger.warning(f"Could not remove temp admin WAV {wav_filepath}: {e_rem}")
\ No newline at end of file
+    return submit_admin_interaction({
+        "source": "telegram_voice_admin", "user_id": user_id, "wav_filepath": wav_filepath, "delete_wav_after": True,
+        "gui_callbacks": gui_callbacks,
+        "telegram_bot_handler_instance_ref": telegram_bot_handler_instance_ref, "ollama_ready_flag": ollama_ready_flag,
+        "whisper_handler_module_ref": whisper_handler_module_ref, "_whisper_module_for_load_audio_ref": _whisper_module_for_load_audio_ref,
+        "tts_manager_module_ref": tts_manager_module_ref, "ollama_handler_module_ref": ollama_handler_module_ref,
+        "state_manager_module_ref": state_manager_module_ref,
+        "telegram_messaging_utils_module_ref": telegram_messaging_utils_module_ref,
+    }).future
@@ -0,0 +1,173 @@
+# utils/artifact_reaper.py
+"""
+Background garbage collector for generated artifacts (Web UI TTS files, Telegram voice temp files, dashboards).
+
+Every folder has a policy of the form {"ttl_seconds": int | None, "max_bytes": int | None}. Each sweep
+makes one os.scandir pass per folder. It deletes files older than the TTL, then deletes the oldest
+files until the folder fits its byte quota. Files recorded in the served-artifact manifest within the
+last ARTIFACT_SERVE_GRACE_SECONDS are never deleted, because a client may still be fetching them.
+Relative folders in config are anchored to the project root (not the working directory), so the
+synthesizer, the Web UI and the reaper all agree on manifest keys.
+"""
+import os
+import threading
+import time
+
+import config
+from logger import get_logger
+
+logger = get_logger("Iri-shka_App.utils.ArtifactReaper")
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def resolve_artifact_path(path: str) -> str:
+    """Absolute, normalized path; relative paths are taken relative to the project root."""
+    return os.path.normpath(path if os.path.isabs(path) else os.path.join(PROJECT_ROOT, path))
+
+# --- Served-artifact manifest (absolute path -> last served/created epoch) ---
+_manifest = {}
+_manifest_lock = threading.Lock()
+
+
+def mark_artifact_in_use(filepath: str):
+    """Records that `filepath` was just created or served. Protects it from reaping for the grace period."""
+    if not filepath: return
+    with _manifest_lock:
+        _manifest[resolve_artifact_path(filepath)] = time.time()
+
+
+def _protected_since(abs_path: str):
+    with _manifest_lock:
+        return _manifest.get(abs_path)
+
+
+def _prune_manifest(now: float):
+    cutoff = now - config.ARTIFACT_SERVE_GRACE_SECONDS
+    with _manifest_lock:
+        stale = [p for p, ts in _manifest.items() if ts < cutoff]
+        for p in stale: del _manifest[p]
+
+
+def sweep_folder(folder: str, ttl_seconds=None, max_bytes=None, now=None) -> dict:
+    """
+    One scandir pass over `folder` (non-recursive, regular files only).
+    Returns {"folder", "scanned", "deleted", "reclaimed_bytes", "remaining_bytes", "protected"}.
+    """
+    now = now if now is not None else time.time()
+    folder = resolve_artifact_path(folder)
+    result = {"folder": folder, "scanned": 0, "deleted": 0, "reclaimed_bytes": 0, "remaining_bytes": 0, "protected": 0}
+    if not os.path.isdir(folder): return result
+    grace_cutoff = now - config.ARTIFACT_SERVE_GRACE_SECONDS
+
+    survivors = [] # (last_used_ts, size, path, protected)
+    try:
+        with os.scandir(folder) as it:
+            for entry in it:
+                try:
+                    if not entry.is_file(follow_symlinks=False): continue
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue # Vanished mid-sweep
+                result["scanned"] += 1
+                served_ts = _protected_since(os.path.normpath(entry.path))
+                last_used = max(st.st_mtime, served_ts or 0.0)
+                protected = last_used >= grace_cutoff
+                if protected: result["protected"] += 1
+                if ttl_seconds is not None and not protected and now - last_used > ttl_seconds:
+                    if _remove(entry.path, st.st_size, result): continue
+                survivors.append((last_used, st.st_size, entry.path, protected))
+    except OSError as e_scan:
+        logger.warning(f"Could not scan '{folder}': {e_scan}")
+        return result
+
+    total = sum(s[1] for s in survivors)
+    if max_bytes is not None and total > max_bytes:
+        survivors.sort(key=lambda s: s[0]) # Oldest first
+        for last_used, size, path, protected in survivors:
+            if total <= max_bytes: break
+            if protected: continue
+            if _remove(path, size, result): total -= size
+        if total > max_bytes:
+            logger.warning(f"'{folder}' still over quota ({total}/{max_bytes} bytes); remaining files are recently served.")
+    result["remaining_bytes"] = total
+    return result
+
+
+def _remove(path: str, size: int, result: dict) -> bool:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return True
+    except OSError as e_rm:
+        logger.debug(f"Could not remove '{path}': {e_rm}") # Often still open on Windows; retry next sweep
+        return False
+    result["deleted"] += 1
+    result["reclaimed_bytes"] += size
+    with _manifest_lock:
+        _manifest.pop(os.path.normpath(path), None)
+    return True
+
+
+class ArtifactReaper:
+    def __init__(self, policies=None, interval_seconds=None):
+        self.policies = policies if policies is not None else config.ARTIFACT_REAPER_POLICIES
+        self.interval_seconds = interval_seconds if interval_seconds is not None else config.ARTIFACT_REAPER_INTERVAL_SECONDS
+        self.stop_event = threading.Event()
+        self.reaper_thread = None
+        self.total_reclaimed_bytes = 0
+        self.total_deleted_files = 0
+        self.last_sweep_results = []
+        self.last_sweep_ts = None
+
+    def sweep_once(self) -> list:
+        now = time.time()
+        results = []
+        for folder, policy in self.policies.items():
+            res = sweep_folder(folder, policy.get("ttl_seconds"), policy.get("max_bytes"), now=now)
+            results.append(res)
+            self.total_reclaimed_bytes += res["reclaimed_bytes"]
+            self.total_deleted_files += res["deleted"]
+        _prune_manifest(now)
+        self.last_sweep_results = results
+        self.last_sweep_ts = now
+        reclaimed = sum(r["reclaimed_bytes"] for r in results)
+        if reclaimed:
+            details = ", ".join(f"{os.path.basename(r['folder'])}: -{r['deleted']} files/{r['reclaimed_bytes'] // 1024}KB" for r in results if r["deleted"])
+            logger.info(f"Reaper sweep reclaimed {reclaimed / 1024:.1f}KB ({details}). Total since start: {self.total_reclaimed_bytes / (1024**2):.1f}MB.")
+        else:
+            logger.debug(f"Reaper sweep: nothing to reclaim ({sum(r['scanned'] for r in results)} files scanned).")
+        return results
+
+    def _reaper_loop(self):
+        logger.debug("ArtifactReaper loop entered.")
+        while not self.stop_event.is_set():
+            try:
+                self.sweep_once()
+            except Exception as e:
+                logger.error(f"Unexpected error in ArtifactReaper sweep: {e}", exc_info=True)
+            self.stop_event.wait(self.interval_seconds)
+        logger.info("ArtifactReaper loop finished.")
+
+    def start(self):
+        if self.reaper_thread and self.reaper_thread.is_alive():
+            logger.info("ArtifactReaper thread already running."); return
+        self.stop_event.clear()
+        self.reaper_thread = threading.Thread(target=self._reaper_loop, daemon=True, name="ArtifactReaperThread")
+        self.reaper_thread.start()
+        logger.info(f"ArtifactReaper started (interval {self.interval_seconds}s, {len(self.policies)} folders).")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.reaper_thread and self.reaper_thread.is_alive():
+            self.reaper_thread.join(timeout=5)
+            if self.reaper_thread.is_alive(): logger.warning("ArtifactReaper thread did not join cleanly.")
+        logger.info(f"ArtifactReaper stopped. Reclaimed {self.total_reclaimed_bytes / (1024**2):.1f}MB in {self.total_deleted_files} files.")
+
+    def get_stats(self) -> dict:
+        return {
+            "total_reclaimed_bytes": self.total_reclaimed_bytes,
+            "total_deleted_files": self.total_deleted_files,
+            "last_sweep_ts": self.last_sweep_ts,
+            "last_sweep": self.last_sweep_results,
+        }
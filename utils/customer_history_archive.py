@@ -0,0 +1,173 @@
+# utils/customer_history_archive.py
+"""
+Windowing for customer chat_history.
+
+The live customer state keeps the last CUSTOMER_HISTORY_WINDOW_MESSAGES messages, plus a rolling
+"history_summary" of everything older. Older messages move to a per-customer gzip JSONL archive
+(<CUSTOMER_HISTORY_ARCHIVE_FOLDER>/<id>.jsonl.gz). Each archival appends one gzip member, so nothing
+is ever rewritten. Trimming waits until the history exceeds the window by CUSTOMER_HISTORY_ARCHIVE_BATCH
+messages, so archival (and a full history rewrite in the SQLite backend) happens once per batch,
+not once per message. search_archive() answers "what did this customer say about X / in this period";
+the admin prompt gets the archived messages matching the admin's request for the active customer.
+
+Archiving happens before the trimmed state reaches disk (write-behind). If the process dies in between,
+the next trim sees the same older turns again. archive_messages() therefore skips everything up to the
+newest message already in the archive (matched by content digest), so a turn is archived at most once.
+"""
+import collections
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+
+import config
+from logger import get_logger
+
+logger = get_logger("Iri-shka_App.utils.CustomerHistoryArchive")
+
+_archive_lock = threading.Lock() # Serializes appends; archives are small, one lock is enough
+_LAST_KEY_CACHE_SIZE = 4096
+_last_archived_keys = collections.OrderedDict() # telegram_user_id -> digest of the newest archived message (LRU)
+_QUERY_TERM_RE = re.compile(r"\w{4,}")
+
+
+def get_archive_filepath(telegram_user_id: int) -> str:
+    return os.path.join(config.CUSTOMER_HISTORY_ARCHIVE_FOLDER, f"{telegram_user_id}.jsonl.gz")
+
+
+def _message_text(msg: dict) -> str:
+    return str(msg.get("message", msg.get("text", "")) or "")
+
+
+def _message_key(msg) -> str:
+    return hashlib.sha1(json.dumps(msg, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _last_archived_key(telegram_user_id: int):
+    """Digest of the newest archived message; the archive is scanned once per customer, then cached. Call under _archive_lock."""
+    if telegram_user_id in _last_archived_keys:
+        _last_archived_keys.move_to_end(telegram_user_id)
+        return _last_archived_keys[telegram_user_id]
+    last = None
+    for last in iter_archived_messages(telegram_user_id): pass
+    key = _message_key(last) if last is not None else None
+    _remember_last_key(telegram_user_id, key)
+    return key
+
+
+def _remember_last_key(telegram_user_id: int, key):
+    _last_archived_keys[telegram_user_id] = key
+    _last_archived_keys.move_to_end(telegram_user_id)
+    while len(_last_archived_keys) > _LAST_KEY_CACHE_SIZE: _last_archived_keys.popitem(last=False)
+
+
+def archive_messages(telegram_user_id: int, messages: list) -> int:
+    """
+    Appends messages to the customer's archive as one gzip member. Messages up to and including the newest
+    one already archived are skipped (re-trim after a crash). Returns how many of `messages` are now archived.
+    """
+    if not messages: return 0
+    path = get_archive_filepath(telegram_user_id)
+    with _archive_lock:
+        last_key = _last_archived_key(telegram_user_id)
+        keys = [_message_key(m) for m in messages]
+        already = next((i + 1 for i in range(len(keys) - 1, -1, -1) if keys[i] == last_key), 0) if last_key else 0
+        if already: logger.info(f"Customer {telegram_user_id}: {already} message(s) were already archived; skipping them.")
+        fresh = messages[already:]
+        if fresh:
+            payload = "".join(json.dumps(m, ensure_ascii=False) + "\n" for m in fresh).encode("utf-8")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "ab") as f:
+                f.write(gzip.compress(payload, compresslevel=6))
+                f.flush()
+                os.fsync(f.fileno())
+            _remember_last_key(telegram_user_id, keys[-1])
+    return len(messages)
+
+
+def iter_archived_messages(telegram_user_id: int):
+    """Yields archived messages oldest first. A torn final member (crash mid-append) ends iteration."""
+    path = get_archive_filepath(telegram_user_id)
+    if not os.path.exists(path): return
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip(): continue
+                try: yield json.loads(line)
+                except ValueError: continue
+    except (EOFError, OSError) as e_read:
+        logger.warning(f"Archive '{path}' ends with an unreadable member: {e_read}")
+
+
+def search_archive(telegram_user_id: int, text_query: str = None, sender: str = None,
+                   since_iso: str = None, until_iso: str = None, limit: int = 50, any_terms=None) -> list:
+    """
+    Archived messages matching all given filters (case-insensitive substring, sender, ISO time range, and at
+    least one of any_terms if given). Returns the last `limit` matches, newest last.
+    """
+    query = text_query.lower() if text_query else None
+    terms = [t.lower() for t in any_terms or () if t]
+    if any_terms is not None and not terms: return []
+    matches = []
+    for msg in iter_archived_messages(telegram_user_id):
+        if sender and msg.get("sender") != sender: continue
+        ts = msg.get("timestamp") or ""
+        if since_iso and ts < since_iso: continue
+        if until_iso and ts > until_iso: continue
+        text = _message_text(msg).lower()
+        if query and query not in text: continue
+        if terms and not any(t in text for t in terms): continue
+        matches.append(msg)
+        if limit and len(matches) > limit: matches.pop(0)
+    return matches
+
+
+def archive_matches_for_request(telegram_user_id: int, request_text: str, limit: int = None) -> list:
+    """Archived messages of a customer that share a word (4+ letters) with an admin request. [] when nothing is archived."""
+    if not os.path.exists(get_archive_filepath(telegram_user_id)): return []
+    terms = sorted(set(_QUERY_TERM_RE.findall((request_text or "").lower())))
+    limit = config.CUSTOMER_HISTORY_ARCHIVE_PROMPT_MATCHES if limit is None else limit
+    return search_archive(telegram_user_id, any_terms=terms, limit=limit) if terms and limit > 0 else []
+
+
+def _summarize_messages(previous_summary: str, messages: list) -> str:
+    """Heuristic rolling summary: one clipped line per archived message, oldest lines dropped past the size cap."""
+    lines = [ln for ln in (previous_summary or "").split("\n") if ln]
+    for msg in messages:
+        text = " ".join(_message_text(msg).split())
+        if not text: continue
+        day = (msg.get("timestamp") or "")[:10]
+        clip = text if len(text) <= 120 else text[:117] + "..."
+        lines.append(f"{day} {msg.get('sender', '?')}: {clip}".strip())
+    summary = "\n".join(lines)
+    max_chars = config.CUSTOMER_HISTORY_SUMMARY_MAX_CHARS
+    if len(summary) > max_chars:
+        summary = summary[-max_chars:]
+        summary = summary[summary.find("\n") + 1:] if "\n" in summary else summary # Drop the cut line
+    return summary
+
+
+def apply_history_window(telegram_user_id: int, customer_state: dict) -> int:
+    """
+    Trims customer_state["chat_history"] in place to the window once it overflows by a batch.
+    Archives the removed messages and folds them into customer_state["history_summary"]. Returns the number archived.
+    """
+    history = customer_state.get("chat_history")
+    window = config.CUSTOMER_HISTORY_WINDOW_MESSAGES
+    if not isinstance(history, list) or window <= 0 or len(history) <= window + config.CUSTOMER_HISTORY_ARCHIVE_BATCH:
+        return 0
+    older, recent = history[:-window], history[-window:]
+    try:
+        archived = archive_messages(telegram_user_id, older)
+    except OSError as e_archive:
+        logger.error(f"Could not archive chat history for customer {telegram_user_id}; keeping it live: {e_archive}", exc_info=True)
+        return 0
+    customer_state["chat_history"] = recent
+    customer_state["history_summary"] = _summarize_messages(customer_state.get("history_summary", ""), older)
+    customer_state["archived_message_count"] = int(customer_state.get("archived_message_count") or 0) + archived
+    customer_state["history_archived_at"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    logger.info(f"Archived {archived} chat message(s) for customer {telegram_user_id}; {len(recent)} kept live.")
+    return archived
@@ -1,16 +1,116 @@
 # utils/customer_llm_processor.py
-import json
-import asyncio
-import threading # For type hint
+import threading
 
 import config
 from logger import get_logger
+from .versioned_state import get_app_state
+from . import json_codec
+from . import state_patch
 
 logger = get_logger("Iri-shka_App.utils.CustomerLLMProcessor")
 
+def _queue_telegram_text(telegram_bot_handler_instance_ref, user_id: int, text: str, what: str):
+    """Hands the text to the bot's outbox (rate limited, retried) without waiting for the send."""
+    future = telegram_bot_handler_instance_ref.queue_text_message(user_id, text)
+    future.add_done_callback(lambda f: f.exception() and logger.error(f"Failed to send {what} via Telegram: {f.exception()}"))
+
+def _append_admin_turn(turn: dict, state_manager_module_ref, gui_callbacks):
+    """Publishes a new state version with `turn` appended to the admin chat, persists it and refreshes the chat view."""
+    published_snapshot = get_app_state().update(
+        lambda snapshot: {"chat_history": (snapshot.chat_history + [turn])[-config.MAX_HISTORY_TURNS:]})
+    state_manager_module_ref.save_app_state(gui_callbacks) # After the swap, outside any state lock
+    if gui_callbacks and callable(gui_callbacks.get('update_chat_display_from_list')): gui_callbacks['update_chat_display_from_list'](published_snapshot.chat_history)
+
+def _set_customer_stage(customer_user_id: int, stage: str, read_state: dict, state_manager_module_ref, gui_callbacks):
+    """Sets the stage on the customer's current state (messages saved meanwhile are kept)."""
+    def _with_stage(current_state: dict) -> dict:
+        current_state["conversation_stage"] = stage
+        return current_state
+    state_manager_module_ref.update_customer_state(customer_user_id, _with_stage, read_state=read_state, gui_callbacks=gui_callbacks)
+
+def _load_customer_package(customer_user_id: int, state_manager_module_ref, gui_callbacks, function_signature_for_log: str):
+    """(customer_state, interaction_text_blob) for a customer awaiting the LLM, or None if there is nothing to process."""
+    customer_state_obj = state_manager_module_ref.load_or_initialize_customer_state(customer_user_id, gui_callbacks)
+    current_stage = customer_state_obj.get("conversation_stage")
+    if current_stage not in ["aggregating_messages", "acknowledged_pending_llm"]: 
+        logger.warning(f"CUSTOMER_LLM_THREAD: {function_signature_for_log} - Customer not in expected stage ('{current_stage}'). Skipping."); return None
+
+    interaction_blob_parts = []
+    for msg_entry in customer_state_obj.get("chat_history", []): # Windowed; older turns are in history_summary
+        msg_text = msg_entry.get("message", msg_entry.get("text"))
+        if msg_entry.get("sender") == "bot": interaction_blob_parts.append(f"Bot: {msg_text}")
+        elif msg_entry.get("sender") == "customer": interaction_blob_parts.append(f"Customer ({customer_user_id}): {msg_text}")
+    customer_interaction_text_blob_for_prompt = "\n".join(interaction_blob_parts)
+    if customer_interaction_text_blob_for_prompt and customer_state_obj.get("history_summary"):
+        customer_interaction_text_blob_for_prompt = f"[Earlier conversation, summarized]\n{customer_state_obj['history_summary']}\n[Recent messages]\n{customer_interaction_text_blob_for_prompt}"
+    if not customer_interaction_text_blob_for_prompt: 
+        logger.warning(f"CUSTOMER_LLM_THREAD: {function_signature_for_log} - No interaction text. Cannot proceed.")
+        _set_customer_stage(customer_user_id, "error_no_history_for_llm", customer_state_obj, state_manager_module_ref, gui_callbacks)
+        return None
+    return customer_state_obj, customer_interaction_text_blob_for_prompt
+
+
+def _apply_customer_llm_result(
+    customer_user_id: int, customer_state_obj: dict, ollama_data_cust: dict, gui_callbacks: dict,
+    telegram_bot_handler_instance_ref, state_manager_module_ref, tts_manager_module_ref,
+    telegram_messaging_utils_module_ref, function_signature_for_log: str
+    ):
+    """Saves one customer's LLM result (states, calendar conflicts) and sends the admin summary and customer follow-up."""
+    message_for_admin_from_llm = ollama_data_cust.get("message_for_admin")
+    polite_followup_for_customer_from_llm = ollama_data_cust.get("polite_followup_message_for_customer")
+
+    calendar_conflicts = []
+    def _apply_llm_update(current_state: dict):
+        # Patch ops or full documents, validated against the schemas (utils/state_patch.py). Applied to the state as
+        # it is now: the customer may have written while the LLM ran (customer_state_obj is what the prompt saw).
+        updated_state = state_patch.resolve_state_update(
+            current_state, ollama_data_cust, "customer_state", "updated_customer_state", "customer_state_patch",
+            context=f"CUSTOMER_LLM_THREAD ({function_signature_for_log}) customer state")
+        if updated_state:
+            calendar_conflicts.extend(state_manager_module_ref.preview_calendar_conflicts(customer_user_id, updated_state.get("calendar_events", [])))
+        return updated_state or None
+    if state_manager_module_ref.update_customer_state(customer_user_id, _apply_llm_update, read_state=customer_state_obj, gui_callbacks=gui_callbacks):
+        if calendar_conflicts: # Surface double-bookings to the admin along with the summary
+            conflicts_note = "Calendar conflicts:\n" + "\n".join(f"- {c}" for c in calendar_conflicts)
+            message_for_admin_from_llm = f"{message_for_admin_from_llm}\n{conflicts_note}" if message_for_admin_from_llm else conflicts_note
+
+    if ollama_data_cust.get("assistant_state_patch") or ollama_data_cust.get("updated_assistant_state"):
+        def _with_assistant_update(snapshot):
+            merged_assistant_state = state_patch.resolve_state_update(
+                snapshot.assistant_state, ollama_data_cust, "assistant_state", "updated_assistant_state", "assistant_state_patch",
+                context=f"CUSTOMER_LLM_THREAD ({function_signature_for_log}) assistant state")
+            return {"assistant_state": merged_assistant_state} if merged_assistant_state is not None else None
+        published_snapshot = get_app_state().update(_with_assistant_update)
+        if published_snapshot is not None: state_manager_module_ref.save_app_state(gui_callbacks)
+
+        if gui_callbacks and published_snapshot is not None:
+            asst_tasks_cust = published_snapshot.assistant_state.get("internal_tasks", {});
+            if not isinstance(asst_tasks_cust, dict): asst_tasks_cust = {"pending": [], "completed": []}
+            if callable(gui_callbacks.get('update_kanban_pending')): 
+                gui_callbacks['update_kanban_pending'](asst_tasks_cust.get("pending", []))
+            # update_kanban_in_process removed
+            if callable(gui_callbacks.get('update_kanban_completed')): 
+                gui_callbacks['update_kanban_completed'](asst_tasks_cust.get("completed", []))
+
+    if message_for_admin_from_llm: 
+        admin_summary_text = f"[Сводка по клиенту {customer_user_id}] {message_for_admin_from_llm}"
+        admin_chat_turn_cust_summary = {"user": f"[Sys Report: Cust Interaction ID {customer_user_id}]", "assistant": admin_summary_text, "source": "customer_summary_internal", "timestamp": state_manager_module_ref.get_current_timestamp_iso()}
+        _append_admin_turn(admin_chat_turn_cust_summary, state_manager_module_ref, gui_callbacks)
+        if telegram_bot_handler_instance_ref and config.TELEGRAM_ADMIN_USER_ID: 
+            _queue_telegram_text(telegram_bot_handler_instance_ref, int(config.TELEGRAM_ADMIN_USER_ID), admin_summary_text, f"customer summary for {customer_user_id} to admin")
+
+    if polite_followup_for_customer_from_llm and polite_followup_for_customer_from_llm.upper() != "NO_CUSTOMER_FOLLOWUP_NEEDED":
+        if telegram_bot_handler_instance_ref:
+            try:
+                _queue_telegram_text(telegram_bot_handler_instance_ref, customer_user_id, polite_followup_for_customer_from_llm, f"polite follow-up to customer {customer_user_id}")
+                if config.TELEGRAM_REPLY_WITH_VOICE: 
+                    customer_bark_preset = config.BARK_VOICE_PRESET_RU 
+                    telegram_messaging_utils_module_ref.send_voice_reply_to_telegram_user(customer_user_id, polite_followup_for_customer_from_llm, customer_bark_preset, telegram_bot_handler_instance_ref, tts_manager_module_ref)
+            except Exception as e_tg_send_followup: logger.error(f"Failed to send polite follow-up to customer {customer_user_id}: {e_tg_send_followup}")
+
+
 def handle_customer_interaction_package(
-    customer_user_id: int, chat_history_ref: list, user_state_ref: dict, assistant_state_ref: dict,
-    global_states_lock_ref: threading.Lock, gui_callbacks: dict,
+    customer_user_id: int, gui_callbacks: dict,
     telegram_bot_handler_instance_ref, state_manager_module_ref,
     ollama_handler_module_ref, tts_manager_module_ref,
     telegram_messaging_utils_module_ref
@@ -21,123 +121,213 @@ def handle_customer_interaction_package(
     if gui_callbacks and callable(gui_callbacks.get('act_status_update')):
         gui_callbacks['act_status_update']("ACT: BUSY", "busy")
     try:
-        customer_state_obj = state_manager_module_ref.load_or_initialize_customer_state(customer_user_id, gui_callbacks)
-        current_stage = customer_state_obj.get("conversation_stage")
-        if current_stage not in ["aggregating_messages", "acknowledged_pending_llm"]: 
-            logger.warning(f"CUSTOMER_LLM_THREAD: {function_signature_for_log} - Customer not in expected stage ('{current_stage}'). Skipping."); return
-
-        interaction_blob_parts = []
-        for msg_entry in customer_state_obj.get("chat_history", []):
-            if msg_entry.get("sender") == "bot": interaction_blob_parts.append(f"Bot: {msg_entry.get('text')}")
-            elif msg_entry.get("sender") == "customer": interaction_blob_parts.append(f"Customer ({customer_user_id}): {msg_entry.get('text')}")
-        customer_interaction_text_blob_for_prompt = "\n".join(interaction_blob_parts)
-        if not customer_interaction_text_blob_for_prompt: 
-            logger.warning(f"CUSTOMER_LLM_THREAD: {function_signature_for_log} - No interaction text. Cannot proceed.")
-            customer_state_obj["conversation_stage"] = "error_no_history_for_llm"; state_manager_module_ref.save_customer_state(customer_user_id, customer_state_obj, gui_callbacks); return
-
-        with global_states_lock_ref: assistant_state_snapshot_for_customer_llm = assistant_state_ref.copy()
+        package = _load_customer_package(customer_user_id, state_manager_module_ref, gui_callbacks, function_signature_for_log)
+        if package is None: return
+        customer_state_obj, customer_interaction_text_blob_for_prompt = package
+
+        assistant_state_snapshot_for_customer_llm = get_app_state().current().assistant_state.copy() # Lock-free snapshot read
         admin_name_for_customer_prompt = assistant_state_snapshot_for_customer_llm.get("admin_name", config.DEFAULT_ASSISTANT_STATE["admin_name"])
 
-        format_kwargs_customer = { 
+        format_kwargs_customer = {
             "admin_name_value": admin_name_for_customer_prompt,
             "actual_thanks_and_forwarded_message_value": config.TELEGRAM_NON_ADMIN_THANKS_AND_FORWARDED,
             "customer_user_id": str(customer_user_id),
-            "customer_state_string": json.dumps(customer_state_obj, indent=2, ensure_ascii=False),
+            "customer_state_string": json_codec.dumps(customer_state_obj, indent=2),
             "customer_interaction_text_blob": customer_interaction_text_blob_for_prompt,
         }
-        expected_keys_customer = ["updated_customer_state", "updated_assistant_state", "message_for_admin", "polite_followup_message_for_customer"]
+        expected_keys_customer = state_patch.customer_response_keys()
 
         ollama_data_cust, ollama_error_cust = ollama_handler_module_ref.call_ollama_for_chat_response(
-            prompt_template_to_use=config.OLLAMA_CUSTOMER_PROMPT_TEMPLATE_V3, transcribed_text="", current_chat_history=[],
+            prompt_template_to_use=state_patch.customer_prompt_template(), transcribed_text="", current_chat_history=[],
             current_user_state=customer_state_obj, current_assistant_state=assistant_state_snapshot_for_customer_llm,
-            format_kwargs=format_kwargs_customer, expected_keys_override=expected_keys_customer, gui_callbacks=gui_callbacks)
+            format_kwargs=format_kwargs_customer, expected_keys_override=expected_keys_customer, gui_callbacks=gui_callbacks,
+            stats_label=f"customer/{config.LLM_STATE_UPDATE_MODE}")
 
         if ollama_error_cust: 
             logger.error(f"CUSTOMER_LLM_THREAD: {function_signature_for_log} - Ollama error: {ollama_error_cust}")
-            customer_state_obj["conversation_stage"] = "error_llm_processing"; state_manager_module_ref.save_customer_state(customer_user_id, customer_state_obj, gui_callbacks)
+            _set_customer_stage(customer_user_id, "error_llm_processing", customer_state_obj, state_manager_module_ref, gui_callbacks)
             error_admin_msg = f"{config.TELEGRAM_NON_ADMIN_PROCESSING_ERROR_TO_ADMIN_PREFIX} {customer_user_id}: {ollama_error_cust}"
-            with global_states_lock_ref: 
-                admin_chat_turn = {"user": f"[Sys Alert: Cust LLM Err ID {customer_user_id}]", "assistant": error_admin_msg, "source": "customer_llm_error_internal", "timestamp": state_manager_module_ref.get_current_timestamp_iso()}
-                chat_history_ref.append(admin_chat_turn)
-                updated_chat_hist = state_manager_module_ref.save_states(chat_history_ref, user_state_ref, assistant_state_ref, gui_callbacks)
-                if len(chat_history_ref) != len(updated_chat_hist): chat_history_ref[:] = updated_chat_hist
-                if gui_callbacks and callable(gui_callbacks.get('update_chat_display_from_list')): gui_callbacks['update_chat_display_from_list'](chat_history_ref)
+            admin_chat_turn = {"user": f"[Sys Alert: Cust LLM Err ID {customer_user_id}]", "assistant": error_admin_msg, "source": "customer_llm_error_internal", "timestamp": state_manager_module_ref.get_current_timestamp_iso()}
+            _append_admin_turn(admin_chat_turn, state_manager_module_ref, gui_callbacks)
             if telegram_bot_handler_instance_ref and config.TELEGRAM_ADMIN_USER_ID: 
-                try: asyncio.run_coroutine_threadsafe(telegram_bot_handler_instance_ref.send_text_message_to_user(int(config.TELEGRAM_ADMIN_USER_ID), error_admin_msg), telegram_bot_handler_instance_ref.async_loop).result(timeout=10)
-                except Exception as e_tg_send_err: logger.error(f"Failed to send customer LLM error alert to admin TG: {e_tg_send_err}")
+                _queue_telegram_text(telegram_bot_handler_instance_ref, int(config.TELEGRAM_ADMIN_USER_ID), error_admin_msg, "customer LLM error alert to admin")
             return 
 
-        updated_customer_state_from_llm = ollama_data_cust.get("updated_customer_state") 
-        updated_assistant_state_changes_from_llm = ollama_data_cust.get("updated_assistant_state")
-        message_for_admin_from_llm = ollama_data_cust.get("message_for_admin")
-        polite_followup_for_customer_from_llm = ollama_data_cust.get("polite_followup_message_for_customer")
-
-        if updated_customer_state_from_llm: state_manager_module_ref.save_customer_state(customer_user_id, updated_customer_state_from_llm, gui_callbacks)
-        
-        if updated_assistant_state_changes_from_llm: 
-            with global_states_lock_ref:
-                temp_as_copy = assistant_state_ref.copy()
-                
-                # Handle internal_tasks: pending and completed only
-                if "internal_tasks" in updated_assistant_state_changes_from_llm and isinstance(updated_assistant_state_changes_from_llm["internal_tasks"], dict):
-                    llm_tasks_dict = updated_assistant_state_changes_from_llm["internal_tasks"]
-                    
-                    if "internal_tasks" not in temp_as_copy or not isinstance(temp_as_copy.get("internal_tasks"), dict):
-                        temp_as_copy["internal_tasks"] = {"pending": [], "completed": []}
-                    
-                    for task_type in ["pending", "completed"]: # Only process these two
-                        if task_type not in temp_as_copy["internal_tasks"] or not isinstance(temp_as_copy["internal_tasks"].get(task_type), list):
-                            temp_as_copy["internal_tasks"][task_type] = []
-                        
-                        new_tasks_from_llm = llm_tasks_dict.get(task_type, [])
-                        if not isinstance(new_tasks_from_llm, list): 
-                            new_tasks_from_llm = [str(new_tasks_from_llm)] if new_tasks_from_llm else []
-                        
-                        existing_tasks_in_merged = temp_as_copy["internal_tasks"][task_type]
-                        temp_as_copy["internal_tasks"][task_type] = list(dict.fromkeys(
-                            [str(t) for t in existing_tasks_in_merged] + [str(t) for t in new_tasks_from_llm]
-                        ))
-                    if "in_process" in llm_tasks_dict:
-                         logger.warning(f"CUSTOMER_LLM_THREAD ({function_signature_for_log}): LLM provided 'in_process' tasks. This key is now ignored. Tasks: {llm_tasks_dict['in_process']}")
-                
-                # Update other assistant state keys
-                for key, val_llm in updated_assistant_state_changes_from_llm.items():
-                    if key != "internal_tasks": 
-                        temp_as_copy[key] = val_llm
-                        
-                assistant_state_ref.clear(); assistant_state_ref.update(temp_as_copy)
-                state_manager_module_ref.save_assistant_state_only(assistant_state_ref.copy(), gui_callbacks)
-                
-                if gui_callbacks:
-                    asst_tasks_cust = assistant_state_ref.get("internal_tasks", {});
-                    if not isinstance(asst_tasks_cust, dict): asst_tasks_cust = {"pending": [], "completed": []}
-                    if callable(gui_callbacks.get('update_kanban_pending')): 
-                        gui_callbacks['update_kanban_pending'](asst_tasks_cust.get("pending", []))
-                    # update_kanban_in_process removed
-                    if callable(gui_callbacks.get('update_kanban_completed')): 
-                        gui_callbacks['update_kanban_completed'](asst_tasks_cust.get("completed", []))
-
-        if message_for_admin_from_llm: 
-            admin_summary_text = f"[Сводка по клиенту {customer_user_id}] {message_for_admin_from_llm}"
-            with global_states_lock_ref: 
-                admin_chat_turn_cust_summary = {"user": f"[Sys Report: Cust Interaction ID {customer_user_id}]", "assistant": admin_summary_text, "source": "customer_summary_internal", "timestamp": state_manager_module_ref.get_current_timestamp_iso()}
-                chat_history_ref.append(admin_chat_turn_cust_summary)
-                updated_chat_hist_admin = state_manager_module_ref.save_states(chat_history_ref, user_state_ref, assistant_state_ref, gui_callbacks)
-                if len(chat_history_ref) != len(updated_chat_hist_admin): chat_history_ref[:] = updated_chat_hist_admin
-                if gui_callbacks and callable(gui_callbacks.get('update_chat_display_from_list')): gui_callbacks['update_chat_display_from_list'](chat_history_ref)
-            if telegram_bot_handler_instance_ref and config.TELEGRAM_ADMIN_USER_ID: 
-                try: asyncio.run_coroutine_threadsafe(telegram_bot_handler_instance_ref.send_text_message_to_user(int(config.TELEGRAM_ADMIN_USER_ID), admin_summary_text), telegram_bot_handler_instance_ref.async_loop).result(timeout=10)
-                except Exception as e_tg_send_summary: logger.error(f"Failed to send customer summary to admin TG for {customer_user_id}: {e_tg_send_summary}")
-
-        if polite_followup_for_customer_from_llm and polite_followup_for_customer_from_llm.upper() != "NO_CUSTOMER_FOLLOWUP_NEEDED":
-            if telegram_bot_handler_instance_ref:
-                try:
-                    asyncio.run_coroutine_threadsafe(telegram_bot_handler_instance_ref.send_text_message_to_user(customer_user_id, polite_followup_for_customer_from_llm), telegram_bot_handler_instance_ref.async_loop).result(timeout=10)
-                    if config.TELEGRAM_REPLY_WITH_VOICE: 
-                        customer_bark_preset = config.BARK_VOICE_PRESET_RU 
-                        telegram_messaging_utils_module_ref.send_voice_reply_to_telegram_user(customer_user_id, polite_followup_for_customer_from_llm, customer_bark_preset, telegram_bot_handler_instance_ref, tts_manager_module_ref)
-                except Exception as e_tg_send_followup: logger.error(f"Failed to send polite follow-up to customer {customer_user_id}: {e_tg_send_followup}")
+        _apply_customer_llm_result(
+            customer_user_id, customer_state_obj, ollama_data_cust, gui_callbacks, telegram_bot_handler_instance_ref, state_manager_module_ref,
+            tts_manager_module_ref, telegram_messaging_utils_module_ref, function_signature_for_log)
     finally:
         if gui_callbacks and callable(gui_callbacks.get('act_status_update')):
             gui_callbacks['act_status_update']("ACT: IDLE", "idle")
-        logger.info(f"CUSTOMER_LLM_THREAD: {function_signature_for_log} - Processing finished.")
\ No newline at end of file
+        logger.info(f"CUSTOMER_LLM_THREAD: {function_signature_for_log} - Processing finished.")
+
+# --- Batched customer packages (config.CUSTOMER_LLM_BATCH_SIZE > 1) ---
+BATCH_RESULT_KEYS = state_patch.CUSTOMER_RESPONSE_KEYS["patch"]
+
+def build_batch_format_kwargs(packages: list, admin_name: str) -> dict:
+    """Prompt values for OLLAMA_CUSTOMER_BATCH_PROMPT_TEMPLATE; packages are (customer_user_id, customer_state, interaction_text_blob)."""
+    sections = [config.OLLAMA_CUSTOMER_BATCH_SECTION_TEMPLATE.format(
+                    index=i, customer_count=len(packages), customer_user_id=customer_user_id,
+                    customer_state_string=json_codec.dumps(customer_state, indent=2), customer_interaction_text_blob=blob)
+                for i, (customer_user_id, customer_state, blob) in enumerate(packages, start=1)]
+    return {
+        "admin_name_value": admin_name,
+        "actual_thanks_and_forwarded_message_value": config.TELEGRAM_NON_ADMIN_THANKS_AND_FORWARDED,
+        "customer_count": len(packages),
+        "customer_sections": "\n".join(sections),
+    }
+
+def split_batch_results(ollama_data: dict, customer_user_ids) -> dict:
+    """{customer_user_id: result} for the well-formed per-customer entries of a batch response. Others are left out."""
+    results = ollama_data.get("results") if isinstance(ollama_data, dict) else None
+    if not isinstance(results, list): return {}
+    wanted, by_id, duplicated = set(customer_user_ids), {}, set()
+    for entry in results:
+        if not isinstance(entry, dict): continue
+        try: customer_user_id = int(str(entry.get("customer_user_id")).strip())
+        except ValueError: continue
+        missing = [k for k in BATCH_RESULT_KEYS if k not in entry]
+        if customer_user_id not in wanted or missing:
+            logger.warning(f"Batch result for customer {customer_user_id} rejected (unexpected id or missing keys {missing}).")
+            continue
+        if customer_user_id in by_id: duplicated.add(customer_user_id)
+        by_id[customer_user_id] = entry
+    for customer_user_id in duplicated: # Ambiguous; the per-customer fallback decides
+        del by_id[customer_user_id]
+    return by_id
+
+def request_customer_batch(packages: list, ollama_handler_module_ref, gui_callbacks=None):
+    """One LLM call for all packages. Returns ({customer_user_id: result}, error_message_or_None)."""
+    assistant_state_snapshot = get_app_state().current().assistant_state.copy()
+    admin_name = assistant_state_snapshot.get("admin_name", config.DEFAULT_ASSISTANT_STATE["admin_name"])
+    ollama_data, ollama_error = ollama_handler_module_ref.call_ollama_for_chat_response(
+        prompt_template_to_use=config.OLLAMA_CUSTOMER_BATCH_PROMPT_TEMPLATE, transcribed_text="", current_chat_history=[],
+        current_user_state={}, current_assistant_state=assistant_state_snapshot,
+        format_kwargs=build_batch_format_kwargs(packages, admin_name), expected_keys_override=["results"],
+        gui_callbacks=gui_callbacks, stats_label=f"customer_batch/{len(packages)}")
+    if ollama_error: return {}, ollama_error
+    return split_batch_results(ollama_data, [p[0] for p in packages]), None
+
+def handle_customer_interaction_batch(
+    customer_user_ids: list, gui_callbacks: dict,
+    telegram_bot_handler_instance_ref, state_manager_module_ref,
+    ollama_handler_module_ref, tts_manager_module_ref,
+    telegram_messaging_utils_module_ref
+    ):
+    """
+    Processes several customers' packages with one LLM call. Customers whose result is missing or malformed
+    (or all of them, if the call fails) are processed again one by one with handle_customer_interaction_package.
+    """
+    customer_user_ids = list(dict.fromkeys(customer_user_ids))
+    refs = dict(gui_callbacks=gui_callbacks,
+                telegram_bot_handler_instance_ref=telegram_bot_handler_instance_ref, state_manager_module_ref=state_manager_module_ref,
+                ollama_handler_module_ref=ollama_handler_module_ref, tts_manager_module_ref=tts_manager_module_ref,
+                telegram_messaging_utils_module_ref=telegram_messaging_utils_module_ref)
+    function_signature_for_log = f"handle_customer_interaction_batch(cust_ids={customer_user_ids})"
+    fallback_ids = customer_user_ids if len(customer_user_ids) <= 1 else []
+    if not fallback_ids:
+        logger.info(f"CUSTOMER_LLM_THREAD: {function_signature_for_log} - Starting batched processing.")
+        if gui_callbacks and callable(gui_callbacks.get('act_status_update')):
+            gui_callbacks['act_status_update']("ACT: BUSY", "busy")
+        try:
+            packages = []
+            for customer_user_id in customer_user_ids:
+                package = _load_customer_package(customer_user_id, state_manager_module_ref, gui_callbacks, f"{function_signature_for_log}/{customer_user_id}")
+                if package is not None: packages.append((customer_user_id, *package))
+            results = {}
+            if len(packages) > 1:
+                results, batch_error = request_customer_batch(packages, ollama_handler_module_ref, gui_callbacks)
+                if batch_error: logger.warning(f"CUSTOMER_LLM_THREAD: {function_signature_for_log} - Batch call failed ({batch_error}); falling back to per-customer calls.")
+            for customer_user_id, customer_state_obj, _blob in packages:
+                if customer_user_id not in results:
+                    fallback_ids.append(customer_user_id); continue
+                try:
+                    _apply_customer_llm_result(
+                        customer_user_id, customer_state_obj, results[customer_user_id], gui_callbacks, telegram_bot_handler_instance_ref,
+                        state_manager_module_ref, tts_manager_module_ref, telegram_messaging_utils_module_ref,
+                        f"{function_signature_for_log}/{customer_user_id}")
+                except Exception as e_apply:
+                    logger.error(f"CUSTOMER_LLM_THREAD: {function_signature_for_log} - Applying the result for customer {customer_user_id} failed: {e_apply}", exc_info=True)
+            logger.info(f"CUSTOMER_LLM_THREAD: {function_signature_for_log} - {len(results)}/{len(packages)} customer(s) handled by the batch call.")
+        finally:
+            if gui_callbacks and callable(gui_callbacks.get('act_status_update')):
+                gui_callbacks['act_status_update']("ACT: IDLE", "idle")
+    for customer_user_id in fallback_ids:
+        handle_customer_interaction_package(customer_user_id=customer_user_id, **refs)
+
+
+if __name__ == "__main__":
+    # Throughput at batch sizes K=1,2,4,8 against a fake Ollama. Like a single-GPU Ollama it serves one request at a
+    # time and takes prompt_tokens / PREFILL_TPS + output_tokens / GEN_TPS seconds (tokens ~ chars / 4), scaled by TIME_SCALE.
+    import http.server
+    import re
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    from . import ollama_handler
+
+    PREFILL_TPS, GEN_TPS, TIME_SCALE, N_CUSTOMERS = 1500.0, 40.0, 0.02, 16
+    gpu_lock = threading.Lock()
+
+    def fake_result(customer_user_id) -> dict:
+        return {"customer_state_patch": [{"op": "replace", "path": "intent", "value": "Запись на консультацию"},
+                                         {"op": "replace", "path": "conversation_stage", "value": "llm_followup_sent"}],
+                "assistant_state_patch": [{"op": "append", "path": "internal_tasks.pending",
+                                           "value": f"Сообщить о контакте от {customer_user_id} по поводу консультации"}],
+                "message_for_admin": f"Партнер, новый клиент {customer_user_id} хочет записаться на консультацию.",
+                "polite_followup_message_for_customer": "Спасибо! Мы скоро с вами свяжемся."}
+
+    class FakeOllamaHandler(http.server.BaseHTTPRequestHandler):
+        def do_POST(self):
+            prompt = json_codec.loads(self.rfile.read(int(self.headers["Content-Length"])))["prompt"]
+            batch_ids = re.findall(r"Telegram User ID (\d+) ===", prompt)
+            if batch_ids: output = {"results": [{"customer_user_id": cid, **fake_result(cid)} for cid in batch_ids]}
+            else: output = fake_result(re.search(r"Customer's Telegram User ID: (\d+)", prompt).group(1))
+            output_str = json_codec.dumps(output)
+            prompt_tokens, output_tokens = len(prompt) // 4, len(output_str) // 4
+            with gpu_lock: time.sleep((prompt_tokens / PREFILL_TPS + output_tokens / GEN_TPS) * TIME_SCALE)
+            body = json_codec.dumps_bytes({"response": output_str, "eval_count": output_tokens, "prompt_eval_count": prompt_tokens,
+                                           "eval_duration": int(output_tokens / GEN_TPS * 1e9)})
+            self.send_response(200); self.send_header("Content-Type", "application/json"); self.end_headers(); self.wfile.write(body)
+        def log_message(self, *args): pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FakeOllamaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    config.OLLAMA_API_URL = f"http://127.0.0.1:{server.server_address[1]}/api/generate"
+    config.LLM_STATE_UPDATE_MODE = "patch"
+
+    packages = []
+    for i in range(N_CUSTOMERS):
+        customer_user_id = 500000 + i
+        state = json_codec.schema_defaults(json_codec.CustomerStateSchema)
+        state.update({"user_id": customer_user_id, "conversation_stage": "aggregating_messages"})
+        blob = (f"Bot: {config.TELEGRAM_NON_ADMIN_GREETING}\nCustomer ({customer_user_id}): Здравствуйте, меня зовут Клиент {i}.\n"
+                f"Customer ({customer_user_id}): Хочу записаться на консультацию в четверг после обеда.")
+        packages.append((customer_user_id, state, blob))
+    admin_name = config.DEFAULT_ASSISTANT_STATE["admin_name"]
+
+    def run_single(package):
+        customer_user_id, state, blob = package
+        data, error = ollama_handler.call_ollama_for_chat_response(
+            prompt_template_to_use=state_patch.customer_prompt_template(), transcribed_text="", current_chat_history=[],
+            current_user_state=state, current_assistant_state=config.DEFAULT_ASSISTANT_STATE,
+            format_kwargs={"admin_name_value": admin_name, "actual_thanks_and_forwarded_message_value": config.TELEGRAM_NON_ADMIN_THANKS_AND_FORWARDED,
+                           "customer_user_id": str(customer_user_id), "customer_state_string": json_codec.dumps(state, indent=2),
+                           "customer_interaction_text_blob": blob},
+            expected_keys_override=state_patch.customer_response_keys(), stats_label="customer_batch/1")
+        return 0 if error else 1
+
+    def run_batch(batch):
+        results, error = request_customer_batch(batch, ollama_handler)
+        return len(results)
+
+    print(f"{N_CUSTOMERS} customers, fake Ollama: {PREFILL_TPS:.0f} prefill tok/s, {GEN_TPS:.0f} gen tok/s, time x{TIME_SCALE}")
+    for k in (1, 2, 4, 8):
+        batches = [packages[i:i + k] for i in range(0, N_CUSTOMERS, k)]
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=3) as pool: # LLM_TASK_THREAD_POOL_SIZE
+            handled = sum(pool.map(run_single if k == 1 else run_batch, [b[0] for b in batches] if k == 1 else batches))
+        elapsed = time.perf_counter() - t0
+        stats = ollama_handler.get_llm_eval_metrics().get(f"customer_batch/{k}", {})
+        print(f"K={k}: {handled}/{N_CUSTOMERS} handled, {N_CUSTOMERS / elapsed:.1f} customers/s, "
+              f"{stats.get('avg_prompt_eval_count', 0) * len(batches) / N_CUSTOMERS:.0f} prompt tokens/customer")
+    server.shutdown()
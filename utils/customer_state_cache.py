@@ -0,0 +1,155 @@
+# utils/customer_state_cache.py
+"""
+Bounded LRU cache of customer states plus per-customer locks.
+
+The cache owns one master copy per resident customer. get() hands out deep copies, so callers can
+mutate freely. put() stores a deep copy (write-through: state_manager then persists it).
+Read-modify-write sections for one customer are serialized with customer_lock(user_id) from threads,
+or `async with async_customer_lock(user_id)` from the Telegram event loop. Both halves of the pair use
+the same threading.Lock. The asyncio.Lock in front of it keeps coroutines for one customer queued in
+the loop, so only one of them can be waiting on the thread lock, and it does that wait in an executor.
+"""
+import asyncio
+import collections
+import contextlib
+import copy
+import threading
+import time
+
+import config
+from logger import get_logger
+
+logger = get_logger("Iri-shka_App.utils.CustomerStateCache")
+
+
+class _LockPair:
+    __slots__ = ("thread_lock", "async_lock")
+
+    def __init__(self):
+        self.thread_lock = threading.Lock()
+        self.async_lock = None # Created lazily inside the event loop
+
+
+class CustomerStateCache:
+    def __init__(self, capacity: int = None):
+        self.capacity = capacity if capacity is not None else config.CUSTOMER_STATE_CACHE_SIZE
+        self._entries = collections.OrderedDict() # user_id -> state dict (master copy)
+        self._locks = {} # user_id -> _LockPair
+        self._mutex = threading.Lock()
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock_acquisitions = 0
+        self.lock_contended = 0
+        self.lock_wait_total_s = 0.0
+        self.lock_wait_max_s = 0.0
+
+    # --- Cache ---
+    def get(self, user_id: int):
+        with self._mutex:
+            state = self._entries.get(user_id)
+            if state is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return copy.deepcopy(state)
+
+    def put(self, user_id: int, state: dict):
+        snapshot = copy.deepcopy(state)
+        with self._mutex:
+            self._entries[user_id] = snapshot
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.capacity:
+                evicted_id, _ = self._entries.popitem(last=False)
+                self.evictions += 1
+                pair = self._locks.get(evicted_id)
+                if pair is not None and not pair.thread_lock.locked() and not (pair.async_lock and pair.async_lock.locked()):
+                    del self._locks[evicted_id]
+
+    def invalidate(self, user_id: int):
+        with self._mutex:
+            self._entries.pop(user_id, None)
+
+    # --- Per-customer locks ---
+    def _lock_pair(self, user_id: int) -> _LockPair:
+        with self._mutex:
+            pair = self._locks.get(user_id)
+            if pair is None:
+                pair = self._locks[user_id] = _LockPair()
+            return pair
+
+    def _record_acquire(self, waited_s: float, contended: bool):
+        with self._mutex:
+            self.lock_acquisitions += 1
+            if contended:
+                self.lock_contended += 1
+                self.lock_wait_total_s += waited_s
+                self.lock_wait_max_s = max(self.lock_wait_max_s, waited_s)
+
+    @contextlib.contextmanager
+    def customer_lock(self, user_id: int):
+        lock = self._lock_pair(user_id).thread_lock
+        if lock.acquire(blocking=False):
+            self._record_acquire(0.0, False)
+        else:
+            t0 = time.perf_counter()
+            lock.acquire()
+            self._record_acquire(time.perf_counter() - t0, True)
+        try:
+            yield
+        finally:
+            lock.release()
+
+    @contextlib.asynccontextmanager
+    async def async_customer_lock(self, user_id: int):
+        pair = self._lock_pair(user_id)
+        if pair.async_lock is None:
+            with self._mutex:
+                if pair.async_lock is None: pair.async_lock = asyncio.Lock()
+        t0 = time.perf_counter()
+        contended = pair.async_lock.locked()
+        async with pair.async_lock:
+            if not pair.thread_lock.acquire(blocking=False):
+                contended = True # Held by a worker thread: wait off the event loop
+                acquire_future = asyncio.get_running_loop().run_in_executor(None, pair.thread_lock.acquire)
+                try:
+                    await asyncio.shield(acquire_future)
+                except asyncio.CancelledError: # The executor will still get the lock; hand it back
+                    acquire_future.add_done_callback(lambda _f: pair.thread_lock.release())
+                    raise
+            self._record_acquire(time.perf_counter() - t0 if contended else 0.0, contended)
+            try:
+                yield
+            finally:
+                pair.thread_lock.release()
+
+    def get_metrics(self) -> dict:
+        with self._mutex:
+            lookups = self.hits + self.misses
+            return {
+                "resident": len(self._entries),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "lock_acquisitions": self.lock_acquisitions,
+                "lock_contended": self.lock_contended,
+                "lock_contention_rate": (self.lock_contended / self.lock_acquisitions) if self.lock_acquisitions else 0.0,
+                "lock_wait_avg_ms": (self.lock_wait_total_s / self.lock_contended * 1000) if self.lock_contended else 0.0,
+                "lock_wait_max_ms": self.lock_wait_max_s * 1000,
+            }
+
+
+_cache: CustomerStateCache = None # type: ignore
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> CustomerStateCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = CustomerStateCache()
+        return _cache
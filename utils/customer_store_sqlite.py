@@ -0,0 +1,219 @@
+# utils/customer_store_sqlite.py
+"""
+Optional SQLite (WAL) backend for customer states (config.CUSTOMER_STATE_BACKEND = "sqlite").
+
+- customers: one row per Telegram user. Indexed columns: conversation_stage, last_message_timestamp, name.
+  Everything else in the state dict (intent, calendar_events, ...) is kept in extra_json.
+- customer_chat_history: one row per turn. A save that only appends turns inserts just those rows.
+  The stored prefix is checked by hashing only its first and last turn (history_edge_digest), so an
+  append costs O(new turns). A rewritten history (/start reset, inserted greeting, trimmed front) changes
+  one of those edges and is rewritten in full without reading back the old rows. history_digest is the
+  chained digest of all turns, extended incrementally.
+- Turns and extra_json go through utils.json_codec (orjson/msgspec when installed). Digests depend on the
+  codec's exact bytes, so switching backend makes each customer's next save a one-time full rewrite.
+
+Migration from the JSON folder:  python -m utils.customer_store_sqlite migrate [--folder F] [--db D]
+"""
+import argparse
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import config
+from logger import get_logger
+from . import json_codec
+
+logger = get_logger("Iri-shka_App.utils.CustomerStoreSqlite")
+
+_INDEXED_FIELDS = ("name", "conversation_stage", "last_message_timestamp")
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS customers (
+    user_id INTEGER PRIMARY KEY,
+    name TEXT,
+    conversation_stage TEXT,
+    last_message_timestamp TEXT,
+    extra_json TEXT NOT NULL DEFAULT '{}',
+    history_len INTEGER NOT NULL DEFAULT 0,
+    history_digest TEXT NOT NULL DEFAULT '',
+    history_edge_digest TEXT NOT NULL DEFAULT '',
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_customers_stage ON customers(conversation_stage);
+CREATE INDEX IF NOT EXISTS idx_customers_last_msg ON customers(last_message_timestamp);
+CREATE INDEX IF NOT EXISTS idx_customers_name ON customers(name);
+CREATE TABLE IF NOT EXISTS customer_chat_history (
+    user_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    sender TEXT,
+    timestamp TEXT,
+    turn_json TEXT NOT NULL,
+    PRIMARY KEY (user_id, seq)
+) WITHOUT ROWID;
+"""
+
+
+def _turn_json(turn) -> str:
+    return json_codec.dumps(turn, sort_keys=True)
+
+
+def _chain_digest(previous_digest: str, turn_jsons) -> str:
+    digest = previous_digest
+    for tj in turn_jsons:
+        digest = hashlib.sha1((digest + tj).encode("utf-8")).hexdigest()
+    return digest
+
+
+def _edge_digest(history: list, length: int) -> str:
+    """Digest of the first and last turn of history[:length]; '' for an empty prefix."""
+    if length <= 0: return ""
+    return hashlib.sha1((_turn_json(history[0]) + "\x00" + _turn_json(history[length - 1])).encode("utf-8")).hexdigest()
+
+
+class SqliteCustomerStore:
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or config.CUSTOMER_STATE_DB_FILE
+        parent = os.path.dirname(self.db_path)
+        if parent: os.makedirs(parent, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL") # Durable at WAL checkpoints; no fsync per commit
+        self._conn.executescript(_SCHEMA)
+        columns = {r[1] for r in self._conn.execute("PRAGMA table_info(customers)")}
+        if "history_edge_digest" not in columns: # DB created before the column existed; each customer is rewritten once
+            self._conn.execute("ALTER TABLE customers ADD COLUMN history_edge_digest TEXT NOT NULL DEFAULT ''")
+        logger.info(f"SQLite customer store opened at '{self.db_path}' (WAL).")
+
+    # --- Single customer ---
+    def load(self, user_id: int):
+        """Returns the customer's state dict, or None if the customer is unknown."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT name, conversation_stage, last_message_timestamp, extra_json FROM customers WHERE user_id=?",
+                (user_id,)).fetchone()
+            if row is None: return None
+            turns = self._conn.execute(
+                "SELECT turn_json FROM customer_chat_history WHERE user_id=? ORDER BY seq", (user_id,)).fetchall()
+        state = json_codec.loads(row[3]) if row[3] else {}
+        state.update({"user_id": user_id, "name": row[0], "conversation_stage": row[1],
+                      "last_message_timestamp": row[2] if row[2] is not None else ""})
+        state["chat_history"] = [json_codec.loads(t[0]) for t in turns]
+        return state
+
+    def save(self, user_id: int, state: dict) -> bool:
+        history = state.get("chat_history") or []
+        extra = {k: v for k, v in state.items() if k not in _INDEXED_FIELDS and k not in ("chat_history", "user_id")}
+        with self._lock:
+            cur = self._conn.cursor()
+            try:
+                cur.execute("BEGIN IMMEDIATE")
+                stored = cur.execute("SELECT history_len, history_digest, history_edge_digest FROM customers WHERE user_id=?",
+                                     (user_id,)).fetchone()
+                stored_len, stored_digest, stored_edges = stored if stored else (0, "", "")
+                if stored and stored_len <= len(history) and _edge_digest(history, stored_len) == stored_edges:
+                    new_turns = [(seq, _turn_json(history[seq])) for seq in range(stored_len, len(history))]
+                    new_digest = _chain_digest(stored_digest, [tj for _, tj in new_turns])
+                else: # History was replaced or shortened: rewrite this customer's rows
+                    cur.execute("DELETE FROM customer_chat_history WHERE user_id=?", (user_id,))
+                    new_turns = [(seq, _turn_json(turn)) for seq, turn in enumerate(history)]
+                    new_digest = _chain_digest("", [tj for _, tj in new_turns])
+                if new_turns:
+                    cur.executemany(
+                        "INSERT INTO customer_chat_history (user_id, seq, sender, timestamp, turn_json) VALUES (?, ?, ?, ?, ?)",
+                        [(user_id, seq, history[seq].get("sender") if isinstance(history[seq], dict) else None,
+                          history[seq].get("timestamp") if isinstance(history[seq], dict) else None, tj)
+                         for seq, tj in new_turns])
+                cur.execute(
+                    "INSERT INTO customers (user_id, name, conversation_stage, last_message_timestamp, extra_json, history_len, history_digest, "
+                    "history_edge_digest, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(user_id) DO UPDATE SET name=excluded.name, "
+                    "conversation_stage=excluded.conversation_stage, last_message_timestamp=excluded.last_message_timestamp, "
+                    "extra_json=excluded.extra_json, history_len=excluded.history_len, history_digest=excluded.history_digest, "
+                    "history_edge_digest=excluded.history_edge_digest, updated_at=excluded.updated_at",
+                    (user_id, state.get("name"), state.get("conversation_stage"), state.get("last_message_timestamp") or "",
+                     json_codec.dumps(extra), len(history), new_digest, _edge_digest(history, len(history)), time.time()))
+                cur.execute("COMMIT")
+                return True
+            except sqlite3.Error as e_db:
+                try: cur.execute("ROLLBACK")
+                except sqlite3.Error: pass
+                logger.error(f"SQLite save failed for customer {user_id}: {e_db}", exc_info=True)
+                return False
+
+    # --- Indexed queries ---
+    def find_ids_by_stage(self, stage: str) -> list:
+        with self._lock:
+            return [r[0] for r in self._conn.execute("SELECT user_id FROM customers WHERE conversation_stage=?", (stage,))]
+
+    def find_ids_active_since(self, iso_timestamp: str) -> list:
+        """Customers whose last_message_timestamp >= iso_timestamp (UTC ISO strings compare lexicographically)."""
+        with self._lock:
+            return [r[0] for r in self._conn.execute(
+                "SELECT user_id FROM customers WHERE last_message_timestamp >= ? AND last_message_timestamp != '' "
+                "ORDER BY last_message_timestamp DESC", (iso_timestamp,))]
+
+    def find_ids_by_name(self, name: str) -> list:
+        with self._lock:
+            return [r[0] for r in self._conn.execute("SELECT user_id FROM customers WHERE name=?", (name,))]
+
+    def all_ids(self) -> list:
+        with self._lock:
+            return [r[0] for r in self._conn.execute("SELECT user_id FROM customers")]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM customers").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            try:
+                self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                self._conn.close()
+            except sqlite3.Error as e_close:
+                logger.warning(f"Error closing SQLite customer store: {e_close}")
+
+
+def migrate_json_folder(folder: str, store: SqliteCustomerStore, overwrite: bool = False) -> dict:
+    """One-shot import of `{id}_state.json` files. Existing DB rows are kept unless overwrite=True."""
+    result = {"imported": 0, "skipped_existing": 0, "failed": 0}
+    if not os.path.isdir(folder):
+        logger.warning(f"Migration source folder '{folder}' does not exist.")
+        return result
+    with os.scandir(folder) as it:
+        for entry in it:
+            if not entry.name.endswith("_state.json"): continue
+            try:
+                user_id = int(entry.name[:-len("_state.json")])
+            except ValueError:
+                continue
+            if not overwrite and store.load(user_id) is not None:
+                result["skipped_existing"] += 1; continue
+            try:
+                state = json_codec.load_file(entry.path)
+                if not isinstance(state, dict): raise ValueError("state is not a JSON object")
+            except (ValueError, OSError) as e_read:
+                logger.warning(f"Skipping unreadable customer file '{entry.path}': {e_read}")
+                result["failed"] += 1; continue
+            if store.save(user_id, state): result["imported"] += 1
+            else: result["failed"] += 1
+    logger.info(f"Customer JSON -> SQLite migration finished: {result}")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Iri-shka SQLite customer store tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_migrate = sub.add_parser("migrate", help="Import the JSON customer_states folder into SQLite")
+    p_migrate.add_argument("--folder", default=config.CUSTOMER_STATES_FOLDER)
+    p_migrate.add_argument("--db", default=config.CUSTOMER_STATE_DB_FILE)
+    p_migrate.add_argument("--overwrite", action="store_true", help="Replace customers already present in the DB")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        store = SqliteCustomerStore(args.db)
+        t0 = time.perf_counter()
+        res = migrate_json_folder(args.folder, store, overwrite=args.overwrite)
+        print(f"{res} in {time.perf_counter() - t0:.2f}s; {store.count()} customers in '{args.db}'.")
+        print("Set CUSTOMER_STATE_BACKEND=sqlite to use it.")
+        store.close()
@@ -1,9 +1,7 @@
 # utils/dashboard_utils.py
-import tkinter as tk # For tk.TclError
-import threading # For type hint
-
 import config # For default states (indirectly via TG handler status)
 from logger import get_logger
+from .versioned_state import get_app_state
 # from gui_manager import GUIManager # Import for type hint if you prefer stricter typing
 
 logger = get_logger("Iri-shka_App.utils.DashboardUtils")
@@ -13,11 +11,7 @@ def get_dashboard_data_for_telegram(
     telegram_bot_handler_instance_ref, 
     ollama_ready_flag: bool,
     whisper_handler_module_ref, 
-    tts_manager_module_ref,
-    user_state_ref: dict, 
-    assistant_state_ref: dict, 
-    chat_history_ref: list,
-    global_states_lock_ref: threading.Lock
+    tts_manager_module_ref
     ) -> dict:
     logger.debug("Gathering data for HTML dashboard...")
     component_statuses = {}
@@ -43,8 +37,8 @@ def get_dashboard_data_for_telegram(
             if text_label_widget and hasattr(text_label_widget, 'cget') and text_label_widget.winfo_exists():
                 try:
                     text_content = text_label_widget.cget("text")
-                except tk.TclError:
-                    logger.warning(f"TclError getting text for GUI label {label_attr_name}")
+                except Exception: # TclError from a destroyed widget; tkinter is not imported here so --headless never loads it
+                    logger.warning(f"Error getting text for GUI label {label_attr_name}")
             
             # Get the semantic status type directly from GUIManager's stored types
             status_type = gui_ref.get_component_status_type(key) 
@@ -109,14 +103,14 @@ def get_dashboard_data_for_telegram(
     if gui_ref and hasattr(gui_ref, 'app_status_label') and gui_ref.app_status_label and gui_ref.app_status_label.winfo_exists():
         try: 
             app_overall_status_text = gui_ref.app_status_label.cget("text")
-        except tk.TclError: 
-            logger.warning("TclError getting app_overall_status_text from GUI.")
+        except Exception: # TclError from a destroyed widget
+            logger.warning("Error getting app_overall_status_text from GUI.")
             pass # Keep default "Status Unavailable"
 
-    with global_states_lock_ref:
-        current_admin_user_state = user_state_ref.copy()
-        current_assistant_state_snapshot = assistant_state_ref.copy()
-        current_admin_chat_history = chat_history_ref[:]
+    state_snapshot = get_app_state().current() # Immutable and lock-free; empty until startup publishes version 1
+    current_admin_user_state = state_snapshot.user_state
+    current_assistant_state_snapshot = state_snapshot.assistant_state
+    current_admin_chat_history = state_snapshot.chat_history
 
     # Ensure all expected component keys are in component_statuses, even if with defaults
     all_expected_keys = ["act", "inet", "webui", "tele", "mem", "hear", "voice", "mind", "vis", "art"]
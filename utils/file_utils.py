@@ -1,11 +1,14 @@
 # utils/file_utils.py
 import os
+import json
 import shutil
 import datetime
+import tempfile
 # from tkinter import messagebox # REMOVED
 
 # Assuming logger.py is in the same 'utils' directory
 from logger import get_logger
+from . import json_codec
 
 logger = get_logger(__name__) # Gets the Iri-shka_App logger
 
@@ -29,4 +32,94 @@ def backup_corrupted_file(filepath): # No GUI interaction
         shutil.move(filepath, corrupted_backup_path)
         logger.info(f"Backed up corrupted file '{filepath}' to '{corrupted_backup_path}'")
     except OSError as ose:
-        logger.error(f"Could not back up corrupted file '{filepath}': {ose}", exc_info=True)
\ No newline at end of file
+        logger.error(f"Could not back up corrupted file '{filepath}': {ose}", exc_info=True)
+
+LAST_GOOD_SUFFIX = ".lastgood"
+
+def _fsync_directory(dir_path):
+    """Persists a rename in `dir_path` (POSIX only; Windows cannot open directories for fsync)."""
+    if os.name == "nt": return
+    try:
+        fd = os.open(dir_path or ".", os.O_RDONLY)
+        try: os.fsync(fd)
+        finally: os.close(fd)
+    except OSError as e:
+        logger.debug(f"Directory fsync failed for '{dir_path}': {e}")
+
+def _rotate_last_good(filepath):
+    """Keeps the current (atomically written, so complete) file as the last-good generation. Hard link, no data copy."""
+    if not os.path.exists(filepath): return
+    last_good_path = filepath + LAST_GOOD_SUFFIX
+    link_tmp = last_good_path + ".tmp"
+    try:
+        if os.path.exists(link_tmp): os.remove(link_tmp)
+        os.link(filepath, link_tmp)
+    except OSError: # Filesystem without hard links
+        try: shutil.copy2(filepath, link_tmp)
+        except OSError as e_copy:
+            logger.warning(f"Could not keep last-good copy of '{filepath}': {e_copy}")
+            return
+    os.replace(link_tmp, last_good_path)
+
+def atomic_write_json(filepath, data, fsync=True, fsync_dir=False, keep_last_good=True, indent=4):
+    """
+    Writes `data` as JSON so `filepath` is always either the old or the new complete document:
+    temp file in the same directory -> flush/fsync -> os.replace. Optionally fsyncs the directory
+    so the rename itself survives power loss, and keeps the previous version as `<file>.lastgood`.
+    Raises OSError/TypeError on failure; the original file is then untouched.
+    """
+    dir_path = os.path.dirname(os.path.abspath(filepath))
+    payload = json_codec.dumps_bytes(data, indent=indent) # orjson/msgspec backends always indent by 2
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(filepath) + ".", suffix=".tmp", dir=dir_path)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+            f.flush()
+            if fsync: os.fsync(f.fileno())
+        if keep_last_good: _rotate_last_good(filepath)
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        try: os.remove(tmp_path)
+        except OSError: pass
+        raise
+    if fsync_dir: _fsync_directory(dir_path)
+
+def load_last_good_json(filepath):
+    """Returns the parsed last-good generation of `filepath`, or None if there is no valid one."""
+    last_good_path = filepath + LAST_GOOD_SUFFIX
+    if not os.path.exists(last_good_path): return None
+    try:
+        return json_codec.load_file(last_good_path)
+    except (ValueError, OSError) as e:
+        logger.warning(f"Last-good copy '{last_good_path}' is unusable too: {e}")
+        return None
+
+
+if __name__ == "__main__":
+    # Benchmark: plain 'w' + json.dump (old behavior) vs atomic_write_json variants, customer-sized document.
+    # Run from the project root as a module (relative imports): python -m utils.file_utils
+    import time
+    bench_dir = tempfile.mkdtemp(prefix="iri_atomic_bench_")
+    doc = {"user_id": 123456789, "name": "Bench", "conversation_stage": "chatting", "calendar_events": [],
+           "chat_history": [{"role": "user", "content": "Hello " * 40, "timestamp": "2025-01-01T00:00:00"} for _ in range(20)]}
+    target = os.path.join(bench_dir, "123456789_state.json")
+    n = 200
+
+    def plain_write(path, d):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(d, f, indent=4, ensure_ascii=False)
+
+    variants = [
+        ("plain open('w')", lambda: plain_write(target, doc)),
+        ("atomic, no fsync", lambda: atomic_write_json(target, doc, fsync=False)),
+        ("atomic, fsync", lambda: atomic_write_json(target, doc, fsync=True)),
+        ("atomic, fsync + dir fsync", lambda: atomic_write_json(target, doc, fsync=True, fsync_dir=True)),
+    ]
+    print(f"{'variant':<28}{'mean ms':>10}{'p95 ms':>10}")
+    for label, fn in variants:
+        samples = []
+        for _ in range(n):
+            t0 = time.perf_counter(); fn(); samples.append((time.perf_counter() - t0) * 1000)
+        samples.sort()
+        print(f"{label:<28}{sum(samples) / n:>10.3f}{samples[int(n * 0.95)]:>10.3f}")
+    shutil.rmtree(bench_dir, ignore_errors=True)
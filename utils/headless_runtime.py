@@ -0,0 +1,102 @@
+# utils/headless_runtime.py
+"""
+Runtime for `python main.py --headless` (servers without a display).
+
+The desktop app drives its periodic work from Tk after() calls and shows status in widgets. In headless
+mode there is no Tk: HeadlessRuntime runs periodic tasks on daemon threads and blocks the main thread until
+SIGINT/SIGTERM (or stop()), and LogOnlyGUICallbacks stands in for gui_callbacks, logging status changes
+instead of drawing them. Nothing here imports tkinter, so Tk does not need to be installed.
+"""
+import os
+import signal
+import threading
+
+from logger import get_logger
+
+logger = get_logger("Iri-shka_App.utils.HeadlessRuntime")
+
+# gui_callbacks keys that carry a (text, type) status pair
+_STATUS_KEYS = (
+    'status_update', 'act_status_update', 'inet_status_update', 'webui_status_update', 'tele_status_update',
+    'memory_status_update', 'hearing_status_update', 'voice_status_update', 'mind_status_update',
+    'vis_status_update', 'art_status_update',
+)
+
+
+class LogOnlyGUICallbacks:
+    """
+    as_dict() gives a gui_callbacks dict whose status updates are logged once per change, and whose
+    message boxes are logged at their level. Widget-only callbacks (chat display, kanban, calendar, theme)
+    are left out; callers already skip keys that are not callable.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last = {}
+
+    def _status(self, key):
+        def _update(text, status_type=None, *args, **kwargs):
+            with self._lock:
+                changed = self._last.get(key) != (text, status_type)
+                self._last[key] = (text, status_type)
+            if changed: logger.info(f"[{key}] {text} ({status_type})" if status_type else f"[{key}] {text}")
+        return _update
+
+    @staticmethod
+    def _messagebox(log_fn):
+        def _show(title, message=None, *args, **kwargs): log_fn(f"{title}: {message}" if message is not None else str(title))
+        return _show
+
+    def last(self, key: str, default=None):
+        """Last (text, type) reported for a status key."""
+        with self._lock: return self._last.get(key, default)
+
+    def as_dict(self) -> dict:
+        callbacks = {key: self._status(key) for key in _STATUS_KEYS}
+        callbacks['speak_button_update'] = lambda *args, **kwargs: None
+        callbacks['gpu_status_update_display'] = lambda *args, **kwargs: None
+        callbacks['messagebox_error'] = self._messagebox(logger.error)
+        callbacks['messagebox_warn'] = self._messagebox(logger.warning)
+        callbacks['messagebox_info'] = self._messagebox(logger.info)
+        return callbacks
+
+
+class HeadlessRuntime:
+    def __init__(self):
+        self._stop_requested = threading.Event()
+        self._threads = []
+
+    def every(self, interval_seconds: float, fn, name: str, initial_delay: float = None):
+        """Runs fn() every interval_seconds on a daemon thread until stop(). Exceptions are logged, not raised."""
+        def _loop():
+            if self._stop_requested.wait(interval_seconds if initial_delay is None else initial_delay): return
+            while True:
+                try: fn()
+                except Exception as e_task: logger.error(f"Periodic task '{name}' failed: {e_task}", exc_info=True)
+                if self._stop_requested.wait(interval_seconds): return
+        thread = threading.Thread(target=_loop, daemon=True, name=f"Headless-{name}")
+        self._threads.append(thread)
+        thread.start()
+        return thread
+
+    def install_signal_handlers(self):
+        """SIGINT/SIGTERM (and SIGBREAK on Windows) request a graceful stop; a second signal kills the process."""
+        def _handler(signum, _frame):
+            if self._stop_requested.is_set():
+                logger.warning(f"Signal {signum} received again; exiting without cleanup.")
+                os._exit(1)
+            logger.info(f"Signal {signum} received; shutting down.")
+            self._stop_requested.set()
+        for sig_name in ("SIGINT", "SIGTERM", "SIGBREAK"):
+            sig = getattr(signal, sig_name, None)
+            if sig is not None:
+                try: signal.signal(sig, _handler)
+                except (ValueError, OSError) as e_sig: logger.warning(f"Could not install {sig_name} handler: {e_sig}")
+
+    def stop(self):
+        self._stop_requested.set()
+
+    def run_until_stopped(self):
+        """Blocks the calling (main) thread until stop() or a signal."""
+        logger.info("Headless runtime running. Send SIGINT/SIGTERM to stop.")
+        while not self._stop_requested.wait(1.0): pass # Short waits keep signal delivery prompt on Windows
+        for thread in self._threads: thread.join(timeout=1.0)
@@ -0,0 +1,216 @@
+# utils/history_journal.py
+"""
+Append-only JSONL journal for the admin chat history.
+
+Each turn is one line. A save is a single small append, so its cost does not grow with the history,
+unlike rewriting the whole JSON array on every turn. Durability and size are kept in check by:
+- fsync batching: fsync after CHAT_HISTORY_FSYNC_BATCH appends or CHAT_HISTORY_FSYNC_INTERVAL_SECONDS,
+  whichever comes first. sync() forces it.
+- compaction: once the journal holds CHAT_HISTORY_COMPACTION_FACTOR * MAX_HISTORY_TURNS lines, it is
+  rewritten (temp file + os.replace) to the last MAX_HISTORY_TURNS turns. That rewrite is bounded by
+  MAX_HISTORY_TURNS, not by how long the app has been running.
+- tail recovery: startup reads only the last blocks of the file. A torn final line from a crash is
+  truncated away before the next append.
+"""
+import json
+import os
+import threading
+import time
+
+import config
+from logger import get_logger
+
+logger = get_logger("Iri-shka_App.utils.HistoryJournal")
+
+_TAIL_READ_BLOCK = 64 * 1024
+
+
+class ChatHistoryJournal:
+    def __init__(self, filepath: str, max_turns: int = None):
+        self.filepath = filepath
+        self.max_turns = max_turns or config.MAX_HISTORY_TURNS
+        self._lock = threading.Lock()
+        self._fh = None
+        self._line_count = 0 # Lines currently in the journal file (approximate after a torn tail)
+        self._unsynced_appends = 0
+        self._last_fsync = time.monotonic()
+        self._last_journaled_turn = None # Strong ref to the last dict written; used to find new turns
+
+    # --- Recovery ---
+    def _read_tail_lines(self, wanted_lines: int) -> list:
+        """Returns up to `wanted_lines` last non-empty lines (bytes), reading backwards in blocks."""
+        with open(self.filepath, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            pos = f.tell()
+            buf = b""
+            while pos > 0 and buf.count(b"\n") <= wanted_lines:
+                read_size = min(_TAIL_READ_BLOCK, pos)
+                pos -= read_size
+                f.seek(pos)
+                buf = f.read(read_size) + buf
+        lines = [ln for ln in buf.split(b"\n") if ln.strip()]
+        if pos > 0 and lines: lines = lines[1:] # First line may be partial when we stopped mid-file
+        return lines[-wanted_lines:]
+
+    def load_tail(self, gui_callbacks=None) -> list:
+        """Loads the last max_turns turns. Migrates the legacy JSON array file on first run."""
+        with self._lock:
+            if not os.path.exists(self.filepath):
+                turns = self._migrate_legacy_json()
+                self._rewrite_locked(turns)
+                return turns
+            turns = []
+            try:
+                self._truncate_torn_tail()
+                raw_lines = self._read_tail_lines(self.max_turns + 1)
+            except OSError as e_read:
+                logger.error(f"Could not read chat history journal '{self.filepath}': {e_read}", exc_info=True)
+                return []
+            for raw in raw_lines:
+                try:
+                    turn = json.loads(raw.decode('utf-8'))
+                    if isinstance(turn, dict): turns.append(turn)
+                except (ValueError, UnicodeDecodeError):
+                    logger.warning(f"Skipping unreadable journal line in '{self.filepath}'.")
+            turns = turns[-self.max_turns:]
+            self._line_count = self._count_lines_fast()
+            if self._line_count > self.max_turns * config.CHAT_HISTORY_COMPACTION_FACTOR:
+                self._rewrite_locked(turns)
+            logger.info(f"Recovered {len(turns)} admin chat turns from journal tail ({self._line_count} lines on disk).")
+            self._last_journaled_turn = turns[-1] if turns else None
+            return turns
+
+    def _truncate_torn_tail(self):
+        """Drops a partial last line (crash mid-append) so the next append starts on a clean line."""
+        with open(self.filepath, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size == 0: return
+            f.seek(size - 1)
+            if f.read(1) == b"\n": return
+            pos = size
+            while pos > 0:
+                read_size = min(_TAIL_READ_BLOCK, pos)
+                pos -= read_size
+                f.seek(pos)
+                block = f.read(read_size)
+                nl = block.rfind(b"\n")
+                if nl != -1:
+                    pos += nl + 1
+                    break
+            f.truncate(pos)
+            logger.warning(f"Truncated torn final line ({size - pos} bytes) from chat history journal '{self.filepath}'.")
+
+    def _count_lines_fast(self) -> int:
+        count = 0
+        with open(self.filepath, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                count += block.count(b"\n")
+        return count
+
+    def _migrate_legacy_json(self) -> list:
+        legacy = config.CHAT_HISTORY_FILE
+        if not os.path.exists(legacy): return []
+        try:
+            with open(legacy, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if isinstance(data, list):
+                turns = [t for t in data if isinstance(t, dict)][-self.max_turns:]
+                logger.info(f"Migrated {len(turns)} turns from legacy '{legacy}' into journal '{self.filepath}'.")
+                return turns
+        except (ValueError, OSError) as e_legacy:
+            logger.warning(f"Could not migrate legacy chat history '{legacy}': {e_legacy}")
+        return []
+
+    # --- Appends ---
+    def _open_for_append(self):
+        if self._fh is None or self._fh.closed:
+            parent = os.path.dirname(self.filepath)
+            if parent: os.makedirs(parent, exist_ok=True)
+            self._fh = open(self.filepath, 'ab')
+        return self._fh
+
+    def append_turns(self, turns) -> int:
+        """Appends turns as JSONL lines. fsync is batched. Returns the number appended."""
+        if not turns: return 0
+        payload = b"".join(json.dumps(t, ensure_ascii=False).encode('utf-8') + b"\n" for t in turns)
+        with self._lock:
+            fh = self._open_for_append()
+            fh.write(payload)
+            fh.flush()
+            self._line_count += len(turns)
+            self._unsynced_appends += len(turns)
+            self._last_journaled_turn = turns[-1]
+            if (self._unsynced_appends >= config.CHAT_HISTORY_FSYNC_BATCH or
+                    time.monotonic() - self._last_fsync >= config.CHAT_HISTORY_FSYNC_INTERVAL_SECONDS):
+                self._fsync_locked()
+            if self._line_count > self.max_turns * config.CHAT_HISTORY_COMPACTION_FACTOR:
+                self._compact_locked()
+        return len(turns)
+
+    def append_new_turns_from(self, chat_history: list) -> int:
+        """
+        Appends the turns of `chat_history` that come after the last journaled turn (matched by identity, or by
+        equality once the turns were frozen into a new snapshot). New turns are at the end, so this only inspects
+        the newest entries.
+        """
+        last = self._last_journaled_turn
+        start = 0
+        if last is not None:
+            for idx in range(len(chat_history) - 1, -1, -1):
+                if chat_history[idx] is last or chat_history[idx] == last:
+                    start = idx + 1
+                    break
+            else:
+                # Last journaled turn is gone from memory (list was replaced): journal what we have
+                logger.debug("Last journaled turn not found in chat history; re-syncing journal from memory.")
+                with self._lock: self._rewrite_locked(list(chat_history)[-self.max_turns:])
+                return len(chat_history)
+        return self.append_turns(chat_history[start:])
+
+    def _fsync_locked(self):
+        if self._fh and not self._fh.closed:
+            try: os.fsync(self._fh.fileno())
+            except OSError as e_sync: logger.warning(f"fsync failed for '{self.filepath}': {e_sync}")
+        self._unsynced_appends = 0
+        self._last_fsync = time.monotonic()
+
+    def sync(self):
+        with self._lock: self._fsync_locked()
+
+    # --- Compaction ---
+    def _compact_locked(self):
+        try:
+            self._fsync_locked()
+            raw_lines = self._read_tail_lines(self.max_turns)
+            turns = []
+            for raw in raw_lines:
+                try: turns.append(json.loads(raw.decode('utf-8')))
+                except (ValueError, UnicodeDecodeError): continue
+            self._rewrite_locked(turns)
+            logger.info(f"Compacted chat history journal to {len(turns)} turns.")
+        except OSError as e_compact:
+            logger.error(f"Chat history journal compaction failed: {e_compact}", exc_info=True)
+
+    def _rewrite_locked(self, turns: list):
+        if self._fh and not self._fh.closed: self._fh.close()
+        self._fh = None
+        parent = os.path.dirname(self.filepath)
+        if parent: os.makedirs(parent, exist_ok=True)
+        tmp_path = f"{self.filepath}.tmp"
+        with open(tmp_path, 'wb') as f:
+            for t in turns: f.write(json.dumps(t, ensure_ascii=False).encode('utf-8') + b"\n")
+            f.flush(); os.fsync(f.fileno())
+        os.replace(tmp_path, self.filepath)
+        self._line_count = len(turns)
+        self._unsynced_appends = 0
+        self._last_journaled_turn = turns[-1] if turns else None
+
+    def compact(self):
+        with self._lock: self._compact_locked()
+
+    def close(self):
+        with self._lock:
+            self._fsync_locked()
+            if self._fh and not self._fh.closed: self._fh.close()
+            self._fh = None
@@ -3,6 +3,7 @@
 import datetime
 from datetime import timezone, timedelta # Correct import
 import config # For TIMEZONE_OFFSET_HOURS
+from .calendar_index import get_calendar_index, ADMIN_OWNER
 
 # from logger import get_logger
 # logger = get_logger("Iri-shka_App.utils.HTMLDashboardGenerator") # Uncomment if logging is needed here
@@ -136,19 +137,11 @@ def generate_dashboard_html(
     def format_calendar_events_to_html(events, max_items=5):
         if not events: return "<li>No upcoming events</li>"
         html_items = []
-        try:
-            # Ensure all items are dicts before trying to sort
-            valid_events = [e for e in events if isinstance(e, dict)]
-            sorted_events = sorted(
-                valid_events, 
-                key=lambda x: (
-                    str(x.get("date", "9999-99-99")), 
-                    str(x.get("time", "99:99"))
-                )
-            )
-        except TypeError: 
-            # Fallback if items are not dicts or sorting fails for other reasons
-            sorted_events = [e for e in events if isinstance(e, dict)] # just filter, don't sort
+        # The admin calendar is indexed by state_manager on load/save; take the next events from now on
+        try: now_local = datetime.datetime.now(timezone(timedelta(hours=config.TIMEZONE_OFFSET_HOURS))).replace(tzinfo=None)
+        except Exception: now_local = datetime.datetime.now()
+        sorted_events = [ev.raw for ev in get_calendar_index().next_events(max_items, after=now_local, owners=[ADMIN_OWNER])]
+        if not sorted_events: return "<li>No upcoming events</li>"
         
         for event in sorted_events[:max_items]:
             desc = str(event.get("description") or event.get("name") or "Event")[:100].replace('<','<').replace('>','>')
@@ -0,0 +1,252 @@
+# utils/inference_modes.py
+"""
+Inference modes (precision / quantization / compilation) shared by Bark and Whisper.
+
+Modes:
+    fp32 - default full precision, any device.
+    fp16 - float16 autocast, CUDA only.
+    bf16 - bfloat16 autocast, CUDA only (needs hardware bf16 support).
+    int8 - dynamic int8 quantization of nn.Linear layers, CPU only.
+    auto - fp16 on CUDA, fp32 on CPU.
+torch.compile is a separate on/off switch layered on top of any mode.
+
+Run `python -m utils.inference_modes` to print a real-time-factor matrix for every CPU mode.
+"""
+import contextlib
+import sys
+import time
+
+import config
+from logger import get_logger
+
+logger = get_logger("Iri-shka_App.utils.InferenceModes")
+
+torch = None
+TORCH_AVAILABLE = False
+try:
+    import torch as _torch_module
+    torch = _torch_module
+    TORCH_AVAILABLE = True
+except ImportError:
+    logger.warning("PyTorch not found. Inference mode selection disabled (fp32 only).")
+
+VALID_MODES = ("fp32", "fp16", "bf16", "int8", "auto")
+GPU_ONLY_MODES = ("fp16", "bf16")
+CPU_ONLY_MODES = ("int8",)
+
+
+def resolve_inference_mode(requested_mode: str, device: str) -> str:
+    """Maps a requested mode onto one that is valid for `device`. Falls back to fp32 on mismatch."""
+    mode = (requested_mode or "auto").strip().lower()
+    if mode not in VALID_MODES:
+        logger.warning(f"Unknown inference mode '{requested_mode}'. Using 'auto'.")
+        mode = "auto"
+    if mode == "auto":
+        return "fp16" if device == "cuda" else "fp32"
+    if mode in GPU_ONLY_MODES and device != "cuda":
+        logger.warning(f"Inference mode '{mode}' requires CUDA (device is '{device}'). Falling back to fp32.")
+        return "fp32"
+    if mode == "bf16" and TORCH_AVAILABLE and not torch.cuda.is_bf16_supported():
+        logger.warning("Inference mode 'bf16' not supported by this GPU. Falling back to fp16.")
+        return "fp16"
+    if mode in CPU_ONLY_MODES and device != "cpu":
+        logger.warning(f"Inference mode '{mode}' is CPU only (device is '{device}'). Falling back to fp32.")
+        return "fp32"
+    return mode
+
+
+def is_torch_compile_supported() -> bool:
+    """torch.compile needs torch>=2.0 and a working Triton/inductor backend (not available on Windows)."""
+    if not TORCH_AVAILABLE or not hasattr(torch, "compile"):
+        return False
+    if sys.platform.startswith("win"):
+        return False
+    return True
+
+
+def _autocast_dtype(mode: str):
+    if mode == "fp16": return torch.float16
+    if mode == "bf16": return torch.bfloat16
+    return None
+
+
+@contextlib.contextmanager
+def inference_context(mode: str, device: str):
+    """
+    Context for a single forward/generate call: torch.inference_mode() plus autocast for fp16/bf16.
+    Replaces the plain torch.no_grad() blocks.
+    """
+    if not TORCH_AVAILABLE:
+        yield
+        return
+    autocast_dtype = _autocast_dtype(mode) if device == "cuda" else None
+    with torch.inference_mode():
+        if autocast_dtype is not None:
+            with torch.autocast(device_type="cuda", dtype=autocast_dtype):
+                yield
+        else:
+            yield
+
+
+def quantize_linear_layers_int8(model):
+    """Dynamic int8 quantization of all nn.Linear layers (CPU). Returns the quantized model."""
+    # quantize_dynamic matches exact types only. Whisper wraps nn.Linear in a thin dtype-casting
+    # subclass, which is a no-op on fp32 CPU, so downcast those to plain nn.Linear first.
+    for module in model.modules():
+        if isinstance(module, torch.nn.Linear) and type(module) is not torch.nn.Linear:
+            module.__class__ = torch.nn.Linear
+    quantized = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    logger.info(f"Applied dynamic int8 quantization to Linear layers of {type(model).__name__}.")
+    return quantized
+
+
+def compile_submodules(model, submodule_names):
+    """
+    Wraps forward() of the named submodules with torch.compile. generate() loops on HF/whisper models
+    are Python-level, so compiling the inner transformers is what actually pays off.
+    Returns the list of submodule names that were compiled.
+    """
+    compiled = []
+    if not is_torch_compile_supported():
+        logger.info("torch.compile not supported on this platform. Skipping compilation.")
+        return compiled
+    for name in submodule_names:
+        submodule = getattr(model, name, None)
+        if submodule is None or not hasattr(submodule, "forward"):
+            continue
+        try:
+            submodule.forward = torch.compile(submodule.forward, dynamic=True)
+            compiled.append(name)
+        except Exception as e:
+            logger.warning(f"torch.compile failed for submodule '{name}': {e}")
+    if compiled:
+        logger.info(f"torch.compile applied to submodules: {compiled}")
+    return compiled
+
+
+def uncompile_submodules(model, submodule_names):
+    """Reverts compile_submodules (drops the instance-level forward override)."""
+    for name in submodule_names:
+        submodule = getattr(model, name, None)
+        if submodule is not None and "forward" in vars(submodule):
+            del submodule.forward
+
+
+def prepare_model_for_mode(model, mode: str, device: str, use_torch_compile=False, compile_targets=()):
+    """
+    Applies `mode` to an already loaded model and moves it to `device`.
+    Returns (model, compiled_submodule_names).
+    """
+    if mode == "int8":
+        model = model.to("cpu")
+        model.eval()
+        model = quantize_linear_layers_int8(model)
+    else:
+        model = model.to(device)
+        model.eval()
+    compiled = []
+    if use_torch_compile:
+        compiled = compile_submodules(model, compile_targets or ())
+    return model, compiled
+
+
+def warmup(fn, label: str):
+    """Runs `fn` once (triggers CUDA kernel selection / torch.compile tracing). Returns (ok, seconds)."""
+    start = time.perf_counter()
+    try:
+        fn()
+    except Exception as e:
+        elapsed = time.perf_counter() - start
+        logger.warning(f"Warmup pass for {label} failed after {elapsed:.2f}s: {e}", exc_info=True)
+        return False, elapsed
+    elapsed = time.perf_counter() - start
+    logger.info(f"Warmup pass for {label} completed in {elapsed:.2f}s.")
+    return True, elapsed
+
+
+def real_time_factor(processing_seconds: float, audio_seconds: float) -> float:
+    """RTF < 1.0 means faster than real time."""
+    if audio_seconds <= 0: return float("inf")
+    return processing_seconds / audio_seconds
+
+
+# --- CPU benchmark matrix ---
+BENCHMARK_TEXT = "Hello, this is a short benchmark sentence for the speech engine."
+
+
+def _benchmark_bark_cpu(modes, compile_options, repeats):
+    from transformers import AutoProcessor, BarkModel
+    from utils.speak_bark import BarkTTS
+
+    rows = []
+    processor = AutoProcessor.from_pretrained(config.BARK_MODEL_NAME)
+    for mode in modes:
+        for use_compile in compile_options:
+            model = BarkModel.from_pretrained(config.BARK_MODEL_NAME)
+            model, compiled = prepare_model_for_mode(model, mode, "cpu", use_compile, config.BARK_COMPILE_SUBMODULES)
+            if use_compile and not compiled:
+                continue
+            engine = BarkTTS(processor, model, "cpu", config.BARK_VOICE_PRESET_EN, inference_mode=mode)
+            warmup(lambda: engine.synthesize_speech_to_array("Hi."), f"Bark {mode}{'+compile' if use_compile else ''}")
+            rtfs = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                audio, sr = engine.synthesize_speech_to_array(BENCHMARK_TEXT)
+                elapsed = time.perf_counter() - start
+                if audio is not None and sr:
+                    rtfs.append(real_time_factor(elapsed, len(audio) / sr))
+            rows.append(("bark", mode, use_compile, min(rtfs) if rtfs else float("nan"), sum(rtfs) / len(rtfs) if rtfs else float("nan")))
+            del engine, model
+    return rows
+
+
+def _benchmark_whisper_cpu(modes, compile_options, repeats, audio_seconds=10.0):
+    import numpy as np
+    import whisper
+
+    rows = []
+    rng = np.random.default_rng(0)
+    audio = (rng.standard_normal(int(audio_seconds * config.INPUT_RATE)) * 0.01).astype(np.float32)
+    for mode in modes:
+        for use_compile in compile_options:
+            model = whisper.load_model(config.WHISPER_MODEL_SIZE, device="cpu")
+            model, compiled = prepare_model_for_mode(model, mode, "cpu", use_compile, config.WHISPER_COMPILE_SUBMODULES)
+            if use_compile and not compiled:
+                continue
+
+            def _run():
+                with inference_context(mode, "cpu"):
+                    return model.transcribe(audio, fp16=False, language="en")
+
+            warmup(_run, f"Whisper {mode}{'+compile' if use_compile else ''}")
+            rtfs = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                _run()
+                rtfs.append(real_time_factor(time.perf_counter() - start, audio_seconds))
+            rows.append(("whisper", mode, use_compile, min(rtfs), sum(rtfs) / len(rtfs)))
+            del model
+    return rows
+
+
+if __name__ == "__main__":
+    import logging
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if not TORCH_AVAILABLE:
+        print("PyTorch not installed; nothing to benchmark.")
+        sys.exit(1)
+
+    cpu_modes = ["fp32", "int8"]
+    compile_opts = [False, True] if is_torch_compile_supported() else [False]
+    bench_repeats = 3
+
+    results = []
+    try: results += _benchmark_bark_cpu(cpu_modes, compile_opts, bench_repeats)
+    except Exception as e_bark: logger.error(f"Bark benchmark failed: {e_bark}", exc_info=True)
+    try: results += _benchmark_whisper_cpu(cpu_modes, compile_opts, bench_repeats)
+    except Exception as e_whisper: logger.error(f"Whisper benchmark failed: {e_whisper}", exc_info=True)
+
+    print(f"\n{'model':<8} {'mode':<5} {'compile':<8} {'best RTF':>9} {'mean RTF':>9}")
+    for model_name, mode, use_compile, best_rtf, mean_rtf in results:
+        print(f"{model_name:<8} {mode:<5} {str(use_compile):<8} {best_rtf:>9.3f} {mean_rtf:>9.3f}")
+    print("\nRTF < 1.0 is faster than real time. Pick the lowest RTF whose output still sounds/reads correct.")
@@ -1,10 +1,10 @@
 # utils/initialization_manager.py
 import requests
 import re
-import threading # For type hint
 
 import config
 from logger import get_logger
+from .versioned_state import get_app_state
 
 logger = get_logger("Iri-shka_App.utils.InitializationManager")
 
@@ -34,11 +34,9 @@ def check_search_engine_status():
     except requests.exceptions.RequestException as e: logger.error(f"Search Engine error: {e}"); return "INET: ERR", "error"
 
 def load_all_models_and_services(
-    gui_callbacks: dict, assistant_state_ref: dict, chat_history_ref: list,
-    telegram_bot_handler_instance_ref, fn_set_ollama_ready_flag,
+    gui_callbacks: dict, telegram_bot_handler_instance_ref, fn_set_ollama_ready_flag,
     whisper_handler_module_ref, tts_manager_module_ref,
-    ollama_handler_module_ref, state_manager_module_ref,
-    global_states_lock_ref: threading.Lock
+    ollama_handler_module_ref, state_manager_module_ref
     ):
     # ... (content from thought process, ensure all refs are used)
     logger.info("LOADER: --- Starting model and services loading/checking ---")
@@ -62,10 +60,12 @@ def load_all_models_and_services(
     inet_short_text, inet_status_type = check_search_engine_status() # ... check inet ...
     safe_gui_callback('inet_status_update', inet_short_text, inet_status_type)
     
-    with global_states_lock_ref: # ... set default admin_name in assistant_state_ref ...
-        if "admin_name" not in assistant_state_ref: assistant_state_ref["admin_name"] = config.DEFAULT_ASSISTANT_STATE["admin_name"]
+    loaded_snapshot = get_app_state().update( # ... set default admin_name in assistant_state ...
+        lambda snapshot: None if "admin_name" in snapshot.assistant_state else
+        {"assistant_state": {**snapshot.assistant_state, "admin_name": config.DEFAULT_ASSISTANT_STATE["admin_name"]}}
+    ) or get_app_state().current()
     
-    safe_gui_callback('memory_status_update', "MEM: LOADED" if chat_history_ref else "MEM: FRESH", "loaded" if chat_history_ref else "fresh") 
+    safe_gui_callback('memory_status_update', "MEM: LOADED" if loaded_snapshot.chat_history else "MEM: FRESH", "loaded" if loaded_snapshot.chat_history else "fresh") 
     
     if whisper_handler_module_ref.WHISPER_CAPABLE: # ... load whisper ...
         whisper_handler_module_ref.load_whisper_model(config.WHISPER_MODEL_SIZE, gui_callbacks)
@@ -80,13 +80,12 @@ def load_all_models_and_services(
     if ollama_is_ready_now: safe_gui_callback('mind_status_update', "MIND: RDY", "ready")
     else: short_code_ollama, status_type_ollama = _parse_ollama_error_to_short_code(ollama_log_msg); safe_gui_callback('mind_status_update', f"MIND: {short_code_ollama}", status_type_ollama)
 
-    current_tele_status_for_as = "off" # ... set telegram status in assistant_state_ref ...
+    current_tele_status_for_as = "off" # ... set telegram status in assistant_state ...
     if telegram_bot_handler_instance_ref: current_tele_status_for_as = telegram_bot_handler_instance_ref.get_status()
     elif not config.TELEGRAM_BOT_TOKEN: current_tele_status_for_as = "no_token"
     elif not config.TELEGRAM_ADMIN_USER_ID: current_tele_status_for_as = "no_admin"
-    with global_states_lock_ref: 
-        assistant_state_ref["telegram_bot_status"] = current_tele_status_for_as
-        state_manager_module_ref.save_assistant_state_only(assistant_state_ref.copy(), gui_callbacks) 
+    get_app_state().update(lambda snapshot: {"assistant_state": {**snapshot.assistant_state, "telegram_bot_status": current_tele_status_for_as}})
+    state_manager_module_ref.save_app_state(gui_callbacks) # After the swap, outside any state lock
 
     # ... final GUI status updates ...
     if whisper_handler_module_ref.is_whisper_ready():
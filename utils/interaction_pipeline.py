@@ -0,0 +1,254 @@
+# utils/interaction_pipeline.py
+"""
+Stage-based pipeline engine.
+
+A pipeline is a list of Stages. Each stage has its own worker threads and a bounded input queue, so
+while stage B works on job N, stage A can already work on job N+1 (e.g. STT of the next message
+overlaps the LLM call of the current one). A full queue blocks the stage in front of it, and a full
+first queue blocks submit(), which keeps memory bounded under load.
+
+- A stage function takes the PipelineJob and updates job.ctx. job.finish(result) ends the job early
+  and skips the remaining stages, e.g. when there is nothing to send to the LLM.
+- Stage(after_prior="merge") makes a job wait at that stage until every earlier job has left "merge"
+  (or ended). The LLM stage uses this so a prompt always sees the previous turn's merged state.
+- Stage(timeout=...) fails the job with StageTimeoutError if the stage runs longer than that. A Python
+  thread cannot be killed, so the worker stays busy until the call returns, but the job's future
+  resolves right away and the late result is dropped. job.cancel() works the same way; stage
+  functions can call job.raise_if_cancelled() between steps to stop early.
+- on_finished(job) runs once per job, whatever the outcome (result, exception or cancellation).
+
+job.future is a concurrent.futures.Future that resolves with job.ctx (or the value passed to finish()).
+"""
+import collections
+import queue
+import threading
+import time
+from concurrent.futures import Future, CancelledError
+
+from logger import get_logger
+
+logger = get_logger("Iri-shka_App.utils.InteractionPipeline")
+
+
+class StageTimeoutError(TimeoutError):
+    pass
+
+
+class DurationStat:
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self): self.count, self.total, self.max = 0, 0.0, 0.0
+
+    def add(self, seconds: float):
+        self.count += 1; self.total += seconds; self.max = max(self.max, seconds)
+
+    def as_dict(self) -> dict:
+        return {"count": self.count, "avg_s": round(self.total / self.count, 3) if self.count else 0.0, "max_s": round(self.max, 3)}
+
+
+class Stage:
+    def __init__(self, name: str, fn, workers: int = 1, timeout: float = None, queue_size: int = 4, after_prior: str = None):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.timeout = timeout if timeout and timeout > 0 else None
+        self.queue_size = max(1, queue_size)
+        self.after_prior = after_prior
+
+
+class PipelineJob:
+    def __init__(self, seq: int, ctx: dict):
+        self.seq = seq
+        self.ctx = ctx
+        self.future = Future()
+        self.created_at = time.monotonic()
+        self.stage = None # Name of the stage the job is in
+        self.stage_durations = {} # stage name -> seconds spent running it
+        self._cancel_requested = threading.Event()
+        self._enqueued_at = self.created_at
+        self._on_end = None
+
+    @property
+    def done(self) -> bool: return self.future.done()
+
+    @property
+    def cancelled(self) -> bool: return self._cancel_requested.is_set()
+
+    def raise_if_cancelled(self):
+        if self._cancel_requested.is_set(): raise CancelledError(f"Pipeline job {self.seq} was cancelled.")
+
+    def finish(self, result=None):
+        """Ends the job with a result; later stages are skipped."""
+        self._end(lambda: self.future.set_result(self.ctx if result is None else result))
+
+    def fail(self, exc: BaseException):
+        self._cancel_requested.set()
+        self._end(lambda: self.future.set_exception(exc))
+
+    def cancel(self) -> bool:
+        self._cancel_requested.set()
+        return self._end(self.future.cancel)
+
+    def _end(self, resolve) -> bool:
+        if self.future.done(): return False
+        try: resolve()
+        except Exception: return False # InvalidStateError: another thread resolved it first
+        if self._on_end: self._on_end(self)
+        return True
+
+
+class InteractionPipeline:
+    def __init__(self, name: str, stages: list, on_finished=None):
+        if not stages: raise ValueError("A pipeline needs at least one stage.")
+        self.name = name
+        self._stages = stages
+        self._index = {stage.name: i for i, stage in enumerate(stages)}
+        for stage in stages:
+            if stage.after_prior and stage.after_prior not in self._index:
+                raise ValueError(f"Stage '{stage.name}' waits on unknown stage '{stage.after_prior}'.")
+        self._queues = [queue.Queue(maxsize=stage.queue_size) for stage in stages]
+        self._on_finished = on_finished
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._not_past = collections.defaultdict(set) # stage name -> seqs of live jobs that have not left it yet
+        self._barrier_stages = {stage.after_prior for stage in stages if stage.after_prior}
+        self._active = {}
+        self._threads = []
+        self._stopping = False
+        self._wait_stats = collections.defaultdict(DurationStat)
+        self._run_stats = collections.defaultdict(DurationStat)
+        self._total_stat = DurationStat()
+        self._outcomes = collections.Counter()
+
+    def start(self):
+        if self._threads: return
+        for index, stage in enumerate(self._stages):
+            for n in range(stage.workers):
+                thread = threading.Thread(target=self._worker, args=(index,), daemon=True, name=f"{self.name}-{stage.name}-{n}")
+                self._threads.append(thread)
+                thread.start()
+        logger.info(f"Pipeline '{self.name}' started: " + " -> ".join(f"{s.name}(x{s.workers})" for s in self._stages))
+
+    def stop(self, timeout: float = 2.0):
+        """Cancels queued and running jobs and stops the workers."""
+        with self._cond:
+            self._stopping = True
+            active = list(self._active.values())
+            self._cond.notify_all()
+        for job in active: job.cancel()
+        for q, stage in zip(self._queues, self._stages):
+            for _ in range(stage.workers):
+                try: q.put_nowait(None)
+                except queue.Full: pass # Workers also check _stopping after every item
+        deadline = time.monotonic() + timeout
+        for thread in self._threads: thread.join(timeout=max(0.0, deadline - time.monotonic()))
+        self._threads = []
+
+    def submit(self, ctx: dict, block: bool = True, timeout: float = None) -> PipelineJob:
+        """Queues ctx for the first stage. Blocks while that queue is full (raises queue.Full if block=False)."""
+        with self._cond:
+            if self._stopping: raise RuntimeError(f"Pipeline '{self.name}' is stopped.")
+            self._seq += 1
+            job = PipelineJob(self._seq, ctx)
+            job._on_end = self._job_ended
+            self._active[job.seq] = job
+            for stage_name in self._barrier_stages: self._not_past[stage_name].add(job.seq)
+        try: self._queues[0].put(job, block, timeout)
+        except queue.Full:
+            job.cancel(); raise
+        return job
+
+    def _job_ended(self, job: PipelineJob):
+        with self._cond:
+            self._active.pop(job.seq, None)
+            for pending in self._not_past.values(): pending.discard(job.seq)
+            self._total_stat.add(time.monotonic() - job.created_at)
+            outcome = "cancelled" if job.future.cancelled() else type(job.future.exception()).__name__ if job.future.exception() else "ok"
+            self._outcomes[outcome] += 1
+            self._cond.notify_all()
+        if self._on_finished:
+            try: self._on_finished(job)
+            except Exception as e_finish: logger.error(f"Pipeline '{self.name}' on_finished failed for job {job.seq}: {e_finish}", exc_info=True)
+
+    def _leave_stage(self, job: PipelineJob, stage_name: str):
+        if stage_name not in self._barrier_stages: return
+        with self._cond:
+            self._not_past[stage_name].discard(job.seq)
+            self._cond.notify_all()
+
+    def _wait_for_prior(self, job: PipelineJob, stage_name: str) -> bool:
+        """Blocks until no earlier live job is still before or in stage_name. False if the job ended meanwhile."""
+        with self._cond:
+            while not (self._stopping or job.done):
+                if not any(seq < job.seq for seq in self._not_past[stage_name]): return True
+                self._cond.wait(0.5)
+        return False
+
+    def _worker(self, index: int):
+        stage, in_queue = self._stages[index], self._queues[index]
+        is_last = index == len(self._stages) - 1
+        while True:
+            job = in_queue.get()
+            if job is None or self._stopping:
+                if job is not None: job.cancel()
+                return
+            if job.done: continue # Cancelled or timed out while queued
+            if stage.after_prior and not self._wait_for_prior(job, stage.after_prior): continue
+            started = time.monotonic()
+            with self._cond: self._wait_stats[stage.name].add(started - job._enqueued_at)
+            job.stage = stage.name
+            timer = None
+            if stage.timeout:
+                timer = threading.Timer(stage.timeout, job.fail, args=(StageTimeoutError(
+                    f"Stage '{stage.name}' exceeded {stage.timeout:g}s (job {job.seq})."),))
+                timer.daemon = True; timer.start()
+            try: stage.fn(job)
+            except CancelledError: job.cancel()
+            except Exception as e_stage:
+                logger.error(f"Pipeline '{self.name}' stage '{stage.name}' failed for job {job.seq}: {e_stage}", exc_info=True)
+                job.fail(e_stage)
+            finally:
+                if timer: timer.cancel()
+                duration = time.monotonic() - started
+                job.stage_durations[stage.name] = duration
+                with self._cond: self._run_stats[stage.name].add(duration)
+            self._leave_stage(job, stage.name)
+            if job.done: continue # Finished early, failed, timed out or cancelled
+            if is_last: job.finish(); continue
+            job._enqueued_at = time.monotonic()
+            self._queues[index + 1].put(job) # Blocks while the next stage is backed up
+
+    def get_metrics(self) -> dict:
+        with self._cond:
+            return {"stages": {s.name: {"queue_wait": self._wait_stats[s.name].as_dict(), "run": self._run_stats[s.name].as_dict(),
+                                        "queued": self._queues[i].qsize()} for i, s in enumerate(self._stages)},
+                    "end_to_end": self._total_stat.as_dict(), "outcomes": dict(self._outcomes), "in_flight": len(self._active)}
+
+
+if __name__ == "__main__":
+    # Overlap demo: 6 voice turns through stt(0.4s) -> llm(1.0s) -> merge(0.05s) -> reply(0.5s), run serially vs pipelined
+    sleep_stage = lambda seconds: (lambda job: time.sleep(seconds))
+    durations = [("stt", 0.4), ("llm", 1.0), ("merge", 0.05), ("reply", 0.5)]
+    n_jobs = 6
+    t0 = time.perf_counter()
+    for _ in range(n_jobs):
+        for _, seconds in durations: time.sleep(seconds)
+    serial_s = time.perf_counter() - t0
+
+    order = []
+    stages = [Stage(name, sleep_stage(seconds), after_prior="merge" if name == "llm" else None) for name, seconds in durations]
+    stages[2].fn = lambda job: order.append(job.ctx["n"])
+    pipe = InteractionPipeline("demo", stages)
+    pipe.start()
+    t0 = time.perf_counter()
+    jobs = [pipe.submit({"n": n}) for n in range(n_jobs)]
+    for job in jobs: job.future.result()
+    pipelined_s = time.perf_counter() - t0
+    print(f"{n_jobs} turns: serial {serial_s:.2f}s, pipelined {pipelined_s:.2f}s (merge order {order})")
+
+    slow = InteractionPipeline("timeout-demo", [Stage("llm", sleep_stage(1.0), timeout=0.2)])
+    slow.start()
+    try: slow.submit({}).future.result()
+    except StageTimeoutError as e: print(f"timeout -> {e}")
+    print(pipe.get_metrics())
+    pipe.stop(); slow.stop()
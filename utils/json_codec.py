@@ -0,0 +1,252 @@
+# utils/json_codec.py
+"""
+JSON codec layer plus typed schemas for the state documents.
+
+The backend is picked once at import: orjson, then msgspec, then the stdlib json module. Output is
+always UTF-8 with non-ASCII kept as-is (same as ensure_ascii=False). orjson and msgspec only pretty-print
+with 2 spaces, so any requested indent becomes 2 with those backends. sort_keys=True gives a deterministic
+encoding (used for content digests); the exact bytes still differ between backends. Decode errors are always raised as
+json.JSONDecodeError, so existing `except json.JSONDecodeError` handlers keep working.
+
+Schemas (slotted dataclasses) describe DEFAULT_USER_STATE, DEFAULT_NON_ADMIN_USER_STATE and
+DEFAULT_ASSISTANT_STATE. apply_schema() validates and fills defaults in a single pass over the fields.
+Wrongly-typed values fall back to the default, unknown keys are preserved, and removed keys are dropped.
+"""
+import copy
+import dataclasses
+import json
+import typing
+
+import config
+from logger import get_logger
+
+logger = get_logger("Iri-shka_App.utils.JsonCodec")
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    orjson = None
+    ORJSON_AVAILABLE = False
+
+try:
+    import msgspec
+    MSGSPEC_AVAILABLE = True
+except ImportError:
+    msgspec = None
+    MSGSPEC_AVAILABLE = False
+
+
+# --- Backends ---
+def _stdlib_dumps_bytes(obj, indent=None, sort_keys=False) -> bytes:
+    return json.dumps(obj, indent=indent, ensure_ascii=False, sort_keys=sort_keys).encode("utf-8")
+
+def _stdlib_loads(data):
+    return json.loads(data)
+
+
+def _orjson_dumps_bytes(obj, indent=None, sort_keys=False) -> bytes:
+    option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0) | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+    return orjson.dumps(obj, option=option)
+
+def _orjson_loads(data):
+    return orjson.loads(data) # orjson.JSONDecodeError subclasses json.JSONDecodeError
+
+
+_msgspec_encoder = msgspec.json.Encoder() if MSGSPEC_AVAILABLE else None
+_msgspec_decoder = msgspec.json.Decoder() if MSGSPEC_AVAILABLE else None
+try: _msgspec_sorted_encoder = msgspec.json.Encoder(order="sorted") if MSGSPEC_AVAILABLE else None
+except TypeError: _msgspec_sorted_encoder = None # msgspec < 0.17: sorted output goes through stdlib
+
+def _msgspec_dumps_bytes(obj, indent=None, sort_keys=False) -> bytes:
+    if sort_keys and _msgspec_sorted_encoder is None: return _stdlib_dumps_bytes(obj, indent, sort_keys)
+    encoded = (_msgspec_sorted_encoder if sort_keys else _msgspec_encoder).encode(obj)
+    return msgspec.json.format(encoded, indent=2) if indent else encoded
+
+def _msgspec_loads(data):
+    try:
+        return _msgspec_decoder.decode(data)
+    except msgspec.DecodeError as e:
+        text = data.decode("utf-8", "replace") if isinstance(data, (bytes, bytearray)) else str(data)
+        raise json.JSONDecodeError(str(e), text, 0) from e
+
+
+_BACKENDS = {
+    "stdlib": (_stdlib_dumps_bytes, _stdlib_loads),
+}
+if MSGSPEC_AVAILABLE: _BACKENDS["msgspec"] = (_msgspec_dumps_bytes, _msgspec_loads)
+if ORJSON_AVAILABLE: _BACKENDS["orjson"] = (_orjson_dumps_bytes, _orjson_loads)
+
+BACKEND = "orjson" if ORJSON_AVAILABLE else ("msgspec" if MSGSPEC_AVAILABLE else "stdlib")
+_dumps_bytes_impl, _loads_impl = _BACKENDS[BACKEND]
+logger.debug(f"JSON codec backend: {BACKEND}")
+
+
+def dumps_bytes(obj, indent=None, sort_keys=False) -> bytes:
+    try:
+        return _dumps_bytes_impl(obj, indent, sort_keys)
+    except TypeError:
+        if BACKEND == "stdlib": raise
+        return _stdlib_dumps_bytes(obj, indent, sort_keys) # e.g. types the fast encoder refuses; stdlib has the final say
+
+def dumps(obj, indent=None, sort_keys=False) -> str:
+    return dumps_bytes(obj, indent, sort_keys).decode("utf-8")
+
+def loads(data):
+    """Parses str or bytes. Raises json.JSONDecodeError on invalid input."""
+    return _loads_impl(data)
+
+def load_file(filepath):
+    with open(filepath, "rb") as f:
+        return loads(f.read())
+
+
+# --- Typed state schemas ---
+def _default_from(source: dict, key: str):
+    return dataclasses.field(default_factory=lambda: copy.deepcopy(source.get(key)))
+
+
+@dataclasses.dataclass(slots=True)
+class AdminUserStateSchema:
+    name: str = _default_from(config.DEFAULT_USER_STATE, "name")
+    current_topic: str = _default_from(config.DEFAULT_USER_STATE, "current_topic")
+    topics_discussed: list = _default_from(config.DEFAULT_USER_STATE, "topics_discussed")
+    user_sentiment_summary: str = _default_from(config.DEFAULT_USER_STATE, "user_sentiment_summary")
+    preferences: dict = _default_from(config.DEFAULT_USER_STATE, "preferences")
+    calendar_events: list = _default_from(config.DEFAULT_USER_STATE, "calendar_events")
+    birthdays: list = _default_from(config.DEFAULT_USER_STATE, "birthdays")
+    gui_theme: str = _default_from(config.DEFAULT_USER_STATE, "gui_theme")
+    chat_font_size: typing.Union[int, str] = _default_from(config.DEFAULT_USER_STATE, "chat_font_size")
+
+    REMOVED_KEYS: typing.ClassVar[tuple] = ("todos",)
+
+
+@dataclasses.dataclass(slots=True)
+class CustomerStateSchema:
+    user_id: typing.Optional[int] = None
+    type_of_user: str = "customer"
+    name: typing.Optional[str] = _default_from(config.DEFAULT_NON_ADMIN_USER_STATE, "name")
+    intent: typing.Optional[str] = _default_from(config.DEFAULT_NON_ADMIN_USER_STATE, "intent")
+    chat_history: list = _default_from(config.DEFAULT_NON_ADMIN_USER_STATE, "chat_history")
+    calendar_events: list = _default_from(config.DEFAULT_NON_ADMIN_USER_STATE, "calendar_events")
+    history_summary: str = _default_from(config.DEFAULT_NON_ADMIN_USER_STATE, "history_summary")
+    conversation_stage: str = _default_from(config.DEFAULT_NON_ADMIN_USER_STATE, "conversation_stage")
+    last_message_timestamp: str = ""
+
+    REMOVED_KEYS: typing.ClassVar[tuple] = ()
+
+
+def _normalize_internal_tasks(value):
+    """internal_tasks keeps only 'pending' and 'completed' lists ('in_process' was retired)."""
+    if not isinstance(value, dict): return None
+    return {
+        **{k: v for k, v in value.items() if k not in ("in_process", "pending", "completed")},
+        "pending": value["pending"] if isinstance(value.get("pending"), list) else [],
+        "completed": value["completed"] if isinstance(value.get("completed"), list) else [],
+    }
+
+
+@dataclasses.dataclass(slots=True)
+class AssistantStateSchema:
+    persona_name: str = _default_from(config.DEFAULT_ASSISTANT_STATE, "persona_name")
+    admin_name: str = _default_from(config.DEFAULT_ASSISTANT_STATE, "admin_name")
+    current_emotion: dict = _default_from(config.DEFAULT_ASSISTANT_STATE, "current_emotion")
+    active_goals: list = _default_from(config.DEFAULT_ASSISTANT_STATE, "active_goals")
+    knowledge_gaps_identified: list = _default_from(config.DEFAULT_ASSISTANT_STATE, "knowledge_gaps_identified")
+    internal_tasks: dict = dataclasses.field(
+        default_factory=lambda: _normalize_internal_tasks(copy.deepcopy(config.DEFAULT_ASSISTANT_STATE.get("internal_tasks", {}))),
+        metadata={"normalize": _normalize_internal_tasks})
+    session_summary_points: list = _default_from(config.DEFAULT_ASSISTANT_STATE, "session_summary_points")
+    notifications: list = _default_from(config.DEFAULT_ASSISTANT_STATE, "notifications")
+    last_used_language: str = _default_from(config.DEFAULT_ASSISTANT_STATE, "last_used_language")
+    telegram_bot_status: str = _default_from(config.DEFAULT_ASSISTANT_STATE, "telegram_bot_status")
+
+    REMOVED_KEYS: typing.ClassVar[tuple] = ()
+
+
+def _runtime_types(annotation) -> tuple:
+    origin = typing.get_origin(annotation)
+    if origin is typing.Union:
+        return tuple(t for arg in typing.get_args(annotation) for t in _runtime_types(arg))
+    if annotation is type(None): return (type(None),)
+    return (origin or annotation,)
+
+
+_SCHEMA_PLANS = {} # schema class -> list of (name, accepted_types, default_factory, normalize)
+
+def _plan_for(schema_cls) -> list:
+    plan = _SCHEMA_PLANS.get(schema_cls)
+    if plan is None:
+        hints = typing.get_type_hints(schema_cls)
+        plan = []
+        for f in dataclasses.fields(schema_cls):
+            factory = f.default_factory if f.default_factory is not dataclasses.MISSING else (lambda d=f.default: d)
+            plan.append((f.name, _runtime_types(hints[f.name]), factory, f.metadata.get("normalize")))
+        _SCHEMA_PLANS[schema_cls] = plan
+    return plan
+
+
+def apply_schema(schema_cls, data, context: str = "") -> dict:
+    """
+    One pass: returns a new dict with every schema field present and correctly typed (defaults where
+    missing or invalid), the retired keys removed, and unknown extra keys kept.
+    """
+    if not isinstance(data, dict): data = {}
+    result = {k: v for k, v in data.items() if k not in schema_cls.REMOVED_KEYS}
+    for name, accepted_types, factory, normalize in _plan_for(schema_cls):
+        value = result.get(name, dataclasses.MISSING)
+        if value is not dataclasses.MISSING and normalize is not None:
+            value = normalize(value)
+            if value is None: value = dataclasses.MISSING
+        if value is dataclasses.MISSING:
+            result[name] = factory()
+        elif not isinstance(value, accepted_types) or (isinstance(value, bool) and bool not in accepted_types and int in accepted_types):
+            logger.warning(f"{context or schema_cls.__name__}: field '{name}' has invalid type {type(value).__name__}; using default.")
+            result[name] = factory()
+        else:
+            result[name] = value
+    return result
+
+
+def schema_field_types(schema_cls) -> dict:
+    """Field name -> tuple of accepted runtime types."""
+    return {name: accepted_types for name, accepted_types, _factory, _normalize in _plan_for(schema_cls)}
+
+
+def schema_defaults(schema_cls) -> dict:
+    return apply_schema(schema_cls, {})
+
+
+if __name__ == "__main__":
+    # Benchmark: encode/decode time per state document for every available backend, plus schema application.
+    import time
+
+    customer_doc = schema_defaults(CustomerStateSchema)
+    customer_doc.update({"user_id": 123456789, "name": "Анна", "conversation_stage": "aggregating_messages",
+                         "chat_history": [{"sender": "customer", "message": "Здравствуйте, хочу записаться " * 4,
+                                           "timestamp": "2025-01-01T10:00:00+00:00"} for _ in range(30)]})
+    documents = {
+        "admin_user_state": schema_defaults(AdminUserStateSchema),
+        "assistant_state": schema_defaults(AssistantStateSchema),
+        "customer_state(30 msgs)": customer_doc,
+    }
+    n = 2000
+    print(f"Active backend: {BACKEND}")
+    print(f"{'document':<26}{'backend':<9}{'indent':>7}{'encode us':>11}{'decode us':>11}{'bytes':>8}")
+    for doc_name, doc in documents.items():
+        for backend_name, (enc, dec) in _BACKENDS.items():
+            for indent in (None, 2):
+                payload = enc(doc, indent)
+                t0 = time.perf_counter()
+                for _ in range(n): enc(doc, indent)
+                t_enc = (time.perf_counter() - t0) / n * 1e6
+                t0 = time.perf_counter()
+                for _ in range(n): dec(payload)
+                t_dec = (time.perf_counter() - t0) / n * 1e6
+                print(f"{doc_name:<26}{backend_name:<9}{str(indent):>7}{t_enc:>11.1f}{t_dec:>11.1f}{len(payload):>8}")
+    for schema_cls, doc in ((AdminUserStateSchema, documents["admin_user_state"]),
+                            (AssistantStateSchema, documents["assistant_state"]),
+                            (CustomerStateSchema, customer_doc)):
+        t0 = time.perf_counter()
+        for _ in range(n): apply_schema(schema_cls, doc)
+        print(f"apply_schema({schema_cls.__name__}): {(time.perf_counter() - t0) / n * 1e6:.1f} us")
@@ -0,0 +1,165 @@
+# utils/loop_monitor.py
+"""
+Event-loop lag monitor for the Telegram polling loop.
+
+A heartbeat coroutine sleeps for `interval` and measures how late it wakes up. Lateness means some
+callback held the loop, and while it does, no other update is handled. A watchdog thread checks the
+heartbeat too. When the loop has been stuck longer than the threshold, it records the loop thread's
+current stack, so the log line names the code that blocked rather than just the size of the stall.
+
+    monitor = EventLoopLagMonitor("TelegramLoop")
+    await monitor.start()   # from inside the loop (e.g. Application.post_init)
+    ...
+    await monitor.stop()    # e.g. Application.post_shutdown
+"""
+import asyncio
+import sys
+import threading
+import time
+import traceback
+
+import config
+from logger import get_logger
+from .interaction_pipeline import DurationStat
+
+logger = get_logger("Iri-shka_App.utils.LoopMonitor")
+
+
+class EventLoopLagMonitor:
+    def __init__(self, name: str, threshold_ms: float = None, interval_s: float = None):
+        self.name = name
+        self.threshold_s = (threshold_ms if threshold_ms is not None else config.TELEGRAM_LOOP_LAG_THRESHOLD_MS) / 1000.0
+        self.interval_s = interval_s if interval_s is not None else config.TELEGRAM_LOOP_MONITOR_INTERVAL_SECONDS
+        self._task = None
+        self._watchdog = None
+        self._stop_requested = threading.Event()
+        self._loop_thread_id = None
+        self._lock = threading.Lock()
+        self._expected_wake = None # monotonic time the heartbeat should wake at; None while stopped
+        self._stall_stack = None # Loop thread stack captured by the watchdog during the current stall
+        self._lag = DurationStat()
+        self._stalls = 0
+
+    async def start(self):
+        if self._task: return
+        self._loop_thread_id = threading.get_ident()
+        self._stop_requested.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat(), name=f"{self.name}-lag-monitor")
+        self._watchdog = threading.Thread(target=self._watch, daemon=True, name=f"{self.name}-LagWatchdog")
+        self._watchdog.start()
+        logger.info(f"Loop lag monitor '{self.name}' started (threshold {self.threshold_s * 1000:.0f} ms).")
+
+    async def stop(self):
+        self._stop_requested.set()
+        task, self._task = self._task, None
+        if task:
+            task.cancel()
+            try: await task
+            except asyncio.CancelledError: pass
+        if self._watchdog: self._watchdog.join(timeout=1.0); self._watchdog = None
+        logger.info(f"Loop lag monitor '{self.name}' stopped: {self.get_metrics()}")
+
+    async def _heartbeat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock: self._expected_wake = loop.time() + self.interval_s
+            await asyncio.sleep(self.interval_s)
+            lag = max(0.0, loop.time() - self._expected_wake)
+            with self._lock:
+                self._lag.add(lag)
+                stack, self._stall_stack = self._stall_stack, None
+                if lag >= self.threshold_s: self._stalls += 1
+            if lag >= self.threshold_s:
+                where = f" Blocked in:\n{stack}" if stack else ""
+                logger.warning(f"Event loop '{self.name}' blocked for {lag * 1000:.0f} ms.{where}")
+
+    def _watch(self):
+        """Captures the loop thread's stack once per stall, while the blocking callback is still running."""
+        while not self._stop_requested.wait(self.threshold_s / 2):
+            with self._lock:
+                if self._expected_wake is None or self._stall_stack is not None: continue
+                if time.monotonic() - self._expected_wake < self.threshold_s: continue # loop.time() is monotonic
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None: continue
+            stack = "".join(traceback.format_list(traceback.extract_stack(frame)[-6:])) # Innermost frames
+            with self._lock: self._stall_stack = stack
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            return {"lag": self._lag.as_dict(), "stalls_over_threshold": self._stalls, "threshold_ms": round(self.threshold_s * 1000)}
+
+
+if __name__ == "__main__":
+    # Update-flood simulation: 500 customer messages in 6 s (10x the 500/minute target) through a handler that
+    # loads and saves a JSON state file (fsync'd, like the atomic state writes) and, every 50th message,
+    # runs a 250 ms CPU job standing in for pydub/ffmpeg or dashboard rendering. A probe "admin update"
+    # is measured every 100 ms. Inline: the blocking work runs on the loop. Offloaded: run_in_executor.
+    import json
+    import os
+    import shutil
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+
+    n_messages, duration_s, probe_every_s = 500, 6.0, 0.1
+    state_dir = tempfile.mkdtemp(prefix="loop_flood_")
+    history = [{"sender": "customer", "message": "x" * 120, "timestamp": "2025-01-01T00:00:00"}] * 60
+
+    def load_state(user_id):
+        path = os.path.join(state_dir, f"{user_id}.json")
+        if not os.path.exists(path): return {"user_id": user_id, "chat_history": list(history)}
+        with open(path, "r", encoding="utf-8") as f: return json.load(f)
+
+    def save_state(user_id, state):
+        path = os.path.join(state_dir, f"{user_id}.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(state, f); f.flush(); os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+    def cpu_job():
+        end = time.perf_counter() + 0.25
+        while time.perf_counter() < end: pass
+
+    async def flood(offload: bool) -> dict:
+        loop = asyncio.get_running_loop()
+        pool = ThreadPoolExecutor(max_workers=4)
+        run = (lambda fn, *a: loop.run_in_executor(pool, fn, *a)) if offload else (lambda fn, *a: _inline(fn, *a))
+        locks = {}
+        monitor = EventLoopLagMonitor("flood-" + ("offloaded" if offload else "inline"), threshold_ms=100, interval_s=0.02)
+        await monitor.start()
+
+        async def handle(n):
+            user_id = n % 40
+            lock = locks.setdefault(user_id, asyncio.Lock())
+            async with lock:
+                state = await run(load_state, user_id)
+                state["chat_history"].append({"sender": "customer", "message": f"msg {n}"})
+                state["chat_history"] = state["chat_history"][-60:]
+                await run(save_state, user_id, state)
+            if n % 50 == 0: await run(cpu_job)
+
+        probe_latencies = []
+        async def probes():
+            started = time.perf_counter()
+            for k in range(1, int(duration_s / probe_every_s) + 1):
+                arrives_at = started + k * probe_every_s # When the admin update "arrives"
+                await asyncio.sleep(max(0.0, arrives_at - time.perf_counter()))
+                probe_latencies.append(time.perf_counter() - arrives_at) # How long until the loop got to it
+
+        probe_task = asyncio.create_task(probes())
+        tasks = []
+        for n in range(n_messages):
+            tasks.append(asyncio.create_task(handle(n)))
+            await asyncio.sleep(duration_s / n_messages)
+        await asyncio.gather(*tasks); await probe_task
+        await monitor.stop()
+        pool.shutdown()
+        probe_latencies.sort()
+        return {"max_lag_ms": round(monitor.get_metrics()["lag"]["max_s"] * 1000), "stalls": monitor.get_metrics()["stalls_over_threshold"],
+                "probe_p99_ms": round(probe_latencies[int(len(probe_latencies) * 0.99) - 1] * 1000, 1),
+                "probe_max_ms": round(probe_latencies[-1] * 1000, 1)}
+
+    async def _inline(fn, *args): return fn(*args)
+
+    for offload in (False, True):
+        print(("offloaded" if offload else "inline   "), asyncio.run(flood(offload)))
+    shutil.rmtree(state_dir, ignore_errors=True)
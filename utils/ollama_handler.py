@@ -1,13 +1,45 @@
 # utils/ollama_handler.py
 import requests
 import json
+import threading
 from datetime import datetime, timezone, timedelta
 import config # Imports OLLAMA_API_URL, OLLAMA_MODEL_NAME, OLLAMA_PROMPT_TEMPLATE etc.
 
 from logger import get_logger # Assuming logger.py is in project root
+from . import json_codec
 
 logger = get_logger("Iri-shka_App.OllamaHandler")
 
+_eval_stats_lock = threading.Lock()
+_eval_stats = {} # stats_label -> {"turns", "eval_count", "prompt_eval_count", "eval_duration_ns"}
+
+
+def _record_eval_stats(stats_label: str, ollama_api_response: dict):
+    """Accumulates Ollama's per-request token counters (eval_count = generated tokens) under stats_label."""
+    eval_count = ollama_api_response.get("eval_count")
+    if eval_count is None: return
+    prompt_eval_count = ollama_api_response.get("prompt_eval_count") or 0
+    eval_duration_ns = ollama_api_response.get("eval_duration") or 0
+    with _eval_stats_lock:
+        stats = _eval_stats.setdefault(stats_label, {"turns": 0, "eval_count": 0, "prompt_eval_count": 0, "eval_duration_ns": 0})
+        stats["turns"] += 1
+        stats["eval_count"] += eval_count
+        stats["prompt_eval_count"] += prompt_eval_count
+        stats["eval_duration_ns"] += eval_duration_ns
+    logger.info(f"LLM turn stats [{stats_label}]: eval_count={eval_count}, prompt_eval_count={prompt_eval_count}, "
+                f"eval_duration={eval_duration_ns / 1e9:.2f}s")
+
+
+def get_llm_eval_metrics() -> dict:
+    """Per stats_label averages: generated tokens (eval_count), prompt tokens and generation seconds per turn."""
+    with _eval_stats_lock:
+        return {label: {
+            "turns": s["turns"],
+            "avg_eval_count": s["eval_count"] / s["turns"],
+            "avg_prompt_eval_count": s["prompt_eval_count"] / s["turns"],
+            "avg_eval_seconds": s["eval_duration_ns"] / s["turns"] / 1e9,
+        } for label, s in _eval_stats.items() if s["turns"]}
+
 def check_ollama_server_and_model():
     """
     Pings the Ollama server with the primary model to check readiness.
@@ -76,7 +108,8 @@ def call_ollama_for_chat_response(
     language_instruction: str = "",   # For admin prompt primarily
     format_kwargs: dict = None,       # ALL other dynamic values needed by the prompt template
     expected_keys_override: list = None, # To specify different expected JSON keys for different prompts
-    gui_callbacks=None
+    gui_callbacks=None,
+    stats_label: str = "other"        # Groups eval_count metrics, e.g. "admin/patch" vs "admin/full"
 ):
     """
     Calls the Ollama API with a dynamically formatted prompt and expects a JSON response
@@ -120,8 +153,8 @@ def call_ollama_for_chat_response(
         "current_time_string": datetime.now(timezone(timedelta(hours=config.TIMEZONE_OFFSET_HOURS))).strftime("%A, %Y-%m-%d %H:%M:%S"),
         "history_len": len(history_for_prompt),
         "chat_log_string": final_chat_log_string,
-        "user_state_string": json.dumps(current_user_state, indent=2, ensure_ascii=False), # This will be admin's state or customer's state depending on caller
-        "assistant_state_string": json.dumps(current_assistant_state, indent=2, ensure_ascii=False),
+        "user_state_string": json_codec.dumps(current_user_state, indent=2), # This will be admin's state or customer's state depending on caller
+        "assistant_state_string": json_codec.dumps(current_assistant_state, indent=2),
         "last_transcribed_text": transcribed_text, # Primarily for admin direct interaction prompt
         "actual_dark_theme_value": config.GUI_THEME_DARK,
         "actual_light_theme_value": config.GUI_THEME_LIGHT,
@@ -172,7 +205,9 @@ def call_ollama_for_chat_response(
 
         # Ollama's API response is JSON. The LLM's generated output (which should also be JSON)
         # is expected to be a string within the "response" field of Ollama's JSON.
-        response_json_str = response.json().get("response", "")
+        ollama_api_response = response.json()
+        _record_eval_stats(stats_label, ollama_api_response)
+        response_json_str = ollama_api_response.get("response", "")
         if not response_json_str:
             err_msg = "Ollama API call successful, but the 'response' field (containing LLM's JSON string) was empty."
             logger.error(f"{err_msg} (Context: {log_user_identifier})")
@@ -180,7 +215,7 @@ def call_ollama_for_chat_response(
 
         try:
             # Parse the JSON string that the LLM generated
-            ollama_llm_generated_json_output = json.loads(response_json_str)
+            ollama_llm_generated_json_output = json_codec.loads(response_json_str)
         except json.JSONDecodeError as je:
             err_msg = (f"Ollama's 'response' field content was not valid JSON: {je}. "
                        f"LLM generated text (first 500 chars): {response_json_str[:500]}...")
@@ -0,0 +1,189 @@
+# utils/opus_encoder.py
+"""
+In-memory NumPy PCM -> Opus/OGG encoding for TTS replies (Telegram voice notes, Web UI playback).
+
+Backends, in order of preference:
+  1. libsndfile through `soundfile` (native, in-process). Used when libsndfile >= 1.0.29 has OGG/OPUS.
+  2. ffmpeg over stdin/stdout pipes. A spare ffmpeg process is always pre-spawned with the fixed
+     encoder arguments, so its startup cost stays off the reply path.
+Neither backend touches the disk. Resampling is vectorized NumPy (FIR low-pass + linear interpolation).
+TTS_OPUS_BITRATE applies to both: ffmpeg gets it as -b:a, libsndfile (soundfile >= 0.12) as the
+compression_level it maps linearly onto Opus' 6-256 kbit/s range.
+"""
+import io
+import shutil
+import subprocess
+import threading
+
+import numpy as np
+
+import config
+from logger import get_logger
+
+logger = get_logger("Iri-shka_App.utils.OpusEncoder")
+
+sf = None
+SOUNDFILE_OPUS_AVAILABLE = False
+try:
+    import soundfile as sf_module
+    sf = sf_module
+    SOUNDFILE_OPUS_AVAILABLE = "OPUS" in sf.available_subtypes("OGG")
+except ImportError:
+    logger.warning("soundfile not found. Native Opus encoding unavailable.")
+except Exception as e_sf_probe:
+    logger.warning(f"Could not probe libsndfile for OGG/OPUS support: {e_sf_probe}")
+
+FFMPEG_PATH = shutil.which("ffmpeg")
+OPUS_SUPPORTED_RATES = (8000, 12000, 16000, 24000, 48000)
+_SNDFILE_OPUS_MIN_BPS, _SNDFILE_OPUS_MAX_BPS = 6000, 256000 # libsndfile: compression_level 1.0 -> min, 0.0 -> max
+_sndfile_compression_supported = True # Cleared if soundfile < 0.12 rejects compression_level
+
+
+def bitrate_to_bps(bitrate) -> int:
+    """'24k' / '24000' / 24000 -> 24000."""
+    text = str(bitrate).strip().lower()
+    return int(float(text[:-1]) * 1000) if text.endswith("k") else int(float(text))
+
+
+def _sndfile_compression_level(bitrate) -> float:
+    bps = min(max(bitrate_to_bps(bitrate), _SNDFILE_OPUS_MIN_BPS), _SNDFILE_OPUS_MAX_BPS)
+    return 1.0 - (bps - _SNDFILE_OPUS_MIN_BPS) / (_SNDFILE_OPUS_MAX_BPS - _SNDFILE_OPUS_MIN_BPS)
+
+
+def _lowpass_kernel(cutoff_ratio: float, taps: int = 63) -> np.ndarray:
+    """Hann-windowed sinc, cutoff as a fraction of the source Nyquist."""
+    n = np.arange(taps) - (taps - 1) / 2
+    kernel = cutoff_ratio * np.sinc(cutoff_ratio * n) * np.hanning(taps)
+    return (kernel / kernel.sum()).astype(np.float32)
+
+
+def resample_pcm(audio: np.ndarray, src_rate: int, dst_rate: int) -> np.ndarray:
+    """Mono float32 resampling, fully vectorized. Low-passes first when downsampling to avoid aliasing."""
+    audio = np.asarray(audio, dtype=np.float32).reshape(-1)
+    if src_rate == dst_rate or audio.size == 0:
+        return audio
+    if dst_rate < src_rate:
+        audio = np.convolve(audio, _lowpass_kernel(dst_rate / src_rate * 0.95), mode="same")
+    out_len = int(round(audio.size * dst_rate / src_rate))
+    positions = np.arange(out_len, dtype=np.float64) * (src_rate / dst_rate)
+    return np.interp(positions, np.arange(audio.size, dtype=np.float64), audio).astype(np.float32)
+
+
+def float_to_pcm16_bytes(audio: np.ndarray) -> bytes:
+    return (np.clip(audio, -1.0, 1.0) * 32767.0).astype("<i2").tobytes()
+
+
+class _FfmpegOpusPipe:
+    """Keeps one idle ffmpeg process ready. Each encode consumes it and spawns the next in the background."""
+    def __init__(self, sample_rate: int, bitrate: str):
+        self.sample_rate = sample_rate
+        self.bitrate = bitrate
+        self._lock = threading.Lock()
+        self._spare = None
+        self._closed = False
+
+    def _spawn(self):
+        return subprocess.Popen(
+            [FFMPEG_PATH, "-hide_banner", "-loglevel", "error",
+             "-f", "s16le", "-ar", str(self.sample_rate), "-ac", "1", "-i", "pipe:0",
+             "-c:a", "libopus", "-b:a", self.bitrate, "-application", "voip", "-f", "ogg", "pipe:1"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+
+    def _refill(self):
+        try:
+            proc = self._spawn()
+        except Exception as e_spawn:
+            logger.warning(f"Could not pre-spawn ffmpeg: {e_spawn}")
+            return
+        with self._lock:
+            if self._closed or self._spare is not None:
+                proc.kill(); proc.wait()
+                return
+            self._spare = proc
+
+    def encode(self, pcm16: bytes, timeout: float) -> bytes:
+        with self._lock:
+            proc, self._spare = self._spare, None
+        if proc is None or proc.poll() is not None:
+            proc = self._spawn()
+        if not self._closed:
+            threading.Thread(target=self._refill, daemon=True, name="FfmpegOpusRefill").start()
+        try:
+            ogg_bytes, err = proc.communicate(input=pcm16, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill(); proc.communicate()
+            raise RuntimeError(f"ffmpeg Opus encode timed out after {timeout}s")
+        if proc.returncode != 0:
+            raise RuntimeError(f"ffmpeg Opus encode failed ({proc.returncode}): {err.decode(errors='replace')[:200]}")
+        return ogg_bytes
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            proc, self._spare = self._spare, None
+        if proc is not None:
+            proc.kill(); proc.wait()
+
+
+_ffmpeg_pipe = None
+_ffmpeg_pipe_lock = threading.Lock()
+
+
+def _get_ffmpeg_pipe(sample_rate: int, bitrate: str):
+    global _ffmpeg_pipe
+    with _ffmpeg_pipe_lock:
+        if _ffmpeg_pipe is None or _ffmpeg_pipe.sample_rate != sample_rate or _ffmpeg_pipe.bitrate != bitrate:
+            if _ffmpeg_pipe is not None: _ffmpeg_pipe.close()
+            _ffmpeg_pipe = _FfmpegOpusPipe(sample_rate, bitrate)
+        return _ffmpeg_pipe
+
+
+def is_opus_encoding_available() -> bool:
+    return SOUNDFILE_OPUS_AVAILABLE or bool(FFMPEG_PATH)
+
+
+def encode_pcm_to_ogg_opus(audio: np.ndarray, samplerate: int, target_rate=None, bitrate=None) -> bytes:
+    """
+    Encodes mono float PCM to an OGG/Opus byte string entirely in memory.
+    Raises RuntimeError if no backend is available or encoding fails.
+    """
+    target_rate = int(target_rate or config.TTS_OPUS_SAMPLE_RATE)
+    bitrate = bitrate or config.TTS_OPUS_BITRATE
+    if target_rate not in OPUS_SUPPORTED_RATES:
+        logger.warning(f"Opus does not support {target_rate}Hz. Using 48000Hz.")
+        target_rate = 48000
+    pcm = resample_pcm(audio, int(samplerate), target_rate)
+
+    if SOUNDFILE_OPUS_AVAILABLE:
+        global _sndfile_compression_supported
+        buf = io.BytesIO()
+        if _sndfile_compression_supported:
+            try:
+                sf.write(buf, pcm, target_rate, format="OGG", subtype="OPUS",
+                         compression_level=_sndfile_compression_level(bitrate), bitrate_mode="VARIABLE")
+                return buf.getvalue()
+            except TypeError: # soundfile < 0.12
+                _sndfile_compression_supported = False
+                logger.warning("soundfile < 0.12 cannot set the Opus bitrate; TTS_OPUS_BITRATE only applies to ffmpeg.")
+                buf = io.BytesIO()
+        sf.write(buf, pcm, target_rate, format="OGG", subtype="OPUS")
+        return buf.getvalue()
+    if FFMPEG_PATH:
+        return _get_ffmpeg_pipe(target_rate, bitrate).encode(float_to_pcm16_bytes(pcm), config.TTS_OPUS_ENCODE_TIMEOUT_SECONDS)
+    raise RuntimeError("No Opus encoder available (libsndfile without OPUS and no ffmpeg on PATH).")
+
+
+def encode_pcm_to_wav(audio: np.ndarray, samplerate: int) -> bytes:
+    """PCM_16 WAV bytes, for clients that cannot play Opus."""
+    buf = io.BytesIO()
+    sf.write(buf, np.asarray(audio, dtype=np.float32), int(samplerate), format="WAV", subtype="PCM_16")
+    return buf.getvalue()
+
+
+def shutdown_encoder():
+    global _ffmpeg_pipe
+    with _ffmpeg_pipe_lock:
+        if _ffmpeg_pipe is not None:
+            _ffmpeg_pipe.close()
+            _ffmpeg_pipe = None
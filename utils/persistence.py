@@ -0,0 +1,219 @@
+# utils/persistence.py
+"""
+Write-behind persistence for state documents (assistant state, admin user state, customer states).
+
+Saves mark a document dirty with a snapshot of its latest content. A single flusher thread writes each
+dirty document once its debounce window has elapsed, so a burst of saves becomes one write.
+
+Durability per document type (config.PERSISTENCE_POLICIES):
+  mode "sync"          - written on the caller's thread before save returns (the old behavior).
+  mode "write_behind"  - returned immediately. Written `debounce_ms` after the last save, and at most
+                         `max_delay_ms` after the first unflushed save, so steady churn cannot starve it.
+                         A process crash (not a clean exit) can lose up to max_delay_ms of updates.
+shutdown() (called from on_app_exit) and flush() write everything pending before returning.
+Reads must go through get_pending() first so callers never see disk content older than their own save.
+get_pending() also returns a snapshot that is being written right now, until its write has finished.
+Writes of one document never overlap: a document that is being written is not taken again until that
+write finishes, so an older snapshot can never land on disk after a newer one.
+"""
+import collections
+import copy
+import threading
+import time
+
+import config
+from logger import get_logger
+
+logger = get_logger("Iri-shka_App.utils.Persistence")
+
+
+class _PendingDoc:
+    __slots__ = ("data", "write_fn", "first_dirty", "deadline", "gui_callbacks")
+
+    def __init__(self, data, write_fn, first_dirty, deadline, gui_callbacks):
+        self.data = data
+        self.write_fn = write_fn
+        self.first_dirty = first_dirty
+        self.deadline = deadline
+        self.gui_callbacks = gui_callbacks
+
+
+class WriteBehindStore:
+    def __init__(self, policies=None):
+        self.policies = policies if policies is not None else config.PERSISTENCE_POLICIES
+        self._cond = threading.Condition()
+        self._pending = {} # (doc_type, key) -> _PendingDoc
+        self._writing = {} # doc_id -> _PendingDoc whose write is in progress (flusher or flush())
+        self._stopped = False
+        self._thread = None
+        # Metrics
+        self.saves_requested = 0
+        self.writes_performed = 0
+        self.write_errors = 0
+        self._avoided_timestamps = collections.deque() # monotonic ts of each coalesced (skipped) write
+        self._last_metrics_log = time.monotonic()
+
+    def _policy(self, doc_type: str) -> dict:
+        return self.policies.get(doc_type, self.policies.get("default", {"mode": "sync"}))
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._flusher_loop, daemon=True, name="WriteBehindFlusher")
+            self._thread.start()
+
+    def save(self, doc_type: str, key, data, write_fn, gui_callbacks=None) -> bool:
+        """
+        Persists `data` with `write_fn(data) -> bool` according to the doc type's policy.
+        `data` is deep-copied before returning, so the caller may keep mutating its object.
+        """
+        policy = self._policy(doc_type)
+        with self._cond:
+            self.saves_requested += 1
+        if policy.get("mode", "sync") != "write_behind" or self._stopped:
+            ok = self._run_write(write_fn, data, doc_type, key, gui_callbacks)
+            return ok
+
+        snapshot = copy.deepcopy(data)
+        now = time.monotonic()
+        debounce = policy.get("debounce_ms", 500) / 1000.0
+        max_delay = policy.get("max_delay_ms", 2000) / 1000.0
+        doc_id = (doc_type, key)
+        with self._cond:
+            existing = self._pending.get(doc_id)
+            if existing is not None:
+                self._avoided_timestamps.append(now) # The earlier snapshot will never be written
+                existing.data = snapshot
+                existing.write_fn = write_fn
+                existing.gui_callbacks = gui_callbacks
+                existing.deadline = min(now + debounce, existing.first_dirty + max_delay)
+            else:
+                self._pending[doc_id] = _PendingDoc(snapshot, write_fn, now, now + debounce, gui_callbacks)
+            self._ensure_thread()
+            self._cond.notify()
+        return True
+
+    def get_pending(self, doc_type: str, key):
+        """Deep copy of the newest content for a document that is not on disk yet (pending or in flight), or None."""
+        doc_id = (doc_type, key)
+        with self._cond:
+            doc = self._pending.get(doc_id) or self._writing.get(doc_id)
+            return copy.deepcopy(doc.data) if doc is not None else None
+
+    def _run_write(self, write_fn, data, doc_type, key, gui_callbacks) -> bool:
+        try:
+            ok = bool(write_fn(data))
+        except Exception as e_write:
+            logger.error(f"Write of {doc_type} '{key}' raised: {e_write}", exc_info=True)
+            ok = False
+        with self._cond:
+            self.writes_performed += 1
+            if not ok: self.write_errors += 1
+        if not ok and gui_callbacks and callable(gui_callbacks.get('messagebox_warn')):
+            gui_callbacks['messagebox_warn']("Save Error", f"Could not save {doc_type} '{key}'. See logs.")
+        return ok
+
+    def _take_due(self, force=False):
+        """Pops due documents that are not being written and marks them as being written. Call under _cond."""
+        now = time.monotonic()
+        due = [doc_id for doc_id, doc in self._pending.items()
+               if doc_id not in self._writing and (force or doc.deadline <= now)]
+        batch = [(doc_id, self._pending.pop(doc_id)) for doc_id in due]
+        self._writing.update(batch)
+        return batch
+
+    def _write_batch(self, batch):
+        """Writes a batch taken by _take_due (without holding _cond) and releases its documents."""
+        try:
+            for (doc_type, key), doc in batch:
+                self._run_write(doc.write_fn, doc.data, doc_type, key, doc.gui_callbacks)
+        finally:
+            with self._cond:
+                for doc_id, doc in batch:
+                    if self._writing.get(doc_id) is doc: del self._writing[doc_id]
+                self._cond.notify_all()
+
+    def _flusher_loop(self):
+        logger.debug("Write-behind flusher started.")
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    deadlines = [doc.deadline for doc_id, doc in self._pending.items() if doc_id not in self._writing]
+                    if deadlines:
+                        wait_for = min(deadlines) - time.monotonic()
+                        if wait_for <= 0: break
+                        self._cond.wait(wait_for)
+                    else:
+                        self._cond.wait() # Nothing pending, or only documents flush() is writing right now
+                if self._stopped and not self._pending: break
+                batch = self._take_due(force=self._stopped)
+                if not batch: # Stopped while flush() still writes the rest
+                    self._cond.wait(0.1); continue
+            self._write_batch(batch)
+            if time.monotonic() - self._last_metrics_log >= 60.0:
+                self._last_metrics_log = time.monotonic()
+                metrics = self.get_metrics()
+                logger.info(f"Write-behind: {metrics['writes_avoided_per_minute']} writes avoided in the last minute "
+                            f"({metrics['writes_performed']} writes for {metrics['saves_requested']} saves since start).")
+        logger.debug("Write-behind flusher stopped.")
+
+    def flush(self, timeout=None) -> bool:
+        """Barrier: writes every pending document now and waits until all writes (incl. in-flight) finish."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._cond:
+                while True:
+                    if not self._pending and not self._writing: return True
+                    batch = self._take_due(force=True) # Skips documents whose write is still running
+                    if batch: break
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0: return False
+                    self._cond.wait(remaining if remaining is not None else 0.1)
+            self._write_batch(batch) # Documents saved again meanwhile are picked up on the next pass
+
+    def shutdown(self, timeout=10.0):
+        """Flushes everything, then stops the flusher. Later saves are written synchronously."""
+        flushed = self.flush(timeout=timeout)
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread and self._thread.is_alive(): self._thread.join(timeout=timeout)
+        metrics = self.get_metrics()
+        logger.info(f"Write-behind store shut down (flushed: {flushed}). Saves: {metrics['saves_requested']}, "
+                    f"writes: {metrics['writes_performed']}, avoided: {metrics['writes_avoided_total']}.")
+        return flushed
+
+    def get_metrics(self) -> dict:
+        now = time.monotonic()
+        with self._cond:
+            while self._avoided_timestamps and now - self._avoided_timestamps[0] > 60.0:
+                self._avoided_timestamps.popleft()
+            return {
+                "saves_requested": self.saves_requested,
+                "writes_performed": self.writes_performed,
+                "write_errors": self.write_errors,
+                "writes_avoided_total": max(self.saves_requested - self.writes_performed - len(self._pending) - len(self._writing), 0),
+                "writes_avoided_per_minute": len(self._avoided_timestamps),
+                "pending_documents": len(self._pending),
+            }
+
+
+_store: WriteBehindStore = None # type: ignore
+_store_lock = threading.Lock()
+
+
+def get_store() -> WriteBehindStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = WriteBehindStore()
+        return _store
+
+
+def flush(timeout=None) -> bool:
+    return get_store().flush(timeout=timeout)
+
+
+def shutdown(timeout=10.0) -> bool:
+    with _store_lock:
+        store = _store
+    return store.shutdown(timeout=timeout) if store is not None else True
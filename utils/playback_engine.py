@@ -0,0 +1,355 @@
+# utils/playback_engine.py
+"""
+Gapless playback for streaming TTS.
+
+One sounddevice.OutputStream per process stays open in callback mode and pulls from a preallocated
+single-producer/single-consumer ring buffer. Utterances only reset the per-utterance state; the stream
+and ring are reopened when the sample rate changes or the device stream died. The synthesis thread
+writes chunks as they are ready, and the PortAudio callback reads them (silence while the ring is empty).
+Neither side takes a lock.
+Chunk boundaries get a short equal-power crossfade, or a fade-out/fade-in around the configured gap,
+so nothing clicks. The gap itself is zero-filled in place instead of allocating silence arrays.
+"""
+import inspect
+import threading
+import time
+
+import numpy as np
+
+import config
+from logger import get_logger
+
+logger = get_logger("Iri-shka_App.utils.PlaybackEngine")
+
+sd = None
+SD_AVAILABLE = False
+try:
+    import sounddevice as sd_module
+    sd = sd_module
+    SD_AVAILABLE = True
+except ImportError:
+    logger.warning("SoundDevice library not found. Streaming playback engine unavailable.")
+except Exception as e_sd_import:
+    logger.error(f"Error importing SoundDevice for playback engine: {e_sd_import}", exc_info=True)
+
+
+class PcmRingBuffer:
+    """
+    Fixed-size float32 ring buffer for exactly one writer thread and one reader (the audio callback).
+    Each index is only ever written by its owner, and int assignment is atomic under the GIL,
+    so the buffer needs no lock.
+    """
+    def __init__(self, capacity_samples: int):
+        self._buf = np.zeros(int(capacity_samples), dtype=np.float32)
+        self._capacity = int(capacity_samples)
+        self._write_pos = 0 # Total samples ever written (owned by writer)
+        self._read_pos = 0  # Total samples ever read (owned by reader)
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    def available_to_read(self) -> int:
+        return self._write_pos - self._read_pos
+
+    def available_to_write(self) -> int:
+        return self._capacity - (self._write_pos - self._read_pos)
+
+    def write(self, samples: np.ndarray) -> int:
+        """Copies as many samples as fit. Returns the number written."""
+        n = min(len(samples), self.available_to_write())
+        if n <= 0: return 0
+        start = self._write_pos % self._capacity
+        first = min(n, self._capacity - start)
+        self._buf[start:start + first] = samples[:first]
+        if n > first:
+            self._buf[:n - first] = samples[first:n]
+        self._write_pos += n # Publish only after the copy is complete
+        return n
+
+    def write_zeros(self, count: int) -> int:
+        n = min(int(count), self.available_to_write())
+        if n <= 0: return 0
+        start = self._write_pos % self._capacity
+        first = min(n, self._capacity - start)
+        self._buf[start:start + first] = 0.0
+        if n > first:
+            self._buf[:n - first] = 0.0
+        self._write_pos += n
+        return n
+
+    def read_into(self, out: np.ndarray) -> int:
+        """Fills `out` (1-D view) with up to len(out) samples. Returns the number read."""
+        n = min(len(out), self.available_to_read())
+        if n <= 0: return 0
+        start = self._read_pos % self._capacity
+        first = min(n, self._capacity - start)
+        out[:first] = self._buf[start:start + first]
+        if n > first:
+            out[first:n] = self._buf[:n - first]
+        self._read_pos += n
+        return n
+
+    def discard(self):
+        """Reader side: drops everything queued."""
+        self._read_pos = self._write_pos
+
+
+def _callback_accepts_timestamp(callback) -> bool:
+    try:
+        params = inspect.signature(callback).parameters.values()
+    except (TypeError, ValueError):
+        return False
+    return any(p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD, p.VAR_POSITIONAL) for p in params)
+
+
+class StreamingPlaybackEngine:
+    """
+    Usage (from the synthesis thread):
+        engine = get_shared_engine()
+        engine.begin(stop_event, on_playback_start_callback)  # waits for any previous utterance to end
+        engine.write_chunk(audio, samplerate)   # repeat per chunk, blocks only when the ring is full
+        engine.finish_and_wait()                # drains the ring (returns at once if stop_event is set)
+        engine.end_utterance()                  # idempotent; call in a finally
+    The stream stays open between utterances; close() is for shutdown.
+    """
+    def __init__(self, crossfade_ms=None, ring_seconds=None, blocksize=None):
+        self.crossfade_ms = config.PLAYBACK_CROSSFADE_MS if crossfade_ms is None else crossfade_ms
+        self.ring_seconds = config.PLAYBACK_RING_BUFFER_SECONDS if ring_seconds is None else ring_seconds
+        self.blocksize = config.PLAYBACK_BLOCKSIZE if blocksize is None else blocksize
+
+        self.samplerate = None
+        self._ring = None
+        self._stream = None
+        self._fade_in = None
+        self._fade_out = None
+        self._stream_failed = False # Set when the device stream ended on its own; the next chunk reopens
+        self._stream_generation = 0 # finished_callback of an already replaced stream is ignored
+        self._utterance_lock = threading.Lock() # One utterance feeds the ring at a time
+
+        # Per-utterance state, reset by begin()
+        self.stop_event = None
+        self.on_playback_start_callback = None
+        self.playback_start_ts = None # Wall-clock (time.time()) when the first sample reaches the DAC
+        self._gap_samples = 0
+        self._gap_ms = 0
+        self._tail = None      # Held-back end of the previous chunk, crossfaded into the next one
+        self._chunks_written = 0
+        self._input_finished = False
+        self._first_audio_event = threading.Event()
+        self._drained_event = threading.Event()
+        self._in_utterance = False
+
+    # --- Stream lifecycle ---
+    def _open(self, samplerate: int):
+        self._close_stream()
+        self.samplerate = int(samplerate)
+        self._ring = PcmRingBuffer(max(int(self.ring_seconds * self.samplerate), self.samplerate))
+        fade_len = max(int(self.crossfade_ms / 1000 * self.samplerate), 0)
+        self._fade_in, self._fade_out = None, None
+        if fade_len > 0:
+            t = np.linspace(0.0, np.pi / 2, fade_len, dtype=np.float32)
+            self._fade_in, self._fade_out = np.sin(t), np.cos(t) # Equal-power pair
+        self._stream_failed = False
+        generation = self._stream_generation
+        self._stream = sd.OutputStream(
+            samplerate=self.samplerate, channels=1, dtype='float32',
+            blocksize=self.blocksize, callback=self._audio_callback,
+            finished_callback=lambda: self._on_stream_finished(generation)
+        )
+        self._stream.start()
+        logger.info(f"OutputStream opened. SR: {self.samplerate}, blocksize: {self.blocksize}, latency: {self._stream.latency}")
+
+    def _on_stream_finished(self, generation: int):
+        if generation != self._stream_generation: return # Closed on purpose
+        logger.warning("OutputStream ended unexpectedly; it will be reopened on the next chunk.")
+        self._stream_failed = True
+        self._drained_event.set()
+
+    def _audio_callback(self, outdata, frames, time_info, status):
+        if status:
+            logger.debug(f"OutputStream status: {status}")
+        out = outdata[:, 0]
+        ring, stop_event = self._ring, self.stop_event
+        if stop_event is not None and stop_event.is_set():
+            out.fill(0)
+            ring.discard() # The reader owns read_pos, so it drops whatever is queued
+            if self._input_finished or not self._in_utterance: self._drained_event.set()
+            return
+        n = ring.read_into(out)
+        if n < frames:
+            out[n:] = 0.0 # Idle or underrun: keep the stream running on silence
+        if n > 0 and self.playback_start_ts is None and self._in_utterance:
+            try: dac_delay = max(time_info.outputBufferDacTime - time_info.currentTime, 0.0)
+            except Exception: dac_delay = 0.0
+            self.playback_start_ts = time.time() + dac_delay
+            self._first_audio_event.set()
+        if self._input_finished and ring.available_to_read() == 0:
+            self._drained_event.set()
+
+    def _wait_and_report_start(self, stop_event, drained_event, first_audio_event, callback):
+        while not first_audio_event.wait(0.1):
+            if stop_event.is_set() or drained_event.is_set():
+                return
+        if not callback: return
+        playback_start_ts = self.playback_start_ts or time.time()
+        delay = playback_start_ts - time.time()
+        if delay > 0: time.sleep(delay) # Fire when the sound is actually audible
+        try:
+            if _callback_accepts_timestamp(callback): callback(playback_start_ts)
+            else: callback()
+        except Exception as cb_exc:
+            logger.error(f"Error in on_playback_start_callback: {cb_exc}", exc_info=True)
+
+    def begin(self, stop_event: threading.Event, on_playback_start_callback=None, gap_ms=None):
+        """Starts a new utterance on the already open stream. Blocks until the previous one has ended."""
+        self._utterance_lock.acquire()
+        self.stop_event = stop_event
+        self.on_playback_start_callback = on_playback_start_callback
+        self._gap_ms = config.BARK_SILENCE_DURATION_MS if gap_ms is None else gap_ms
+        self._gap_samples = max(int(self._gap_ms / 1000 * self.samplerate), 0) if self.samplerate else 0
+        self.playback_start_ts = None
+        self._tail = None
+        self._chunks_written = 0
+        self._input_finished = False
+        self._first_audio_event = threading.Event()
+        self._drained_event = threading.Event()
+        self._in_utterance = True
+        # Report playback start from a normal thread, never from inside the audio callback
+        threading.Thread(target=self._wait_and_report_start, daemon=True, name="PlaybackStartNotifier",
+                         args=(stop_event, self._drained_event, self._first_audio_event, on_playback_start_callback)).start()
+
+    def end_utterance(self):
+        """Releases the engine for the next utterance. Queued audio of a stopped utterance is dropped by the callback."""
+        if not self._in_utterance: return
+        self._input_finished = True
+        if self.stop_event is not None and self.stop_event.is_set() and self._ring is not None:
+            deadline = time.monotonic() + 0.5 # A callback block or two is enough for the reader to discard the ring
+            while self._ring.available_to_read() and not self._stream_failed and time.monotonic() < deadline:
+                time.sleep(0.005)
+            if self._ring.available_to_read(): self._stream_failed = True # Stale audio left: reopen on the next chunk
+        self._in_utterance = False
+        self.stop_event = None
+        self.on_playback_start_callback = None
+        self._utterance_lock.release()
+
+    # --- Producer side ---
+    def _push(self, samples: np.ndarray) -> bool:
+        """Writes all samples, waiting for space. Returns False if stopped."""
+        offset, total = 0, len(samples)
+        while offset < total:
+            if self.stop_event.is_set() or self._stream_failed: return False
+            written = self._ring.write(samples[offset:])
+            offset += written
+            if written == 0:
+                time.sleep(min(0.01, self.blocksize / self.samplerate)) # Ring full: wait about one block
+        return True
+
+    def _push_zeros(self, count: int) -> bool:
+        remaining = count
+        while remaining > 0:
+            if self.stop_event.is_set() or self._stream_failed: return False
+            written = self._ring.write_zeros(remaining)
+            remaining -= written
+            if written == 0:
+                time.sleep(min(0.01, self.blocksize / self.samplerate))
+        return True
+
+    def write_chunk(self, audio_array: np.ndarray, samplerate: int) -> bool:
+        """Queues one synthesized chunk. Returns False if playback was stopped/unavailable."""
+        if self.stop_event.is_set(): return False
+        if self._stream is None or self._stream_failed or (self._chunks_written == 0 and int(samplerate) != self.samplerate):
+            if not SD_AVAILABLE or not sd:
+                logger.error("Cannot play chunk: SoundDevice not available.")
+                return False
+            self._open(samplerate) # First use, dead stream, or a new sample rate at an utterance boundary
+            self._gap_samples = max(int(self._gap_ms / 1000 * self.samplerate), 0)
+        elif int(samplerate) != self.samplerate:
+            logger.warning(f"Chunk samplerate {samplerate} differs from stream {self.samplerate}. Resampling linearly.")
+            src_idx = np.arange(int(len(audio_array) * self.samplerate / samplerate)) * (samplerate / self.samplerate)
+            audio_array = np.interp(src_idx, np.arange(len(audio_array)), audio_array)
+
+        chunk = np.asarray(audio_array, dtype=np.float32).reshape(-1)
+        fade_len = len(self._fade_in) if self._fade_in is not None else 0
+        fade_len = min(fade_len, len(chunk) // 2)
+
+        if self._tail is not None:
+            tail = self._tail
+            if fade_len and len(tail) == fade_len:
+                if self._gap_samples > 0:
+                    # Fade out, keep the configured pause, fade in
+                    tail *= self._fade_out[:fade_len]
+                    if not self._push(tail) or not self._push_zeros(self._gap_samples): return False
+                    head = chunk[:fade_len] * self._fade_in[:fade_len]
+                    if not self._push(head): return False
+                else:
+                    mixed = tail * self._fade_out[:fade_len] + chunk[:fade_len] * self._fade_in[:fade_len]
+                    if not self._push(mixed): return False
+                body_start = fade_len
+            else:
+                if not self._push(tail) or not self._push_zeros(self._gap_samples): return False
+                body_start = 0
+        else:
+            if self._chunks_written > 0 and not self._push_zeros(self._gap_samples): return False
+            body_start = 0
+        self._chunks_written += 1
+
+        body_end = len(chunk) - fade_len
+        if body_end > body_start and not self._push(chunk[body_start:body_end]): return False
+        self._tail = chunk[body_end:].copy() if fade_len else None
+        return True
+
+    def finish_and_wait(self, timeout=None) -> bool:
+        """Flushes the held-back tail and blocks until the ring has played out or stop_event is set."""
+        if self._stream is None or self._chunks_written == 0:
+            self._input_finished = True
+            return not self.stop_event.is_set()
+        if self._tail is not None and not self.stop_event.is_set():
+            if self._fade_out is not None and len(self._tail) <= len(self._fade_out):
+                self._tail *= self._fade_out[:len(self._tail)]
+            self._push(self._tail)
+            self._tail = None
+        self._input_finished = True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._drained_event.is_set():
+            if self.stop_event.is_set(): break
+            if deadline is not None and time.monotonic() > deadline:
+                logger.warning("Playback drain timed out.")
+                break
+            self._drained_event.wait(0.05)
+        return not self.stop_event.is_set()
+
+    def _close_stream(self):
+        stream, self._stream = self._stream, None
+        if stream is None: return
+        self._stream_generation += 1
+        try:
+            stream.abort() # Drop whatever is queued in the device right away
+            stream.close()
+        except Exception as e_close:
+            logger.warning(f"Error closing OutputStream: {e_close}")
+
+    def close(self):
+        """Closes the device stream at shutdown. A later write_chunk would open a new one."""
+        self._close_stream()
+        self._drained_event.set()
+        logger.info("OutputStream closed.")
+
+
+_shared_engine = None
+_shared_engine_lock = threading.Lock()
+
+
+def get_shared_engine() -> StreamingPlaybackEngine:
+    """The process-wide engine; its OutputStream is opened on the first chunk and kept open."""
+    global _shared_engine
+    with _shared_engine_lock:
+        if _shared_engine is None: _shared_engine = StreamingPlaybackEngine()
+        return _shared_engine
+
+
+def close_shared_engine():
+    global _shared_engine
+    with _shared_engine_lock:
+        engine, _shared_engine = _shared_engine, None
+    if engine is not None: engine.close()
@@ -11,45 +11,19 @@ from transformers import AutoProcessor, BarkModel # Keep these here for BarkTTS
 import numpy as np
 import os
 import threading
-import queue
 import time
 import config
 import logging # Added for standalone test logger setup
 
 # Assuming logger.py is in the same 'utils' directory
 from logger import get_logger
+from utils.inference_modes import inference_context
 
 logger = get_logger(__name__)
 
-# --- NLTK Setup ---
-import nltk
-from nltk.tokenize import sent_tokenize # <<< *** ADDED THIS LINE ***
-try:
-    nltk.data.find('tokenizers/punkt')
-    logger.info("NLTK 'punkt' tokenizer found.")
-except LookupError as e:
-    missing_resource_name = "punkt"
-    try:
-        error_lines = str(e).splitlines()
-        for line_content in error_lines:
-            if "Resource" in line_content and "not found" in line_content:
-                parts = line_content.strip().split(" ")
-                missing_resource_name = parts[1] if len(parts) > 1 else "punkt"
-                break
-    except Exception:
-        pass # Keep default missing_resource_name
-    logger.warning(f"NLTK resource '{missing_resource_name}' not found. Attempting to download 'punkt'...")
-    try:
-        nltk.download('punkt', quiet=True)
-        nltk.data.find('tokenizers/punkt') # Verify after download
-        logger.info(f"NLTK 'punkt' tokenizer downloaded successfully.")
-    except Exception as download_exc:
-        logger.error(f"Failed to download NLTK 'punkt' automatically: {download_exc}", exc_info=True)
-        logger.error("Please try downloading 'punkt' manually in a Python interpreter:\n"
-                     ">>> import nltk\n"
-                     ">>> nltk.download('punkt')")
-        # Potentially raise an error or set a flag if NLTK is critical and download fails
-# --- End NLTK Setup ---
+# --- Text Segmentation Setup (punkt is loaded once, shared with Telegram voice replies) ---
+from utils import text_segmentation
+text_segmentation.preload()
 
 # --- SoundDevice Setup ---
 SD_AVAILABLE = False
@@ -70,14 +44,17 @@ except Exception as e: # Catch other potential errors during sounddevice import
     SD_AVAILABLE = False
 # --- End SoundDevice Setup ---
 
+from utils.playback_engine import get_shared_engine
+
 
 class BarkTTS:
-    def __init__(self, processor, model, device, voice_preset="v2/en_speaker_6"):
+    def __init__(self, processor, model, device, voice_preset="v2/en_speaker_6", inference_mode="fp32"):
         self.processor = processor
         self.model = model
         self.device = device
         self.voice_preset = voice_preset
-        logger.debug(f"BarkTTS instance created. Voice: {voice_preset}, Device: {device}")
+        self.inference_mode = inference_mode # Already resolved for `device` (see utils/inference_modes.py)
+        logger.debug(f"BarkTTS instance created. Voice: {voice_preset}, Device: {device}, Mode: {inference_mode}")
 
     def synthesize_speech_to_array(self, text, generation_params=None):
         try:
@@ -96,10 +73,10 @@ class BarkTTS:
                 effective_params.update(generation_params)
             logger.debug(f"Bark generation params: {effective_params}")
 
-            with torch.no_grad():
+            with inference_context(self.inference_mode, self.device):
                 speech_output = self.model.generate(**inputs, **effective_params)
 
-            audio_array = speech_output.cpu().numpy().squeeze()
+            audio_array = speech_output.float().cpu().numpy().squeeze() # float() since autocast may yield fp16
             samplerate = self.model.generation_config.sample_rate
 
             if audio_array.ndim > 1 and audio_array.shape[0] > 1:
@@ -116,50 +93,30 @@ class BarkTTS:
 
 
 class StreamingBarkTTS:
-    def __init__(self, bark_tts_instance, max_sentences_per_chunk=None, silence_duration_ms=None):
+    def __init__(self, bark_tts_instance, chunk_target_seconds=None, silence_duration_ms=None):
+        # Playback goes through utils.playback_engine (one process-wide callback-mode OutputStream + ring buffer)
         self.bark_tts = bark_tts_instance
-        self.max_sentences_per_chunk = max_sentences_per_chunk if max_sentences_per_chunk is not None else config.BARK_MAX_SENTENCES_PER_CHUNK
+        self.chunk_target_seconds = chunk_target_seconds if chunk_target_seconds is not None else config.TTS_CHUNK_TARGET_SECONDS
         self.silence_duration_ms = silence_duration_ms if silence_duration_ms is not None else config.BARK_SILENCE_DURATION_MS
-        self.audio_queue = queue.Queue(maxsize=10) # Max 10 chunks in queue
         self.current_on_playback_start_callback = None
         logger.debug("StreamingBarkTTS instance created.")
 
     def _chunk_text(self, text):
-        lang_for_nltk = 'english'
-        if self.bark_tts.voice_preset and 'ru_' in self.bark_tts.voice_preset.lower():
-            lang_for_nltk = 'russian'
-        logger.debug(f"Chunking text for NLTK language: {lang_for_nltk}")
-
-        try:
-            # sent_tokenize IS NOW CORRECTLY IMPORTED AND USED
-            sentences = sent_tokenize(text, language=lang_for_nltk)
-        except LookupError:
-            logger.warning(f"NLTK punkt data for '{lang_for_nltk}' not found during chunking, falling back to English tokenization.")
-            sentences = sent_tokenize(text, language='english') # Fallback
-        except Exception as e:
-            logger.error(f"Error during NLTK sentence tokenization: {e}. Treating full text as one chunk.", exc_info=True)
-            return [text] # Fallback: treat the whole text as a single chunk
-
-        chunks = []; current_chunk_sentences = []
-        for i, sentence in enumerate(sentences):
-            current_chunk_sentences.append(sentence)
-            if len(current_chunk_sentences) >= self.max_sentences_per_chunk or (i + 1) == len(sentences):
-                chunks.append(" ".join(current_chunk_sentences))
-                current_chunk_sentences = []
-        logger.debug(f"Text chunked into {len(chunks)} parts.")
+        chunks = text_segmentation.segment_for_tts(
+            text, voice_preset=self.bark_tts.voice_preset, target_seconds=self.chunk_target_seconds
+        )
+        logger.debug(f"Text chunked into {len(chunks)} duration-balanced parts.")
         return chunks
 
-    # ... (rest of the StreamingBarkTTS class and __main__ block remains the same as the previously refactored version)
-    def _synthesis_worker(self, full_text, stop_event: threading.Event, generation_params=None):
+    def _synthesis_worker(self, full_text, stop_event: threading.Event, engine, generation_params=None):
+        """Synthesizes chunk by chunk and hands each one to the playback engine as soon as it is ready."""
         thread_name = threading.current_thread().name
         logger.info(f"Bark Synthesis Worker ({thread_name}) started for text: '{full_text[:70]}...'")
         text_chunks = self._chunk_text(full_text)
         if not text_chunks:
             logger.error(f"Bark TTS ({thread_name}): Text could not be chunked or was empty. Aborting synthesis.")
-            self.audio_queue.put(None) # Signal playback to terminate
             return
 
-        first_chunk = True
         for i, chunk_text in enumerate(text_chunks):
             if stop_event.is_set():
                 logger.info(f"Bark TTS ({thread_name}): Stop event detected, breaking synthesis loop (chunk {i+1}/{len(text_chunks)}).")
@@ -171,115 +128,18 @@ class StreamingBarkTTS:
             )
 
             if stop_event.is_set():
-                logger.info(f"Bark TTS ({thread_name}): Stop event detected after synthesis of chunk {i+1}, before queueing.")
+                logger.info(f"Bark TTS ({thread_name}): Stop event detected after synthesis of chunk {i+1}, before playback.")
                 break
 
             if audio_array is not None and samplerate is not None:
-                if not first_chunk and self.silence_duration_ms > 0:
-                    silence_samples = int(self.silence_duration_ms / 1000 * samplerate)
-                    silence_array = np.zeros(silence_samples, dtype=audio_array.dtype)
-                    logger.debug(f"Bark TTS ({thread_name}): Adding {self.silence_duration_ms}ms silence to queue.")
-                    try:
-                        self.audio_queue.put((silence_array, samplerate), timeout=2)
-                    except queue.Full:
-                        if stop_event.is_set():
-                            logger.info(f"Bark TTS ({thread_name}): Stop event during queue.Full for silence. Breaking.")
-                            break
-                        logger.warning(f"Bark TTS ({thread_name}): Audio queue full while trying to put silence. Synthesis might be too fast or playback stalled. Skipping silence.")
-                        continue # Try to put the main audio next
-
-                logger.debug(f"Bark TTS ({thread_name}): Putting audio chunk {i+1} into queue.")
-                try:
-                    self.audio_queue.put((audio_array, samplerate), timeout=2)
-                except queue.Full:
-                    if stop_event.is_set():
-                        logger.info(f"Bark TTS ({thread_name}): Stop event during queue.Full for audio chunk {i+1}. Breaking.")
-                        break
-                    logger.warning(f"Bark TTS ({thread_name}): Audio queue full while trying to put chunk {i+1}. Synthesis might be too fast or playback stalled. Skipping chunk.")
-                    continue
-                first_chunk = False
+                logger.debug(f"Bark TTS ({thread_name}): Feeding chunk {i+1} to playback engine. Duration: {len(audio_array)/samplerate:.2f}s")
+                if not engine.write_chunk(audio_array, samplerate):
+                    logger.info(f"Bark TTS ({thread_name}): Playback engine rejected chunk {i+1} (stopped). Breaking.")
+                    break
             else:
                  logger.warning(f"Bark TTS ({thread_name}): Failed to synthesize chunk {i+1}: '{chunk_text[:30]}...'")
-
-        logger.info(f"Bark TTS ({thread_name}): Synthesis loop finished. Placing sentinel in queue.")
-        try:
-            self.audio_queue.put(None, timeout=1) # Sentinel to signal end of audio
-        except queue.Full:
-            if not stop_event.is_set(): # Only warn if not already stopping
-                 logger.warning(f"Bark TTS ({thread_name}): Could not place sentinel in queue (full). Playback might not terminate cleanly if not already stopped.")
         logger.info(f"Bark Synthesis Worker ({thread_name}) finished.")
 
-
-    def _playback_worker(self, stop_event: threading.Event):
-        if not SD_AVAILABLE or not sd: # Check sd explicitly
-            logger.error("Playback worker cannot start: SoundDevice not available.")
-            return
-
-        thread_name = threading.current_thread().name
-        logger.info(f"Bark Playback Worker ({thread_name}) started.")
-        stream_active = False
-        try:
-            while not stop_event.is_set():
-                try:
-                    item = self.audio_queue.get(timeout=0.2) # Check queue periodically
-                except queue.Empty:
-                    continue # No audio yet, or synthesis is slow
-
-                if item is None: # Sentinel found
-                    logger.info(f"Bark TTS ({thread_name}): Sentinel received. Ending playback.")
-                    break
-
-                if stop_event.is_set(): # Check stop event after getting item
-                    logger.info(f"Bark TTS ({thread_name}): Stop event detected while item in queue. Discarding.")
-                    self.audio_queue.task_done() # Mark item as processed
-                    break
-
-                audio_array, samplerate = item
-
-                # This check might be redundant if None items are only sentinels, but good for safety
-                if audio_array is None or samplerate is None:
-                    logger.warning(f"Bark TTS ({thread_name}): Received None audio_array or samplerate unexpectedly. Skipping.")
-                    self.audio_queue.task_done()
-                    continue
-
-                if not stream_active:
-                    try:
-                        device_info = sd.query_devices(kind='output')
-                        logger.info(f"Bark TTS ({thread_name}): Playback starting. Samplerate: {samplerate}, Device: {device_info['name']}")
-                    except Exception as e:
-                        logger.warning(f"Bark TTS ({thread_name}): Could not query audio device: {e}. Samplerate: {samplerate}", exc_info=False)
-
-                    if self.current_on_playback_start_callback:
-                        logger.debug(f"Bark TTS ({thread_name}): Calling on_playback_start_callback.")
-                        try:
-                            self.current_on_playback_start_callback()
-                        except Exception as cb_exc:
-                            logger.error(f"Bark TTS ({thread_name}): Error in on_playback_start_callback: {cb_exc}", exc_info=True)
-                    stream_active = True
-
-                logger.debug(f"Bark TTS ({thread_name}): Playing audio chunk. Duration: {len(audio_array)/samplerate:.2f}s")
-                try:
-                    if not stop_event.is_set(): # Double check before actual play
-                        sd.play(audio_array, samplerate)
-                        sd.wait() # Wait for this chunk to finish playing
-                    else:
-                        logger.info(f"Bark TTS ({thread_name}): Stop event set before playing chunk. Stopping playback.")
-                        sd.stop() # Attempt to stop any ongoing sound
-                        break
-                except Exception as e_play:
-                    logger.error(f"Bark TTS ({thread_name}): Error during sd.play/wait: {e_play}", exc_info=True)
-                    if stop_event.is_set(): break # Exit loop if already stopping
-                finally:
-                    self.audio_queue.task_done() # Mark item as processed
-
-        except Exception as e: # Catch-all for unexpected errors in the playback loop
-            logger.error(f"Bark TTS ({thread_name}): Unhandled error in playback worker: {e}", exc_info=True)
-        finally:
-            if stream_active and sd:
-                logger.info(f"Bark TTS ({thread_name}): Playback worker finishing. Stopping any active sound.")
-                sd.stop() # Ensure sound is stopped on exit
-            logger.info(f"Bark Playback Worker ({thread_name}) finished.")
-
     def synthesize_and_play_stream(self, full_text, stop_event: threading.Event, generation_params=None, on_playback_start_callback=None):
         if not SD_AVAILABLE or not sd:
             logger.error(f"Cannot synthesize and play: SoundDevice not available. Text: '{full_text[:50]}...'")
@@ -295,55 +155,20 @@ class StreamingBarkTTS:
         self.current_on_playback_start_callback = on_playback_start_callback
         logger.info(f"Starting TTS stream for: '{full_text[:70]}...'")
 
-        synthesis_thread = threading.Thread(
-            target=self._synthesis_worker,
-            args=(full_text, stop_event, generation_params),
-            daemon=True,
-            name="BarkSynthesisWorker"
-        )
-        playback_thread = threading.Thread(
-            target=self._playback_worker,
-            args=(stop_event,),
-            daemon=True,
-            name="BarkPlaybackWorker"
-        )
-
-        synthesis_thread.start()
-        playback_thread.start()
-
-        # Wait for threads to complete or stop_event to be set
-        # This loop primarily ensures the main calling thread waits if needed.
-        # The actual work is in the worker threads.
-        while synthesis_thread.is_alive() or playback_thread.is_alive():
-            if stop_event.is_set():
-                logger.info("Main stream control: Stop event detected. Waiting for threads to join.")
-                break
-            time.sleep(0.05) # Brief sleep to avoid busy-waiting
-
-        logger.debug("Main stream control: Joining synthesis thread...")
-        synthesis_thread.join(timeout=3)
-        if synthesis_thread.is_alive():
-            logger.warning("Main stream control: Synthesis thread did not join cleanly after 3s.")
-
-        logger.debug("Main stream control: Joining playback thread...")
-        playback_thread.join(timeout=3) # Playback might take time to finish if sd.wait() is long
-        if playback_thread.is_alive():
-            logger.warning("Main stream control: Playback thread did not join cleanly after 3s.")
-
-        if stop_event.is_set() and sd: # If stopped, ensure sd is stopped
-            logger.info("Main stream control: Stop event was set, ensuring sounddevice is stopped.")
-            sd.stop()
-
-        # Clear the queue (important if synthesis was faster than stop or if errors occurred)
-        logger.debug("Main stream control: Clearing any remaining items from audio queue.")
-        while not self.audio_queue.empty():
-            try:
-                self.audio_queue.get_nowait()
-            except queue.Empty:
-                break
-            self.audio_queue.task_done()
-
-        self.current_on_playback_start_callback = None # Clear callback
+        # Runs on the caller's thread (tts_manager already gives each utterance its own thread);
+        # the engine's OutputStream callback does the actual playback concurrently.
+        engine = get_shared_engine()
+        engine.begin(stop_event, on_playback_start_callback=on_playback_start_callback, gap_ms=self.silence_duration_ms)
+        try:
+            self._synthesis_worker(full_text, stop_event, engine, generation_params)
+            engine.finish_and_wait()
+            if engine.playback_start_ts:
+                logger.debug(f"Playback started at {engine.playback_start_ts:.3f} (epoch).")
+        except Exception as e:
+            logger.error(f"Unhandled error in TTS stream: {e}", exc_info=True)
+        finally:
+            engine.end_utterance()
+            self.current_on_playback_start_callback = None # Clear callback
 
         if not stop_event.is_set():
             logger.info(f"Finished speaking \"{full_text[:50]}...\"")
@@ -2,230 +2,219 @@
 import json
 import os
 import sys
-from .file_utils import backup_corrupted_file, ensure_folder # Use relative import for utils
+import threading
+from .file_utils import backup_corrupted_file, ensure_folder, atomic_write_json, load_last_good_json # Use relative import for utils
+from .history_journal import ChatHistoryJournal
+from . import persistence
+from . import json_codec
+from .customer_state_cache import get_cache as _get_customer_cache
+from .customer_history_archive import apply_history_window
+from .calendar_index import get_calendar_index, format_conflict, ADMIN_OWNER
+from .versioned_state import get_app_state
 import config # Import config to access default states
 from logger import get_logger # Assuming logger.py is in project root, adjust if it's also in utils
 import datetime # For timestamps
 
 logger = get_logger("Iri-shka_App.StateManager")
 
+_chat_history_journal: ChatHistoryJournal = None # type: ignore
+
+def _get_chat_history_journal() -> ChatHistoryJournal:
+    global _chat_history_journal
+    if _chat_history_journal is None:
+        _chat_history_journal = ChatHistoryJournal(config.CHAT_HISTORY_JOURNAL_FILE, config.MAX_HISTORY_TURNS)
+    return _chat_history_journal
+
+_customer_sqlite_store = None
+
+def _get_customer_sqlite_store():
+    global _customer_sqlite_store
+    if _customer_sqlite_store is None:
+        from .customer_store_sqlite import SqliteCustomerStore
+        _customer_sqlite_store = SqliteCustomerStore(config.CUSTOMER_STATE_DB_FILE)
+    return _customer_sqlite_store
+
+def _use_sqlite_customer_store() -> bool:
+    return config.CUSTOMER_STATE_BACKEND == "sqlite"
+
+def close_customer_state_store():
+    """Checkpoints and closes the SQLite customer store if it was opened (call after flushing pending writes)."""
+    global _customer_sqlite_store
+    if _customer_sqlite_store is not None:
+        _customer_sqlite_store.close()
+        _customer_sqlite_store = None
+
+def close_chat_history_journal():
+    """Final fsync + close of the admin chat journal (call on app exit)."""
+    if _chat_history_journal is not None:
+        _chat_history_journal.close()
+
+def _sync_calendar_index(owner, calendar_events) -> list:
+    """Incrementally re-indexes one owner's calendar. Logs and returns overlaps introduced by newly added events."""
+    index = get_calendar_index()
+    added, _removed = index.sync_owner(owner, calendar_events)
+    conflicts = [(event, other) for event in added for other in index.conflicts_with(event)]
+    for event, other in conflicts:
+        logger.warning(f"Calendar conflict: {format_conflict(event, other)}")
+    return conflicts
+
+def rebuild_calendar_index(gui_callbacks=None) -> int:
+    """Indexes every customer's calendar (admin calendar is indexed by load_initial_states). Returns events indexed."""
+    flush_pending_state_writes()
+    if _use_sqlite_customer_store():
+        customer_ids = _get_customer_sqlite_store().all_ids()
+    elif os.path.isdir(config.CUSTOMER_STATES_FOLDER):
+        customer_ids = [int(f[:-len("_state.json")]) for f in os.listdir(config.CUSTOMER_STATES_FOLDER)
+                        if f.endswith("_state.json") and f[:-len("_state.json")].isdigit()]
+    else:
+        customer_ids = []
+    for customer_id in customer_ids: # Read directly, so a full scan does not flush the LRU cache
+        try:
+            stored_state = (_get_customer_sqlite_store().load(customer_id) if _use_sqlite_customer_store()
+                            else json_codec.load_file(get_customer_state_filepath(customer_id)))
+        except (ValueError, OSError) as e_read:
+            logger.warning(f"Skipping calendar of customer {customer_id} while indexing: {e_read}")
+            continue
+        if isinstance(stored_state, dict):
+            get_calendar_index().sync_owner(customer_id, stored_state.get("calendar_events", []))
+    logger.info(f"Calendar index built: {len(get_calendar_index())} event(s), {len(customer_ids)} customer calendar(s).")
+    return len(get_calendar_index())
+
+def preview_calendar_conflicts(owner, calendar_events) -> list:
+    """Human-readable overlaps that saving `calendar_events` for `owner` would introduce (owner: ADMIN_OWNER or customer id)."""
+    return [format_conflict(a, b) for a, b in get_calendar_index().preview_conflicts(owner, calendar_events)]
+
+def flush_pending_state_writes(timeout=None) -> bool:
+    """Barrier: blocks until every write-behind state document is on disk."""
+    return persistence.flush(timeout=timeout)
+
+def shutdown_state_persistence():
+    """Flushes pending state writes and stops the write-behind flusher (call on app exit)."""
+    persistence.shutdown()
+
+def _write_json_file(filepath, data: dict, description: str) -> bool:
+    try:
+        atomic_write_json(filepath, data, fsync=config.STATE_FSYNC_FILES, fsync_dir=config.STATE_FSYNC_DIRECTORY,
+                          keep_last_good=config.STATE_KEEP_LAST_GOOD)
+        logger.debug(f"{description} written to {filepath}")
+        return True
+    except (IOError, OSError, TypeError, ValueError) as e:
+        logger.error(f"Error writing {description} to '{filepath}': {e}", exc_info=True)
+        return False
+
 def get_current_timestamp_iso():
     """Returns the current UTC time as an ISO 8601 string."""
     return datetime.datetime.now(datetime.timezone.utc).isoformat()
 
 # --- Generic JSON Load/Init (Internal Helper) ---
-def _load_or_initialize_json_internal(filepath, default_content_dict: dict, entity_type="file", gui_callbacks=None):
+def _recover_last_good(filepath, entity_type):
+    """Restores `filepath` from its last-good generation (see atomic_write_json). Returns the dict or None."""
+    data = load_last_good_json(filepath)
+    if not isinstance(data, dict):
+        logger.warning(f"No usable last-good copy for {entity_type} '{filepath}'. Initializing with defaults.")
+        return None
+    try:
+        atomic_write_json(filepath, data, fsync=config.STATE_FSYNC_FILES, fsync_dir=config.STATE_FSYNC_DIRECTORY, keep_last_good=False)
+    except (IOError, OSError) as e_restore:
+        logger.error(f"Recovered {entity_type} from last-good copy but could not rewrite '{filepath}': {e_restore}", exc_info=True)
+    logger.warning(f"Recovered {entity_type} '{filepath}' from its last-good copy.")
+    return data
+
+def _load_or_initialize_json_internal(filepath, schema, entity_type="file", gui_callbacks=None, initial_overrides: dict = None):
     """
-    Loads JSON from filepath or initializes with a copy of default_content_dict.
+    Loads JSON from filepath or initializes it with the schema defaults (plus initial_overrides).
+    Validation and default-filling are done in one pass by json_codec.apply_schema.
     Ensures parent directory exists. Returns a dictionary.
     """
+    data = None
     if os.path.exists(filepath):
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                logger.info(f"Loaded JSON from {entity_type} path: {filepath}")
-                # Ensure it's a dict, merge with defaults to ensure all keys exist
-                if isinstance(data, dict):
-                    # Start with a copy of defaults, then update with loaded data
-                    # This ensures new keys in default_content_dict are added if missing in the file
-                    merged_data = default_content_dict.copy()
-                    merged_data.update(data) # Overwrites defaults with loaded values, adds new default keys
-                    
-                    # Specifically for assistant_state, ensure internal_tasks structure is correct
-                    if entity_type == "assistant state" or "assistant state (" in entity_type:
-                        if "internal_tasks" not in merged_data:
-                            merged_data["internal_tasks"] = default_content_dict.get("internal_tasks", {"pending": [], "completed": []}).copy()
-                            logger.info(f"Initialized 'internal_tasks' in {filepath} as it was missing.")
-                        elif not isinstance(merged_data["internal_tasks"], dict):
-                            logger.warning(f"'internal_tasks' in {filepath} is not a dict. Resetting.")
-                            merged_data["internal_tasks"] = default_content_dict.get("internal_tasks", {"pending": [], "completed": []}).copy()
-                        else: # It is a dict, ensure 'pending' and 'completed' exist, remove 'in_process'
-                            tasks_dict = merged_data["internal_tasks"]
-                            if "in_process" in tasks_dict:
-                                logger.info(f"Removing 'in_process' tasks from {filepath} during load/merge.")
-                                # Optionally, move 'in_process' tasks to 'pending' if desired, or just discard
-                                # For now, just discarding.
-                                # if isinstance(tasks_dict["in_process"], list) and tasks_dict["in_process"]:
-                                #     if "pending" not in tasks_dict or not isinstance(tasks_dict.get("pending"),list):
-                                #         tasks_dict["pending"] = []
-                                #     tasks_dict["pending"].extend(tasks_dict["in_process"])
-                                #     tasks_dict["pending"] = list(dict.fromkeys(tasks_dict["pending"])) # Deduplicate
-                                del tasks_dict["in_process"]
-                            
-                            if "pending" not in tasks_dict or not isinstance(tasks_dict.get("pending"), list):
-                                tasks_dict["pending"] = default_content_dict.get("internal_tasks",{}).get("pending",[]).copy()
-                            if "completed" not in tasks_dict or not isinstance(tasks_dict.get("completed"), list):
-                                 tasks_dict["completed"] = default_content_dict.get("internal_tasks",{}).get("completed",[]).copy()
-                    
-                    # Specifically for user_state, ensure 'todos' is NOT present
-                    if entity_type == "admin user state" or "admin user state (" in entity_type:
-                        if "todos" in merged_data:
-                            logger.info(f"Removing 'todos' key from admin user state in {filepath} during load/merge.")
-                            del merged_data["todos"]
-                            
-                    return merged_data
-                else: 
-                    logger.warning(f"Loaded data from {filepath} is not a dictionary. Initializing.")
-                    # Fall through to initialize
+            data = json_codec.load_file(filepath)
+            logger.info(f"Loaded JSON from {entity_type} path: {filepath}")
         except (json.JSONDecodeError, IOError) as e:
-            logger.warning(f"Error loading {entity_type} '{filepath}': {e}. Backing up and initializing.", exc_info=False)
+            logger.warning(f"Error loading {entity_type} '{filepath}': {e}. Backing up and trying last-good copy.", exc_info=False)
             backup_corrupted_file(filepath)
-            # Fall through to initialize
-    
+            data = _recover_last_good(filepath, entity_type)
+        if data is not None and not isinstance(data, dict):
+            logger.warning(f"Loaded data from {filepath} is not a dictionary. Trying last-good copy.")
+            data = _recover_last_good(filepath, entity_type)
+
+    if isinstance(data, dict):
+        return json_codec.apply_schema(schema, data, context=f"{entity_type} '{filepath}'")
+
     # Initialize or re-initialize if loading failed or data was not dict
+    content_to_write = json_codec.schema_defaults(schema)
+    if initial_overrides: content_to_write.update(initial_overrides)
     try:
         parent_dir = os.path.dirname(filepath)
         if parent_dir and not os.path.exists(parent_dir): 
             ensure_folder(parent_dir, gui_callbacks)
-
-        content_to_write = default_content_dict.copy() # Always work with a fresh copy
-        
-        # Ensure correct structure for assistant state defaults if this is an initialization
-        if entity_type == "assistant state" or "assistant state (" in entity_type:
-            if "internal_tasks" in content_to_write and "in_process" in content_to_write["internal_tasks"]:
-                del content_to_write["internal_tasks"]["in_process"]
-            if "internal_tasks" not in content_to_write or not isinstance(content_to_write.get("internal_tasks"), dict):
-                 content_to_write["internal_tasks"] = {"pending": [], "completed": []}
-            if "pending" not in content_to_write["internal_tasks"]: content_to_write["internal_tasks"]["pending"] = []
-            if "completed" not in content_to_write["internal_tasks"]: content_to_write["internal_tasks"]["completed"] = []
-
-
-        # Ensure 'todos' is not in default admin user state if initializing
-        if entity_type == "admin user state" or "admin user state (" in entity_type:
-            if "todos" in content_to_write:
-                del content_to_write["todos"]
-
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(content_to_write, f, indent=4, ensure_ascii=False)
+        atomic_write_json(filepath, content_to_write, fsync=config.STATE_FSYNC_FILES, fsync_dir=config.STATE_FSYNC_DIRECTORY,
+                          keep_last_good=False)
         logger.info(f"Initialized {entity_type} '{filepath}' with default content.")
-        return content_to_write 
-    except IOError as e:
+    except (IOError, OSError) as e:
         error_msg = f"CRITICAL: Could not write initial {entity_type} '{filepath}': {e}"
         logger.critical(error_msg, exc_info=True)
         if gui_callbacks and 'messagebox_error' in gui_callbacks:
             gui_callbacks['messagebox_error']("File Error", f"Could not write initial {filepath}. System may be unstable.")
-        
-        final_default_copy = default_content_dict.copy()
-        if entity_type == "assistant state" or "assistant state (" in entity_type:
-            if "internal_tasks" in final_default_copy and "in_process" in final_default_copy["internal_tasks"]:
-                del final_default_copy["internal_tasks"]["in_process"]
-        if entity_type == "admin user state" or "admin user state (" in entity_type:
-            if "todos" in final_default_copy:
-                del final_default_copy["todos"]
-        return final_default_copy
+    return content_to_write
 
 
 # --- Main Admin/App State Loading ---
 def load_initial_states(gui_callbacks=None):
     logger.info("Loading initial states (admin chat history, admin user state, assistant state)...")
     
-    chat_history_data = []
-    if os.path.exists(config.CHAT_HISTORY_FILE):
-        try:
-            with open(config.CHAT_HISTORY_FILE, 'r', encoding='utf-8') as f:
-                chat_history_data = json.load(f)
-            if not isinstance(chat_history_data, list):
-                logger.warning(f"{config.CHAT_HISTORY_FILE} did not contain a list. Initializing as empty list.")
-                chat_history_data = []
-                backup_corrupted_file(config.CHAT_HISTORY_FILE) 
-                with open(config.CHAT_HISTORY_FILE, 'w', encoding='utf-8') as f: 
-                    json.dump(chat_history_data, f, indent=4, ensure_ascii=False)
-        except (json.JSONDecodeError, IOError) as e:
-            logger.warning(f"Error loading chat history '{config.CHAT_HISTORY_FILE}': {e}. Backing up and initializing as empty list.", exc_info=False)
-            backup_corrupted_file(config.CHAT_HISTORY_FILE)
-            chat_history_data = []
-            try: 
-                with open(config.CHAT_HISTORY_FILE, 'w', encoding='utf-8') as f:
-                    json.dump(chat_history_data, f, indent=4, ensure_ascii=False)
-            except IOError as ioe_ch:
-                 logger.error(f"Could not write initial empty chat history: {ioe_ch}")
-    else: 
-        try:
-            with open(config.CHAT_HISTORY_FILE, 'w', encoding='utf-8') as f:
-                json.dump(chat_history_data, f, indent=4, ensure_ascii=False)
-            logger.info(f"Initialized '{config.CHAT_HISTORY_FILE}' with empty list.")
-        except IOError as ioe_ch_init:
-            logger.error(f"Could not write initial empty chat history on first creation: {ioe_ch_init}")
+    # Admin chat history lives in an append-only JSONL journal; only its tail is read here
+    try:
+        chat_history_data = _get_chat_history_journal().load_tail(gui_callbacks)
+    except Exception as e_journal:
+        logger.error(f"Error loading admin chat history journal '{config.CHAT_HISTORY_JOURNAL_FILE}': {e_journal}. Starting with empty history.", exc_info=True)
+        chat_history_data = []
     chat_history = list(chat_history_data)
 
 
-    default_user_state_admin_template = config.DEFAULT_USER_STATE.copy()
-    # Ensure 'todos' is not in the template being passed if it somehow lingered in config.py
-    if "todos" in default_user_state_admin_template: 
-        del default_user_state_admin_template["todos"]
-        
     user_state_admin = _load_or_initialize_json_internal(
-        config.USER_STATE_FILE, default_user_state_admin_template, "admin user state", gui_callbacks
+        config.USER_STATE_FILE, json_codec.AdminUserStateSchema, "admin user state", gui_callbacks
     )
-
-    default_assistant_state_template = config.DEFAULT_ASSISTANT_STATE.copy()
-    # Ensure internal_tasks has the correct structure in the template passed
-    if "internal_tasks" in default_assistant_state_template:
-        if "in_process" in default_assistant_state_template["internal_tasks"]:
-            del default_assistant_state_template["internal_tasks"]["in_process"]
-        if "pending" not in default_assistant_state_template["internal_tasks"]: default_assistant_state_template["internal_tasks"]["pending"] = []
-        if "completed" not in default_assistant_state_template["internal_tasks"]: default_assistant_state_template["internal_tasks"]["completed"] = []
-    else:
-        default_assistant_state_template["internal_tasks"] = {"pending": [], "completed": []}
-
-
     assistant_state = _load_or_initialize_json_internal(
-        config.ASSISTANT_STATE_FILE, default_assistant_state_template, "assistant state", gui_callbacks
+        config.ASSISTANT_STATE_FILE, json_codec.AssistantStateSchema, "assistant state", gui_callbacks
     )
     
-    if "admin_name" not in assistant_state: # From original logic
-        assistant_state["admin_name"] = default_assistant_state_template["admin_name"]
-        logger.warning(f"Key 'admin_name' missing in loaded assistant_state. Added default: {assistant_state['admin_name']}")
-
+    _sync_calendar_index(ADMIN_OWNER, user_state_admin.get("calendar_events", []))
     logger.info("Initial admin/assistant states loaded/initialized and defaults ensured.")
     return chat_history, user_state_admin, assistant_state
 
 # --- Helpers for just loading/saving assistant state (for thread safety) ---
 def load_assistant_state_only(gui_callbacks=None) -> dict:
-    default_assistant_state_template = config.DEFAULT_ASSISTANT_STATE.copy()
-    if "internal_tasks" in default_assistant_state_template and "in_process" in default_assistant_state_template["internal_tasks"]:
-        del default_assistant_state_template["internal_tasks"]["in_process"]
-    if "internal_tasks" not in default_assistant_state_template or not isinstance(default_assistant_state_template.get("internal_tasks"),dict):
-        default_assistant_state_template["internal_tasks"] = {"pending":[], "completed":[]}
-    if "pending" not in default_assistant_state_template["internal_tasks"]: default_assistant_state_template["internal_tasks"]["pending"] = []
-    if "completed" not in default_assistant_state_template["internal_tasks"]: default_assistant_state_template["internal_tasks"]["completed"] = []
-
-
-    loaded_state = _load_or_initialize_json_internal(
-        config.ASSISTANT_STATE_FILE, default_assistant_state_template, "assistant state (isolated load)", gui_callbacks
+    pending_state = persistence.get_store().get_pending("assistant_state", config.ASSISTANT_STATE_FILE)
+    if pending_state is not None: # Newer than the file on disk
+        return pending_state
+    return _load_or_initialize_json_internal(
+        config.ASSISTANT_STATE_FILE, json_codec.AssistantStateSchema, "assistant state (isolated load)", gui_callbacks
     )
-    if "admin_name" not in loaded_state: # From original logic
-        loaded_state["admin_name"] = default_assistant_state_template["admin_name"]
-    return loaded_state
 
 def save_assistant_state_only(assistant_state_data: dict, gui_callbacks=None) -> bool:
-    try:
-        parent_dir = os.path.dirname(config.ASSISTANT_STATE_FILE)
-        if parent_dir and not os.path.exists(parent_dir):
-            ensure_folder(parent_dir, gui_callbacks)
-
-        # Before saving, ensure the structure is correct
-        state_to_save = assistant_state_data.copy()
-        if "internal_tasks" in state_to_save:
-            if isinstance(state_to_save["internal_tasks"], dict) and "in_process" in state_to_save["internal_tasks"]:
-                del state_to_save["internal_tasks"]["in_process"]
-            # Ensure pending and completed are lists
-            if not isinstance(state_to_save["internal_tasks"].get("pending"), list): state_to_save["internal_tasks"]["pending"] = []
-            if not isinstance(state_to_save["internal_tasks"].get("completed"), list): state_to_save["internal_tasks"]["completed"] = []
-        else: # Ensure it exists if somehow deleted before save
-             state_to_save["internal_tasks"] = {"pending": [], "completed": []}
-
-
-        with open(config.ASSISTANT_STATE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(state_to_save, f, indent=4, ensure_ascii=False)
-        logger.debug("Assistant state saved successfully (isolated save).")
-        return True
-    except IOError as e:
-        error_msg = f"Error saving assistant state file (isolated save): {e}"
-        logger.error(error_msg, exc_info=True)
-        if gui_callbacks and 'messagebox_warn' in gui_callbacks:
-             gui_callbacks['messagebox_warn']("Save Error", f"Could not save assistant state: {e}")
-        return False
+    parent_dir = os.path.dirname(config.ASSISTANT_STATE_FILE)
+    if parent_dir and not os.path.exists(parent_dir):
+        ensure_folder(parent_dir, gui_callbacks)
+
+    # Before saving, ensure the structure is correct
+    state_to_save = assistant_state_data.copy()
+    if "internal_tasks" in state_to_save:
+        if isinstance(state_to_save["internal_tasks"], dict): # Plain copy: the input may be a frozen snapshot
+            state_to_save["internal_tasks"] = {k: v for k, v in state_to_save["internal_tasks"].items() if k != "in_process"}
+        # Ensure pending and completed are lists
+        if not isinstance(state_to_save["internal_tasks"].get("pending"), list): state_to_save["internal_tasks"]["pending"] = []
+        if not isinstance(state_to_save["internal_tasks"].get("completed"), list): state_to_save["internal_tasks"]["completed"] = []
+    else: # Ensure it exists if somehow deleted before save
+         state_to_save["internal_tasks"] = {"pending": [], "completed": []}
+
+    # Written now or coalesced by the write-behind store, per PERSISTENCE_POLICIES["assistant_state"]
+    return persistence.get_store().save(
+        "assistant_state", config.ASSISTANT_STATE_FILE, state_to_save,
+        lambda data: _write_json_file(config.ASSISTANT_STATE_FILE, data, "assistant state"),
+        gui_callbacks
+    )
 
 # --- Main Admin/App State Saving (user_state is admin's) ---
 def save_states(chat_history, user_state_admin, assistant_state, gui_callbacks=None):
@@ -234,22 +223,20 @@ def save_states(chat_history, user_state_admin, assistant_state, gui_callbacks=N
     save_assistant_state_only(assistant_state, gui_callbacks) # This now ensures correct structure
 
     # Save admin's user state
-    try:
-        parent_dir = os.path.dirname(config.USER_STATE_FILE) 
-        if parent_dir and not os.path.exists(parent_dir): ensure_folder(parent_dir, gui_callbacks)
-        
-        admin_state_to_save = user_state_admin.copy()
-        if "todos" in admin_state_to_save: # Ensure 'todos' is removed before saving
-            del admin_state_to_save["todos"]
-            
-        with open(config.USER_STATE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(admin_state_to_save, f, indent=4, ensure_ascii=False)
-        logger.info("Admin User state saved successfully.")
-    except IOError as e:
-        error_msg = f"Error saving admin user state file: {e}"
-        logger.error(error_msg, exc_info=True)
-        if gui_callbacks and 'messagebox_warn' in gui_callbacks:
-             gui_callbacks['messagebox_warn']("Save Error", f"Could not save admin user state: {e}")
+    parent_dir = os.path.dirname(config.USER_STATE_FILE) 
+    if parent_dir and not os.path.exists(parent_dir): ensure_folder(parent_dir, gui_callbacks)
+
+    admin_state_to_save = user_state_admin.copy()
+    if "todos" in admin_state_to_save: # Ensure 'todos' is removed before saving
+        del admin_state_to_save["todos"]
+
+    if persistence.get_store().save(
+        "admin_user_state", config.USER_STATE_FILE, admin_state_to_save,
+        lambda data: _write_json_file(config.USER_STATE_FILE, data, "admin user state"),
+        gui_callbacks
+    ):
+        logger.info("Admin User state saved (or queued for write-behind).")
+    _sync_calendar_index(ADMIN_OWNER, admin_state_to_save.get("calendar_events", []))
 
     current_chat_history = list(chat_history)
     if len(current_chat_history) > config.MAX_HISTORY_TURNS:
@@ -258,13 +245,10 @@ def save_states(chat_history, user_state_admin, assistant_state, gui_callbacks=N
         logger.info(f"Admin chat history trimmed by {trimmed_count} turns to maintain max {config.MAX_HISTORY_TURNS} turns.")
 
     try:
-        parent_dir = os.path.dirname(config.CHAT_HISTORY_FILE) 
-        if parent_dir and not os.path.exists(parent_dir): ensure_folder(parent_dir, gui_callbacks)
-        with open(config.CHAT_HISTORY_FILE, 'w', encoding='utf-8') as f:
-            json.dump(current_chat_history, f, indent=4, ensure_ascii=False)
-        logger.info("Admin chat history saved successfully.")
-    except IOError as e:
-        error_msg = f"Error saving admin chat history file: {e}"
+        appended = _get_chat_history_journal().append_new_turns_from(current_chat_history)
+        logger.info(f"Admin chat history journaled ({appended} new turn(s)).")
+    except (IOError, OSError) as e:
+        error_msg = f"Error appending to admin chat history journal: {e}"
         logger.error(error_msg, exc_info=True)
         if gui_callbacks and 'messagebox_warn' in gui_callbacks:
              gui_callbacks['messagebox_warn']("Save Error", f"Could not save admin chat history: {e}")
@@ -272,23 +256,93 @@ def save_states(chat_history, user_state_admin, assistant_state, gui_callbacks=N
     return current_chat_history
 
 
+_app_state_persist_lock = threading.Lock()
+_persisted_app_state_version = 0
+
+def save_app_state(gui_callbacks=None) -> int:
+    """
+    Persists the newest published admin/app snapshot (utils/versioned_state.py). Writers call it after their swap,
+    holding no state lock. Concurrent callers are serialised here, not on the state: whoever gets in writes the
+    newest version (which contains every earlier one), and an older version is never written after a newer one.
+    Returns the version on disk (or queued for write-behind).
+    """
+    global _persisted_app_state_version
+    with _app_state_persist_lock:
+        snapshot = get_app_state().current()
+        if snapshot.version > _persisted_app_state_version:
+            save_states(snapshot.chat_history, snapshot.user_state, snapshot.assistant_state, gui_callbacks)
+            _persisted_app_state_version = snapshot.version
+        return _persisted_app_state_version
+
+
 # --- Customer State Management ---
+def find_customer_ids_by_stage(conversation_stage: str) -> list:
+    """Indexed lookup with the SQLite backend; with JSON files this has to open every customer file."""
+    flush_pending_state_writes()
+    if _use_sqlite_customer_store():
+        return _get_customer_sqlite_store().find_ids_by_stage(conversation_stage)
+    found = []
+    if not os.path.isdir(config.CUSTOMER_STATES_FOLDER): return found
+    for fname in os.listdir(config.CUSTOMER_STATES_FOLDER):
+        if not fname.endswith("_state.json"): continue
+        try:
+            if json_codec.load_file(os.path.join(config.CUSTOMER_STATES_FOLDER, fname)).get("conversation_stage") == conversation_stage:
+                found.append(int(fname[:-len("_state.json")]))
+        except (ValueError, OSError, AttributeError):
+            continue
+    return found
+
+def find_customer_ids_active_since(iso_timestamp: str) -> list:
+    """Customers with last_message_timestamp >= iso_timestamp (UTC ISO). Most recent first with SQLite."""
+    flush_pending_state_writes()
+    if _use_sqlite_customer_store():
+        return _get_customer_sqlite_store().find_ids_active_since(iso_timestamp)
+    found = []
+    if not os.path.isdir(config.CUSTOMER_STATES_FOLDER): return found
+    for fname in os.listdir(config.CUSTOMER_STATES_FOLDER):
+        if not fname.endswith("_state.json"): continue
+        try:
+            ts = json_codec.load_file(os.path.join(config.CUSTOMER_STATES_FOLDER, fname)).get("last_message_timestamp") or ""
+            if ts and ts >= iso_timestamp: found.append(int(fname[:-len("_state.json")]))
+        except (ValueError, OSError, AttributeError):
+            continue
+    return found
+
+def customer_state_lock(telegram_user_id: int):
+    """Context manager serializing read-modify-write of one customer's state across threads."""
+    return _get_customer_cache().customer_lock(telegram_user_id)
+
+def customer_state_async_lock(telegram_user_id: int):
+    """`async with` counterpart of customer_state_lock for the Telegram event loop (same underlying lock)."""
+    return _get_customer_cache().async_customer_lock(telegram_user_id)
+
+def get_customer_cache_metrics() -> dict:
+    return _get_customer_cache().get_metrics()
+
 def get_customer_state_filepath(telegram_user_id: int) -> str:
     return os.path.join(config.CUSTOMER_STATES_FOLDER, f"{str(telegram_user_id)}_state.json")
 
 def load_or_initialize_customer_state(telegram_user_id: int, gui_callbacks=None) -> dict:
-    ensure_folder(config.CUSTOMER_STATES_FOLDER, gui_callbacks) 
-    filepath = get_customer_state_filepath(telegram_user_id)
-
-    default_customer_state_template = config.DEFAULT_NON_ADMIN_USER_STATE.copy()
-    default_customer_state_template["user_id"] = telegram_user_id 
-    if default_customer_state_template["last_message_timestamp"] == "": 
-         default_customer_state_template["last_message_timestamp"] = ""
+    cached_state = _get_customer_cache().get(telegram_user_id)
+    if cached_state is not None:
+        return cached_state
 
+    if not _use_sqlite_customer_store(): ensure_folder(config.CUSTOMER_STATES_FOLDER, gui_callbacks) 
+    filepath = get_customer_state_filepath(telegram_user_id)
 
-    customer_state = _load_or_initialize_json_internal(
-        filepath, default_customer_state_template, f"customer {telegram_user_id} state", gui_callbacks
-    )
+    customer_state = persistence.get_store().get_pending("customer_state", telegram_user_id)
+    if customer_state is None and _use_sqlite_customer_store():
+        stored_state = _get_customer_sqlite_store().load(telegram_user_id)
+        customer_state = json_codec.apply_schema(json_codec.CustomerStateSchema, stored_state or {"user_id": telegram_user_id},
+                                                 context=f"customer {telegram_user_id} state")
+        if stored_state is None:
+            logger.info(f"Initializing new customer {telegram_user_id} in SQLite store.")
+            _get_customer_sqlite_store().save(telegram_user_id, customer_state)
+    if customer_state is None: # Nothing newer waiting in the write-behind store
+        customer_state = _load_or_initialize_json_internal(
+            filepath, json_codec.CustomerStateSchema, f"customer {telegram_user_id} state", gui_callbacks,
+            initial_overrides={"user_id": telegram_user_id}
+        )
     
     if customer_state.get("user_id") != telegram_user_id:
         logger.warning(f"Correcting user_id in state for customer {telegram_user_id} post-load. File had: {customer_state.get('user_id')}")
@@ -297,30 +351,51 @@ def load_or_initialize_customer_state(telegram_user_id: int, gui_callbacks=None)
         customer_state["type_of_user"] = "customer"
         logger.warning(f"Correcting type_of_user for customer {telegram_user_id}.")
 
+    _get_customer_cache().put(telegram_user_id, customer_state)
+    get_calendar_index().sync_owner(telegram_user_id, customer_state.get("calendar_events", []))
     return customer_state
 
 
 def save_customer_state(telegram_user_id: int, customer_state_data: dict, gui_callbacks=None) -> bool:
-    filepath = get_customer_state_filepath(telegram_user_id)
-    try:
+    if _use_sqlite_customer_store():
+        filepath = config.CUSTOMER_STATE_DB_FILE
+        write_fn = lambda data: _get_customer_sqlite_store().save(telegram_user_id, data)
+    else:
+        filepath = get_customer_state_filepath(telegram_user_id)
+        write_fn = lambda data: _write_json_file(filepath, data, f"customer state for user ID {telegram_user_id}")
         parent_dir = os.path.dirname(filepath)
         if parent_dir and not os.path.exists(parent_dir):
              ensure_folder(parent_dir, gui_callbacks) 
 
-        if "last_message_timestamp" in customer_state_data and customer_state_data["last_message_timestamp"] is None:
-            customer_state_data["last_message_timestamp"] = ""
-        if "chat_history" in customer_state_data and not isinstance(customer_state_data["chat_history"], list):
-            customer_state_data["chat_history"] = []
-        if "calendar_events" in customer_state_data and not isinstance(customer_state_data["calendar_events"], list):
-            customer_state_data["calendar_events"] = []
-
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(customer_state_data, f, indent=4, ensure_ascii=False)
-        logger.info(f"Customer state for user ID {telegram_user_id} saved to {filepath}")
-        return True
-    except IOError as e:
-        error_msg = f"Error saving customer state for user ID {telegram_user_id} to '{filepath}': {e}"
-        logger.error(error_msg, exc_info=True)
-        if gui_callbacks and 'messagebox_warn' in gui_callbacks:
-            gui_callbacks['messagebox_warn']("Customer State Save Error", error_msg)
-        return False
\ No newline at end of file
+    if "last_message_timestamp" in customer_state_data and customer_state_data["last_message_timestamp"] is None:
+        customer_state_data["last_message_timestamp"] = ""
+    if "chat_history" in customer_state_data and not isinstance(customer_state_data["chat_history"], list):
+        customer_state_data["chat_history"] = []
+    if "calendar_events" in customer_state_data and not isinstance(customer_state_data["calendar_events"], list):
+        customer_state_data["calendar_events"] = []
+
+    apply_history_window(telegram_user_id, customer_state_data) # Keeps the live history bounded; older turns go to the archive
+    _get_customer_cache().put(telegram_user_id, customer_state_data) # Write-through: cache first, then disk
+    _sync_calendar_index(telegram_user_id, customer_state_data.get("calendar_events", []))
+    saved = persistence.get_store().save("customer_state", telegram_user_id, customer_state_data, write_fn, gui_callbacks)
+    if saved:
+        logger.info(f"Customer state for user ID {telegram_user_id} saved (or queued for write-behind) to {filepath}")
+    return saved
+
+def update_customer_state(telegram_user_id: int, update_fn, read_state: dict = None, gui_callbacks=None):
+    """
+    Read-modify-write of one customer's state under customer_state_lock. update_fn(current_state) gets the state
+    as it is now (not as the caller read it before a long LLM call) and returns the new state, or None for no change.
+    read_state is the state the caller's work was based on. If the customer wrote since then, their newer
+    conversation_stage and last_message_timestamp are kept, so those messages still start the next package.
+    Returns the saved state, or None.
+    """
+    with customer_state_lock(telegram_user_id):
+        current_state = load_or_initialize_customer_state(telegram_user_id, gui_callbacks)
+        current_stage, current_last_message = current_state.get("conversation_stage"), current_state.get("last_message_timestamp")
+        updated_state = update_fn(current_state)
+        if updated_state is None: return None
+        if read_state is not None and current_last_message != read_state.get("last_message_timestamp"):
+            logger.info(f"Customer {telegram_user_id} wrote during processing; keeping stage '{current_stage}'.")
+            updated_state["conversation_stage"], updated_state["last_message_timestamp"] = current_stage, current_last_message
+        return updated_state if save_customer_state(telegram_user_id, updated_state, gui_callbacks) else None
@@ -0,0 +1,348 @@
+# utils/state_patch.py
+"""
+Incremental state updates from the LLM.
+
+In "patch" mode (LLM_STATE_UPDATE_MODE) the prompts ask for a short list of JSON-Patch-like ops per
+state document, not the whole document. This saves generation tokens (eval_count) in proportion to the
+state size. Supported ops, with `path` as a JSON Pointer ("/internal_tasks/pending/-") or dotted
+("internal_tasks.pending"):
+    {"op": "add",          "path": ..., "value": ...}  set a key / insert at a list index / append with "-"
+    {"op": "replace",      "path": ..., "value": ...}  existing key or index only
+    {"op": "remove",       "path": ...}
+    {"op": "append",       "path": <list>, "value": ...}
+    {"op": "remove_value", "path": <list>, "value": ...}  first equal item; a dict value matches any item containing it
+    {"op": "move_value",   "from": <list>, "path": <list>, "value": ...}  e.g. a task from pending to completed
+Each op is checked on its own: protected roots, the path must resolve, the root field keeps its schema
+type, and calendar events need a valid date. An invalid op is skipped and reported; the valid ones still
+apply. The result is run through json_codec.apply_schema.
+
+"full" mode keeps the previous protocol. The whole updated document is merged over the current one, and
+internal_tasks lists are unioned. resolve_state_update() accepts either form from either mode.
+"""
+import copy
+
+import config
+from logger import get_logger
+from . import json_codec
+from .calendar_index import CalendarIndex
+
+logger = get_logger("Iri-shka_App.utils.StatePatch")
+
+_MISSING = object()
+
+# Document kinds: (schema, roots the LLM may not touch)
+DOCUMENTS = {
+    "admin_user_state": (json_codec.AdminUserStateSchema, ("todos",)),
+    "assistant_state": (json_codec.AssistantStateSchema, ()),
+    "customer_state": (json_codec.CustomerStateSchema, ("user_id", "type_of_user", "chat_history", "history_summary")),
+}
+
+ADMIN_RESPONSE_KEYS = {
+    "full": ["answer_to_user", "updated_user_state", "updated_assistant_state", "updated_active_customer_state"],
+    "patch": ["answer_to_user", "user_state_patch", "assistant_state_patch", "active_customer_state_patch"],
+}
+CUSTOMER_RESPONSE_KEYS = {
+    "full": ["updated_customer_state", "updated_assistant_state", "message_for_admin", "polite_followup_message_for_customer"],
+    "patch": ["customer_state_patch", "assistant_state_patch", "message_for_admin", "polite_followup_message_for_customer"],
+}
+
+
+class PatchError(ValueError):
+    pass
+
+
+def patch_mode_enabled() -> bool:
+    return config.LLM_STATE_UPDATE_MODE == "patch"
+
+def admin_prompt_template() -> str:
+    return config.OLLAMA_PROMPT_TEMPLATE_PATCH if patch_mode_enabled() else config.OLLAMA_PROMPT_TEMPLATE
+
+def customer_prompt_template() -> str:
+    return config.OLLAMA_CUSTOMER_PROMPT_TEMPLATE_PATCH if patch_mode_enabled() else config.OLLAMA_CUSTOMER_PROMPT_TEMPLATE_V3
+
+def admin_response_keys() -> list:
+    return ADMIN_RESPONSE_KEYS["patch" if patch_mode_enabled() else "full"]
+
+def customer_response_keys() -> list:
+    return CUSTOMER_RESPONSE_KEYS["patch" if patch_mode_enabled() else "full"]
+
+
+# --- Paths ---
+def parse_path(path) -> list:
+    if isinstance(path, (list, tuple)): return [str(p) for p in path]
+    if not isinstance(path, str) or not path.strip(): raise PatchError(f"invalid path {path!r}")
+    path = path.strip()
+    if path.startswith("/"):
+        return [t.replace("~1", "/").replace("~0", "~") for t in path[1:].split("/")]
+    return path.split(".")
+
+
+def _child(container, token):
+    if isinstance(container, dict):
+        if token not in container: raise PatchError(f"key '{token}' not found")
+        return container[token]
+    if isinstance(container, list):
+        try: return container[int(token)]
+        except (ValueError, IndexError): raise PatchError(f"list index '{token}' out of range")
+    raise PatchError(f"cannot descend into {type(container).__name__} at '{token}'")
+
+
+def _resolve_parent(doc, tokens):
+    parent = doc
+    for token in tokens[:-1]:
+        parent = _child(parent, token)
+    return parent, tokens[-1]
+
+
+def _resolve(doc, tokens):
+    target = doc
+    for token in tokens:
+        target = _child(target, token)
+    return target
+
+
+def _list_at(doc, tokens) -> list:
+    target = _resolve(doc, tokens)
+    if not isinstance(target, list): raise PatchError(f"'{'.'.join(tokens)}' is not a list")
+    return target
+
+
+def _matches(item, value) -> bool:
+    if isinstance(value, dict) and isinstance(item, dict):
+        return all(item.get(k) == v for k, v in value.items())
+    return item == value
+
+
+def _remove_matching(items: list, value, label: str):
+    for i, item in enumerate(items):
+        if _matches(item, value):
+            del items[i]
+            return
+    raise PatchError(f"no item matching {value!r} in '{label}'")
+
+
+# --- Applying ---
+def _apply_op(doc: dict, op: dict):
+    kind = op.get("op")
+    tokens = parse_path(op.get("path"))
+    value = op.get("value", _MISSING)
+    if kind in ("add", "replace", "append", "remove_value", "move_value") and value is _MISSING:
+        raise PatchError(f"'{kind}' needs a value")
+
+    if kind == "append":
+        _list_at(doc, tokens).append(value)
+    elif kind == "remove_value":
+        _remove_matching(_list_at(doc, tokens), value, ".".join(tokens))
+    elif kind == "move_value":
+        from_tokens = parse_path(op.get("from"))
+        source, target = _list_at(doc, from_tokens), _list_at(doc, tokens)
+        _remove_matching(source, value, ".".join(from_tokens))
+        target.append(value)
+    elif kind in ("add", "replace", "remove"):
+        parent, last = _resolve_parent(doc, tokens)
+        if isinstance(parent, dict):
+            if kind != "add" and last not in parent: raise PatchError(f"key '{last}' not found")
+            if kind == "remove": del parent[last]
+            else: parent[last] = value
+        elif isinstance(parent, list):
+            if kind == "add" and last == "-":
+                parent.append(value); return
+            try: index = int(last)
+            except ValueError: raise PatchError(f"bad list index '{last}'")
+            if kind == "add":
+                if not 0 <= index <= len(parent): raise PatchError(f"list index {index} out of range")
+                parent.insert(index, value)
+            else:
+                if not 0 <= index < len(parent): raise PatchError(f"list index {index} out of range")
+                if kind == "remove": del parent[index]
+                else: parent[index] = value
+        else:
+            raise PatchError(f"cannot modify inside {type(parent).__name__}")
+    else:
+        raise PatchError(f"unsupported op {kind!r}")
+
+
+def _root_type_error(schema, root: str, doc: dict, previous):
+    accepted = json_codec.schema_field_types(schema).get(root)
+    if accepted is None: return None # Extra keys are allowed, as in full mode
+    if root not in doc: return f"required field '{root}' would be removed"
+    if not isinstance(doc[root], accepted): return f"field '{root}' would become {type(doc[root]).__name__}"
+    if root == "calendar_events":
+        for event in doc[root]:
+            if (not isinstance(previous, list) or event not in previous) and CalendarIndex.parse_fields(event) is None:
+                return f"invalid calendar event {event!r} (needs description and date YYYY-MM-DD)"
+    return None
+
+
+def apply_patch(document: dict, ops, kind: str, context: str = "") -> tuple:
+    """
+    Applies `ops` to a copy of `document` (kind: key of DOCUMENTS).
+    Returns (new_document, applied_count, errors). Invalid ops are skipped; errors lists why.
+    """
+    schema, protected_roots = DOCUMENTS[kind]
+    doc = copy.deepcopy(document) if isinstance(document, dict) else {}
+    if ops is None or ops == {}: ops = []
+    if isinstance(ops, dict): ops = [ops] # A single op instead of a list
+    if not isinstance(ops, list):
+        return json_codec.apply_schema(schema, doc, context), 0, [f"patch must be a list of ops, got {type(ops).__name__}"]
+    applied, errors = 0, []
+    for op in ops:
+        try:
+            if not isinstance(op, dict): raise PatchError(f"op must be an object, got {op!r}")
+            roots = {parse_path(op.get("path"))[0]}
+            if op.get("from") is not None: roots.add(parse_path(op["from"])[0])
+            blocked = roots.intersection(protected_roots)
+            if blocked: raise PatchError(f"field '{blocked.pop()}' is read-only")
+            backup = {root: copy.deepcopy(doc[root]) if root in doc else _MISSING for root in roots}
+            _apply_op(doc, op)
+            problem = next(filter(None, (_root_type_error(schema, root, doc, backup[root]) for root in roots)), None)
+            if problem:
+                for root, previous in backup.items(): # Roll this op back
+                    if previous is _MISSING: doc.pop(root, None)
+                    else: doc[root] = previous
+                raise PatchError(problem)
+            applied += 1
+        except PatchError as e_op:
+            errors.append(f"{op!r}: {e_op}")
+    if errors:
+        logger.warning(f"{context or kind}: skipped {len(errors)} invalid patch op(s): {errors}")
+    return json_codec.apply_schema(schema, doc, context), applied, errors
+
+
+def _dedupe_tasks(state: dict) -> dict:
+    tasks = state.get("internal_tasks")
+    if isinstance(tasks, dict):
+        for task_type in ("pending", "completed"):
+            if isinstance(tasks.get(task_type), list):
+                tasks[task_type] = list(dict.fromkeys(str(t) for t in tasks[task_type]))
+    return state
+
+
+def merge_full_assistant_state(base: dict, changes: dict, context: str = "") -> dict:
+    """Full-mode merge: top-level keys replaced, internal_tasks.pending/completed unioned (order kept), 'in_process' ignored."""
+    merged = copy.deepcopy(base)
+    llm_tasks_dict = changes.get("internal_tasks")
+    if isinstance(llm_tasks_dict, dict):
+        if not isinstance(merged.get("internal_tasks"), dict):
+            merged["internal_tasks"] = {"pending": [], "completed": []}
+        for task_type in ("pending", "completed"):
+            existing = merged["internal_tasks"].get(task_type)
+            if not isinstance(existing, list): existing = []
+            new_tasks = llm_tasks_dict.get(task_type, [])
+            if not isinstance(new_tasks, list): new_tasks = [str(new_tasks)] if new_tasks else []
+            merged["internal_tasks"][task_type] = list(existing) + list(new_tasks)
+        if "in_process" in llm_tasks_dict:
+            logger.warning(f"{context or 'assistant_state'}: LLM provided 'in_process' tasks. This key is ignored. Tasks: {llm_tasks_dict['in_process']}")
+    for key, val_llm in changes.items():
+        if key != "internal_tasks": merged[key] = val_llm
+    return _dedupe_tasks(json_codec.apply_schema(json_codec.AssistantStateSchema, merged, context))
+
+
+def resolve_state_update(base: dict, llm_data: dict, kind: str, full_key: str, patch_key: str, context: str = ""):
+    """
+    The updated document described by llm_data, or None if it has no (usable) update for it.
+    A patch (llm_data[patch_key]) wins over a full document (llm_data[full_key]).
+    """
+    if not isinstance(llm_data, dict): return None
+    schema, protected_roots = DOCUMENTS[kind]
+    ops = llm_data.get(patch_key)
+    if ops is not None:
+        if not ops: return None # Empty patch: nothing to change
+        updated, applied, _errors = apply_patch(base, ops, kind, context)
+        if not applied: return None
+        return _dedupe_tasks(updated) if kind == "assistant_state" else updated
+    changes = llm_data.get(full_key)
+    if not isinstance(changes, dict) or not changes:
+        if full_key in llm_data and changes not in (None, {}):
+            logger.warning(f"{context or kind}: '{full_key}' from LLM was not a dict. State not modified by LLM this turn.")
+        return None
+    if kind == "assistant_state": return merge_full_assistant_state(base, changes, context)
+    merged = copy.deepcopy(base)
+    merged.update({k: v for k, v in changes.items() if k not in protected_roots})
+    return json_codec.apply_schema(schema, merged, context)
+
+
+def _measure_live_eval_count(requests_text: list, user_state: dict, assistant_state: dict, rounds: int) -> dict:
+    """
+    Runs the same admin requests through the configured Ollama once per mode and returns get_llm_eval_metrics().
+    eval_count is Ollama's own count of generated tokens; each mode starts from the same states.
+    """
+    from . import ollama_handler
+    original_mode = config.LLM_STATE_UPDATE_MODE
+    try:
+        for mode in ("full", "patch"):
+            config.LLM_STATE_UPDATE_MODE = mode
+            live_user_state, live_assistant_state, chat_history = copy.deepcopy(user_state), copy.deepcopy(assistant_state), []
+            for _ in range(rounds):
+                for text in requests_text:
+                    data, error = ollama_handler.call_ollama_for_chat_response(
+                        prompt_template_to_use=admin_prompt_template(), transcribed_text=text, current_chat_history=chat_history,
+                        current_user_state=live_user_state, current_assistant_state=live_assistant_state,
+                        language_instruction=config.LANGUAGE_INSTRUCTION_NON_RUSSIAN,
+                        format_kwargs={"admin_name_value": "Partner", "assistant_admin_name_current_value": "Partner",
+                                       "is_customer_context_active": False, "active_customer_id": "N/A",
+                                       "active_customer_state_string": "{}"},
+                        expected_keys_override=admin_response_keys(), stats_label=f"admin/{mode}")
+                    if error: print(f"  {mode}: '{text[:40]}' failed: {error}"); continue
+                    live_user_state = resolve_state_update(live_user_state, data, "admin_user_state", "updated_user_state", "user_state_patch") or live_user_state
+                    live_assistant_state = resolve_state_update(live_assistant_state, data, "assistant_state", "updated_assistant_state", "assistant_state_patch") or live_assistant_state
+                    chat_history.append({"user": text, "assistant": data.get("answer_to_user", ""), "source": "gui"})
+    finally:
+        config.LLM_STATE_UPDATE_MODE = original_mode
+    return ollama_handler.get_llm_eval_metrics()
+
+
+if __name__ == "__main__":
+    # Offline comparison of what the LLM has to generate per turn in each mode (same state change), plus apply cost.
+    # --live N measures the real eval_count per turn in both modes against the configured Ollama (OLLAMA_API_URL).
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Full-document vs patch state updates")
+    parser.add_argument("--live", type=int, default=0, metavar="ROUNDS", help="Run the sample admin requests ROUNDS times per mode against Ollama")
+    args = parser.parse_args()
+
+    user_state = json_codec.schema_defaults(json_codec.AdminUserStateSchema)
+    user_state["calendar_events"] = [{"description": f"Meeting {i}", "date": f"2025-07-{i + 1:02d}", "time": "10:00"} for i in range(12)]
+    user_state["topics_discussed"] = [f"topic {i}" for i in range(10)]
+    assistant_state = json_codec.schema_defaults(json_codec.AssistantStateSchema)
+    assistant_state["internal_tasks"]["pending"] += [f"Task {i}" for i in range(10)]
+
+    new_event = {"description": "Call with supplier", "date": "2025-07-20", "time": "15:00"}
+    full_response = {
+        "answer_to_user": "Done, I added the call and marked the check as completed.",
+        "updated_user_state": {**user_state, "calendar_events": user_state["calendar_events"] + [new_event]},
+        "updated_assistant_state": {**assistant_state, "internal_tasks": {
+            "pending": [t for t in assistant_state["internal_tasks"]["pending"] if t != "Task 3"],
+            "completed": assistant_state["internal_tasks"]["completed"] + ["Task 3"]}},
+        "updated_active_customer_state": None,
+    }
+    patch_response = {
+        "answer_to_user": full_response["answer_to_user"],
+        "user_state_patch": [{"op": "append", "path": "calendar_events", "value": new_event}],
+        "assistant_state_patch": [{"op": "move_value", "from": "internal_tasks.pending", "path": "internal_tasks.completed", "value": "Task 3"}],
+        "active_customer_state_patch": [],
+    }
+    for name, response in (("full", full_response), ("patch", patch_response)):
+        text = json_codec.dumps(response, indent=2)
+        print(f"{name:>5}: {len(text):>6} chars, ~{len(text) // 4:>5} output tokens (chars/4 estimate)")
+
+    n = 2000
+    t0 = time.perf_counter()
+    for _ in range(n):
+        resolve_state_update(user_state, patch_response, "admin_user_state", "updated_user_state", "user_state_patch")
+        resolve_state_update(assistant_state, patch_response, "assistant_state", "updated_assistant_state", "assistant_state_patch")
+    print(f"apply patches: {(time.perf_counter() - t0) / n * 1e6:.0f} us/turn")
+    t0 = time.perf_counter()
+    for _ in range(n):
+        resolve_state_update(user_state, full_response, "admin_user_state", "updated_user_state", "user_state_patch")
+        resolve_state_update(assistant_state, full_response, "assistant_state", "updated_assistant_state", "assistant_state_patch")
+    print(f"merge full documents: {(time.perf_counter() - t0) / n * 1e6:.0f} us/turn")
+
+    if args.live:
+        sample_requests = ["Add a call with the supplier on 2025-07-20 at 15:00.", "Task 3 is done, please mark it completed.",
+                           "Remind yourself to prepare the monthly report.", "What is on my calendar for July 5th?"]
+        print(f"Live run: {len(sample_requests)} requests x {args.live} round(s) per mode, model {config.OLLAMA_MODEL_NAME} at {config.OLLAMA_API_URL}")
+        for label, m in sorted(_measure_live_eval_count(sample_requests, user_state, assistant_state, args.live).items()):
+            print(f"{label:>12}: {m['turns']} turns, eval_count {m['avg_eval_count']:.0f}/turn, "
+                  f"prompt_eval_count {m['avg_prompt_eval_count']:.0f}/turn, generation {m['avg_eval_seconds']:.2f}s/turn")
@@ -0,0 +1,304 @@
+# utils/telegram_fake_api.py
+"""
+Offline fake of the Telegram Bot API for benchmarking update ingestion (polling vs webhook).
+
+The fake serves the methods the bot uses (getMe, getUpdates, setWebhook, sendMessage, ...) on 127.0.0.1.
+It generates synthetic customer "/start" updates at a fixed rate, each from a new user id, so each one
+gets exactly one greeting reply. It delivers them the way the bot asked for them: held for getUpdates,
+or POSTed to the URL given to setWebhook (with its secret token and up to max_connections connections).
+Latency is the time from creating an update to the bot's sendMessage for that chat.
+
+Against the real app (no network needed):
+    python -m utils.telegram_fake_api --port 8081 --updates 1000 --rate 100
+    TELEGRAM_API_BASE_URL=http://127.0.0.1:8081/bot TELEGRAM_INGESTION_MODE=polling python main.py --headless
+    TELEGRAM_API_BASE_URL=http://127.0.0.1:8081/bot TELEGRAM_INGESTION_MODE=webhook \\
+        TELEGRAM_WEBHOOK_URL=http://127.0.0.1:8443/telegram/webhook python main.py --headless
+The synthetic users get customer states, with ids from FAKE_USER_ID_BASE up, so they are easy to remove.
+
+    python -m utils.telegram_fake_api --self-test
+runs both modes against a minimal in-process bot. That bot polls like the app does (poll_interval, long
+poll timeout) or receives updates through utils.telegram_webhook, then replies after a fixed handler time.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import re
+import time
+import urllib.parse
+
+import config
+from logger import get_logger
+
+logger = get_logger("Iri-shka_App.utils.TelegramFakeAPI")
+
+FAKE_USER_ID_BASE = 990_000_000_000
+_BOT_USER = {"id": 1, "is_bot": True, "first_name": "FakeIrishka", "username": "fake_irishka_bot",
+             "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+
+class HttpConnection:
+    """Minimal keep-alive HTTP/1.1 client (Content-Length bodies only), enough for localhost benchmarks."""
+    def __init__(self, host: str, port: int):
+        self.host, self.port = host, port
+        self._reader = self._writer = None
+
+    async def request(self, method: str, path: str, body: bytes = b"", headers: dict = None) -> tuple:
+        if self._writer is None: self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\nContent-Length: {len(body)}\r\n"
+        head += "".join(f"{k}: {v}\r\n" for k, v in (headers or {}).items())
+        try:
+            self._writer.write(head.encode("latin-1") + b"\r\n" + body)
+            await self._writer.drain()
+            status_line, resp_headers = await _read_head(self._reader)
+            length = int(resp_headers.get("content-length", "0"))
+            data = await self._reader.readexactly(length) if length else b""
+        except (ConnectionError, asyncio.IncompleteReadError):
+            self.close(); raise
+        if resp_headers.get("connection", "").lower() == "close": self.close()
+        return int(status_line.split(" ")[1]), data
+
+    def close(self):
+        if self._writer: self._writer.close()
+        self._reader = self._writer = None
+
+
+async def _read_head(reader: asyncio.StreamReader) -> tuple:
+    lines = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    return lines[0], headers
+
+
+def _parse_params(query: str, body: bytes, content_type: str) -> dict:
+    """Bot API parameters from the query string and a JSON, urlencoded or multipart body."""
+    params = {k: v[-1] for k, v in urllib.parse.parse_qs(query).items()}
+    if "application/json" in content_type and body: params.update(json.loads(body))
+    elif "multipart/form-data" in content_type:
+        for name, value in re.findall(rb'name="([^"]+)"\r\n(?:[^\r\n]+\r\n)*\r\n(.*?)\r\n--', body, re.S):
+            if len(value) < 4096: params[name.decode()] = value.decode("utf-8", "replace")
+    elif body: params.update({k: v[-1] for k, v in urllib.parse.parse_qs(body.decode("utf-8")).items()})
+    for key, value in list(params.items()): # Form values are JSON-encoded where they are not plain strings
+        if isinstance(value, str):
+            try: params[key] = json.loads(value)
+            except ValueError: pass
+    return params
+
+
+def _percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values: return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))]
+
+
+class FakeTelegramAPI:
+    def __init__(self, host: str = "127.0.0.1", port: int = 8081):
+        self.host, self.port = host, port
+        self._server = None
+        self._connections = set()
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._pending = collections.deque() # Updates waiting for getUpdates
+        self._pending_event = asyncio.Event()
+        self._webhook = None # {"url", "secret", "max_connections"} once setWebhook is called
+        self._webhook_queue = asyncio.Queue()
+        self._webhook_tasks = []
+        self.ready = asyncio.Event() # Set when the bot polls or registers a webhook
+        self.mode = None
+        self.created_at = {} # chat_id -> monotonic time the update was created
+        self.latencies = {} # chat_id -> seconds until the first reply
+        self.method_counts = collections.Counter()
+        self.webhook_errors = 0
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve_connection, self.host, self.port)
+        if not self.port: self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Fake Telegram API on http://{self.host}:{self.port}/bot<token>/")
+
+    async def stop(self):
+        for task in self._webhook_tasks: task.cancel()
+        await asyncio.gather(*self._webhook_tasks, return_exceptions=True)
+        if self._server: self._server.close()
+        for writer in list(self._connections): writer.close() # Ends keep-alive handlers (and pending long polls)
+        self._pending_event.set()
+        if self._server: await self._server.wait_closed()
+        while self._connections: await asyncio.sleep(0.01)
+
+    # --- Synthetic load ---
+    def _make_update(self, user_id: int) -> dict:
+        update_id, message_id = self._next_update_id, self._next_message_id
+        self._next_update_id += 1; self._next_message_id += 1
+        user = {"id": user_id, "is_bot": False, "first_name": f"Load{user_id % 100000}", "username": f"load{user_id}"}
+        return {"update_id": update_id, "message": {
+            "message_id": message_id, "date": int(time.time()), "chat": {"id": user_id, "type": "private", "first_name": user["first_name"]},
+            "from": user, "text": "/start", "entities": [{"type": "bot_command", "offset": 0, "length": 6}]}}
+
+    async def generate(self, n_updates: int, rate_per_second: float):
+        """Creates n_updates at a steady rate and delivers them in the bot's chosen mode."""
+        started = time.monotonic()
+        for n in range(n_updates):
+            await asyncio.sleep(max(0.0, started + n / rate_per_second - time.monotonic()))
+            user_id = FAKE_USER_ID_BASE + n
+            update = self._make_update(user_id)
+            self.created_at[user_id] = time.monotonic()
+            if self._webhook: self._webhook_queue.put_nowait(update)
+            else: self._pending.append(update); self._pending_event.set()
+
+    async def wait_for_replies(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while len(self.latencies) < len(self.created_at):
+            if time.monotonic() > deadline: return False
+            await asyncio.sleep(0.05)
+        return True
+
+    def report(self) -> dict:
+        values = sorted(self.latencies.values())
+        span = (max(self.created_at[c] + l for c, l in self.latencies.items()) - min(self.created_at.values())) if values else 0.0
+        return {"mode": self.mode, "updates": len(self.created_at), "replied": len(values),
+                "p50_ms": round(_percentile(values, 50) * 1000, 1), "p95_ms": round(_percentile(values, 95) * 1000, 1),
+                "p99_ms": round(_percentile(values, 99) * 1000, 1), "max_ms": round((values[-1] if values else 0) * 1000, 1),
+                "replies_per_s": round(len(values) / span, 1) if span else 0.0, "webhook_errors": self.webhook_errors}
+
+    # --- Webhook delivery ---
+    def _start_webhook_senders(self):
+        url = urllib.parse.urlsplit(self._webhook["url"])
+        headers = {"Content-Type": "application/json"}
+        if self._webhook["secret"]: headers["X-Telegram-Bot-Api-Secret-Token"] = self._webhook["secret"]
+        async def _sender():
+            conn = HttpConnection(url.hostname, url.port or 80)
+            while True:
+                update = await self._webhook_queue.get()
+                try:
+                    status, _ = await conn.request("POST", url.path or "/", json.dumps(update).encode(), headers)
+                    if status != 200: self.webhook_errors += 1
+                except (ConnectionError, asyncio.IncompleteReadError, OSError):
+                    self.webhook_errors += 1; conn.close()
+        self._webhook_tasks = [asyncio.get_running_loop().create_task(_sender()) for _ in range(self._webhook["max_connections"])]
+
+    # --- Bot API ---
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._connections.add(writer)
+        try:
+            while True:
+                request_line, headers = await _read_head(reader)
+                length = int(headers.get("content-length", "0"))
+                body = await reader.readexactly(length) if length else b""
+                target = request_line.split(" ")[1]
+                path, _, query = target.partition("?")
+                method = path.rsplit("/", 1)[-1]
+                result = await self._call(method, _parse_params(query, body, headers.get("content-type", "")))
+                payload = json.dumps({"ok": True, "result": result}).encode()
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: "
+                             + str(len(payload)).encode() + b"\r\n\r\n" + payload)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError): pass
+        finally:
+            self._connections.discard(writer); writer.close()
+
+    async def _call(self, method: str, params: dict):
+        self.method_counts[method] += 1
+        if method == "getMe": return _BOT_USER
+        if method == "getUpdates":
+            if self.mode is None: self.mode = "polling"; self.ready.set()
+            offset = int(params.get("offset") or 0)
+            while self._pending and self._pending[0]["update_id"] < offset: self._pending.popleft() # Acknowledged
+            if not self._pending:
+                self._pending_event.clear()
+                try: await asyncio.wait_for(self._pending_event.wait(), float(params.get("timeout") or 0))
+                except asyncio.TimeoutError: pass
+            return list(self._pending)[:int(params.get("limit") or 100)]
+        if method == "setWebhook":
+            self._webhook = {"url": params["url"], "secret": params.get("secret_token") or "",
+                             "max_connections": int(params.get("max_connections") or 40)}
+            self.mode = "webhook"; self._start_webhook_senders(); self.ready.set()
+            return True
+        if method == "getWebhookInfo":
+            return {"url": (self._webhook or {}).get("url", ""), "has_custom_certificate": False, "pending_update_count": self._webhook_queue.qsize()}
+        if method in ("sendMessage", "sendDocument", "sendVoice"):
+            chat_id = int(params.get("chat_id") or 0)
+            if chat_id in self.created_at and chat_id not in self.latencies:
+                self.latencies[chat_id] = time.monotonic() - self.created_at[chat_id]
+            message_id = self._next_message_id; self._next_message_id += 1
+            return {"message_id": message_id, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"},
+                    "from": _BOT_USER, "text": params.get("text", "")}
+        return True # deleteWebhook, setMyCommands, sendChatAction, deleteMessage, ...
+
+
+async def _run_against_app(args):
+    api = FakeTelegramAPI(port=args.port)
+    await api.start()
+    print(f"Waiting for the bot: set TELEGRAM_API_BASE_URL=http://127.0.0.1:{api.port}/bot and start the app.")
+    await asyncio.wait_for(api.ready.wait(), args.wait_ready)
+    await asyncio.sleep(1.0) # Let the bot finish starting up
+    print(f"Bot connected ({api.mode}); sending {args.updates} updates at {args.rate}/s...")
+    await api.generate(args.updates, args.rate)
+    if not await api.wait_for_replies(args.reply_timeout): print("Timed out waiting for some replies.")
+    print(api.report())
+    await api.stop()
+
+
+async def _self_test(args):
+    """Minimal stand-in bot, polling like the app's run_polling settings, or behind utils.telegram_webhook."""
+    from .telegram_webhook import TelegramWebhookServer
+    handler_seconds = 0.005
+
+    async def run_mode(mode: str) -> dict:
+        api = FakeTelegramAPI(port=0)
+        await api.start()
+        updates = asyncio.Queue()
+        conns = [HttpConnection(api.host, api.port) for _ in range(args.concurrency)]
+        async def worker(conn):
+            while True:
+                update = await updates.get()
+                await asyncio.sleep(handler_seconds) # Handler work
+                chat_id = update["message"]["chat"]["id"]
+                await conn.request("POST", "/botTEST/sendMessage", json.dumps({"chat_id": chat_id, "text": "hi"}).encode(),
+                                   {"Content-Type": "application/json"})
+        tasks = [asyncio.create_task(worker(c)) for c in conns]
+        poll_conn, server = HttpConnection(api.host, api.port), None
+        if mode == "polling":
+            async def poller():
+                offset = 0
+                while True:
+                    _, data = await poll_conn.request("POST", "/botTEST/getUpdates", json.dumps({"offset": offset, "timeout": args.poll_timeout}).encode(),
+                                                      {"Content-Type": "application/json"})
+                    for update in json.loads(data)["result"]:
+                        offset = update["update_id"] + 1; updates.put_nowait(update)
+                    await asyncio.sleep(args.poll_interval)
+            tasks.append(asyncio.create_task(poller()))
+        else:
+            async def on_update(update): updates.put_nowait(update)
+            server = TelegramWebhookServer(on_update, "127.0.0.1", 0, "/telegram/webhook", "s3cret")
+            await server.start()
+            await poll_conn.request("POST", "/botTEST/setWebhook", json.dumps({"url": f"http://127.0.0.1:{server.port}/telegram/webhook",
+                                                                                   "secret_token": "s3cret", "max_connections": 40}).encode(),
+                                    {"Content-Type": "application/json"})
+        await asyncio.wait_for(api.ready.wait(), 5)
+        await api.generate(args.updates, args.rate)
+        await api.wait_for_replies(args.reply_timeout)
+        report = api.report()
+        for task in tasks: task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for conn in conns + [poll_conn]: conn.close()
+        if server: await server.stop()
+        await api.stop()
+        return report
+
+    for mode in ("polling", "webhook"): print(await run_mode(mode))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API for offline ingestion benchmarks.")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=100.0, help="Updates per second")
+    parser.add_argument("--wait-ready", type=float, default=120.0, help="Seconds to wait for the bot to connect")
+    parser.add_argument("--reply-timeout", type=float, default=60.0)
+    parser.add_argument("--self-test", action="store_true", help="Benchmark polling vs webhook with an in-process stand-in bot")
+    parser.add_argument("--poll-interval", type=float, default=config.TELEGRAM_POLL_INTERVAL_SECONDS, help="Self-test: pause between getUpdates calls")
+    parser.add_argument("--poll-timeout", type=float, default=config.TELEGRAM_POLLING_TIMEOUT, help="Self-test: getUpdates long-poll timeout")
+    parser.add_argument("--concurrency", type=int, default=32, help="Self-test: concurrent update handlers")
+    cli_args = parser.parse_args()
+    asyncio.run(_self_test(cli_args) if cli_args.self_test else _run_against_app(cli_args))
@@ -1,11 +1,16 @@
 # utils/telegram_handler.py
 import asyncio
+import concurrent.futures
+import functools
+import io
+import secrets
+import ssl
 import threading
 import queue
 import config
 from telegram import Update, BotCommand, InputFile
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from telegram.error import InvalidToken, NetworkError, TelegramError
+from telegram.error import InvalidToken, NetworkError, TelegramError, BadRequest
 import logging
 import os
 import datetime # For dashboard filename & calendar summary
@@ -15,10 +20,15 @@ from .file_utils import ensure_folder
 from .state_manager import (
     load_or_initialize_customer_state,
     save_customer_state,
+    customer_state_async_lock,
     get_current_timestamp_iso
 )
 from .customer_interaction_manager import CustomerInteractionManager
 from .html_dashboard_generator import generate_dashboard_html
+from .calendar_index import get_calendar_index, event_fingerprint
+from .loop_monitor import EventLoopLagMonitor
+from .telegram_outbox import TelegramOutbox
+from .telegram_webhook import TelegramWebhookServer
 
 from logger import get_logger # Assuming logger.py is in project root
 
@@ -51,6 +61,16 @@ else:
     logger.info("Pydub-dependent features (e.g., admin voice replies) disabled in config or Pydub not imported for Telegram handler.")
 
 
+def _convert_voice_to_wav(ogg_path: str, wav_path: str):
+    audio = AudioSegment_class.from_file(ogg_path)
+    audio = audio.set_frame_rate(config.INPUT_RATE).set_channels(config.CHANNELS)
+    audio.export(wav_path, format="wav")
+
+
+def _read_file_bytes(filepath: str) -> bytes:
+    with open(filepath, 'rb') as f: return f.read()
+
+
 def get_telegram_bot_status():
     global _current_bot_status
     with _status_lock:
@@ -111,6 +131,14 @@ class TelegramBotHandler:
         self.async_loop = None
         self._app_lock = threading.Lock()
         self._is_shutting_down = False
+        # Handlers run on the polling loop; file I/O, SQLite, ffmpeg and dashboard rendering go here instead
+        self._blocking_executor = concurrent.futures.ThreadPoolExecutor(max_workers=config.TELEGRAM_BLOCKING_WORKERS, thread_name_prefix="TelegramBlocking")
+        self._loop_monitor = None
+        self._admin_order_lock = None # asyncio.Lock, created on the polling loop; keeps admin updates in arrival order
+        self._webhook_stop = None # asyncio.Event while the webhook server runs
+        # All outgoing messages: rate limited per chat and globally, coalesced, retried on 429/network errors
+        self.outbox = TelegramOutbox(self._send_text_now, self._send_voice_bytes_now,
+                                     is_transient=lambda e: isinstance(e, NetworkError) and not isinstance(e, BadRequest)) # BadRequest subclasses NetworkError
 
         if not self.token:
             _set_telegram_bot_status("no_token", self.gui_callbacks, log_level=logging.ERROR); return
@@ -121,7 +149,6 @@ class TelegramBotHandler:
         ensure_folder(config.CUSTOMER_STATES_FOLDER, self.gui_callbacks)
         ensure_folder(config.TELEGRAM_VOICE_TEMP_FOLDER, self.gui_callbacks)
         ensure_folder(config.TELEGRAM_TTS_TEMP_FOLDER, self.gui_callbacks)
-        ensure_folder(os.path.join(config.DATA_FOLDER, "temp_dashboards"), self.gui_callbacks)
 
 
     def _setup_application_handlers(self):
@@ -136,6 +163,25 @@ class TelegramBotHandler:
             logger.info("Admin voice message handler disabled (Pydub not available or Admin ID invalid). Non-admin voice ignored.")
         logger.debug("Telegram bot handlers configured.")
 
+    async def _run_blocking(self, fn, *args):
+        """Runs a blocking call on the handler's executor so the polling loop keeps serving other updates."""
+        return await asyncio.get_running_loop().run_in_executor(self._blocking_executor, functools.partial(fn, *args))
+
+    async def _on_application_init(self, app: Application):
+        self._admin_order_lock = asyncio.Lock()
+        self.outbox.attach(asyncio.get_running_loop())
+        self._loop_monitor = EventLoopLagMonitor("TelegramLoop")
+        await self._loop_monitor.start()
+
+    async def _on_application_shutdown(self, app: Application):
+        await self.outbox.close()
+        if self._loop_monitor: await self._loop_monitor.stop()
+        self._loop_monitor = None
+
+    def get_loop_metrics(self) -> dict:
+        monitor = self._loop_monitor
+        return monitor.get_metrics() if monitor else {}
+
     async def _set_bot_commands_on_startup(self):
         with self._app_lock: app = self.application
         if app:
@@ -155,40 +201,36 @@ class TelegramBotHandler:
         except Exception: pass
         temp_reply_generating = await update.message.reply_text("Generating status dashboard, please wait a moment...")
         try:
-            dashboard_data = self.fn_get_dashboard_data()
-            if not dashboard_data:
+            html_bytes = await self._run_blocking(self._render_dashboard_html)
+            if not html_bytes:
                 logger.error("Failed to gather data for the dashboard.")
                 await temp_reply_generating.edit_text("Sorry, an error occurred while gathering data for the dashboard.")
                 return
-            html_content = generate_dashboard_html(
-                admin_user_state=dashboard_data.get("admin_user_state", {}),
-                assistant_state_snapshot=dashboard_data.get("assistant_state", {}),
-                admin_chat_history=dashboard_data.get("admin_chat_history", []),
-                component_statuses=dashboard_data.get("component_statuses", {}),
-                app_overall_status=dashboard_data.get("app_overall_status", "N/A")
-            )
             dashboard_filename = f"irishka_dashboard_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.html"
-            temp_dashboard_folder = os.path.join(config.DATA_FOLDER, "temp_dashboards")
-            ensure_folder(temp_dashboard_folder, self.gui_callbacks)
-            dashboard_filepath = os.path.join(temp_dashboard_folder, dashboard_filename)
-            with open(dashboard_filepath, "w", encoding="utf-8") as f: f.write(html_content)
-            logger.info(f"HTML dashboard generated: {dashboard_filepath}")
-            with open(dashboard_filepath, "rb") as doc_to_send:
-                await context.bot.send_document(
-                    chat_id=update.effective_chat.id, # type: ignore
-                    document=doc_to_send, filename=dashboard_filename,
-                    caption=f"Iri-shka Status Dashboard ({datetime.datetime.now().strftime('%H:%M:%S')})"
-                )
+            logger.info(f"HTML dashboard generated ({len(html_bytes)} bytes).")
+            await context.bot.send_document(
+                chat_id=update.effective_chat.id, # type: ignore
+                document=InputFile(io.BytesIO(html_bytes), filename=dashboard_filename), filename=dashboard_filename,
+                caption=f"Iri-shka Status Dashboard ({datetime.datetime.now().strftime('%H:%M:%S')})"
+            )
             logger.info(f"Dashboard sent to admin {update.effective_user.id}.")
             await temp_reply_generating.delete()
         except Exception as e:
             logger.error(f"Error generating or sending HTML dashboard: {e}", exc_info=True)
             try: await temp_reply_generating.edit_text("Sorry, an error occurred while generating the status dashboard.")
             except Exception: await update.message.reply_text("Sorry, an error occurred while generating the status dashboard.")
-        finally:
-            if 'dashboard_filepath' in locals() and os.path.exists(dashboard_filepath):
-                try: os.remove(dashboard_filepath)
-                except Exception as e_rem_dash: logger.warning(f"Could not remove temp dashboard file {dashboard_filepath}: {e_rem_dash}")
+
+    def _render_dashboard_html(self):
+        """Gathers dashboard data and renders it to UTF-8 HTML bytes (None if no data). Runs on the executor."""
+        dashboard_data = self.fn_get_dashboard_data()
+        if not dashboard_data: return None
+        return generate_dashboard_html(
+            admin_user_state=dashboard_data.get("admin_user_state", {}),
+            assistant_state_snapshot=dashboard_data.get("assistant_state", {}),
+            admin_chat_history=dashboard_data.get("admin_chat_history", []),
+            component_statuses=dashboard_data.get("component_statuses", {}),
+            app_overall_status=dashboard_data.get("app_overall_status", "N/A")
+        ).encode("utf-8")
 
     async def _format_and_send_customer_calendar_summary(self, user_id: int, customer_state: dict, context: ContextTypes.DEFAULT_TYPE):
         """Helper to format and send calendar summary to the customer."""
@@ -196,17 +238,10 @@ class TelegramBotHandler:
         summary_parts = []
         if calendar_events:
             summary_parts.append(config.TELEGRAM_CUSTOMER_CALENDAR_SUMMARY_HEADER)
-            # Sort events by date and time
-            try:
-                sorted_events = sorted(
-                    calendar_events,
-                    key=lambda x: (
-                        str(x.get("date", "9999-99-99")),
-                        str(x.get("time", "99:99"))
-                    )
-                )
-            except: # Fallback if sorting fails
-                sorted_events = calendar_events
+            # state_manager keeps the index in sync on every customer load/save; events come back already sorted
+            sorted_events = [ev.raw for ev in get_calendar_index().events_for_owner(user_id)]
+            indexed_fingerprints = {event_fingerprint(ev) for ev in sorted_events} # Undated events are not indexed; list them last
+            sorted_events += [ev for ev in calendar_events if isinstance(ev, dict) and event_fingerprint(ev) not in indexed_fingerprints]
 
             for event in sorted_events:
                 desc = event.get("description", "Событие")
@@ -231,44 +266,46 @@ class TelegramBotHandler:
 
         if user_id == self.admin_user_id_int:
             logger.info(f"/start command received from admin user {user_id}.")
-            await update.message.reply_text(config.TELEGRAM_START_MESSAGE)
-            await self._send_dashboard_to_admin(update, context)
+            async with self._admin_order_lock:
+                await update.message.reply_text(config.TELEGRAM_START_MESSAGE)
+                await self._send_dashboard_to_admin(update, context)
         else:
             logger.info(f"/start command from non-admin user {user_id} ({user.username}).")
-            customer_state = load_or_initialize_customer_state(user_id, self.gui_callbacks)
-            customer_name = customer_state.get("name", "unknown")
-            is_known_customer_by_name = customer_name != "unknown" and customer_name is not None
-
-            messages_to_send = []
-            if is_known_customer_by_name:
-                messages_to_send.append(config.TELEGRAM_RETURNING_CUSTOMER_GREETING_KNOWN_NAME.format(customer_name=customer_name))
-                # Calendar summary will be handled by a separate call to _format_and_send_customer_calendar_summary
-            else: # New user or name still unknown in state
-                messages_to_send.append(config.TELEGRAM_NON_ADMIN_GREETING)
-
-            # Send initial greeting part
-            if messages_to_send:
-                await update.message.reply_text("\n".join(messages_to_send))
+            async with customer_state_async_lock(user_id): # Serialize with LLM workers touching this customer
+                customer_state = await self._run_blocking(load_or_initialize_customer_state, user_id, self.gui_callbacks)
+                customer_name = customer_state.get("name", "unknown")
+                is_known_customer_by_name = customer_name != "unknown" and customer_name is not None
+
+                messages_to_send = []
+                if is_known_customer_by_name:
+                    messages_to_send.append(config.TELEGRAM_RETURNING_CUSTOMER_GREETING_KNOWN_NAME.format(customer_name=customer_name))
+                    # Calendar summary will be handled by a separate call to _format_and_send_customer_calendar_summary
+                else: # New user or name still unknown in state
+                    messages_to_send.append(config.TELEGRAM_NON_ADMIN_GREETING)
+
+                # Send initial greeting part
+                if messages_to_send:
+                    await update.message.reply_text("\n".join(messages_to_send))
             
-            # Update chat history with bot's greeting
-            customer_state["chat_history"] = [] # Reset history for a /start command re-engagement
-            for msg_text in messages_to_send:
-                customer_state["chat_history"].append({
-                    "sender": "bot", "message": msg_text, "timestamp": current_time_iso
-                })
-
-            if is_known_customer_by_name:
-                await self._format_and_send_customer_calendar_summary(user_id, customer_state, context)
-                # Add calendar summary to chat history (optional, could be verbose)
-                # For now, let's assume the action of sending is enough, actual text not in customer history.
-                await update.message.reply_text(config.TELEGRAM_RETURNING_CUSTOMER_QUESTION_PROMPT)
-                customer_state["chat_history"].append({
-                    "sender": "bot", "message": config.TELEGRAM_RETURNING_CUSTOMER_QUESTION_PROMPT, "timestamp": current_time_iso
-                })
-
-            customer_state["conversation_stage"] = "awaiting_initial_reply"
-            customer_state["last_message_timestamp"] = "" # Reset timer, let their next message trigger it
-            save_customer_state(user_id, customer_state, self.gui_callbacks)
+                # Update chat history with bot's greeting
+                customer_state["chat_history"] = [] # Reset history for a /start command re-engagement
+                for msg_text in messages_to_send:
+                    customer_state["chat_history"].append({
+                        "sender": "bot", "message": msg_text, "timestamp": current_time_iso
+                    })
+
+                if is_known_customer_by_name:
+                    await self._format_and_send_customer_calendar_summary(user_id, customer_state, context)
+                    # Add calendar summary to chat history (optional, could be verbose)
+                    # For now, let's assume the action of sending is enough, actual text not in customer history.
+                    await update.message.reply_text(config.TELEGRAM_RETURNING_CUSTOMER_QUESTION_PROMPT)
+                    customer_state["chat_history"].append({
+                        "sender": "bot", "message": config.TELEGRAM_RETURNING_CUSTOMER_QUESTION_PROMPT, "timestamp": current_time_iso
+                    })
+
+                customer_state["conversation_stage"] = "awaiting_initial_reply"
+                customer_state["last_message_timestamp"] = "" # Reset timer, let their next message trigger it
+                await self._run_blocking(save_customer_state, user_id, customer_state, self.gui_callbacks)
 
     async def _text_message_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         user = update.effective_user
@@ -278,59 +315,65 @@ class TelegramBotHandler:
 
         if user_id == self.admin_user_id_int:
             logger.info(f"Admin message from {user_id}: '{text[:70]}...'")
-            self.message_queue_for_admin_llm.put(("telegram_text_admin", user_id, text))
+            async with self._admin_order_lock: # The durable queue writes to SQLite
+                await self._run_blocking(self.message_queue_for_admin_llm.put, ("telegram_text_admin", user_id, text))
         else:
             logger.info(f"Customer message from {user_id} ({user.username}): '{text[:70]}...'")
-            customer_state = load_or_initialize_customer_state(user_id, self.gui_callbacks)
-            current_stage = customer_state.get("conversation_stage", "new")
-            customer_name = customer_state.get("name", "unknown")
-            is_known_customer_by_name = customer_name != "unknown" and customer_name is not None
-
-            # Always append customer's current message to their history
-            customer_state["chat_history"].append({
-                "sender": "customer", "message": text, "timestamp": current_time_iso
-            })
-
-            # Check if this is a re-engagement from a known customer
-            is_new_conversation_cycle = current_stage in ["llm_followup_sent", "interaction_closed", "error_forwarded_to_admin", "new"]
-
-            if is_known_customer_by_name and is_new_conversation_cycle:
-                logger.info(f"Re-engagement from known customer {user_id} (name: {customer_name}). Stage was: {current_stage}")
-                greeting_msg = config.TELEGRAM_RETURNING_CUSTOMER_GREETING_KNOWN_NAME.format(customer_name=customer_name)
-                await update.message.reply_text(greeting_msg)
-                customer_state["chat_history"].append({"sender": "bot", "message": greeting_msg, "timestamp": current_time_iso})
+            async with customer_state_async_lock(user_id): # Serialize with LLM workers touching this customer
+                customer_state = await self._run_blocking(load_or_initialize_customer_state, user_id, self.gui_callbacks)
+                current_stage = customer_state.get("conversation_stage", "new")
+                customer_name = customer_state.get("name", "unknown")
+                is_known_customer_by_name = customer_name != "unknown" and customer_name is not None
+
+                # Always append customer's current message to their history
+                customer_state["chat_history"].append({
+                    "sender": "customer", "message": text, "timestamp": current_time_iso
+                })
+
+                # Check if this is a re-engagement from a known customer
+                is_new_conversation_cycle = current_stage in ["llm_followup_sent", "interaction_closed", "error_forwarded_to_admin", "new"]
+
+                if is_known_customer_by_name and is_new_conversation_cycle:
+                    logger.info(f"Re-engagement from known customer {user_id} (name: {customer_name}). Stage was: {current_stage}")
+                    greeting_msg = config.TELEGRAM_RETURNING_CUSTOMER_GREETING_KNOWN_NAME.format(customer_name=customer_name)
+                    await update.message.reply_text(greeting_msg)
+                    customer_state["chat_history"].append({"sender": "bot", "message": greeting_msg, "timestamp": current_time_iso})
                 
-                await self._format_and_send_customer_calendar_summary(user_id, customer_state, context)
+                    await self._format_and_send_customer_calendar_summary(user_id, customer_state, context)
                 
-                question_prompt_msg = config.TELEGRAM_RETURNING_CUSTOMER_QUESTION_PROMPT
-                await update.message.reply_text(question_prompt_msg)
-                customer_state["chat_history"].append({"sender": "bot", "message": question_prompt_msg, "timestamp": current_time_iso})
+                    question_prompt_msg = config.TELEGRAM_RETURNING_CUSTOMER_QUESTION_PROMPT
+                    await update.message.reply_text(question_prompt_msg)
+                    customer_state["chat_history"].append({"sender": "bot", "message": question_prompt_msg, "timestamp": current_time_iso})
                 
-                customer_state["conversation_stage"] = "aggregating_messages" # Their current text message starts aggregation
+                    customer_state["conversation_stage"] = "aggregating_messages" # Their current text message starts aggregation
             
-            elif not is_known_customer_by_name and (is_new_conversation_cycle or current_stage == "awaiting_initial_reply"):
-                # New user, or user whose name we prompted for but haven't gotten/processed via LLM yet.
-                # If it's their very first message after /start, "awaiting_initial_reply" is fine.
-                # If they send a message and stage is "new", it means /start wasn't used or state was reset.
-                if current_stage == "new": # Treat as if /start was implicitly called by their message
-                    greeting_msg = config.TELEGRAM_NON_ADMIN_GREETING
-                    await update.message.reply_text(greeting_msg)
-                    # Insert greeting before their message in history if it's truly "new"
-                    customer_state["chat_history"].insert(len(customer_state["chat_history"])-1, # Before last (their current) message
-                        {"sender": "bot", "message": greeting_msg, "timestamp": current_time_iso}
-                    )
-                customer_state["conversation_stage"] = "aggregating_messages"
-
-            else: # Continuing an existing aggregation, or some other intermediate state
-                customer_state["conversation_stage"] = "aggregating_messages"
+                elif not is_known_customer_by_name and (is_new_conversation_cycle or current_stage == "awaiting_initial_reply"):
+                    # New user, or user whose name we prompted for but haven't gotten/processed via LLM yet.
+                    # If it's their very first message after /start, "awaiting_initial_reply" is fine.
+                    # If they send a message and stage is "new", it means /start wasn't used or state was reset.
+                    if current_stage == "new": # Treat as if /start was implicitly called by their message
+                        greeting_msg = config.TELEGRAM_NON_ADMIN_GREETING
+                        await update.message.reply_text(greeting_msg)
+                        # Insert greeting before their message in history if it's truly "new"
+                        customer_state["chat_history"].insert(len(customer_state["chat_history"])-1, # Before last (their current) message
+                            {"sender": "bot", "message": greeting_msg, "timestamp": current_time_iso}
+                        )
+                    customer_state["conversation_stage"] = "aggregating_messages"
+
+                else: # Continuing an existing aggregation, or some other intermediate state
+                    customer_state["conversation_stage"] = "aggregating_messages"
             
-            # Update timestamp and record activity for aggregation timer
-            customer_state["last_message_timestamp"] = current_time_iso
-            save_customer_state(user_id, customer_state, self.gui_callbacks)
-            self.customer_interaction_manager.record_customer_activity(user_id)
+                # Update timestamp and record activity for aggregation timer
+                customer_state["last_message_timestamp"] = current_time_iso
+                await self._run_blocking(save_customer_state, user_id, customer_state, self.gui_callbacks)
+                # Timer store write; inside the lock so one customer's messages reach the aggregation policy in order
+                await self._run_blocking(functools.partial(self.customer_interaction_manager.record_customer_activity, user_id, message_text=text))
 
 
     async def _admin_voice_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        async with self._admin_order_lock: await self._handle_admin_voice(update, context)
+
+    async def _handle_admin_voice(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         user = update.effective_user
         logger.info(f"Admin voice message from {user.id}. Duration: {update.message.voice.duration}s")
         if not PYDUB_AVAILABLE or not AudioSegment_class or not pydub_exceptions:
@@ -346,11 +389,9 @@ class TelegramBotHandler:
                 self.gui_callbacks['status_update']("Received Admin voice, processing...")
             voice_file = await voice.get_file()
             await voice_file.download_to_drive(custom_path=temp_ogg_path)
-            audio = AudioSegment_class.from_file(temp_ogg_path)
-            audio = audio.set_frame_rate(config.INPUT_RATE).set_channels(config.CHANNELS)
-            audio.export(temp_wav_path, format="wav")
+            await self._run_blocking(_convert_voice_to_wav, temp_ogg_path, temp_wav_path) # ffmpeg subprocess + resampling
             logger.info(f"Converted admin voice {temp_ogg_path} to {temp_wav_path}")
-            self.message_queue_for_admin_llm.put(("telegram_voice_admin_wav", user.id, temp_wav_path))
+            await self._run_blocking(self.message_queue_for_admin_llm.put, ("telegram_voice_admin_wav", user.id, temp_wav_path))
             await update.message.reply_text("Got your voice message (admin), processing...")
         except FileNotFoundError as fnf_error:
             logger.critical(f"Admin Voice Pydub Error (likely FFmpeg missing): {fnf_error}.", exc_info=True)
@@ -378,18 +419,26 @@ class TelegramBotHandler:
             with self._app_lock: self.async_loop = loop
             if not self.token: raise ValueError("Bot token is missing.")
             app_builder = Application.builder().token(self.token)\
-                .read_timeout(10).connect_timeout(10)
+                .read_timeout(10).connect_timeout(10)\
+                .concurrent_updates(config.TELEGRAM_CONCURRENT_UPDATES)\
+                .post_init(self._on_application_init).post_shutdown(self._on_application_shutdown)
+            if config.TELEGRAM_API_BASE_URL: # Local Bot API server or utils/telegram_fake_api.py
+                base_url = config.TELEGRAM_API_BASE_URL
+                app_builder = app_builder.base_url(base_url).base_file_url(base_url[:-len("bot")] + "file/bot" if base_url.endswith("bot") else base_url)
             app_for_thread = app_builder.build()
 
             with self._app_lock: self.application = app_for_thread
             self._setup_application_handlers()
             loop.run_until_complete(self._set_bot_commands_on_startup())
-            _set_telegram_bot_status("polling", self.gui_callbacks)
-            logger.info("Starting Telegram bot polling (Application.run_polling)...")
-            app_for_thread.run_polling(
-                stop_signals=None, poll_interval=1.0, # type: ignore
-                timeout=config.TELEGRAM_POLLING_TIMEOUT, drop_pending_updates=True,
-            )
+            if config.TELEGRAM_INGESTION_MODE == "webhook":
+                loop.run_until_complete(self._run_webhook(app_for_thread))
+            else:
+                _set_telegram_bot_status("polling", self.gui_callbacks)
+                logger.info("Starting Telegram bot polling (Application.run_polling)...")
+                app_for_thread.run_polling(
+                    stop_signals=None, poll_interval=config.TELEGRAM_POLL_INTERVAL_SECONDS, # type: ignore
+                    timeout=config.TELEGRAM_POLLING_TIMEOUT, drop_pending_updates=True,
+                )
         except InvalidToken:
             logger.critical("Invalid Telegram Bot Token.", exc_info=True)
             _set_telegram_bot_status("bad_token", self.gui_callbacks, log_level=logging.CRITICAL)
@@ -415,6 +464,42 @@ class TelegramBotHandler:
             self._stop_polling_event.set()
             logger.info("Telegram polling thread finished execution.")
 
+    async def _run_webhook(self, app: Application):
+        """
+        Webhook ingestion: TelegramWebhookServer puts updates on app.update_queue and app.start() handles them, as
+        with polling. run_polling() calls post_init/post_shutdown itself; here they are called directly.
+        """
+        if not config.TELEGRAM_WEBHOOK_URL: raise ValueError("TELEGRAM_WEBHOOK_URL must be set for webhook mode.")
+        secret_token = config.TELEGRAM_WEBHOOK_SECRET or secrets.token_urlsafe(32)
+        ssl_context, certificate = None, None
+        if config.TELEGRAM_WEBHOOK_USE_SSL:
+            ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            ssl_context.load_cert_chain(config.SSL_CERT_FILE, config.SSL_KEY_FILE)
+            certificate = await self._run_blocking(_read_file_bytes, config.SSL_CERT_FILE) # Lets Telegram trust a self-signed cert
+
+        async def _queue_update(update_data: dict): await app.update_queue.put(Update.de_json(update_data, app.bot))
+        server = TelegramWebhookServer(_queue_update, config.TELEGRAM_WEBHOOK_LISTEN, config.TELEGRAM_WEBHOOK_PORT,
+                                       config.TELEGRAM_WEBHOOK_PATH, secret_token, ssl_context)
+        self._webhook_stop = asyncio.Event()
+        await app.initialize()
+        try:
+            await self._on_application_init(app)
+            await app.start()
+            await server.start()
+            await app.bot.set_webhook(url=config.TELEGRAM_WEBHOOK_URL, secret_token=secret_token, certificate=certificate,
+                                      max_connections=config.TELEGRAM_WEBHOOK_MAX_CONNECTIONS, drop_pending_updates=True)
+            _set_telegram_bot_status("polling", self.gui_callbacks, status_text_override="TELE: HOOK")
+            logger.info(f"Telegram webhook registered: {config.TELEGRAM_WEBHOOK_URL}")
+            await self._webhook_stop.wait()
+        finally:
+            await server.stop()
+            try: await app.bot.delete_webhook() # Otherwise a later polling start gets 409 Conflict
+            except Exception as e_del: logger.warning(f"Could not delete Telegram webhook: {e_del}")
+            if app.running: await app.stop()
+            await self._on_application_shutdown(app)
+            await app.shutdown()
+            self._webhook_stop = None
+
     def start_polling(self):
         logger.info("Request to start Telegram polling.")
         self._is_shutting_down = False
@@ -438,7 +523,11 @@ class TelegramBotHandler:
         self._is_shutting_down = True; self._stop_polling_event.set()
         loop_to_signal, app_to_signal = None, None
         with self._app_lock: loop_to_signal = self.async_loop; app_to_signal = self.application
-        if app_to_signal and hasattr(app_to_signal, 'running') and app_to_signal.running and loop_to_signal and loop_to_signal.is_running():
+        webhook_stop = self._webhook_stop
+        if webhook_stop is not None and loop_to_signal and loop_to_signal.is_running():
+            logger.info("Signalling the Telegram webhook server to stop.")
+            loop_to_signal.call_soon_threadsafe(webhook_stop.set) # _run_webhook stops and shuts down the app itself
+        elif app_to_signal and hasattr(app_to_signal, 'running') and app_to_signal.running and loop_to_signal and loop_to_signal.is_running():
             logger.info(f"Scheduling PTB application.stop() on its loop.")
             future = asyncio.run_coroutine_threadsafe(app_to_signal.stop(), loop_to_signal)
             try: future.result(timeout=5)
@@ -459,43 +548,52 @@ class TelegramBotHandler:
         logger.info("Stop polling sequence finished.")
 
 
-    async def send_text_message_to_user(self, target_user_id: int, text: str):
+    # --- Outgoing messages ---
+    # queue_* are for worker threads: they return a concurrent.futures.Future at once and never block on the network.
+    # The async send_* wrappers await the same queue and log the outcome instead of raising.
+    def queue_text_message(self, target_user_id: int, text: str):
+        return self.outbox.send_text(target_user_id, text)
+
+    def queue_voice_bytes(self, target_user_id: int, ogg_bytes: bytes, filename: str = "voice.ogg"):
+        if not ogg_bytes:
+            failed = concurrent.futures.Future(); failed.set_exception(ValueError("Empty audio buffer.")); return failed
+        return self.outbox.send_voice(target_user_id, ogg_bytes, filename)
+
+    async def _send_text_now(self, chat_id: int, text: str):
         with self._app_lock: app = self.application
-        if not app or not hasattr(app, 'bot') or not app.bot or not target_user_id:
-            logger.error(f"Cannot send Telegram text: App/Bot not ready or no target_user_id. App: {bool(app)}, Bot: {bool(hasattr(app, 'bot') and app.bot if app else None)}, TargetID: {target_user_id}")
-            return
-        try:
-            await app.bot.send_message(chat_id=target_user_id, text=text)
-            logger.info(f"Text message sent to user {target_user_id}: '{text[:70]}...'")
-        except TelegramError as e: logger.error(f"TelegramError sending text to {target_user_id}: {e}", exc_info=True)
-        except Exception as e: logger.error(f"Failed to send text to {target_user_id}: {e}", exc_info=True)
+        if not app or not getattr(app, 'bot', None): raise RuntimeError("Telegram app/bot not ready.")
+        await app.bot.send_message(chat_id=chat_id, text=text)
+        logger.info(f"Text message sent to user {chat_id}: '{text[:70]}...'")
 
-    async def send_voice_message_to_admin(self, voice_filepath: str): # Specifically for admin
+    async def _send_voice_bytes_now(self, chat_id: int, ogg_bytes: bytes, filename: str):
         with self._app_lock: app = self.application
-        if not app or not hasattr(app, 'bot') or not app.bot or not self.admin_user_id_int:
-            logger.error(f"Cannot send voice to admin: App/Bot not ready or no Admin ID."); return
-        if not os.path.exists(voice_filepath):
-            logger.error(f"Cannot send voice to admin: File not found at {voice_filepath}"); return
-        try:
-            with open(voice_filepath, 'rb') as voice_file_to_send:
-                await app.bot.send_voice(chat_id=self.admin_user_id_int, voice=InputFile(voice_file_to_send))
-            logger.info(f"Voice message sent to admin {self.admin_user_id_int} from file: {voice_filepath}")
-        except TelegramError as e: logger.error(f"TelegramError sending voice to admin: {e}", exc_info=True)
-        except Exception as e: logger.error(f"Unexpected error sending voice to admin: {e}", exc_info=True)
+        if not app or not getattr(app, 'bot', None): raise RuntimeError("Telegram app/bot not ready.")
+        await app.bot.send_voice(chat_id=chat_id, voice=InputFile(io.BytesIO(ogg_bytes), filename=filename))
+        logger.info(f"Voice message sent to user {chat_id} ({len(ogg_bytes)} bytes).")
+
+    async def _await_outbox(self, future, what: str):
+        try: await asyncio.wrap_future(future)
+        except TelegramError as e: logger.error(f"TelegramError sending {what}: {e}", exc_info=True)
+        except Exception as e: logger.error(f"Failed to send {what}: {e}", exc_info=True)
+
+    async def send_text_message_to_user(self, target_user_id: int, text: str):
+        await self._await_outbox(self.queue_text_message(target_user_id, text), f"text to {target_user_id}")
+
+    async def send_voice_message_to_admin(self, voice_filepath: str): # Specifically for admin
+        await self.send_voice_message_to_user(self.admin_user_id_int, voice_filepath)
 
     async def send_voice_message_to_user(self, target_user_id: int, voice_filepath: str): # Generic for any user
-        with self._app_lock: app = self.application
-        if not app or not hasattr(app, 'bot') or not app.bot or not target_user_id:
-            logger.error(f"Cannot send voice to user {target_user_id}: App/Bot not ready or no User ID."); return
         if not os.path.exists(voice_filepath):
             logger.error(f"Cannot send voice to user {target_user_id}: File not found at {voice_filepath}"); return
-        try:
-            with open(voice_filepath, 'rb') as voice_file_to_send:
-                await app.bot.send_voice(chat_id=target_user_id, voice=InputFile(voice_file_to_send))
-            logger.info(f"Voice message sent to user {target_user_id} from file: {voice_filepath}")
-        except TelegramError as e: logger.error(f"TelegramError sending voice to user {target_user_id}: {e}", exc_info=True)
-        except Exception as e: logger.error(f"Unexpected error sending voice to user {target_user_id}: {e}", exc_info=True)
+        try: voice_bytes = await self._run_blocking(_read_file_bytes, voice_filepath)
+        except OSError as e: logger.error(f"Cannot read voice file {voice_filepath}: {e}"); return
+        await self.send_voice_bytes_to_user(target_user_id, voice_bytes, os.path.basename(voice_filepath))
+
+    async def send_voice_bytes_to_user(self, target_user_id: int, ogg_bytes: bytes, filename: str = "voice.ogg"): # In-memory OGG/Opus
+        await self._await_outbox(self.queue_voice_bytes(target_user_id, ogg_bytes, filename), f"voice to {target_user_id}")
 
 
     def get_status(self): return get_telegram_bot_status()
-    def full_shutdown(self): logger.info("Full shutdown of TelegramBotHandler."); self.stop_polling()
\ No newline at end of file
+    def full_shutdown(self):
+        logger.info("Full shutdown of TelegramBotHandler."); self.stop_polling()
+        self._blocking_executor.shutdown(wait=False, cancel_futures=True)
\ No newline at end of file
@@ -1,14 +1,10 @@
 # utils/telegram_messaging_utils.py
-import os
 import datetime
-import asyncio
 import numpy as np
-import soundfile as sf
-import nltk # For sentence tokenization
 
 import config
 from logger import get_logger
-from utils import file_utils
+from utils import opus_encoder, text_segmentation
 
 logger = get_logger("Iri-shka_App.utils.TelegramMessagingUtils")
 
@@ -20,7 +16,7 @@ def initialize_telegram_audio_dependencies(pydub_audio_segment_class, pydub_exce
     _PydubAudioSegment = pydub_audio_segment_class
     _PydubExceptions = pydub_exceptions_class
     if _PydubAudioSegment: logger.info("Pydub reference received in TelegramMessagingUtils.")
-    else: logger.warning("Pydub reference not received; OGG conversion will fail.")
+    else: logger.info("Pydub reference not received (voice replies are encoded by utils.opus_encoder and do not need it).")
 
 def send_voice_reply_to_telegram_user(
     target_user_id: int, text_to_speak: str, bark_voice_preset: str,
@@ -28,36 +24,20 @@ def send_voice_reply_to_telegram_user(
     ):
     # ... (content from thought process, ensure all refs are used)
     if not (telegram_bot_handler_instance_ref and telegram_bot_handler_instance_ref.async_loop and
-            tts_manager_module_ref.is_tts_ready() and _PydubAudioSegment and nltk and np and sf):
+            tts_manager_module_ref.is_tts_ready() and opus_encoder.is_opus_encoding_available() and np):
         missing = [] # ... build missing list ...
         if not tts_manager_module_ref.is_tts_ready(): missing.append("TTS")
-        if not _PydubAudioSegment: missing.append("Pydub")
-        if not nltk: missing.append("NLTK")
+        if not opus_encoder.is_opus_encoding_available(): missing.append("Opus encoder")
         logger.warning(f"Cannot send voice reply to {target_user_id}: Missing ({', '.join(missing)}). Text: '{text_to_speak[:30]}'")
         return
 
     ts_suffix = datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')
-    file_utils.ensure_folder(config.TELEGRAM_TTS_TEMP_FOLDER)
-    temp_tts_merged_wav_path = os.path.join(config.TELEGRAM_TTS_TEMP_FOLDER, f"tts_u{target_user_id}_merged_{ts_suffix}.wav")
-    temp_tts_ogg_path = os.path.join(config.TELEGRAM_TTS_TEMP_FOLDER, f"tts_u{target_user_id}_reply_{ts_suffix}.ogg")
+    voice_filename = f"tts_u{target_user_id}_reply_{ts_suffix}.ogg" # Name shown to Telegram only; nothing is written to disk
 
     bark_tts_engine = tts_manager_module_ref.get_bark_model_instance()
     if not bark_tts_engine: logger.error(f"No Bark instance for user {target_user_id}."); return
 
-    lang_for_nltk = 'english' if 'en_' in bark_voice_preset.lower() else 'russian'
-    try: nltk.data.find(f'tokenizers/punkt/{lang_for_nltk}.pickle')
-    except LookupError: # ... download punkt ...
-        try: nltk.download('punkt', quiet=True)
-        except Exception as e_nltk_dl: logger.error(f"Failed to download NLTK 'punkt' for {lang_for_nltk}: {e_nltk_dl}.")
-    
-    try: sentences = nltk.sent_tokenize(text_to_speak, language=lang_for_nltk)
-    except Exception as e_nltk_sent: sentences = [text_to_speak]; logger.warning(f"NLTK tokenization failed: {e_nltk_sent}.")
-    
-    text_chunks = []; current_batch = [] # ... chunk sentences ...
-    for i, s in enumerate(sentences):
-        current_batch.append(s)
-        if len(current_batch) >= config.BARK_MAX_SENTENCES_PER_CHUNK or (i + 1) == len(sentences):
-            text_chunks.append(" ".join(current_batch)); current_batch = []
+    text_chunks = text_segmentation.segment_for_tts(text_to_speak, voice_preset=bark_voice_preset)
     
     all_audio_pieces = []; target_sr = None; first_valid_chunk = False # ... synthesize and gather audio pieces ...
     for idx, chunk_text in enumerate(text_chunks):
@@ -73,18 +53,13 @@ def send_voice_reply_to_telegram_user(
     if all_audio_pieces and target_sr is not None: # ... merge, convert to OGG, send ...
         merged_audio = np.concatenate(all_audio_pieces)
         try:
-            sf.write(temp_tts_merged_wav_path, merged_audio, target_sr) 
-            pydub_seg = _PydubAudioSegment.from_wav(temp_tts_merged_wav_path).set_frame_rate(16000).set_channels(1)
-            pydub_seg.export(temp_tts_ogg_path, format="ogg", codec="libopus", bitrate="24k") 
-            
-            if hasattr(telegram_bot_handler_instance_ref, 'send_voice_message_to_user'):
-                send_future = asyncio.run_coroutine_threadsafe(telegram_bot_handler_instance_ref.send_voice_message_to_user(target_user_id, temp_tts_ogg_path), telegram_bot_handler_instance_ref.async_loop) 
-                if send_future: send_future.result(timeout=20); logger.info(f"Voice reply sent to {target_user_id}")
-            else: logger.error("TelegramBotHandler missing 'send_voice_message_to_user'.")
+            ogg_bytes = opus_encoder.encode_pcm_to_ogg_opus(merged_audio, target_sr)
+            logger.debug(f"Encoded {len(merged_audio)/target_sr:.1f}s reply to {len(ogg_bytes)} bytes OGG/Opus for {target_user_id}.")
+
+            if hasattr(telegram_bot_handler_instance_ref, 'queue_voice_bytes'):
+                send_future = telegram_bot_handler_instance_ref.queue_voice_bytes(target_user_id, ogg_bytes, voice_filename) # Outbox sends it; no waiting here
+                send_future.add_done_callback(lambda f: f.exception() and logger.error(f"Voice reply to {target_user_id} not delivered: {f.exception()}"))
+                logger.info(f"Voice reply queued for {target_user_id}")
+            else: logger.error("TelegramBotHandler missing 'queue_voice_bytes'.")
         except Exception as e_send_v: logger.error(f"Error processing/sending voice to {target_user_id}: {e_send_v}", exc_info=True)
     else: logger.error(f"No valid audio for {target_user_id}. Cannot send voice.")
-    
-    for f_path in [temp_tts_merged_wav_path, temp_tts_ogg_path]: # ... cleanup temp files ...
-        if os.path.exists(f_path):
-            try: os.remove(f_path)
-            except OSError as e: logger.warning(f"Could not remove temp TTS file {f_path}: {e}")
\ No newline at end of file
@@ -0,0 +1,274 @@
+# utils/telegram_outbox.py
+"""
+Outbound Telegram dispatcher, owned by TelegramBotHandler and run on the bot's event loop.
+
+Worker threads (LLM processors, the admin pipeline) call send_text()/send_voice() and get a
+concurrent.futures.Future back right away; they never wait on the network. On the loop:
+
+- Every chat has its own FIFO and one sender task, so messages to one chat go out in order.
+- A per-chat token bucket (TELEGRAM_OUTBOX_CHAT_PER_SECOND / _CHAT_BURST) and a global one
+  (TELEGRAM_OUTBOX_GLOBAL_PER_SECOND / _GLOBAL_BURST) keep the bot under Telegram's flood limits.
+- Texts queued back to back for the same chat are sent as one message (up to Telegram's 4096
+  characters), so a burst spends one token instead of many. A voice message ends the run.
+- A 429 (an error with .retry_after) waits that long and retries; network errors retry with
+  backoff. Telegram does not say whether a 429 is per chat or bot-wide. When 429s come from
+  TELEGRAM_OUTBOX_GLOBAL_FLOOD_CHATS different chats within a second, the limit is taken as
+  bot-wide and the global bucket is paused too, so the other chats stop collecting 429s. Other errors fail the future at once. Both give up after TELEGRAM_OUTBOX_MAX_RETRIES.
+
+The module does not import telegram: the handler passes the send coroutines and says which errors are transient.
+"""
+import asyncio
+import collections
+import datetime
+import time
+from concurrent.futures import Future
+
+import config
+from logger import get_logger
+from .interaction_pipeline import DurationStat
+
+logger = get_logger("Iri-shka_App.utils.TelegramOutbox")
+
+TELEGRAM_MAX_TEXT_CHARS = 4096
+_FLOOD_WINDOW_SECONDS = 1.0 # 429s from several chats this close together mean a bot-wide limit
+_COALESCE_SEPARATOR = "\n\n"
+
+
+class TokenBucket:
+    """Loop-local token bucket: `rate` tokens per second, at most `capacity` saved up."""
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def block_for(self, seconds: float):
+        """Spends nothing for `seconds` (e.g. after a 429 with retry_after)."""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    async def acquire(self) -> float:
+        """Waits for and takes one token. Returns the seconds waited."""
+        started = time.monotonic()
+        while True:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                await asyncio.sleep(self._blocked_until - now); continue
+            self._refill(now)
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return now - started
+            await asyncio.sleep((1.0 - self._tokens) / self.rate)
+
+
+class _Outgoing:
+    __slots__ = ("kind", "payload", "future", "queued_at")
+
+    def __init__(self, kind: str, payload: tuple):
+        self.kind = kind # "text" or "voice"
+        self.payload = payload # (text,) or (ogg_bytes, filename)
+        self.future = Future()
+        self.queued_at = time.monotonic()
+
+
+def _retry_after_seconds(exc) -> float:
+    retry_after = getattr(exc, "retry_after", None)
+    if isinstance(retry_after, datetime.timedelta): return retry_after.total_seconds()
+    return float(retry_after) if retry_after is not None else None
+
+
+class TelegramOutbox:
+    def __init__(self, send_text, send_voice, is_transient=None):
+        """
+        send_text(chat_id, text) and send_voice(chat_id, ogg_bytes, filename) are coroutines that raise on failure.
+        is_transient(exc) -> bool picks the errors worth retrying with backoff (429s are always retried).
+        """
+        self._send_text = send_text
+        self._send_voice = send_voice
+        self._is_transient = is_transient or (lambda exc: False)
+        self._loop = None
+        self._chats = {} # chat_id -> deque of _Outgoing; present while the chat's sender task runs
+        self._chat_buckets = {}
+        self._global_bucket = None
+        self._senders = set()
+        self._rate_wait = DurationStat()
+        self._queue_to_sent = DurationStat()
+        self._counts = collections.Counter()
+        self._recent_429s = collections.deque() # (monotonic, chat_id)
+
+    # --- Any thread ---
+    def send_text(self, chat_id: int, text: str) -> Future:
+        return self._submit(chat_id, _Outgoing("text", (text,)))
+
+    def send_voice(self, chat_id: int, ogg_bytes: bytes, filename: str = "voice.ogg") -> Future:
+        return self._submit(chat_id, _Outgoing("voice", (ogg_bytes, filename)))
+
+    def _submit(self, chat_id, item: _Outgoing) -> Future:
+        loop = self._loop
+        if not chat_id: item.future.set_exception(ValueError("No chat id for outgoing Telegram message.")); return item.future
+        if loop is None:
+            item.future.set_exception(RuntimeError("Telegram bot is not running; message not sent.")); return item.future
+        try: loop.call_soon_threadsafe(self._enqueue, chat_id, item)
+        except RuntimeError as e_loop: item.future.set_exception(RuntimeError(f"Telegram loop closed: {e_loop}"))
+        return item.future
+
+    # --- Event loop ---
+    def attach(self, loop: asyncio.AbstractEventLoop):
+        """Binds the outbox to the polling loop (Application.post_init)."""
+        self._global_bucket = TokenBucket(config.TELEGRAM_OUTBOX_GLOBAL_PER_SECOND, config.TELEGRAM_OUTBOX_GLOBAL_BURST)
+        self._chat_buckets = {}
+        self._loop = loop
+
+    async def close(self, drain_timeout: float = 5.0):
+        """Stops taking messages, gives queued ones drain_timeout seconds to go out, then fails the rest."""
+        self._loop = None
+        if self._senders:
+            _, pending = await asyncio.wait(list(self._senders), timeout=drain_timeout)
+            for task in pending: task.cancel()
+            if pending: await asyncio.gather(*pending, return_exceptions=True)
+        for chat_id, backlog in list(self._chats.items()):
+            for item in backlog: self._fail(item, RuntimeError("Telegram bot stopped before the message was sent."))
+        self._chats.clear()
+        logger.info(f"Telegram outbox closed: {self.get_metrics()}")
+
+    def _enqueue(self, chat_id, item: _Outgoing):
+        backlog = self._chats.get(chat_id)
+        if backlog is None:
+            backlog = self._chats[chat_id] = collections.deque()
+            task = asyncio.get_running_loop().create_task(self._drain_chat(chat_id, backlog), name=f"TelegramOutbox-{chat_id}")
+            self._senders.add(task); task.add_done_callback(self._senders.discard)
+        backlog.append(item)
+        self._counts["queued"] += 1
+
+    def _bucket_for(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(config.TELEGRAM_OUTBOX_CHAT_PER_SECOND, config.TELEGRAM_OUTBOX_CHAT_BURST)
+        return bucket
+
+    async def _drain_chat(self, chat_id, backlog: collections.deque):
+        chat_bucket = self._bucket_for(chat_id)
+        batch = []
+        try:
+            while backlog:
+                waited = await chat_bucket.acquire()
+                waited += await self._global_bucket.acquire()
+                self._rate_wait.add(waited)
+                batch = self._take_batch(backlog) # Taken after the wait, so texts that piled up meanwhile go out together
+                await self._send_with_retries(chat_id, chat_bucket, batch)
+        except asyncio.CancelledError:
+            for item in batch + list(backlog): self._fail(item, RuntimeError("Telegram outbox closed."))
+            backlog.clear()
+            raise
+        finally:
+            if self._chats.get(chat_id) is backlog and not backlog: del self._chats[chat_id]
+
+    def _take_batch(self, backlog: collections.deque) -> list:
+        batch = [backlog.popleft()]
+        if batch[0].kind != "text": return batch
+        length = len(batch[0].payload[0])
+        while backlog and backlog[0].kind == "text":
+            extra = len(_COALESCE_SEPARATOR) + len(backlog[0].payload[0])
+            if length + extra > TELEGRAM_MAX_TEXT_CHARS: break
+            batch.append(backlog.popleft()); length += extra
+        if len(batch) > 1: self._counts["coalesced"] += len(batch) - 1
+        return batch
+
+    async def _send_with_retries(self, chat_id, chat_bucket: TokenBucket, batch: list):
+        head = batch[0]
+        for attempt in range(1, config.TELEGRAM_OUTBOX_MAX_RETRIES + 2):
+            try:
+                if head.kind == "text": await self._send_text(chat_id, _COALESCE_SEPARATOR.join(item.payload[0] for item in batch))
+                else: await self._send_voice(chat_id, *head.payload)
+            except asyncio.CancelledError: raise
+            except Exception as e_send:
+                retry_after = _retry_after_seconds(e_send)
+                if attempt > config.TELEGRAM_OUTBOX_MAX_RETRIES or (retry_after is None and not self._is_transient(e_send)):
+                    logger.error(f"Telegram {head.kind} to {chat_id} failed after {attempt} attempt(s): {e_send}")
+                    for item in batch: self._fail(item, e_send)
+                    return
+                if retry_after is not None:
+                    self._counts["rate_limited"] += 1
+                    chat_bucket.block_for(retry_after)
+                    if self._is_bot_wide_flood(chat_id):
+                        self._counts["global_rate_limited"] += 1
+                        self._global_bucket.block_for(retry_after)
+                        logger.warning(f"Telegram flood limit hit by several chats; pausing all sends for {retry_after:.1f}s.")
+                    else:
+                        logger.warning(f"Telegram flood limit for chat {chat_id}; retrying in {retry_after:.1f}s.")
+                    delay = retry_after
+                else:
+                    delay = min(30.0, 0.5 * 2 ** (attempt - 1))
+                    logger.warning(f"Telegram {head.kind} to {chat_id} failed ({e_send}); retry {attempt} in {delay:.1f}s.")
+                self._counts["retries"] += 1
+                await asyncio.sleep(delay)
+                continue
+            now = time.monotonic()
+            for item in batch:
+                self._queue_to_sent.add(now - item.queued_at)
+                if not item.future.done(): item.future.set_result(True)
+            self._counts["sent_messages"] += 1
+            return
+
+    def _is_bot_wide_flood(self, chat_id) -> bool:
+        """Records a 429 for chat_id; True once enough different chats got one within _FLOOD_WINDOW_SECONDS."""
+        now = time.monotonic()
+        self._recent_429s.append((now, chat_id))
+        while self._recent_429s[0][0] < now - _FLOOD_WINDOW_SECONDS: self._recent_429s.popleft()
+        return len({c for _, c in self._recent_429s}) >= config.TELEGRAM_OUTBOX_GLOBAL_FLOOD_CHATS
+
+    def _fail(self, item: _Outgoing, exc: BaseException):
+        if item.future.done(): return
+        self._counts["failed"] += 1
+        item.future.set_exception(exc)
+
+    def get_metrics(self) -> dict:
+        return {**dict(self._counts), "rate_wait": self._rate_wait.as_dict(), "queue_to_sent": self._queue_to_sent.as_dict(),
+                "chats_pending": len(self._chats)}
+
+
+if __name__ == "__main__":
+    # Burst demo against a fake Telegram that answers 429 when a chat gets more than 1 msg/s or the bot
+    # more than 30 msg/s: 4 chats x 15 replies + 40 one-off chats, all queued at once from worker threads.
+    import threading
+
+    class RetryAfter(Exception):
+        def __init__(self, seconds): super().__init__(f"Flood control exceeded. Retry in {seconds} seconds"); self.retry_after = seconds
+
+    sent_log, per_chat_last, global_window = [], {}, collections.deque()
+    async def fake_send_text(chat_id, text):
+        await asyncio.sleep(0.03) # Round trip
+        now = time.monotonic()
+        while global_window and now - global_window[0] > 1.0: global_window.popleft()
+        if now - per_chat_last.get(chat_id, -10.0) < 1.0 or len(global_window) >= 30: raise RetryAfter(1)
+        per_chat_last[chat_id] = now; global_window.append(now); sent_log.append((chat_id, text.count("reply")))
+    async def fake_send_voice(chat_id, ogg_bytes, filename): await fake_send_text(chat_id, "voice")
+
+    config.TELEGRAM_OUTBOX_CHAT_PER_SECOND, config.TELEGRAM_OUTBOX_CHAT_BURST = 0.9, 1
+    config.TELEGRAM_OUTBOX_GLOBAL_PER_SECOND, config.TELEGRAM_OUTBOX_GLOBAL_BURST, config.TELEGRAM_OUTBOX_MAX_RETRIES = 25, 5, 5
+    jobs = [(chat, f"reply {n}") for n in range(15) for chat in (1, 2, 3, 4)] + [(100 + chat, "reply 0") for chat in range(40)]
+
+    async def send_directly(): # What the worker threads did before: every reply sent at once, no limits
+        results = await asyncio.gather(*(fake_send_text(chat, text) for chat, text in jobs), return_exceptions=True)
+        return sum(isinstance(r, RetryAfter) for r in results)
+    print(f"direct sends: {asyncio.run(send_directly())} of {len(jobs)} rejected with 429")
+    sent_log.clear(); per_chat_last.clear(); global_window.clear()
+
+    outbox = TelegramOutbox(fake_send_text, fake_send_voice)
+    loop = asyncio.new_event_loop()
+    outbox.attach(loop)
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    t0 = time.monotonic()
+    futures = [outbox.send_text(chat, text) for chat, text in jobs]
+    submit_ms = (time.monotonic() - t0) * 1000
+    for f in futures: f.result(timeout=60)
+    print(f"{len(futures)} replies queued in {submit_ms:.1f} ms (callers never block), all delivered in {time.monotonic() - t0:.2f}s "
+          f"as {len(sent_log)} Telegram messages; texts per message to chat 1: {[n for c, n in sent_log if c == 1]}")
+    print(outbox.get_metrics())
+    asyncio.run_coroutine_threadsafe(outbox.close(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
@@ -0,0 +1,128 @@
+# utils/telegram_webhook.py
+"""
+Webhook receiver for the Telegram bot (TELEGRAM_INGESTION_MODE=webhook).
+
+A small HTTP/1.1 server on the bot's own event loop (stdlib asyncio, so no web framework is needed).
+Telegram POSTs each update as JSON to TELEGRAM_WEBHOOK_PATH and keeps up to max_connections
+connections open. For every request the server:
+
+- rejects anything but POST to the webhook path (404/405),
+- compares X-Telegram-Bot-Api-Secret-Token with the secret given to setWebhook (403 on mismatch),
+- parses the JSON body and hands it to on_update(dict), which only queues it, then answers 200.
+
+Updates are handled afterwards by the Application's update queue, with the same concurrency as polling
+(TELEGRAM_CONCURRENT_UPDATES). Answering before the handler runs keeps Telegram's deliveries flowing. A
+handler error never becomes a non-200 reply, which would make Telegram resend the update.
+"""
+import asyncio
+import hmac
+import json
+import ssl
+import time
+
+from logger import get_logger
+from .interaction_pipeline import DurationStat
+
+logger = get_logger("Iri-shka_App.utils.TelegramWebhook")
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+_MAX_HEADER_BYTES = 16 * 1024
+_MAX_BODY_BYTES = 1024 * 1024 # Telegram updates are a few KB
+_IDLE_TIMEOUT_SECONDS = 75.0
+_REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed",
+            411: "Length Required", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class TelegramWebhookServer:
+    def __init__(self, on_update, listen: str, port: int, path: str, secret_token: str, ssl_context: ssl.SSLContext = None):
+        """on_update(update_dict) is a coroutine that queues the update; it should not do the handling itself."""
+        self._on_update = on_update
+        self.listen = listen
+        self.port = port
+        self.path = path if path.startswith("/") else "/" + path
+        self._secret = (secret_token or "").encode("utf-8")
+        self._ssl_context = ssl_context
+        self._server = None
+        self._connections = set()
+        self._accepted = 0
+        self._rejected = 0
+        self._ingest = DurationStat() # Body received -> update queued
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve_connection, self.listen, self.port, ssl=self._ssl_context,
+                                                  limit=_MAX_HEADER_BYTES)
+        if not self.port: self.port = self._server.sockets[0].getsockname()[1] # Port 0: the OS picked one
+        logger.info(f"Telegram webhook listening on {'https' if self._ssl_context else 'http'}://{self.listen}:{self.port}{self.path}")
+
+    async def stop(self):
+        if not self._server: return
+        self._server.close()
+        for writer in list(self._connections): writer.close()
+        await self._server.wait_closed()
+        while self._connections: await asyncio.sleep(0.01) # Let the connection handlers see the close
+        self._server = None
+        logger.info(f"Telegram webhook stopped: {self.get_metrics()}")
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._connections.add(writer)
+        try:
+            while True:
+                try: head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), _IDLE_TIMEOUT_SECONDS)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError): return
+                except asyncio.LimitOverrunError:
+                    await self._respond(writer, 400, keep_alive=False); return
+                status, keep_alive = await self._handle_request(head, reader)
+                await self._respond(writer, status, keep_alive)
+                if not keep_alive: return
+        except (ConnectionError, asyncio.IncompleteReadError): pass
+        except Exception as e_conn: logger.error(f"Webhook connection error: {e_conn}", exc_info=True)
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _handle_request(self, head: bytes, reader: asyncio.StreamReader) -> tuple:
+        """Returns (status, keep_alive). Always reads the body so the connection stays usable."""
+        lines = head.decode("latin-1").split("\r\n")
+        try: method, target, version = lines[0].split(" ", 2)
+        except ValueError: return 400, False
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+        if "chunked" in headers.get("transfer-encoding", "").lower(): return 411, False # Telegram always sends Content-Length
+        try: length = int(headers.get("content-length", "0"))
+        except ValueError: return 400, False
+        if length > _MAX_BODY_BYTES: return 413, False
+        body = await reader.readexactly(length) if length else b""
+        received_at = time.monotonic()
+
+        if target.split("?", 1)[0] != self.path: return self._reject(404, keep_alive)
+        if method != "POST": return self._reject(405, keep_alive)
+        if self._secret and not hmac.compare_digest(headers.get(SECRET_HEADER, "").encode("utf-8"), self._secret):
+            logger.warning("Webhook request with a wrong or missing secret token rejected.")
+            return self._reject(403, keep_alive)
+        try: update = json.loads(body)
+        except ValueError: return self._reject(400, keep_alive)
+        if not isinstance(update, dict): return self._reject(400, keep_alive)
+        try: await self._on_update(update)
+        except Exception as e_update: # Still 200: a non-200 makes Telegram redeliver the same update over and over
+            logger.error(f"Webhook update {update.get('update_id')} could not be queued: {e_update}", exc_info=True)
+        self._accepted += 1
+        self._ingest.add(time.monotonic() - received_at)
+        return 200, keep_alive
+
+    def _reject(self, status: int, keep_alive: bool) -> tuple:
+        self._rejected += 1
+        return status, keep_alive
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, keep_alive: bool):
+        writer.write(f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\nContent-Length: 0\r\n"
+                     f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1"))
+        await writer.drain()
+
+    def get_metrics(self) -> dict:
+        return {"accepted": self._accepted, "rejected": self._rejected, "open_connections": len(self._connections),
+                "ingest": self._ingest.as_dict()}
@@ -0,0 +1,365 @@
+# utils/text_segmentation.py
+"""
+Shared text normalization + sentence segmentation for TTS (GUI streaming and Telegram voice replies).
+
+- Punkt models are located or downloaded once per process and kept per language.
+- Numbers, years, decimals, versions, percents, times, dates and URLs become speakable words in one regex pass.
+- Sentences are packed into chunks by estimated audio duration, not by sentence count, so every
+  Bark call gets a similar amount of work.
+- Segmentation results are memoized (LRU), because the same replies and error phrases repeat.
+"""
+import functools
+import re
+import threading
+
+import config
+from logger import get_logger
+
+logger = get_logger("Iri-shka_App.utils.TextSegmentation")
+
+nltk = None
+NLTK_AVAILABLE = False
+try:
+    import nltk as nltk_module
+    nltk = nltk_module
+    NLTK_AVAILABLE = True
+except ImportError:
+    logger.warning("NLTK not found. Falling back to regex sentence splitting for TTS.")
+
+_punkt_lock = threading.RLock() # Re-entrant: the English fallback is loaded from inside the lock
+_punkt_download_attempted = False
+_punkt_tokenizers = {} # language -> tokenizer with .tokenize(text)
+
+# Rough speaking rates used to size chunks (characters of normalized text per second of Bark audio)
+CHARS_PER_SECOND = {"english": 14.0, "russian": 12.0}
+
+
+def language_for_preset(voice_preset: str) -> str:
+    return 'russian' if voice_preset and 'ru_' in voice_preset.lower() else 'english'
+
+
+# --- Punkt loading (once) ---
+def _punkt_package() -> str:
+    """NLTK >= 3.8.2 (PunktTokenizer) only reads punkt_tab; older versions only read the pickled punkt."""
+    try:
+        from nltk.tokenize import PunktTokenizer # noqa: F401
+        return 'punkt_tab'
+    except ImportError:
+        return 'punkt'
+
+
+def _ensure_punkt_downloaded():
+    global _punkt_download_attempted
+    package = _punkt_package()
+    try:
+        nltk.data.find(f'tokenizers/{package}'); return True
+    except LookupError:
+        pass
+    if _punkt_download_attempted: return False
+    _punkt_download_attempted = True
+    logger.warning(f"NLTK '{package}' data not found. Attempting one-time download...")
+    ok = False
+    try: ok = bool(nltk.download(package, quiet=True))
+    except Exception as e_dl: logger.error(f"Failed to download NLTK '{package}': {e_dl}")
+    if not ok: logger.error(f"NLTK '{package}' unavailable. Using regex sentence splitting.")
+    return ok
+
+
+def _get_punkt_tokenizer(language: str):
+    if not NLTK_AVAILABLE: return None
+    with _punkt_lock:
+        if language in _punkt_tokenizers: return _punkt_tokenizers[language]
+        tokenizer = None
+        if _ensure_punkt_downloaded():
+            try:
+                from nltk.tokenize import PunktTokenizer # NLTK >= 3.8.2
+                tokenizer = PunktTokenizer(language)
+            except ImportError:
+                try: tokenizer = nltk.data.load(f'tokenizers/punkt/{language}.pickle')
+                except Exception as e_load: logger.warning(f"Could not load punkt for '{language}': {e_load}")
+            except Exception as e_load:
+                logger.warning(f"Could not load punkt for '{language}': {e_load}")
+        if tokenizer is None and language != 'english':
+            logger.warning(f"Punkt for '{language}' unavailable, using English model.")
+            tokenizer = _get_punkt_tokenizer('english')
+        _punkt_tokenizers[language] = tokenizer
+        return tokenizer
+
+
+_REGEX_SENTENCE_SPLIT = re.compile(r'(?<=[.!?…])\s+')
+
+
+def split_sentences(text: str, language: str) -> list:
+    tokenizer = _get_punkt_tokenizer(language)
+    if tokenizer is not None:
+        try: return [s for s in tokenizer.tokenize(text) if s.strip()]
+        except Exception as e_tok: logger.warning(f"Punkt tokenization failed: {e_tok}. Using regex split.")
+    return [s for s in _REGEX_SENTENCE_SPLIT.split(text) if s.strip()]
+
+
+# --- Number words ---
+_EN_ONES = ["zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten",
+            "eleven", "twelve", "thirteen", "fourteen", "fifteen", "sixteen", "seventeen", "eighteen", "nineteen"]
+_EN_TENS = ["", "", "twenty", "thirty", "forty", "fifty", "sixty", "seventy", "eighty", "ninety"]
+_EN_SCALES = [(10**9, "billion"), (10**6, "million"), (1000, "thousand")]
+_EN_ORDINAL_EXCEPTIONS = {"one": "first", "two": "second", "three": "third", "five": "fifth",
+                          "eight": "eighth", "nine": "ninth", "twelve": "twelfth"}
+
+_RU_ONES_M = ["ноль", "один", "два", "три", "четыре", "пять", "шесть", "семь", "восемь", "девять", "десять",
+              "одиннадцать", "двенадцать", "тринадцать", "четырнадцать", "пятнадцать", "шестнадцать",
+              "семнадцать", "восемнадцать", "девятнадцать"]
+_RU_ONES_F = ["ноль", "одна", "две"] + _RU_ONES_M[3:]
+_RU_TENS = ["", "", "двадцать", "тридцать", "сорок", "пятьдесят", "шестьдесят", "семьдесят", "восемьдесят", "девяносто"]
+_RU_HUNDREDS = ["", "сто", "двести", "триста", "четыреста", "пятьсот", "шестьсот", "семьсот", "восемьсот", "девятьсот"]
+_RU_SCALES = [(10**9, ("миллиард", "миллиарда", "миллиардов"), False),
+              (10**6, ("миллион", "миллиона", "миллионов"), False),
+              (1000, ("тысяча", "тысячи", "тысяч"), True)]
+
+
+def _ru_plural(n: int, forms) -> str:
+    n = abs(n) % 100
+    if 11 <= n <= 19: return forms[2]
+    n %= 10
+    if n == 1: return forms[0]
+    if 2 <= n <= 4: return forms[1]
+    return forms[2]
+
+
+def _en_below_1000(n: int) -> str:
+    words = []
+    if n >= 100: words += [_EN_ONES[n // 100], "hundred"]; n %= 100
+    if n >= 20: words.append(_EN_TENS[n // 10] + (f"-{_EN_ONES[n % 10]}" if n % 10 else "")); n = 0
+    if n: words.append(_EN_ONES[n])
+    return " ".join(words)
+
+
+def _ru_below_1000(n: int, feminine=False) -> str:
+    ones = _RU_ONES_F if feminine else _RU_ONES_M
+    words = []
+    if n >= 100: words.append(_RU_HUNDREDS[n // 100]); n %= 100
+    if n >= 20: words.append(_RU_TENS[n // 10]); n %= 10
+    if n: words.append(ones[n])
+    return " ".join(words)
+
+
+def number_to_words(n: int, language: str) -> str:
+    if n < 0: return ("minus " if language == 'english' else "минус ") + number_to_words(-n, language)
+    if n == 0: return _EN_ONES[0] if language == 'english' else _RU_ONES_M[0]
+    if n >= 10**12: return " ".join(number_to_words(int(d), language) for d in str(n)) # Read digit by digit
+    words = []
+    if language == 'english':
+        for scale, name in _EN_SCALES:
+            if n >= scale: words += [_en_below_1000(n // scale), name]; n %= scale
+        if n: words.append(_en_below_1000(n))
+    else:
+        for scale, forms, feminine in _RU_SCALES:
+            if n >= scale:
+                count = n // scale
+                words += [_ru_below_1000(count, feminine), _ru_plural(count, forms)]; n %= scale
+        if n: words.append(_ru_below_1000(n))
+    return " ".join(words)
+
+
+# Ordinal stems for the last word of a Russian number; the ending is added per case.
+_RU_ORDINAL_STEMS = {1: "перв", 2: "втор", 3: "трет", 4: "четвёрт", 5: "пят", 6: "шест", 7: "седьм", 8: "восьм",
+                     9: "девят", 10: "десят", 11: "одиннадцат", 12: "двенадцат", 13: "тринадцат",
+                     14: "четырнадцат", 15: "пятнадцат", 16: "шестнадцат", 17: "семнадцат", 18: "восемнадцат",
+                     19: "девятнадцат", 20: "двадцат", 30: "тридцат", 40: "сороков", 50: "пятидесят",
+                     60: "шестидесят", 70: "семидесят", 80: "восьмидесят", 90: "девяност", 100: "сот",
+                     200: "двухсот", 300: "трёхсот", 400: "четырёхсот", 500: "пятисот", 600: "шестисот",
+                     700: "семисот", 800: "восьмисот", 900: "девятисот", 1000: "тысячн", 2000: "двухтысячн"}
+_RU_ORDINAL_ENDINGS = {"nominative_neuter": ("ое", "ье"), "genitive": ("ого", "ьего")} # (regular, after "трет")
+
+
+def _ru_ordinal(n: int, case: str) -> str:
+    """21 -> "двадцать первое" / "двадцать первого"; 2024 -> "две тысячи двадцать четвёртого"."""
+    if n % 1000 == 0: last = n if n in _RU_ORDINAL_STEMS else None
+    elif n % 100 == 0: last = n % 1000
+    elif n % 100 < 20 or n % 10 == 0: last = n % 100
+    else: last = n % 10
+    if last is None: return number_to_words(n, 'russian')
+    regular, soft = _RU_ORDINAL_ENDINGS[case]
+    stem = _RU_ORDINAL_STEMS[last]
+    head = number_to_words(n - last, 'russian') + " " if n - last else ""
+    if head.startswith("одна тысяча"): head = head[len("одна "):] # "тысяча девятьсот ...", as years are read
+    return head + stem + (soft if last == 3 else regular)
+
+
+def _en_year(n: int) -> str:
+    """1999 -> "nineteen ninety-nine", 1905 -> "nineteen oh five", 2005 -> "two thousand five"."""
+    if not 1100 <= n <= 2099 or 2000 <= n <= 2009: return number_to_words(n, 'english')
+    century, rest = divmod(n, 100)
+    if rest == 0: return f"{number_to_words(century, 'english')} hundred"
+    rest_words = ("oh " if rest < 10 else "") + number_to_words(rest, 'english')
+    return f"{number_to_words(century, 'english')} {rest_words}"
+
+
+def _en_ordinal(n: int) -> str:
+    words = number_to_words(n, 'english')
+    head, sep, last = words.rpartition(" ")
+    last_hyph_head, hyph, last_part = last.rpartition("-")
+    if last_part in _EN_ORDINAL_EXCEPTIONS: last_part = _EN_ORDINAL_EXCEPTIONS[last_part]
+    elif last_part.endswith("y"): last_part = last_part[:-1] + "ieth"
+    else: last_part += "th"
+    return f"{head}{sep}{last_hyph_head}{hyph}{last_part}"
+
+
+_EN_MONTHS = ["January", "February", "March", "April", "May", "June", "July", "August",
+              "September", "October", "November", "December"]
+_RU_MONTHS_GEN = ["января", "февраля", "марта", "апреля", "мая", "июня", "июля", "августа",
+                  "сентября", "октября", "ноября", "декабря"]
+
+
+def _speak_date(year: int, month: int, day: int, language: str):
+    if not (1 <= month <= 12 and 1 <= day <= 31): return None
+    if language == 'english':
+        return f"{_EN_MONTHS[month - 1]} {_en_ordinal(day)}, {_en_year(year)}"
+    return f"{_ru_ordinal(day, 'nominative_neuter')} {_RU_MONTHS_GEN[month - 1]} {_ru_ordinal(year, 'genitive')} года"
+
+
+# One alternation, one pass: the first matching group decides how the span is spoken.
+_NORMALIZE_RE = re.compile(
+    r"(?P<url>\b(?:https?://|www\.)[^\s<>\"']*[^\s<>\"'.,;:!?)]|\b[\w-]+(?:\.[\w-]+)*\.(?:com|org|net|ru|io|dev|info)\b(?:/[^\s<>\"']*[^\s<>\"'.,;:!?)])?)"
+    r"|(?P<iso_date>\b(?P<iy>\d{4})-(?P<im>\d{1,2})-(?P<id>\d{1,2})\b)"
+    r"|(?P<dot_date>\b(?P<dd>\d{1,2})[./](?P<dm>\d{1,2})[./](?P<dy>\d{4})\b)"
+    r"|(?P<time>\b(?P<th>[01]?\d|2[0-3]):(?P<tm>[0-5]\d)\b)"
+    r"|(?P<percent>(?<!\d[.,])(?P<pnum>\d+(?:[.,]\d+)?)\s?%)"
+    r"|(?P<version>\b\d+(?:\.\d+){2,}\b)"
+    r"|(?P<grouped>\b\d{1,3}(?:,\d{3})+\b)"
+    r"|(?P<num_list>\b\d+(?:,\d+){2,}\b)"
+    r"|(?P<decimal>(?<!\d[.,])\b(?P<int_part>\d+)[.,](?P<frac_part>\d+)\b(?![.,]\d))"
+    r"|(?P<integer>\b\d+\b)"
+)
+
+_NORMALIZE_KINDS = ("url", "iso_date", "dot_date", "time", "percent", "version", "grouped", "num_list", "decimal",
+                    "integer")
+_CURRENCY_SIGNS = "$€£₽"
+
+
+def _speak_url(url: str, language: str) -> str:
+    host = re.sub(r'^(?:https?://)?(?:www\.)?', '', url).split('/', 1)[0].rstrip('.,;:')
+    dot_word = " dot " if language == 'english' else " точка "
+    return dot_word.join(part for part in host.split('.') if part)
+
+
+def _speak_decimal(int_part: str, frac_part: str, language: str) -> str:
+    point = "point" if language == 'english' else "запятая"
+    frac_words = " ".join(number_to_words(int(d), language) for d in frac_part) if frac_part.startswith("0") \
+        else number_to_words(int(frac_part), language)
+    return f"{number_to_words(int(int_part), language)} {point} {frac_words}"
+
+
+def normalize_for_speech(text: str, language: str = 'english') -> str:
+    """Rewrites URLs, dates, times, percents and numbers into words for the given language."""
+    def _replace(m):
+        kind = next(k for k in _NORMALIZE_KINDS if m.group(k))
+        try:
+            if kind == "url": return _speak_url(m.group("url"), language)
+            if kind == "iso_date":
+                spoken = _speak_date(int(m.group("iy")), int(m.group("im")), int(m.group("id")), language)
+                return spoken or m.group(0)
+            if kind == "dot_date":
+                spoken = _speak_date(int(m.group("dy")), int(m.group("dm")), int(m.group("dd")), language)
+                return spoken or m.group(0)
+            if kind == "time":
+                hours, minutes = int(m.group("th")), int(m.group("tm"))
+                if minutes == 0:
+                    return f"{number_to_words(hours, language)} {'o’clock' if language == 'english' else 'ноль ноль'}"
+                minute_words = number_to_words(minutes, language)
+                if minutes < 10: minute_words = ("oh " if language == 'english' else "ноль ") + minute_words
+                return f"{number_to_words(hours, language)} {minute_words}"
+            if kind == "percent":
+                num = m.group("pnum")
+                if re.search(r"[.,]", num):
+                    int_part, frac_part = re.split(r"[.,]", num)
+                    words = _speak_decimal(int_part, frac_part, language)
+                    return f"{words} {'percent' if language == 'english' else 'процента'}"
+                n = int(num)
+                unit = "percent" if language == 'english' else _ru_plural(n, ("процент", "процента", "процентов"))
+                return f"{number_to_words(n, language)} {unit}"
+            if kind == "version": # 1.2.3 -> one point two point three
+                point = " point " if language == 'english' else " точка "
+                return point.join(number_to_words(int(part), language) for part in m.group(0).split("."))
+            if kind == "grouped": return number_to_words(int(m.group(0).replace(",", "")), language)
+            if kind == "num_list": return ", ".join(number_to_words(int(p), language) for p in m.group(0).split(","))
+            if kind == "decimal": return _speak_decimal(m.group("int_part"), m.group("frac_part"), language)
+            digits = m.group(0)
+            is_amount = m.start() > 0 and text[m.start() - 1] in _CURRENCY_SIGNS
+            if language == 'english' and len(digits) == 4 and not is_amount: return _en_year(int(digits))
+            return number_to_words(int(digits), language)
+        except Exception:
+            return m.group(0)
+    return _NORMALIZE_RE.sub(_replace, text)
+
+
+# --- Duration-balanced chunking ---
+def estimate_speech_seconds(text: str, language: str) -> float:
+    return len(text) / CHARS_PER_SECOND.get(language, 13.0)
+
+
+_CLAUSE_SPLIT_RE = re.compile(r'(?<=[,;:—–])\s+')
+
+
+def _split_long_sentence(sentence: str, language: str, max_seconds: float) -> list:
+    """Splits an over-long sentence at clause punctuation, then at word boundaries."""
+    max_chars = int(max_seconds * CHARS_PER_SECOND.get(language, 13.0))
+    pieces, current = [], ""
+    for clause in _CLAUSE_SPLIT_RE.split(sentence):
+        words = clause.split() if len(clause) > max_chars else [clause]
+        for word in words:
+            candidate = f"{current} {word}".strip()
+            if current and len(candidate) > max_chars:
+                pieces.append(current); current = word
+            else:
+                current = candidate
+    if current: pieces.append(current)
+    return pieces
+
+
+def pack_sentences(sentences, language: str, target_seconds: float, max_seconds: float) -> list:
+    """Greedy packing: add sentences to a chunk until it would exceed target_seconds."""
+    chunks, current, current_secs = [], [], 0.0
+    for sentence in sentences:
+        secs = estimate_speech_seconds(sentence, language)
+        parts = _split_long_sentence(sentence, language, max_seconds) if secs > max_seconds else [sentence]
+        for part in parts:
+            part_secs = estimate_speech_seconds(part, language)
+            if current and current_secs + part_secs > target_seconds:
+                chunks.append(" ".join(current)); current, current_secs = [], 0.0
+            current.append(part); current_secs += part_secs
+    if current: chunks.append(" ".join(current))
+    return chunks
+
+
+@functools.lru_cache(maxsize=config.TTS_SEGMENT_CACHE_SIZE)
+def _segment_cached(text: str, language: str, normalize: bool, target_seconds: float, max_seconds: float) -> tuple:
+    prepared = normalize_for_speech(text, language) if normalize else text
+    sentences = split_sentences(prepared, language)
+    if not sentences: return ()
+    return tuple(pack_sentences(sentences, language, target_seconds, max_seconds))
+
+
+def segment_for_tts(text: str, voice_preset: str = None, language: str = None, normalize: bool = True,
+                    target_seconds: float = None, max_seconds: float = None) -> list:
+    """
+    Returns TTS-ready chunks for `text`. Language comes from `language`, else from the Bark voice preset.
+    Results are memoized per (text, language, options).
+    """
+    if not text or not text.strip(): return []
+    language = language or language_for_preset(voice_preset)
+    target_seconds = float(target_seconds or config.TTS_CHUNK_TARGET_SECONDS)
+    max_seconds = float(max_seconds or config.TTS_CHUNK_MAX_SECONDS)
+    try:
+        return list(_segment_cached(text.strip(), language, normalize, target_seconds, max_seconds))
+    except Exception as e_seg:
+        logger.error(f"TTS segmentation failed: {e_seg}. Treating full text as one chunk.", exc_info=True)
+        return [text]
+
+
+def get_cache_info():
+    return _segment_cached.cache_info()
+
+
+def preload(languages=("english", "russian")):
+    """Loads punkt models up front so the first reply does not pay for it."""
+    for language in languages: _get_punkt_tokenizer(language)
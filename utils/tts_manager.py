@@ -9,6 +9,7 @@ import numpy as np # For BarkTTS to return array
 
 # Assuming logger.py is in project root
 from logger import get_logger
+from utils import inference_modes
 
 logger = get_logger("Iri-shka_App.utils.tts_manager")
 
@@ -65,6 +66,8 @@ except Exception as e_tts_init:
 _bark_processor_instance = None
 _bark_model_instance = None
 _bark_device_str = None
+_bark_inference_mode = "fp32" # Resolved mode actually applied to the loaded model
+_bark_compiled_submodules = []
 _bark_resources_ready = False
 _bark_loading_in_progress = False
 _bark_load_error_msg = None # Stores specific error from last load attempt
@@ -92,7 +95,8 @@ def get_bark_model_instance():
             return BarkTTS_class(
                 processor=_bark_processor_instance,
                 model=_bark_model_instance,
-                device=_bark_device_str
+                device=_bark_device_str,
+                inference_mode=_bark_inference_mode
                 # voice_preset is passed during synthesize_speech_to_array
             )
         except Exception as e:
@@ -104,6 +108,7 @@ def get_bark_model_instance():
 
 def load_bark_resources(gui_callbacks=None):
     global _bark_processor_instance, _bark_model_instance, _bark_device_str, _bark_resources_ready
+    global _bark_inference_mode, _bark_compiled_submodules
     global _bark_loading_in_progress, _bark_load_error_msg
 
     if not TTS_CAPABLE:
@@ -152,22 +157,38 @@ def load_bark_resources(gui_callbacks=None):
             raise RuntimeError("Core PyTorch/Transformers modules for Bark are not available.")
 
         _bark_device_str = "cuda" if torch_module.cuda.is_available() else "cpu"
-        logger.info(f"Target device for Bark model: {_bark_device_str}")
+        _bark_inference_mode = inference_modes.resolve_inference_mode(config.BARK_INFERENCE_MODE, _bark_device_str)
+        logger.info(f"Target device for Bark model: {_bark_device_str}, inference mode: {_bark_inference_mode}")
 
         logger.info(f"Loading Bark processor from '{model_load_path}'...")
         _bark_processor_instance = AutoProcessor_class.from_pretrained(model_load_path, local_files_only=is_local_path)
 
         logger.info(f"Loading Bark model from '{model_load_path}' to {_bark_device_str}...")
         _bark_model_instance = BarkModel_class.from_pretrained(model_load_path, local_files_only=is_local_path)
-        _bark_model_instance.to(_bark_device_str) # type: ignore
+        _bark_model_instance, _bark_compiled_submodules = inference_modes.prepare_model_for_mode(
+            _bark_model_instance, _bark_inference_mode, _bark_device_str,
+            use_torch_compile=config.BARK_TORCH_COMPILE, compile_targets=config.BARK_COMPILE_SUBMODULES
+        )
 
-        # Optional: CPU offload for small models if on GPU
-        # if _bark_device_str == "cuda" and "small" in model_load_path.lower() and hasattr(_bark_model_instance, "enable_cpu_offload"):
-        #     try: _bark_model_instance.enable_cpu_offload(); logger.info("Enabled CPU offload for Bark model.")
-        #     except Exception as e_offload: logger.warning(f"Could not enable CPU offload: {e_offload}")
+        if config.INFERENCE_WARMUP_ON_LOAD:
+            if gui_callbacks and callable(gui_callbacks.get('status_update')):
+                gui_callbacks['status_update'](f"Warming up Bark TTS ({_bark_inference_mode})...")
+            warmup_engine = BarkTTS_class(
+                processor=_bark_processor_instance, model=_bark_model_instance,
+                device=_bark_device_str, voice_preset=config.BARK_VOICE_PRESET_EN,
+                inference_mode=_bark_inference_mode
+            )
+            warmup_ok, _ = inference_modes.warmup(
+                lambda: warmup_engine.synthesize_speech_to_array("Hi."), f"Bark ({_bark_inference_mode})"
+            )
+            if not warmup_ok and _bark_compiled_submodules:
+                logger.warning("Bark warmup failed with torch.compile enabled. Reverting to eager submodules.")
+                inference_modes.uncompile_submodules(_bark_model_instance, _bark_compiled_submodules)
+                _bark_compiled_submodules = []
 
         _bark_resources_ready = True
-        success_msg = f"Bark TTS ready (Model: {os.path.basename(str(model_load_path))} on {_bark_device_str})."
+        compile_note = "+compile" if _bark_compiled_submodules else ""
+        success_msg = f"Bark TTS ready (Model: {os.path.basename(str(model_load_path))} on {_bark_device_str}, {_bark_inference_mode}{compile_note})."
         logger.info(success_msg)
         if gui_callbacks:
             if callable(gui_callbacks.get('status_update')): gui_callbacks['status_update'](success_msg)
@@ -219,7 +240,8 @@ def start_speaking_response(text_to_speak, persona_name_llm, target_voice_preset
 
         bark_tts_engine_instance = BarkTTS_class(
             processor=_bark_processor_instance, model=_bark_model_instance,
-            device=_bark_device_str, voice_preset=target_voice_preset
+            device=_bark_device_str, voice_preset=target_voice_preset,
+            inference_mode=_bark_inference_mode
         )
         streamer_instance = StreamingBarkTTS_class(bark_tts_instance=bark_tts_engine_instance)
         
@@ -273,6 +295,7 @@ def stop_current_speech(gui_callbacks=None):
 
 def unload_bark_model(gui_callbacks=None):
     global _bark_processor_instance, _bark_model_instance, _bark_device_str, _bark_resources_ready
+    global _bark_inference_mode, _bark_compiled_submodules
     global _bark_loading_in_progress, current_tts_thread, _bark_load_error_msg
 
     logger.info("Unload sequence initiated for Bark TTS model.")
@@ -301,6 +324,8 @@ def unload_bark_model(gui_callbacks=None):
     _bark_loading_in_progress = False
     _bark_load_error_msg = None # Clear previous error on unload
     _bark_device_str = None
+    _bark_inference_mode = "fp32"
+    _bark_compiled_submodules = []
     logger.info("Bark TTS model unloaded.")
     if gui_callbacks:
         if callable(gui_callbacks.get('status_update')):
@@ -312,6 +337,9 @@ def unload_bark_model(gui_callbacks=None):
 def full_shutdown_tts_module():
     logger.info("Full Bark TTS module shutdown for application exit.")
     unload_bark_model()
+    if TTS_CAPABLE:
+        from utils.playback_engine import close_shared_engine
+        close_shared_engine()
     logger.info("Bark TTS module shutdown sequence complete.")
 
 # --- New Status Functions ---
@@ -0,0 +1,133 @@
+# utils/versioned_state.py
+"""
+Immutable, versioned snapshots of the admin/app state (chat_history, user_state, assistant_state).
+
+Readers call get_app_state().current() and get an AppStateSnapshot without taking any lock, because
+publishing just swaps one reference. Snapshot contents are FrozenDict/FrozenList. They are still real
+dict/list subclasses, so json.dumps, iteration, slicing and .copy() behave as before, but any in-place
+mutation raises TypeError instead of silently corrupting shared state. .copy() returns a plain mutable
+dict/list whose nested values are still frozen. Use thaw() when a nested structure must be edited.
+
+Writers never mutate shared state. update(build_fn) is read-copy-update with compare-and-swap: build_fn gets
+the current snapshot and returns the parts it changes, built from that snapshot (e.g. the old chat_history
+plus one turn, or {**snapshot.user_state, key: value}). freeze() keeps already-frozen subtrees as they are,
+so a new version shares every unchanged turn and nested value with the previous one (structural sharing).
+If another writer published in between, the swap fails and build_fn runs again on the newer snapshot,
+so build_fn must not have side effects it cannot repeat. Only the version check and the reference swap run
+under a private lock. Freezing, JSON serialisation, persistence and GUI callbacks all happen outside it.
+Persist from the returned snapshot after the swap (state_manager.save_app_state).
+Versions only go up, so a consumer can keep `version` and check is_stale(version) later.
+"""
+import collections
+import threading
+
+from logger import get_logger
+
+logger = get_logger("Iri-shka_App.utils.VersionedState")
+
+
+def _immutable(self, *args, **kwargs):
+    raise TypeError(f"{type(self).__name__} is an immutable state snapshot; thaw() it or publish a new version.")
+
+
+class FrozenDict(dict):
+    __slots__ = ()
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+    __ior__ = _immutable
+
+    def copy(self) -> dict:
+        return dict(self)
+
+    def __reduce__(self): # deepcopy/pickle produce a plain, mutable dict
+        return (dict, (dict(self),))
+
+
+class FrozenList(list):
+    __slots__ = ()
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _immutable
+    append = extend = insert = pop = remove = clear = sort = reverse = _immutable
+
+    def copy(self) -> list:
+        return list(self)
+
+    def __reduce__(self):
+        return (list, (list(self),))
+
+
+def freeze(obj):
+    """Deep-freezes dicts/lists. Already-frozen parts are returned as-is (shared, not copied)."""
+    if isinstance(obj, (FrozenDict, FrozenList)): return obj
+    if isinstance(obj, dict): return FrozenDict((k, freeze(v)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)): return FrozenList(freeze(v) for v in obj)
+    return obj
+
+
+def thaw(obj):
+    """Deep mutable copy of a (possibly frozen) structure."""
+    if isinstance(obj, dict): return {k: thaw(v) for k, v in obj.items()}
+    if isinstance(obj, list): return [thaw(v) for v in obj]
+    return obj
+
+
+AppStateSnapshot = collections.namedtuple("AppStateSnapshot", ["version", "chat_history", "user_state", "assistant_state"])
+
+_EMPTY_SNAPSHOT = AppStateSnapshot(0, FrozenList(), FrozenDict(), FrozenDict())
+
+
+class VersionedState:
+    def __init__(self):
+        self._current = _EMPTY_SNAPSHOT
+        self._swap_lock = threading.Lock() # Held only for the version check + reference swap; readers never take it
+        self.cas_conflicts = 0 # Swaps that lost the race and were rebuilt on a newer snapshot
+
+    def current(self) -> AppStateSnapshot:
+        return self._current
+
+    @property
+    def version(self) -> int:
+        return self._current.version
+
+    def is_stale(self, version: int) -> bool:
+        return version != self._current.version
+
+    def compare_and_swap(self, expected_version: int, chat_history=None, user_state=None, assistant_state=None):
+        """
+        Publishes a new version if the current one is still `expected_version`. Returns the new snapshot, or None
+        if another writer got there first. Parts passed as None are shared with the previous version.
+        """
+        frozen_parts = [None if part is None else freeze(part) for part in (chat_history, user_state, assistant_state)]
+        with self._swap_lock:
+            prev = self._current
+            if prev.version != expected_version:
+                self.cas_conflicts += 1
+                return None
+            snapshot = AppStateSnapshot(prev.version + 1, *(prev_part if new_part is None else new_part
+                                                             for prev_part, new_part in zip(prev[1:], frozen_parts)))
+            self._current = snapshot
+            return snapshot
+
+    def update(self, build_fn):
+        """
+        build_fn(snapshot) -> {"chat_history"/"user_state"/"assistant_state": new part} or None for no change.
+        Retries on a newer snapshot until the swap succeeds. Returns the published snapshot, or None if unchanged.
+        """
+        while True:
+            prev = self._current
+            parts = build_fn(prev)
+            if not parts: return None
+            snapshot = self.compare_and_swap(prev.version, **parts)
+            if snapshot is not None: return snapshot
+            logger.debug(f"State version {prev.version} was superseded while building the next one; rebuilding.")
+
+    def publish(self, chat_history=None, user_state=None, assistant_state=None) -> AppStateSnapshot:
+        """Unconditional publish, for documents no other writer can see yet (the version loaded at startup)."""
+        return self.update(lambda _snapshot: {k: v for k, v in (("chat_history", chat_history), ("user_state", user_state),
+                                                                ("assistant_state", assistant_state)) if v is not None})
+
+
+_app_state = VersionedState()
+
+
+def get_app_state() -> VersionedState:
+    return _app_state
@@ -7,11 +7,13 @@ import sys
 
 # Assuming logger.py is in project root
 from logger import get_logger
+from utils import inference_modes
 logger = get_logger("Iri-shka_App.utils.whisper_handler")
 
 # --- Whisper Model Setup ---
 _whisper_model = None
 _whisper_device = None
+_whisper_inference_mode = "fp32" # Resolved mode actually applied to the loaded model
 whisper_model_ready = False
 whisper_loading_in_progress = False
 _whisper_load_error_message = None
@@ -44,6 +46,7 @@ except Exception as e_init:
 
 def load_whisper_model(model_size=config.WHISPER_MODEL_SIZE, gui_callbacks=None):
     global _whisper_model, whisper_model_ready, whisper_loading_in_progress, _whisper_load_error_message, _whisper_device
+    global _whisper_inference_mode
 
     if not WHISPER_CAPABLE:
         final_err_msg = _whisper_load_error_message or "Whisper library not imported."
@@ -81,10 +84,28 @@ def load_whisper_model(model_size=config.WHISPER_MODEL_SIZE, gui_callbacks=None)
              _whisper_device = "cuda" if torch.cuda.is_available() else "cpu" # type: ignore
              logger.info(f"Re-confirmed Whisper device during load: {_whisper_device}")
 
-        logger.info(f"Attempting to load Whisper model: {model_size} onto device: {_whisper_device}")
+        _whisper_inference_mode = inference_modes.resolve_inference_mode(config.WHISPER_INFERENCE_MODE, _whisper_device)
+        logger.info(f"Attempting to load Whisper model: {model_size} onto device: {_whisper_device} (mode: {_whisper_inference_mode})")
         _whisper_model = whisper.load_model(model_size, device=_whisper_device) # type: ignore
+        _whisper_model, compiled_submodules = inference_modes.prepare_model_for_mode(
+            _whisper_model, _whisper_inference_mode, _whisper_device,
+            use_torch_compile=config.WHISPER_TORCH_COMPILE, compile_targets=config.WHISPER_COMPILE_SUBMODULES
+        )
+        if config.INFERENCE_WARMUP_ON_LOAD:
+            if gui_callbacks and callable(gui_callbacks.get('status_update')):
+                gui_callbacks['status_update'](f"Warming up Whisper ({_whisper_inference_mode})...")
+            warmup_audio = np.zeros(config.INPUT_RATE, dtype=np.float32) # 1s of silence
+            warmup_ok, _ = inference_modes.warmup(
+                lambda: _run_transcribe({"audio": warmup_audio, "task": "transcribe", "language": "en"}),
+                f"Whisper ({_whisper_inference_mode})"
+            )
+            if not warmup_ok and compiled_submodules:
+                logger.warning("Whisper warmup failed with torch.compile enabled. Reverting to eager submodules.")
+                inference_modes.uncompile_submodules(_whisper_model, compiled_submodules)
+                compiled_submodules = []
         whisper_model_ready = True
-        success_msg = f"Whisper ready (Model: {model_size} on {_whisper_device})."
+        compile_note = "+compile" if compiled_submodules else ""
+        success_msg = f"Whisper ready (Model: {model_size} on {_whisper_device}, {_whisper_inference_mode}{compile_note})."
         logger.info(success_msg)
         if gui_callbacks and callable(gui_callbacks.get('status_update')):
             gui_callbacks['status_update']("Whisper model loaded.")
@@ -115,6 +136,14 @@ def load_whisper_model(model_size=config.WHISPER_MODEL_SIZE, gui_callbacks=None)
     whisper_loading_in_progress = False
 
 
+def _run_transcribe(args_for_transcribe: dict):
+    """Calls the model's transcribe() under the configured inference mode."""
+    # Whisper's own fp16 switch covers the fp16 mode; bf16 runs through autocast with fp16 disabled.
+    args_for_transcribe["fp16"] = (_whisper_device == "cuda" and _whisper_inference_mode == "fp16")
+    with inference_modes.inference_context(_whisper_inference_mode, _whisper_device):
+        return _whisper_model.transcribe(**args_for_transcribe) # type: ignore
+
+
 def transcribe_audio(audio_np_array: np.ndarray, language=None, task="transcribe", gui_callbacks=None):
     """
     Transcribes audio using the loaded Whisper model.
@@ -146,8 +175,7 @@ def transcribe_audio(audio_np_array: np.ndarray, language=None, task="transcribe
         # These are top-level arguments for whisper.model.Whisper.transcribe
         args_for_transcribe = {
             "audio": audio_np_array,
-            "task": str(task),  # Ensure task is a string
-            "fp16": (_whisper_device == "cuda") # Use fp16 only if on CUDA
+            "task": str(task)  # Ensure task is a string. fp16 is set by _run_transcribe from the inference mode
         }
         if language is not None: # Only add 'language' if it's not None (for auto-detection)
             args_for_transcribe["language"] = str(language) # Ensure language is a string
@@ -159,9 +187,9 @@ def transcribe_audio(audio_np_array: np.ndarray, language=None, task="transcribe
         # args_for_transcribe["without_timestamps"] = False # Default
 
         log_args_display = {k:v for k,v in args_for_transcribe.items() if k != 'audio'} # Don't log the huge audio array
-        logger.debug(f"Calling _whisper_model.transcribe() with direct arguments: {log_args_display}")
+        logger.debug(f"Calling _whisper_model.transcribe() with direct arguments: {log_args_display}, mode: {_whisper_inference_mode}")
         
-        result = _whisper_model.transcribe(**args_for_transcribe)
+        result = _run_transcribe(args_for_transcribe)
 
         transcribed_text = result.get("text", "").strip() # type: ignore
         detected_language_code = result.get("language", None) # type: ignore
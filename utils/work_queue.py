@@ -0,0 +1,218 @@
+# utils/work_queue.py
+"""
+Durable record of pending work, so a restart does not lose it (SQLite, WAL).
+
+- customer: one row per customer in an aggregation window or being processed by the LLM.
+  due_at is the wall-clock deadline of the window. state is 'pending' (timer running) or 'running'
+  (handed to the LLM executor). A row is deleted when the package finishes. A new message during
+  processing sets it back to 'pending', and then the finishing package leaves it alone.
+- admin: one row per item put on the admin LLM queue (Telegram text/voice), deleted after processing.
+
+At startup, pending customers with a future deadline get their timers back
+(CustomerInteractionManager.restore_timers). Overdue or interrupted customers, customers stuck in an
+LLM stage without a row, and unprocessed admin items are replayed by fast_forward(), which keeps at most
+WORK_QUEUE_RECOVERY_CONCURRENCY recovered packages in flight. Items that were already attempted
+WORK_QUEUE_MAX_ATTEMPTS times are dropped instead of replayed, so a crashing package cannot loop.
+"""
+import collections
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import config
+from logger import get_logger
+
+logger = get_logger("Iri-shka_App.utils.WorkQueue")
+
+KIND_CUSTOMER = "customer"
+KIND_ADMIN = "admin"
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS work_items (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    payload_json TEXT NOT NULL DEFAULT 'null',
+    due_at REAL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL,
+    updated_at REAL,
+    PRIMARY KEY (kind, key)
+);
+"""
+
+
+class DurableWorkStore:
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or config.WORK_QUEUE_DB_FILE
+        parent = os.path.dirname(self.db_path)
+        if parent: os.makedirs(parent, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._admin_seq = 0
+        logger.info(f"Durable work store opened at '{self.db_path}' (WAL).")
+
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            try: return self._conn.execute(sql, params)
+            except sqlite3.Error as e_db:
+                logger.error(f"Work store statement failed ({sql.split()[0]}): {e_db}")
+                return None
+
+    # --- Customer packages ---
+    def schedule_customer(self, user_id: int, due_at: float):
+        now = time.time()
+        self._execute(
+            "INSERT INTO work_items (kind, key, due_at, state, created_at, updated_at) VALUES (?, ?, ?, 'pending', ?, ?) "
+            "ON CONFLICT(kind, key) DO UPDATE SET due_at=excluded.due_at, state='pending', updated_at=excluded.updated_at",
+            (KIND_CUSTOMER, str(user_id), due_at, now, now))
+
+    def pending_customers(self) -> list:
+        """[(user_id, due_at, state, attempts)] ordered by deadline."""
+        cur = self._execute("SELECT key, due_at, state, attempts FROM work_items WHERE kind=? ORDER BY due_at", (KIND_CUSTOMER,))
+        return [(int(r[0]), r[1] or 0.0, r[2], r[3]) for r in cur] if cur else []
+
+    # --- Admin queue items ---
+    def add_admin_item(self, item: tuple) -> str:
+        with self._lock:
+            self._admin_seq += 1
+            key = f"{time.time_ns():020d}-{self._admin_seq}" # Sorts in arrival order
+        now = time.time()
+        self._execute("INSERT INTO work_items (kind, key, payload_json, state, created_at, updated_at) VALUES (?, ?, ?, 'pending', ?, ?)",
+                      (KIND_ADMIN, key, json.dumps(list(item), ensure_ascii=False), now, now))
+        return key
+
+    def pending_admin_items(self) -> list:
+        """[(key, item_tuple, attempts)] in arrival order."""
+        cur = self._execute("SELECT key, payload_json, attempts FROM work_items WHERE kind=? ORDER BY key", (KIND_ADMIN,))
+        return [(r[0], tuple(json.loads(r[1])), r[2]) for r in cur] if cur else []
+
+    # --- Common ---
+    def mark_running(self, kind: str, key):
+        self._execute("UPDATE work_items SET state='running', attempts=attempts+1, updated_at=? WHERE kind=? AND key=?",
+                      (time.time(), kind, str(key)))
+
+    def complete(self, kind: str, key, only_if_running: bool = False):
+        sql = "DELETE FROM work_items WHERE kind=? AND key=?" + (" AND state='running'" if only_if_running else "")
+        self._execute(sql, (kind, str(key)))
+
+    def counts(self) -> dict:
+        cur = self._execute("SELECT kind, state, COUNT(*) FROM work_items GROUP BY kind, state")
+        return {f"{kind}/{state}": n for kind, state, n in cur} if cur else {}
+
+    def close(self):
+        with self._lock:
+            try:
+                self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                self._conn.close()
+            except sqlite3.Error as e_close:
+                logger.warning(f"Error closing work store: {e_close}")
+
+
+class DurableAdminQueue(queue.Queue):
+    """
+    The admin LLM queue, with every put() journaled in the store. An item is deleted from the store by
+    ack(key) (key from last_get_info() right after get()), or by the getting thread's next task_done().
+    If processing fails before that, the item stays in the store and is replayed on the next start.
+    """
+    def __init__(self, store: DurableWorkStore):
+        super().__init__()
+        self._store = store
+        self._keys = collections.deque() # (store key, enqueued monotonic time), parallel to the queue's own deque
+        self._current = threading.local()
+
+    def put(self, item, block=True, timeout=None):
+        self.put_restored(self._store.add_admin_item(item), item, block, timeout)
+
+    def put_restored(self, key: str, item, block=True, timeout=None):
+        """Enqueues an item that is already in the store (startup recovery)."""
+        super().put((key, item), block, timeout)
+
+    def _put(self, entry): # Called by queue.Queue under its mutex
+        key, item = entry
+        self._keys.append((key, time.monotonic())); self.queue.append(item)
+
+    def _get(self):
+        key, enqueued_at = self._keys.popleft()
+        self._current.key, self._current.waited = key, time.monotonic() - enqueued_at
+        return self.queue.popleft()
+
+    def get(self, block=True, timeout=None):
+        item = super().get(block, timeout)
+        self._store.mark_running(KIND_ADMIN, self._current.key)
+        return item
+
+    def last_get_info(self) -> tuple:
+        """(store key, seconds the item waited in the queue) of this thread's last get()."""
+        return getattr(self._current, "key", None), getattr(self._current, "waited", None)
+
+    def ack(self, key):
+        if key is not None: self._store.complete(KIND_ADMIN, key)
+
+    def task_done(self):
+        key = getattr(self._current, "key", None)
+        if key is not None:
+            self.ack(key); self._current.key = None
+        super().task_done()
+
+
+def fast_forward(customer_ids, admin_items, dispatch_customer, admin_queue: DurableAdminQueue, max_concurrency: int = None) -> threading.Thread:
+    """
+    Replays recovered work in the background. Admin items go back on admin_queue in arrival order.
+    Customers are dispatched through dispatch_customer(user_id) -> Future | None, with at most
+    max_concurrency recovered packages in flight, so live traffic still gets executor slots.
+    """
+    limit = threading.BoundedSemaphore(max(1, max_concurrency or config.WORK_QUEUE_RECOVERY_CONCURRENCY))
+
+    def _run():
+        for key, item in admin_items: admin_queue.put_restored(key, item)
+        t0 = time.time()
+        for user_id in customer_ids:
+            limit.acquire()
+            try: future = dispatch_customer(user_id)
+            except Exception as e_dispatch:
+                logger.error(f"Recovery dispatch failed for customer {user_id}: {e_dispatch}", exc_info=True); future = None
+            if future is None: limit.release()
+            else: future.add_done_callback(lambda _f: limit.release())
+        logger.info(f"Work recovery: {len(admin_items)} admin item(s) re-queued, {len(customer_ids)} customer package(s) "
+                    f"dispatched in {time.time() - t0:.1f}s.")
+
+    thread = threading.Thread(target=_run, daemon=True, name="WorkRecovery")
+    thread.start()
+    return thread
+
+
+def plan_recovery(store: DurableWorkStore, stuck_customer_ids=(), now: float = None) -> dict:
+    """
+    Splits the stored work into {"timers": [(user_id, due_at)], "overdue": [user_id], "admin": [(key, item)]}.
+    stuck_customer_ids are customers whose saved stage says they await the LLM; those without a row are overdue too.
+    """
+    now = now if now is not None else time.time()
+    max_attempts = config.WORK_QUEUE_MAX_ATTEMPTS
+    plan = {"timers": [], "overdue": [], "admin": []}
+    known = set()
+    for user_id, due_at, state, attempts in store.pending_customers():
+        known.add(user_id)
+        if attempts >= max_attempts:
+            logger.error(f"Customer {user_id} package failed {attempts} time(s); dropping it from the work queue.")
+            store.complete(KIND_CUSTOMER, user_id); continue
+        if state == "pending" and due_at > now: plan["timers"].append((user_id, due_at))
+        else: plan["overdue"].append(user_id)
+    for user_id in stuck_customer_ids:
+        if user_id not in known: plan["overdue"].append(user_id)
+    for key, item, attempts in store.pending_admin_items():
+        if attempts >= max_attempts or len(item) != 3:
+            logger.error(f"Dropping admin queue item {key} (attempts: {attempts}): {item!r:.120}")
+            store.complete(KIND_ADMIN, key); continue
+        if item[0] == "telegram_voice_admin_wav" and not os.path.exists(str(item[2])):
+            logger.warning(f"Dropping recovered admin voice item {key}: '{item[2]}' no longer exists.")
+            store.complete(KIND_ADMIN, key); continue
+        plan["admin"].append((key, item))
+    logger.info(f"Work recovery plan: {len(plan['timers'])} timer(s) to restore, {len(plan['overdue'])} overdue customer(s), "
+                f"{len(plan['admin'])} admin item(s).")
+    return plan
@@ -12,6 +12,7 @@ if project_root_dir not in sys.path:
 
 import config
 from utils import file_utils
+from utils.artifact_reaper import mark_artifact_in_use, resolve_artifact_path
 from logger import get_logger
 
 PYDUB_FOR_WEB_AVAILABLE = False; AudioSegment_web = None; PydubExceptions_web = None
@@ -75,15 +76,9 @@ def health_check():
 def process_audio_route():
     web_logger.info(f"Accessed /process_audio with method: {request.method}")
     bridge = current_app.main_app_components.get('bridge')
-    main_interaction_handler = current_app.main_app_components.get('main_interaction_handler')
-    chat_history_ref = current_app.main_app_components.get('chat_history_ref')
-    user_state_ref = current_app.main_app_components.get('user_state_ref')
-    assistant_state_ref = current_app.main_app_components.get('assistant_state_ref')
-    global_lock_ref = current_app.main_app_components.get('global_lock_ref')
-
-    if not all([bridge, main_interaction_handler, chat_history_ref is not None,
-                user_state_ref is not None, assistant_state_ref is not None, global_lock_ref]):
-        web_logger.critical("CRITICAL: WebApp components or state refs not found in Flask app context.")
+
+    if not bridge:
+        web_logger.critical("CRITICAL: WebApp bridge not found in Flask app context.")
         return jsonify({"error": "Server internal configuration error"}), 500
 
     if 'audio_data' not in request.files:
@@ -108,22 +103,8 @@ def process_audio_route():
         audio_segment = audio_segment.set_channels(1).set_frame_rate(config.INPUT_RATE)
         audio_segment.export(temp_wav_path, format="wav")
 
-        current_chat_history_copy = []
-        current_user_state_copy = {}
-        current_assistant_state_copy = {}
-        with global_lock_ref:
-            current_chat_history_copy = list(chat_history_ref)
-            current_user_state_copy = dict(user_state_ref)
-            current_assistant_state_copy = dict(assistant_state_ref)
-
-        bridge_result = bridge.process_admin_web_audio(
-            input_wav_filepath=temp_wav_path,
-            current_chat_history=current_chat_history_copy,
-            current_user_state=current_user_state_copy,
-            current_assistant_state=current_assistant_state_copy,
-            global_lock=global_lock_ref
-        )
-        main_interaction_handler(bridge_result)
+        # STT -> LLM -> state merge -> TTS run in the shared admin pipeline; it also persists and publishes the states
+        bridge_result = bridge.process_admin_web_audio(input_wav_filepath=temp_wav_path)
         response_data = {
             "user_transcription": bridge_result.get("user_transcription"),
             "llm_text_response": bridge_result.get("llm_text_response"),
@@ -153,11 +134,12 @@ def play_audio_route(filename):
     if ".." in filename or filename.startswith("/") or filename.startswith("\\"):
         web_logger.error(f"Invalid or potentially malicious filename requested: '{filename}'")
         return "Invalid filename", 400
-    absolute_tts_serve_folder = os.path.join(project_root_dir, config.WEB_UI_TTS_SERVE_FOLDER)
+    absolute_tts_serve_folder = resolve_artifact_path(config.WEB_UI_TTS_SERVE_FOLDER)
+    mark_artifact_in_use(os.path.join(absolute_tts_serve_folder, filename)) # Keep the reaper away while the client fetches it
     try:
         response = make_response(send_from_directory(
             absolute_tts_serve_folder, filename, as_attachment=False ))
-        response.headers['Content-Type'] = 'audio/wav'
+        response.headers['Content-Type'] = 'audio/ogg; codecs=opus' if filename.lower().endswith('.ogg') else 'audio/wav'
         response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'; response.headers['Pragma'] = 'no-cache'; response.headers['Expires'] = '0'
         return response
     except FileNotFoundError: return "Audio file not found", 404